@@ -122,6 +122,12 @@ def build_parser():
                         help='tsv file path for the development set for the 2nd auxiliary task')
     parser.add_argument('--eval_sets', type=str, default=[], nargs='+',
                         help='tsv file paths for the evaluation sets')
+    parser.add_argument('--feat_store', type=str, default=False, nargs='?',
+                        help='directory of the packed feature store made by utils/pack_feat.py')
+    parser.add_argument('--n_prefetch_batches', type=int, default=0,
+                        help='number of training mini-batches prepared in advance (0: synchronous loading)')
+    parser.add_argument('--n_loader_workers', type=int, default=1,
+                        help='number of threads to prepare training mini-batches')
     parser.add_argument('--nlsyms', type=str, default=False, nargs='?',
                         help='non-linguistic symbols file path')
     parser.add_argument('--dict', type=str,
@@ -161,6 +167,10 @@ def build_parser():
                         help='minimum number of input frames')
     parser.add_argument('--dynamic_batching', type=strtobool, default=True,
                         help='')
+    parser.add_argument('--max_n_frames_batch', type=int, default=0,
+                        help='maximum number of padded input frames in a mini-batch (0: no limit)')
+    parser.add_argument('--max_n_tokens_batch', type=int, default=0,
+                        help='maximum number of padded output tokens in a mini-batch (0: no limit)')
     parser.add_argument('--input_noise_std', type=float, default=0,
                         help='standard deviation of Gaussian noise to input features')
     parser.add_argument('--weight_noise_std', type=float, default=0,
@@ -298,6 +308,8 @@ def build_parser():
                         help='adaptive size ratio for time masking')
     parser.add_argument('--max_n_time_masks', type=int, default=20,
                         help='maximum number of time masking')
+    parser.add_argument('--time_warp_width', type=int, default=0,
+                        help='width of time warping for SpecAugment')
     # MTL
     parser.add_argument('--ctc_weight', type=float, default=0.0,
                         help='CTC loss weight for the main task')
@@ -372,6 +384,10 @@ def build_parser():
     parser.add_argument('--recog_metric', type=str, default='edit_distance',
                         choices=['edit_distance', 'loss', 'accuracy', 'ppl', 'bleu'],
                         help='metric for evaluation')
+    parser.add_argument('--recog_n_score_workers', type=int, default=1,
+                        help='number of worker processes to compute WER/CER')
+    parser.add_argument('--recog_n_shards', type=int, default=1,
+                        help='number of worker processes to decode evaluation sets in parallel (CPU only)')
     parser.add_argument('--recog_oracle', type=strtobool, default=False,
                         help='recognize by teacher-forcing')
     parser.add_argument('--recog_batch_size', type=int, default=1,
@@ -441,6 +457,14 @@ def build_parser():
                         help='')
     parser.add_argument('--recog_ctc_vad_n_accum_frames', type=int, default=4000,
                         help='')
+    parser.add_argument('--recog_ctc_blank_skip_threshold', type=float, default=1.0,
+                        help='skip label extension in CTC beam search at frames '
+                        'where blank probability exceeds this value')
+    parser.add_argument('--recog_ctc_frame_reduction_threshold', type=float, default=1.0,
+                        help='drop encoder frames whose CTC blank probability exceeds this value '
+                        'before attention/RNN-T decoding')
+    parser.add_argument('--recog_ctc_frame_reduction_merge', type=strtobool, default=False,
+                        help='merge each run of blank frames into a single frame instead of dropping it')
     parser.add_argument('--recog_mma_delay_threshold', type=int, default=-1,
                         help='delay threshold for MMA decoder')
     parser.add_argument('--recog_mem_len', type=int, default=0,
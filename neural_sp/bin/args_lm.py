@@ -211,4 +211,8 @@ def build_parser():
                         help='lambda paramter for cache')
     parser.add_argument('--recog_mem_len', type=int, default=0,
                         help='number of tokens for memory in TransformerXL during evaluation')
+    parser.add_argument('--recog_lm_weight', type=float, default=0.3,
+                        help='weight of LM score for N-best rescoring')
+    parser.add_argument('--recog_length_norm', type=strtobool, default=True,
+                        help='normalize LM scores by the number of tokens for N-best rescoring')
     return parser
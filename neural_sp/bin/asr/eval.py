@@ -163,6 +163,7 @@ def main():
             logger.info('ASR decoder state carry over: %s' % (args.recog_asr_state_carry_over))
             logger.info('LM state carry over: %s' % (args.recog_lm_state_carry_over))
             logger.info('model average (Transformer): %d' % (args.recog_n_average))
+            logger.info('number of shards: %d' % (args.recog_n_shards))
 
             # GPU setting
             if args.recog_n_gpus >= 1:
@@ -9,6 +9,7 @@
 import argparse
 import copy
 import cProfile
+import functools
 import logging
 import os
 from setproctitle import setproctitle
@@ -85,13 +86,18 @@ def main():
                         short2long=args.sort_short2long,
                         sort_stop_epoch=args.sort_stop_epoch,
                         dynamic_batching=args.dynamic_batching,
+                        max_n_frames_batch=args.max_n_frames_batch,
+                        max_n_tokens_batch=args.max_n_tokens_batch,
                         ctc=args.ctc_weight > 0,
                         ctc_sub1=args.ctc_weight_sub1 > 0,
                         ctc_sub2=args.ctc_weight_sub2 > 0,
                         subsample_factor=args.subsample_factor,
                         subsample_factor_sub1=args.subsample_factor_sub1,
                         subsample_factor_sub2=args.subsample_factor_sub2,
-                        discourse_aware=args.discourse_aware)
+                        discourse_aware=args.discourse_aware,
+                        feat_store=args.feat_store,
+                        n_prefetch_batches=args.n_prefetch_batches,
+                        n_workers=args.n_loader_workers)
     dev_set = Dataset(corpus=args.corpus,
                       tsv_path=args.dev_set,
                       tsv_path_sub1=args.dev_set_sub1,
@@ -114,7 +120,8 @@ def main():
                       ctc_sub2=args.ctc_weight_sub2 > 0,
                       subsample_factor=args.subsample_factor,
                       subsample_factor_sub1=args.subsample_factor_sub1,
-                      subsample_factor_sub2=args.subsample_factor_sub2)
+                      subsample_factor_sub2=args.subsample_factor_sub2,
+                      feat_store=args.feat_store)
     eval_sets = [Dataset(corpus=args.corpus,
                          tsv_path=s,
                          dict_path=args.dict,
@@ -122,7 +129,8 @@ def main():
                          unit=args.unit,
                          wp_model=args.wp_model,
                          batch_size=1,
-                         is_test=True) for s in args.eval_sets]
+                         is_test=True,
+                         feat_store=args.feat_store) for s in args.eval_sets]
 
     args.vocab = train_set.vocab
     args.vocab_sub1 = train_set.vocab_sub1
@@ -157,6 +165,10 @@ def main():
 
     # Model setting
     model = Speech2Text(args, save_path, train_set.idx2token[0])
+    if args.n_prefetch_batches > 0 and args.input_type == 'speech' and args.n_gpus <= 1:
+        # pad inputs in the loader threads
+        # NOTE: not for multi-GPUs since padded inputs are split differently from lists
+        train_set.collate_fn = functools.partial(model.collate, pin_memory=args.n_gpus == 1)
 
     if not args.resume:
         # Save the conf file as a yaml file
@@ -21,6 +21,7 @@ from neural_sp.bin.train_utils import (
 )
 from neural_sp.datasets.lm import Dataset
 from neural_sp.models.lm.build import build_lm
+from neural_sp.models.torch_utils import tensor2np
 from neural_sp.utils import mkdir_join
 
 logger = logging.getLogger(__name__)
@@ -85,39 +86,37 @@ def main():
 
         hidden = None
         fig_count = 0
-        toknen_count = 0
         n_tokens = args.recog_n_caches
+        model.reset_cache()
         while True:
             ys, is_new_epoch = dataset.next()
-
-            for t in range(ys.shape[1] - 1):
-                loss, hidden = model(ys[:, t:t + 2], hidden, is_eval=True, n_caches=args.recog_n_caches)[:2]
-
-                if len(model.cache_attn) > 0:
-                    if toknen_count == n_tokens:
-                        tokens_keys = dataset.idx2token[0](model.cache_ids[:args.recog_n_caches], return_list=True)
-                        tokens_query = dataset.idx2token[0](model.cache_ids[-n_tokens:], return_list=True)
-
-                        # Slide attention matrix
-                        n_keys = len(tokens_keys)
-                        n_queries = len(tokens_query)
-                        cache_probs = np.zeros((n_keys, n_queries))  # `[n_keys, n_queries]`
-                        mask = np.zeros((n_keys, n_queries))
-                        for i, aw in enumerate(model.cache_attn[-n_tokens:]):
-                            cache_probs[:(n_keys - n_queries + i + 1), i] = aw[0, -(n_keys - n_queries + i + 1):]
-                            mask[(n_keys - n_queries + i + 1):, i] = 1
-
-                        plot_cache_weights(
-                            cache_probs,
-                            keys=tokens_keys,
-                            queries=tokens_query,
-                            save_path=mkdir_join(save_path, str(fig_count) + '.png'),
-                            figsize=(40, 16),
-                            mask=mask)
-                        toknen_count = 0
-                        fig_count += 1
-                    else:
-                        toknen_count += 1
+            loss, hidden = model(ys, hidden, is_eval=True, n_caches=args.recog_n_caches)[:2]
+
+            # Attention weights over the cache for the whole segment
+            cache_attn = tensor2np(model.cache_attn[0])  # `[L, mlen+L]`
+            cache_ids = tensor2np(model.cache_attn_ids[0]).tolist()  # `[mlen+L]`
+            qlen = cache_attn.shape[0]
+            mlen = cache_attn.shape[1] - qlen
+            for q_start in range(0, qlen, n_tokens):
+                q_end = min(q_start + n_tokens, qlen)
+                k_start = max(0, mlen + q_start - args.recog_n_caches)
+                k_end = mlen + q_end - 1
+                if k_end <= k_start:
+                    continue
+                tokens_keys = dataset.idx2token[0](cache_ids[k_start:k_end], return_list=True)
+                tokens_query = dataset.idx2token[0](cache_ids[mlen + q_start:mlen + q_end], return_list=True)
+
+                cache_probs = cache_attn[q_start:q_end, k_start:k_end].T  # `[n_keys, n_queries]`
+                mask = (cache_probs == 0).astype(np.float32)
+
+                plot_cache_weights(
+                    cache_probs,
+                    keys=tokens_keys,
+                    queries=tokens_query,
+                    save_path=mkdir_join(save_path, str(fig_count) + '.png'),
+                    figsize=(40, 16),
+                    mask=mask)
+                fig_count += 1
 
             if is_new_epoch:
                 break
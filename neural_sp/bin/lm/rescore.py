@@ -0,0 +1,131 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Rescore N-best lists with the LM offline.
+
+Each N-best file is a tsv file with columns `utt_id`, `score`, and `text`
+(one hypothesis per line). Rescored N-best lists are saved to
+`recog_dir/<set>.rescored.tsv`, and the best hypotheses to `recog_dir/<set>.1best.txt`.
+
+"""
+
+import logging
+import os
+import pandas as pd
+import sys
+import time
+
+from neural_sp.bin.args_lm import parse_args_eval
+from neural_sp.bin.train_utils import (
+    load_checkpoint,
+    set_logger
+)
+from neural_sp.datasets.token_converter.character import Char2idx
+from neural_sp.datasets.token_converter.phone import Phone2idx
+from neural_sp.datasets.token_converter.word import Word2idx
+from neural_sp.datasets.token_converter.wordpiece import Wp2idx
+from neural_sp.models.lm.build import build_lm
+from neural_sp.models.lm.rescoring import LMRescorer
+
+logger = logging.getLogger(__name__)
+
+
+def build_token2idx(unit, dict_path, wp_model):
+    if unit in ['word', 'word_char']:
+        return Word2idx(dict_path, word_char_mix=(unit == 'word_char'))
+    elif unit == 'wp':
+        return Wp2idx(dict_path, wp_model)
+    elif unit == 'char':
+        return Char2idx(dict_path)
+    elif 'phone' in unit:
+        return Phone2idx(dict_path)
+    else:
+        raise ValueError(unit)
+
+
+def rescore_nbest(rescorer, df, token2idx, lm_weight, eos=2, batch_size=1,
+                  reverse=False, length_norm=True):
+    """Rescore N-best lists of all utterances.
+
+    Args:
+        rescorer (LMRescorer):
+        df (pd.DataFrame): N-best lists with columns `utt_id`, `score`, and `text`
+        token2idx (callable): text to token indices converter
+        lm_weight (float): weight of LM score
+        eos (int): index for <sos>/<eos>
+        batch_size (int): number of utterances rescored at once
+        reverse (bool): score hypotheses in the reversed order (for backward LMs)
+        length_norm (bool): normalize LM scores by the number of tokens
+    Returns:
+        nbest (dict): utterance ID -> list of hypotheses sorted by the new score
+
+    """
+    nbest = {}
+    for utt_id, df_utt in df.groupby('utt_id', sort=False):
+        nbest[utt_id] = [{'hyp': [eos] + token2idx(text) + [eos], 'score': float(score), 'text': text}
+                         for score, text in zip(df_utt['score'], df_utt['text'])]
+
+    utt_ids = list(nbest.keys())
+    for i in range(0, len(utt_ids), batch_size):
+        hyps = [hyp for utt_id in utt_ids[i:i + batch_size] for hyp in nbest[utt_id]]
+        rescorer.rescore(hyps, lm_weight, reverse=reverse, tag='second', length_norm=length_norm)
+
+    return {utt_id: sorted(hyps, key=lambda x: x['score'], reverse=True)
+            for utt_id, hyps in nbest.items()}
+
+
+def main():
+
+    # Load configuration
+    args, _, dir_name = parse_args_eval(sys.argv[1:])
+
+    # Setting for logging
+    if os.path.isfile(os.path.join(args.recog_dir, 'rescore.log')):
+        os.remove(os.path.join(args.recog_dir, 'rescore.log'))
+    set_logger(os.path.join(args.recog_dir, 'rescore.log'), stdout=args.recog_stdout)
+
+    # Load the LM
+    model = build_lm(args)
+    load_checkpoint(args.recog_model[0], model)
+    epoch = int(args.recog_model[0].split('-')[-1])
+    logger.info('epoch: %d' % epoch)
+    logger.info('batch size: %d' % args.recog_batch_size)
+    logger.info('LM weight: %.3f' % args.recog_lm_weight)
+    logger.info('length normalization: %s' % args.recog_length_norm)
+
+    # GPU setting
+    if args.recog_n_gpus > 0:
+        model.cuda()
+    model.eval()
+
+    rescorer = LMRescorer(model)
+    token2idx = build_token2idx(args.unit,
+                                os.path.join(dir_name, 'dict.txt'),
+                                os.path.join(dir_name, 'wp.model'))
+
+    for s in args.recog_sets:
+        start_time = time.time()
+
+        df = pd.read_csv(s, encoding='utf-8', delimiter='\t', keep_default_na=False)
+        nbest = rescore_nbest(rescorer, df, token2idx, args.recog_lm_weight,
+                              eos=model.eos, batch_size=args.recog_batch_size,
+                              reverse=args.backward, length_norm=args.recog_length_norm)
+
+        set_name = os.path.basename(s).split('.')[0]
+        with open(os.path.join(args.recog_dir, set_name + '.rescored.tsv'), 'w') as f_nbest, \
+                open(os.path.join(args.recog_dir, set_name + '.1best.txt'), 'w') as f_1best:
+            f_nbest.write('utt_id\tscore\tscore_lm\ttext\n')
+            for utt_id, hyps in nbest.items():
+                for hyp in hyps:
+                    f_nbest.write('%s\t%.7f\t%.7f\t%s\n' % (utt_id, hyp['score'], hyp['score_lm_second'], hyp['text']))
+                f_1best.write('%s %s\n' % (utt_id, hyps[0]['text']))
+
+        logger.info('Rescored %d utterances (%s)' % (len(nbest), set_name))
+        logger.info('Elasped time: %.2f [sec]:' % (time.time() - start_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -145,6 +145,8 @@ def set_asr_model_name(args):
             dir_name += '_' + str(args.time_width) + 'TM' + str(args.n_time_masks)
         if args.adaptive_size_ratio > 0:
             dir_name += '_psize' + str(args.adaptive_size_ratio)
+    if args.time_warp_width > 0:
+        dir_name += '_' + str(args.time_warp_width) + 'TW'
     if args.input_noise_std > 0:
         dir_name += '_inputnoisestd'
     if args.weight_noise_std > 0:
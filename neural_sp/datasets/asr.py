@@ -10,12 +10,18 @@
 """
 
 import codecs
+import collections
+import copy
+from concurrent.futures import ThreadPoolExecutor
 import kaldiio
+import logging
 import numpy as np
 import os
 import pandas as pd
 import random
 
+from neural_sp.datasets.feature_store import FeatureStore
+from neural_sp.datasets.token_cache import TokenCache
 from neural_sp.datasets.token_converter.character import Char2idx
 from neural_sp.datasets.token_converter.character import Idx2char
 from neural_sp.datasets.token_converter.phone import Idx2phone
@@ -28,6 +34,8 @@ from neural_sp.datasets.token_converter.wordpiece import Wp2idx
 random.seed(1)
 np.random.seed(1)
 
+logger = logging.getLogger(__name__)
+
 
 def count_vocab_size(dict_path):
     vocab_count = 1  # for <blank>
@@ -50,7 +58,9 @@ class Dataset(object):
                  wp_model_sub1=False, ctc_sub1=False, subsample_factor_sub1=1,
                  tsv_path_sub2=False, dict_path_sub2=False, unit_sub2=False,
                  wp_model_sub2=False, ctc_sub2=False, subsample_factor_sub2=1,
-                 discourse_aware=False, first_n_utterances=-1):
+                 discourse_aware=False, first_n_utterances=-1, feat_store=False,
+                 n_prefetch_batches=0, n_workers=1,
+                 max_n_frames_batch=0, max_n_tokens_batch=0):
         """A class for loading dataset.
 
         Args:
@@ -78,6 +88,13 @@ class Dataset(object):
             corpus (str): name of corpus
             discourse_aware (bool):
             first_n_utterances (int): evaluate the first N utterances
+            feat_store (str): directory of the packed feature store made by utils/pack_feat.py
+            n_prefetch_batches (int): number of mini-batches prepared in advance.
+                0 means synchronous loading.
+            n_workers (int): number of threads to prepare mini-batches
+            max_n_frames_batch (int): maximum number of padded input frames in a mini-batch.
+                Utterances are packed into mini-batches under this budget instead of batch_size.
+            max_n_tokens_batch (int): maximum number of padded output tokens in a mini-batch
 
         """
         super(Dataset, self).__init__()
@@ -99,11 +116,21 @@ class Dataset(object):
         self.sort_by = sort_by
         assert sort_by in ['input', 'output', 'shuffle', 'utt_id']
         self.dynamic_batching = dynamic_batching
+        self.max_n_frames_batch = max_n_frames_batch
+        self.max_n_tokens_batch = max_n_tokens_batch
+        self.budget_batching = max_n_frames_batch > 0 or max_n_tokens_batch > 0
         self.corpus = corpus
         self.discourse_aware = discourse_aware
         if discourse_aware:
             assert not is_test
 
+        # for prefetching
+        self.n_prefetch_batches = n_prefetch_batches
+        self.executor = ThreadPoolExecutor(n_workers) if n_prefetch_batches > 0 else None
+        self.prefetched = collections.deque()
+        self.offset_consumed = None  # offset seen by the consumer during prefetching
+        self.collate_fn = None  # padding inputs in advance
+
         self.vocab = count_vocab_size(dict_path)
         self.eos = 2
         self.pad = 3
@@ -155,38 +182,48 @@ class Dataset(object):
         df = pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t')
         df = df.loc[:, ['utt_id', 'speaker', 'feat_path',
                         'xlen', 'xdim', 'text', 'token_id', 'ylen', 'ydim']]
+        self.token_cache = TokenCache(tsv_path, df)
+        df['tsv_idx'] = np.arange(len(df))
         for i in range(1, 3):
             if locals()['tsv_path_sub' + str(i)]:
                 df_sub = pd.read_csv(locals()['tsv_path_sub' + str(i)], encoding='utf-8', delimiter='\t')
                 df_sub = df_sub.loc[:, ['utt_id', 'speaker', 'feat_path',
                                         'xlen', 'xdim', 'text', 'token_id', 'ylen', 'ydim']]
+                setattr(self, 'token_cache_sub' + str(i), TokenCache(locals()['tsv_path_sub' + str(i)], df_sub))
+                df_sub['tsv_idx'] = np.arange(len(df_sub))
                 setattr(self, 'df_sub' + str(i), df_sub)
             else:
+                setattr(self, 'token_cache_sub' + str(i), None)
                 setattr(self, 'df_sub' + str(i), None)
-        self.input_dim = kaldiio.load_mat(df['feat_path'][0]).shape[-1]
+
+        # Load input features from the packed store if available
+        self.feat_store = FeatureStore(feat_store) if feat_store else None
+        if self.feat_store is not None:
+            self.input_dim = self.feat_store.input_dim
+        else:
+            self.input_dim = kaldiio.load_mat(df['feat_path'][0]).shape[-1]
 
         # Remove inappropriate utterances
         if is_test or discourse_aware:
             print('Original utterance num: %d' % len(df))
             n_utts = len(df)
-            df = df[df.apply(lambda x: x['ylen'] > 0, axis=1)]
+            df = df[df['ylen'] > 0]
             print('Removed %d empty utterances' % (n_utts - len(df)))
             if first_n_utterances > 0:
                 n_utts = len(df)
-                df = df[df.apply(lambda x: x['ylen'] > 0, axis=1)]
+                df = df[df['ylen'] > 0]
                 df = df.truncate(before=0, after=first_n_utterances - 1)
                 print('Select first %d utterances' % len(df))
         else:
             print('Original utterance num: %d' % len(df))
             n_utts = len(df)
-            df = df[df.apply(lambda x: min_n_frames <= x[
-                'xlen'] <= max_n_frames, axis=1)]
-            df = df[df.apply(lambda x: x['ylen'] > 0, axis=1)]
+            df = df[(df['xlen'] >= min_n_frames) & (df['xlen'] <= max_n_frames)]
+            df = df[df['ylen'] > 0]
             print('Removed %d utterances (threshold)' % (n_utts - len(df)))
 
             if ctc and subsample_factor > 1:
                 n_utts = len(df)
-                df = df[df.apply(lambda x: x['ylen'] <= (x['xlen'] // subsample_factor), axis=1)]
+                df = df[df['ylen'] <= df['xlen'] // subsample_factor]
                 print('Removed %d utterances (for CTC)' % (n_utts - len(df)))
 
             for i in range(1, 3):
@@ -195,8 +232,7 @@ class Dataset(object):
                 subsample_factor_sub = locals()['subsample_factor_sub' + str(i)]
                 if df_sub is not None:
                     if ctc_sub and subsample_factor_sub > 1:
-                        df_sub = df_sub[df_sub.apply(
-                            lambda x: x['ylen'] <= (x['xlen'] // subsample_factor_sub), axis=1)]
+                        df_sub = df_sub[df_sub['ylen'] <= df_sub['xlen'] // subsample_factor_sub]
 
                     if len(df) != len(df_sub):
                         n_utts = len(df)
@@ -267,12 +303,7 @@ class Dataset(object):
                     setattr(self, 'df_sub' + str(i),
                             getattr(self, 'df_sub' + str(i)).reindex(df.index).reset_index())
 
-        if discourse_aware:
-            self.df_indices_buckets = self.discourse_bucketing(batch_size)
-        elif shuffle_bucket:
-            self.df_indices_buckets = self.shuffle_bucketing(batch_size)
-        else:
-            self.df_indices = list(self.df.index)
+        self._reset_indices(batch_size)
 
     def __len__(self):
         return len(self.df)
@@ -280,6 +311,8 @@ class Dataset(object):
     @property
     def epoch_detail(self):
         """Percentage of the current epoch."""
+        if self.offset_consumed is not None:
+            return self.offset_consumed / len(self)
         return self.offset / len(self)
 
     @property
@@ -293,15 +326,67 @@ class Dataset(object):
                 batch_size (int): size of mini-batch
 
         """
+        # discard mini-batches prepared in advance
+        for future, _, _ in self.prefetched:
+            future.cancel()
+        self.prefetched.clear()
+        self.offset_consumed = None
+
+        self._reset_indices(batch_size)
+
+    def shard(self, shard_id, n_shards, keep_sessions=False):
+        """Split the dataset into contiguous shards for parallel evaluation.
+
+        Args:
+            shard_id (int): index of the shard
+            n_shards (int): total number of shards
+            keep_sessions (bool): move shard boundaries forward so that
+                utterances of the same session are not split into different
+                shards. Some shards can be empty.
+        Returns:
+            dataset (Dataset): shallow copy of self restricted to the shard
+
+        """
+        assert 0 <= shard_id < n_shards
+        start = self._shard_boundary(shard_id, n_shards, keep_sessions)
+        end = self._shard_boundary(shard_id + 1, n_shards, keep_sessions)
+
+        dataset = copy.copy(self)
+        dataset.df = self.df.iloc[start:end]
+        for i in range(1, 3):
+            if getattr(self, 'df_sub' + str(i)) is not None:
+                setattr(dataset, 'df_sub' + str(i),
+                        getattr(self, 'df_sub' + str(i)).loc[dataset.df.index])
+        # each shard is decoded in a separate process, so load mini-batches synchronously
+        dataset.executor = None
+        dataset.prefetched = collections.deque()
+        dataset.offset_consumed = None
+        dataset._reset_indices()
+        return dataset
+
+    def _shard_boundary(self, shard_id, n_shards, keep_sessions):
+        pos = len(self) * shard_id // n_shards
+        if keep_sessions:
+            sessions = self.df['session'].values
+            while 0 < pos < len(self) and sessions[pos] == sessions[pos - 1]:
+                pos += 1
+        return pos
+
+    def _reset_indices(self, batch_size=None):
         if batch_size is None:
             batch_size = self.batch_size
 
         if self.discourse_aware:
-            self.df_indices_buckets = self.discourse_bucketing(batch_size)
+            self.df_indices_buckets = collections.deque(self.discourse_bucketing(batch_size))
+        elif self.budget_batching:
+            self.df_indices_buckets = collections.deque(self.budget_bucketing(batch_size))
         elif self.shuffle_bucket:
-            self.df_indices_buckets = self.shuffle_bucketing(batch_size)
+            self.df_indices_buckets = collections.deque(self.shuffle_bucketing(batch_size))
         else:
-            self.df_indices = list(self.df.index)
+            # order of the current epoch, which is consumed from self.offset
+            self.df_indices = self.df.index.values
+            self.xlens = self.df['xlen'].values
+            self.ylens = self.df['ylen'].values
         self.offset = 0
 
     def next(self, batch_size=None):
@@ -317,11 +402,41 @@ class Dataset(object):
         if batch_size is None:
             batch_size = self.batch_size
 
+        if self.executor is None:
+            df_indices_mb, is_new_epoch, dfs = self._sample_next(batch_size)
+            return self.make_mini_batch(df_indices_mb, dfs), is_new_epoch
+
+        # Sample indices in the main thread for reproducibility, and
+        # load mini-batches in worker threads
+        while len(self.prefetched) <= self.n_prefetch_batches:
+            try:
+                df_indices_mb, is_new_epoch, dfs = self._sample_next(batch_size)
+            except StopIteration:
+                break
+            future = self.executor.submit(self.make_mini_batch, df_indices_mb, dfs)
+            self.prefetched.append((future, is_new_epoch, self.offset))
+        if len(self.prefetched) == 0:
+            raise StopIteration
+
+        future, is_new_epoch, self.offset_consumed = self.prefetched.popleft()
+        return future.result(), is_new_epoch
+
+    def _sample_next(self, batch_size):
+        """Sample data indices of the next mini-batch and update counters.
+
+        Args:
+            batch_size (int): size of mini-batch
+        Returns:
+            df_indices_mb (np.ndarray): indices of dataframe in the mini-batch
+            is_new_epoch (bool): flag for the end of the current epoch
+            dfs (tuple): dataframes referred to by df_indices_mb
+
+        """
         if self.epoch >= self.max_epoch:
             raise StopIteration
 
         df_indices_mb, is_new_epoch = self.sample_index(batch_size)
-        mini_batch = self.make_mini_batch(df_indices_mb)
+        dfs = (self.df, self.df_sub1, self.df_sub2)
 
         if is_new_epoch:
             # shuffle the whole data
@@ -336,10 +451,10 @@ class Dataset(object):
                 # Re-indexing
                 self.df = self.df.reset_index()
 
-            self.reset()
+            self._reset_indices()
             self.epoch += 1
 
-        return mini_batch, is_new_epoch
+        return df_indices_mb, is_new_epoch, dfs
 
     def sample_index(self, batch_size):
         """Sample data indices of mini-batch.
@@ -354,53 +469,44 @@ class Dataset(object):
         is_new_epoch = False
 
         if self.discourse_aware:
-            df_indices_mb = self.df_indices_buckets.pop(0)
+            df_indices_mb = self.df_indices_buckets.popleft()
             self.offset += len(df_indices_mb)
             is_new_epoch = (len(self.df_indices_buckets) == 0)
 
-        elif self.shuffle_bucket:
-            df_indices_mb = self.df_indices_buckets.pop(0)
+        elif self.budget_batching or self.shuffle_bucket:
+            df_indices_mb = self.df_indices_buckets.popleft()
             self.offset += len(df_indices_mb)
             is_new_epoch = (len(self.df_indices_buckets) == 0)
 
             # Shuffle uttrances in mini-batch
             df_indices_mb = random.sample(df_indices_mb, len(df_indices_mb))
         else:
-            if len(self.df_indices) > batch_size:
-                # Change batch size dynamically
-                min_xlen = self.df[self.offset:self.offset + 1]['xlen'].values[0]
-                min_ylen = self.df[self.offset:self.offset + 1]['ylen'].values[0]
-                batch_size = self.set_batch_size(batch_size, min_xlen, min_ylen)
-
-                df_indices_mb = list(self.df[self.offset:self.offset + batch_size].index)
-                self.offset += len(df_indices_mb)
-            else:
-                # Last mini-batch
-                df_indices_mb = self.df_indices[:]
-                self.offset = len(self)
-                is_new_epoch = True
+            is_new_epoch = (len(self) - self.offset <= batch_size)
 
-                # Change batch size dynamically
-                min_xlen = self.df[df_indices_mb[0]:df_indices_mb[0] + 1]['xlen'].values[0]
-                min_ylen = self.df[df_indices_mb[0]:df_indices_mb[0] + 1]['ylen'].values[0]
-                batch_size = self.set_batch_size(batch_size, min_xlen, min_ylen)
+            # Change batch size dynamically
+            min_xlen = self.xlens[self.offset]
+            min_ylen = self.ylens[self.offset]
+            batch_size = self.set_batch_size(batch_size, min_xlen, min_ylen)
 
-                # Remove the rest
-                df_indices_mb = df_indices_mb[:batch_size]
+            df_indices_mb = self.df_indices[self.offset:self.offset + batch_size].tolist()
+            if is_new_epoch:
+                # Last mini-batch (the rest is removed)
+                self.offset = len(self)
+            else:
+                self.offset += len(df_indices_mb)
 
             # Shuffle uttrances in mini-batch
             df_indices_mb = random.sample(df_indices_mb, len(df_indices_mb))
 
-            for i in df_indices_mb:
-                self.df_indices.remove(i)
-
         return df_indices_mb, is_new_epoch
 
-    def make_mini_batch(self, df_indices_mb):
+    def make_mini_batch(self, df_indices_mb, dfs=None):
         """Create mini-batch per step.
 
         Args:
             df_indices_mb (np.ndarray): indices of dataframe in the current mini-batch
+            dfs (tuple): dataframes of the main and auxiliary tasks.
+                Current dataframes are used by default.
         Returns:
             mini_batch_dict (dict):
                 xs (list): input data of size `[T, input_dim]`
@@ -411,43 +517,61 @@ class Dataset(object):
                 utt_ids (list): name of each utterance
                 speakers (list): name of each speaker
                 sessions (list): name of each session
+                xs_pad (tuple): inputs padded by collate_fn if it is set
 
         """
+        df, df_sub1, df_sub2 = dfs if dfs is not None else (self.df, self.df_sub1, self.df_sub2)
+
         # inputs
-        xs = [kaldiio.load_mat(self.df['feat_path'][i]) for i in df_indices_mb]
+        xs = [self.load_feat(df['feat_path'][i]) for i in df_indices_mb]
 
         # outputs
         if self.is_test:
-            ys = [self.token2idx[0](self.df['text'][i]) for i in df_indices_mb]
+            ys = [self.token2idx[0](df['text'][i]) for i in df_indices_mb]
         else:
-            ys = [list(map(int, str(self.df['token_id'][i]).split())) for i in df_indices_mb]
+            ys = [self.token_cache[df['tsv_idx'][i]] for i in df_indices_mb]
 
         ys_sub1 = []
-        if self.df_sub1 is not None:
-            ys_sub1 = [list(map(int, str(self.df_sub1['token_id'][i]).split())) for i in df_indices_mb]
+        if df_sub1 is not None:
+            ys_sub1 = [self.token_cache_sub1[df_sub1['tsv_idx'][i]] for i in df_indices_mb]
         elif self.vocab_sub1 > 0 and not self.is_test:
-            ys_sub1 = [self.token2idx[1](self.df['text'][i]) for i in df_indices_mb]
+            ys_sub1 = [self.token2idx[1](df['text'][i]) for i in df_indices_mb]
 
         ys_sub2 = []
-        if self.df_sub2 is not None:
-            ys_sub2 = [list(map(int, str(self.df_sub2['token_id'][i]).split())) for i in df_indices_mb]
+        if df_sub2 is not None:
+            ys_sub2 = [self.token_cache_sub2[df_sub2['tsv_idx'][i]] for i in df_indices_mb]
         elif self.vocab_sub2 > 0 and not self.is_test:
-            ys_sub2 = [self.token2idx[2](self.df['text'][i]) for i in df_indices_mb]
+            ys_sub2 = [self.token2idx[2](df['text'][i]) for i in df_indices_mb]
 
         mini_batch_dict = {
             'xs': xs,
-            'xlens': [self.df['xlen'][i] for i in df_indices_mb],
+            'xlens': [df['xlen'][i] for i in df_indices_mb],
             'ys': ys,
             'ys_sub1': ys_sub1,
             'ys_sub2': ys_sub2,
-            'utt_ids': [self.df['utt_id'][i] for i in df_indices_mb],
-            'speakers': [self.df['speaker'][i] for i in df_indices_mb],
-            'sessions': [self.df['session'][i] for i in df_indices_mb],
-            'text': [self.df['text'][i] for i in df_indices_mb],
-            'feat_path': [self.df['feat_path'][i] for i in df_indices_mb],  # for plot
+            'utt_ids': [df['utt_id'][i] for i in df_indices_mb],
+            'speakers': [df['speaker'][i] for i in df_indices_mb],
+            'sessions': [df['session'][i] for i in df_indices_mb],
+            'text': [df['text'][i] for i in df_indices_mb],
+            'feat_path': [df['feat_path'][i] for i in df_indices_mb],  # for plot
         }
+        if self.collate_fn is not None:
+            mini_batch_dict['xs_pad'] = self.collate_fn(xs)
         return mini_batch_dict
 
+    def load_feat(self, feat_path):
+        """Load input features of an utterance.
+
+        Args:
+            feat_path (str): feature path in the dataset tsv file
+        Returns:
+            x (np.ndarray): `[T, input_dim]`
+
+        """
+        if self.feat_store is not None and feat_path in self.feat_store:
+            return self.feat_store[feat_path]
+        return kaldiio.load_mat(feat_path)
+
     def set_batch_size(self, batch_size, min_xlen, min_ylen):
         if not self.dynamic_batching:
             return batch_size
@@ -463,12 +587,13 @@ class Dataset(object):
 
     def shuffle_bucketing(self, batch_size):
         df_indices_buckets = []  # list of list
+        df_indices = self.df.index.values
+        xlens = self.df['xlen'].values
+        ylens = self.df['ylen'].values
         offset = 0
         while True:
-            min_xlen = self.df[offset:offset + 1]['xlen'].values[0]
-            min_ylen = self.df[offset:offset + 1]['ylen'].values[0]
-            _batch_size = self.set_batch_size(batch_size, min_xlen, min_ylen)
-            df_indices_mb = list(self.df[offset:offset + _batch_size].index)
+            _batch_size = self.set_batch_size(batch_size, xlens[offset], ylens[offset])
+            df_indices_mb = df_indices[offset:offset + _batch_size].tolist()
             df_indices_buckets.append(df_indices_mb)
             offset += len(df_indices_mb)
             if offset + _batch_size >= len(self):
@@ -478,6 +603,40 @@ class Dataset(object):
         random.shuffle(df_indices_buckets)
         return df_indices_buckets
 
+    def budget_bucketing(self, batch_size):
+        """Pack utterances of similar lengths into mini-batches under the frame/token budget.
+
+        Args:
+            batch_size (int): maximum number of utterances in a mini-batch
+        Returns:
+            df_indices_buckets (list): list of indices of dataframe per mini-batch
+
+        """
+        df_indices = self.df.index.values
+        xlens = self.df['xlen'].values
+        ylens = self.max_ylens(self.df.index)
+
+        # Sort by length with random tie-breaking so that mini-batches differ per epoch
+        perm = np.random.permutation(len(df_indices))
+        perm = perm[np.argsort(xlens[perm] if self.max_n_frames_batch > 0 else ylens[perm], kind='mergesort')]
+        buckets = pack_by_budget(xlens[perm], ylens[perm], batch_size,
+                                 self.max_n_frames_batch, self.max_n_tokens_batch)
+        df_indices_buckets = [df_indices[perm[b]].tolist() for b in buckets]
+        log_padding_efficiency(buckets, xlens[perm], ylens[perm])
+
+        # shuffle buckets
+        random.shuffle(df_indices_buckets)
+        return df_indices_buckets
+
+    def max_ylens(self, df_indices):
+        """Output lengths over the main and auxiliary tasks."""
+        ylens = self.df.loc[df_indices, 'ylen'].values
+        for i in range(1, 3):
+            df_sub = getattr(self, 'df_sub' + str(i))
+            if df_sub is not None:
+                ylens = np.maximum(ylens, df_sub.loc[df_indices, 'ylen'].values)
+        return ylens
+
     def discourse_bucketing(self, batch_size):
         df_indices_buckets = []  # list of list
         session_groups = [(k, v) for k, v in self.df.groupby('n_utt_in_session').groups.items()]
@@ -485,10 +644,69 @@ class Dataset(object):
             random.shuffle(session_groups)
         for n_utt, ids in session_groups:
             first_utt_ids = [i for i in ids if self.df['n_prev_utt'][i] == 0]
-            for i in range(0, len(first_utt_ids), batch_size):
-                first_utt_ids_mb = first_utt_ids[i:i + batch_size]
+            if self.budget_batching:
+                # Sessions stay in the same mini-batch over all utterances, so the
+                # budget is checked with the longest utterance in each session
+                session_xlens = np.array([max(self.df['xlen'][k + j] for j in range(n_utt))
+                                          for k in first_utt_ids])
+                session_ylens = np.array([max(self.max_ylens([k + j for j in range(n_utt)]))
+                                          for k in first_utt_ids])
+                buckets = pack_by_budget(session_xlens, session_ylens, batch_size,
+                                         self.max_n_frames_batch, self.max_n_tokens_batch)
+                first_utt_ids_mbs = [[first_utt_ids[b] for b in bucket] for bucket in buckets]
+            else:
+                first_utt_ids_mbs = [first_utt_ids[i:i + batch_size]
+                                     for i in range(0, len(first_utt_ids), batch_size)]
+            for first_utt_ids_mb in first_utt_ids_mbs:
                 for j in range(n_utt):
                     df_indices_mb = [k + j for k in first_utt_ids_mb]
                     df_indices_buckets.append(df_indices_mb)
 
         return df_indices_buckets
+
+
+def pack_by_budget(xlens, ylens, batch_size, max_n_frames_batch, max_n_tokens_batch):
+    """Greedily pack consecutive utterances into mini-batches.
+
+    A mini-batch is closed when adding the next utterance makes the padded
+    number of input frames (or output tokens) exceed the budget.
+    An utterance exceeding the budget by itself forms a single mini-batch.
+
+    Args:
+        xlens (np.ndarray): `[N]`, input lengths
+        ylens (np.ndarray): `[N]`, output lengths
+        batch_size (int): maximum number of utterances in a mini-batch
+        max_n_frames_batch (int): maximum number of padded input frames.
+            0 means no limit.
+        max_n_tokens_batch (int): maximum number of padded output tokens.
+            0 means no limit.
+    Returns:
+        buckets (list): list of positions in xlens per mini-batch
+
+    """
+    buckets = []
+    start = 0
+    max_xlen, max_ylen = 0, 0
+    for i in range(len(xlens)):
+        max_xlen_i = max(max_xlen, xlens[i])
+        max_ylen_i = max(max_ylen, ylens[i])
+        n_utts = i - start + 1
+        if n_utts > 1 and (n_utts > batch_size or
+                           0 < max_n_frames_batch < n_utts * max_xlen_i or
+                           0 < max_n_tokens_batch < n_utts * max_ylen_i):
+            buckets.append(list(range(start, i)))
+            start = i
+            max_xlen_i, max_ylen_i = xlens[i], ylens[i]
+        max_xlen, max_ylen = max_xlen_i, max_ylen_i
+    if start < len(xlens):
+        buckets.append(list(range(start, len(xlens))))
+    return buckets
+
+
+def log_padding_efficiency(buckets, xlens, ylens):
+    """Log the ratio of non-padded elements in mini-batches."""
+    n_padded_frames = sum(len(b) * xlens[b].max() for b in buckets)
+    n_padded_tokens = sum(len(b) * ylens[b].max() for b in buckets)
+    logger.info('Padding efficiency: %.2f%% (input), %.2f%% (output) in %d mini-batches' %
+                (100 * xlens.sum() / max(1, n_padded_frames),
+                 100 * ylens.sum() / max(1, n_padded_tokens), len(buckets)))
@@ -0,0 +1,105 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Packed feature store memory-mapped from a single file."""
+
+import codecs
+import kaldiio
+import logging
+import numpy as np
+import os
+import pandas as pd
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+FEAT_FILE = 'feats.npy'
+INDEX_FILE = 'index.tsv'
+
+
+def pack_features(tsv_paths, store_dir, dtype='float32'):
+    """Pack input features of dataset tsv files into a feature store.
+
+    All features are concatenated along the time axis in a single npy file,
+    and the position of each utterance is recorded in an index file.
+
+    Args:
+        tsv_paths (list): paths to dataset tsv files
+        store_dir (str): directory to save the feature store
+        dtype (str): data type of the stored features (float32/float16)
+    Returns:
+        n_utts (int): number of packed utterances
+
+    """
+    feat2len = {}
+    for tsv_path in tsv_paths:
+        df = pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t')
+        for feat_path, xlen in zip(df['feat_path'], df['xlen']):
+            if feat_path not in feat2len:
+                feat2len[feat_path] = int(xlen)
+    feat_paths = list(feat2len.keys())
+    xlens = list(feat2len.values())
+    if len(feat_paths) == 0:
+        raise ValueError('No utterances are found in %s.' % tsv_paths)
+
+    input_dim = kaldiio.load_mat(feat_paths[0]).shape[-1]
+    offsets = np.concatenate([[0], np.cumsum(xlens)[:-1]]).astype(np.int64)
+
+    if not os.path.isdir(store_dir):
+        os.makedirs(store_dir)
+    feats = np.lib.format.open_memmap(os.path.join(store_dir, FEAT_FILE), mode='w+',
+                                      dtype=np.dtype(dtype), shape=(sum(xlens), input_dim))
+    for feat_path, offset, xlen in zip(tqdm(feat_paths), offsets, xlens):
+        x = kaldiio.load_mat(feat_path)
+        if x.shape != (xlen, input_dim):
+            raise ValueError('Shape mismatch in %s: %s (tsv: %d frames, %d dims)' %
+                             (feat_path, x.shape, xlen, input_dim))
+        feats[offset:offset + xlen] = x
+    feats.flush()
+    del feats
+
+    with codecs.open(os.path.join(store_dir, INDEX_FILE), 'w', encoding='utf-8') as f:
+        f.write('feat_path\toffset\txlen\n')
+        for feat_path, offset, xlen in zip(feat_paths, offsets, xlens):
+            f.write('%s\t%d\t%d\n' % (feat_path, offset, xlen))
+    logger.info('Packed %d utterances into %s' % (len(feat_paths), store_dir))
+    return len(feat_paths)
+
+
+class FeatureStore(object):
+    """Read-only view of a feature store made by pack_features().
+
+    Args:
+        store_dir (str): directory of the feature store
+
+    """
+
+    def __init__(self, store_dir):
+        self.feats = np.load(os.path.join(store_dir, FEAT_FILE), mmap_mode='r')
+        df = pd.read_csv(os.path.join(store_dir, INDEX_FILE), encoding='utf-8', delimiter='\t')
+        self.index = dict(zip(df['feat_path'], zip(df['offset'], df['xlen'])))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, feat_path):
+        return feat_path in self.index
+
+    @property
+    def input_dim(self):
+        return self.feats.shape[-1]
+
+    def __getitem__(self, feat_path):
+        """Return features of an utterance without copying.
+
+        Args:
+            feat_path (str): feature path in the dataset tsv file
+        Returns:
+            x (np.ndarray): `[T, input_dim]`, read-only
+
+        """
+        offset, xlen = self.index[feat_path]
+        return self.feats[offset:offset + xlen]
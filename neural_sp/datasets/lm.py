@@ -16,6 +16,7 @@ import pandas as pd
 import random
 
 from neural_sp.datasets.asr import count_vocab_size
+from neural_sp.datasets.token_cache import TokenCache
 from neural_sp.datasets.token_converter.character import Char2idx
 from neural_sp.datasets.token_converter.character import Idx2char
 from neural_sp.datasets.token_converter.phone import Idx2phone
@@ -99,17 +100,19 @@ class Dataset(object):
         self.df = pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t')
         self.df = self.df.loc[:, ['utt_id', 'speaker', 'feat_path',
                                   'xlen', 'xdim', 'text', 'token_id', 'ylen', 'ydim']]
+        self.token_cache = TokenCache(tsv_path, self.df)
+        self.df['tsv_idx'] = np.arange(len(self.df))
 
         # Remove inappropriate utterances
         if is_test:
             print('Original utterance num: %d' % len(self.df))
             n_utts = len(self.df)
-            self.df = self.df[self.df.apply(lambda x: x['ylen'] > 0, axis=1)]
+            self.df = self.df[self.df['ylen'] > 0]
             print('Removed %d empty utterances' % (n_utts - len(self.df)))
         else:
             print('Original utterance num: %d' % len(self.df))
             n_utts = len(self.df)
-            self.df = self.df[self.df.apply(lambda x: x['ylen'] >= min_n_tokens, axis=1)]
+            self.df = self.df[self.df['ylen'] >= min_n_tokens]
             print('Removed %d utterances (threshold)' % (n_utts - len(self.df)))
 
         # Sort tsv records
@@ -129,14 +132,10 @@ class Dataset(object):
         self.concat_ids = self.concat_utterances(self.df)
 
     def concat_utterances(self, df):
-        indices = list(df.index)
+        tsv_indices = df['tsv_idx'].values
         if self.backward:
-            indices = indices[::-1]
-        concat_ids = []
-        for i in indices:
-            assert df['token_id'][i] != ''
-            concat_ids += [self.eos] + list(map(int, df['token_id'][i].split()))
-        concat_ids += [self.eos]  # for the last sentence
+            tsv_indices = tsv_indices[::-1]
+        concat_ids = self.token_cache.concat(tsv_indices, sep=self.eos)
         # NOTE: <sos> and <eos> have the same index
 
         # Reshape
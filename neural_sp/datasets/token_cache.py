@@ -0,0 +1,128 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Binary cache of token IDs in a dataset tsv file."""
+
+import hashlib
+import logging
+import numpy as np
+import os
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+CACHE_SUFFIX = '.token_id.npz'
+
+
+def hash_file(path, block_size=1 << 20):
+    """Compute SHA-1 hash of a file."""
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+
+class TokenCache(object):
+    """Token IDs of all utterances in a dataset tsv file stored as a flat array.
+
+    The cache is saved next to the tsv file and rebuilt when the tsv file
+    is modified (the SHA-1 hash of the tsv file does not match).
+
+    Args:
+        tsv_path (str): path to the dataset tsv file
+        df (pd.DataFrame): dataframe already loaded from tsv_path.
+            The tsv file is loaded again if it is not given.
+
+    """
+
+    def __init__(self, tsv_path, df=None):
+        self.cache_path = tsv_path + CACHE_SUFFIX
+        tsv_hash = hash_file(tsv_path)
+
+        if not self._load(tsv_hash):
+            if df is None:
+                df = pd.read_csv(tsv_path, encoding='utf-8', delimiter='\t')
+            self._build(df['token_id'])
+            self._save(tsv_hash)
+
+    def _load(self, tsv_hash):
+        if not os.path.isfile(self.cache_path):
+            return False
+        try:
+            with np.load(self.cache_path) as cache:
+                if int(cache['version']) != CACHE_VERSION or str(cache['tsv_hash']) != tsv_hash:
+                    logger.info('Rebuild outdated token ID cache: %s' % self.cache_path)
+                    return False
+                self.ylens = cache['ylens']
+                self.offsets = cache['offsets']
+                self.token_ids = cache['token_ids']
+        except (IOError, KeyError, ValueError):
+            logger.warning('Rebuild broken token ID cache: %s' % self.cache_path)
+            return False
+        return True
+
+    def _build(self, token_ids):
+        token_ids = token_ids.fillna('').astype(str)
+        self.ylens = token_ids.str.split().str.len().values.astype(np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(self.ylens)[:-1]]).astype(np.int64)
+        self.token_ids = np.fromstring(' '.join(token_ids), dtype=np.int32, sep=' ') \
+            if self.ylens.sum() > 0 else np.zeros((0,), dtype=np.int32)
+        if len(self.token_ids) != self.ylens.sum():
+            raise ValueError('Invalid token IDs in %s' % self.cache_path[:-len(CACHE_SUFFIX)])
+
+    def _save(self, tsv_hash):
+        # NOTE: write to a temporary file first so that concurrent readers never see a partial cache
+        tmp_path = self.cache_path + '.%d.tmp' % os.getpid()
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, version=CACHE_VERSION, tsv_hash=tsv_hash,
+                         ylens=self.ylens, offsets=self.offsets, token_ids=self.token_ids)
+            os.replace(tmp_path, self.cache_path)
+            logger.info('Saved token ID cache: %s' % self.cache_path)
+        except (IOError, OSError):
+            logger.warning('Could not save token ID cache: %s' % self.cache_path)
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+
+    def __len__(self):
+        return len(self.ylens)
+
+    def __getitem__(self, tsv_idx):
+        """Return token IDs of an utterance.
+
+        Args:
+            tsv_idx (int): row index in the tsv file
+        Returns:
+            ys (list): token IDs of size `[L]`
+
+        """
+        tsv_idx = int(tsv_idx)
+        offset = self.offsets[tsv_idx]
+        return self.token_ids[offset:offset + self.ylens[tsv_idx]].tolist()
+
+    def concat(self, tsv_indices, sep):
+        """Concatenate token IDs of utterances with a separator.
+
+        Args:
+            tsv_indices (np.ndarray): row indices in the tsv file
+            sep (int): token ID inserted before each utterance and at the end
+        Returns:
+            concat_ids (np.ndarray): `[sum(L) + len(tsv_indices) + 1]`
+
+        """
+        tsv_indices = np.asarray(tsv_indices, dtype=np.int64)
+        ylens = self.ylens[tsv_indices]
+        n_tokens = int(ylens.sum())
+        concat_ids = np.full((n_tokens + len(tsv_indices) + 1,), sep, dtype=np.int64)
+        # position of each token within its utterance
+        starts = np.cumsum(ylens) - ylens
+        pos = np.arange(n_tokens, dtype=np.int64) - np.repeat(starts, ylens)
+        src = np.repeat(self.offsets[tsv_indices], ylens) + pos
+        dst = np.repeat(starts + np.arange(len(tsv_indices)) + 1, ylens) + pos
+        concat_ids[dst] = self.token_ids[src]
+        return concat_ids
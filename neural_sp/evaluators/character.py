@@ -6,11 +6,11 @@
 
 """Evaluate the character-level model by WER & CER."""
 
-import codecs
 import logging
 from tqdm import tqdm
 
-from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.evaluators.edit_distance import compute_wer_batch
+from neural_sp.evaluators.sharding import decode_sharded
 from neural_sp.utils import mkdir_join
 
 logger = logging.getLogger(__name__)
@@ -56,11 +56,6 @@ def eval_char(models, dataset, recog_params, epoch,
     wer, cer = 0, 0
     n_sub_w, n_ins_w, n_del_w = 0, 0, 0
     n_sub_c, n_ins_c, n_del_c = 0, 0, 0
-    n_word, n_char = 0, 0
-    n_streamable, quantity_rate, n_utt = 0, 0, 0
-    last_success_frame_ratio = 0
-    if progressbar:
-        pbar = tqdm(total=len(dataset))
 
     if task_idx == 0:
         task = 'ys'
@@ -71,7 +66,22 @@ def eval_char(models, dataset, recog_params, epoch,
     elif task_idx == 3:
         task = 'ys_sub3'
 
-    with codecs.open(hyp_trn_save_path, 'w', encoding='utf-8') as f_hyp, codecs.open(ref_trn_save_path, 'w', encoding='utf-8') as f_ref:
+    # states are carried over between utterances in the same session
+    carry_over = recog_params['recog_asr_state_carry_over'] or recog_params['recog_lm_state_carry_over']
+
+    def decode(dataset, f_ref, f_hyp, progressbar):
+        if carry_over:
+            # start from the same states in every shard as in serial decoding
+            for model in models:
+                model.reset_state_carry_over()
+
+        # NOTE: statistics are accumulated per utterance and scored after decoding
+        stats = {'n_word': 0, 'n_char': 0, 'n_streamable': 0, 'n_utt': 0,
+                 'refs_w': [], 'hyps_w': [], 'refs_c': [], 'hyps_c': [],
+                 'quantity_rates': [], 'last_success_frame_ratios': []}
+        if progressbar:
+            pbar = tqdm(total=len(dataset))
+
         while True:
             batch, is_new_epoch = dataset.next(recog_params['recog_batch_size'])
             if streaming or recog_params['recog_chunk_sync']:
@@ -115,34 +125,24 @@ def eval_char(models, dataset, recog_params, epoch,
                 if not streaming:
                     if ('char' in dataset.unit and 'nowb' not in dataset.unit) or (task_idx > 0 and dataset.unit_sub1 == 'char'):
                         # Compute WER
-                        wer_b, sub_b, ins_b, del_b = compute_wer(ref=ref.split(' '),
-                                                                 hyp=hyp.split(' '),
-                                                                 normalize=False)
-                        wer += wer_b
-                        n_sub_w += sub_b
-                        n_ins_w += ins_b
-                        n_del_w += del_b
-                        n_word += len(ref.split(' '))
+                        stats['refs_w'].append(ref.split(' '))
+                        stats['hyps_w'].append(hyp.split(' '))
+                        stats['n_word'] += len(ref.split(' '))
                         # NOTE: sentence error rate for Chinese
 
                     # Compute CER
                     if dataset.corpus == 'csj':
                         ref = ref.replace(' ', '')
                         hyp = hyp.replace(' ', '')
-                    cer_b, sub_b, ins_b, del_b = compute_wer(ref=list(ref),
-                                                             hyp=list(hyp),
-                                                             normalize=False)
-                    cer += cer_b
-                    n_sub_c += sub_b
-                    n_ins_c += ins_b
-                    n_del_c += del_b
-                    n_char += len(ref)
+                    stats['refs_c'].append(list(ref))
+                    stats['hyps_c'].append(list(hyp))
+                    stats['n_char'] += len(ref)
                     if models[0].streamable():
-                        n_streamable += 1
+                        stats['n_streamable'] += 1
                     else:
-                        last_success_frame_ratio += models[0].last_success_frame_ratio()
-                    quantity_rate += models[0].quantity_rate()
-                    n_utt += 1
+                        stats['last_success_frame_ratios'].append(models[0].last_success_frame_ratio())
+                    stats['quantity_rates'].append(models[0].quantity_rate())
+                    stats['n_utt'] += 1
 
                 if progressbar:
                     pbar.update(1)
@@ -150,13 +150,34 @@ def eval_char(models, dataset, recog_params, epoch,
             if is_new_epoch:
                 break
 
-    if progressbar:
-        pbar.close()
+        if progressbar:
+            pbar.close()
+        return stats
+
+    stats = decode_sharded(decode, dataset, ref_trn_save_path, hyp_trn_save_path,
+                           recog_params['recog_n_shards'], progressbar, keep_sessions=carry_over)
 
     # Reset data counters
     dataset.reset()
 
+    n_word, n_char = stats['n_word'], stats['n_char']
+    n_streamable, n_utt = stats['n_streamable'], stats['n_utt']
+    quantity_rate = sum(stats['quantity_rates'])
+    last_success_frame_ratio = sum(stats['last_success_frame_ratios'])
+
     if not streaming:
+        n_workers = recog_params['recog_n_score_workers']
+        for wer_b, sub_b, ins_b, del_b in compute_wer_batch(stats['refs_w'], stats['hyps_w'], n_workers):
+            wer += wer_b
+            n_sub_w += sub_b
+            n_ins_w += ins_b
+            n_del_w += del_b
+        for cer_b, sub_b, ins_b, del_b in compute_wer_batch(stats['refs_c'], stats['hyps_c'], n_workers):
+            cer += cer_b
+            n_sub_c += sub_b
+            n_ins_c += ins_b
+            n_del_c += del_b
+
         if ('char' in dataset.unit and 'nowb' not in dataset.unit) or (task_idx > 0 and dataset.unit_sub1 == 'char'):
             wer /= n_word
             n_sub_w /= n_word
@@ -6,6 +6,9 @@
 
 """Functions for computing edit distance."""
 
+import codecs
+import itertools
+import multiprocessing
 import numpy as np
 
 
@@ -72,69 +75,40 @@ def compute_wer(ref, hyp, normalize=False):
         n_del (int): the number of deletion
 
     """
-    # Initialisation
-    d = np.zeros((len(ref) + 1) * (len(hyp) + 1), dtype=np.uint16)
-    d = d.reshape((len(ref) + 1, len(hyp) + 1))
-    for i in range(len(ref) + 1):
-        for j in range(len(hyp) + 1):
-            if i == 0:
-                d[0][j] = j
-            elif j == 0:
-                d[i][0] = i
-
-    # Computation
-    for i in range(1, len(ref) + 1):
-        for j in range(1, len(hyp) + 1):
-            if ref[i - 1] == hyp[j - 1]:
-                d[i][j] = d[i - 1][j - 1]
-            else:
-                sub_tmp = d[i - 1][j - 1] + 1
-                ins_tmp = d[i][j - 1] + 1
-                del_tmp = d[i - 1][j] + 1
-                d[i][j] = min(sub_tmp, ins_tmp, del_tmp)
+    # Map words to integer IDs
+    word2id = {}
+    ref_ids = np.array([word2id.setdefault(w, len(word2id)) for w in ref], dtype=np.int64)
+    hyp_ids = np.array([word2id.setdefault(w, len(word2id)) for w in hyp], dtype=np.int64)
 
-    wer = d[len(ref)][len(hyp)]
+    d = edit_distance_matrix(ref_ids, hyp_ids)
+    wer = int(d[len(ref), len(hyp)])
 
     # Find out the manipulation steps
     x = len(ref)
     y = len(hyp)
-    error_list = []
-    while True:
-        if x == 0 and y == 0:
-            break
-        else:
-            if x > 0 and y > 0:
-                if d[x][y] == d[x - 1][y - 1] and ref[x - 1] == hyp[y - 1]:
-                    error_list.append("C")
-                    x = x - 1
-                    y = y - 1
-                elif d[x][y] == d[x][y - 1] + 1:
-                    error_list.append("I")
-                    y = y - 1
-                elif d[x][y] == d[x - 1][y - 1] + 1:
-                    error_list.append("S")
-                    x = x - 1
-                    y = y - 1
-                else:
-                    error_list.append("D")
-                    x = x - 1
-            elif x == 0 and y > 0:
-                if d[x][y] == d[x][y - 1] + 1:
-                    error_list.append("I")
-                    y = y - 1
-                else:
-                    error_list.append("D")
-                    x = x - 1
-            elif y == 0 and x > 0:
-                error_list.append("D")
+    n_sub, n_ins, n_del, n_cor = 0, 0, 0, 0
+    while x > 0 or y > 0:
+        if x > 0 and y > 0:
+            if d[x, y] == d[x - 1, y - 1] and ref_ids[x - 1] == hyp_ids[y - 1]:
+                n_cor += 1
                 x = x - 1
+                y = y - 1
+            elif d[x, y] == d[x, y - 1] + 1:
+                n_ins += 1
+                y = y - 1
+            elif d[x, y] == d[x - 1, y - 1] + 1:
+                n_sub += 1
+                x = x - 1
+                y = y - 1
             else:
-                raise ValueError
-
-    n_sub = error_list.count("S")
-    n_ins = error_list.count("I")
-    n_del = error_list.count("D")
-    n_cor = error_list.count("C")
+                n_del += 1
+                x = x - 1
+        elif x == 0:
+            n_ins += 1
+            y = y - 1
+        else:
+            n_del += 1
+            x = x - 1
 
     assert wer == (n_sub + n_ins + n_del)
     assert n_cor == (len(ref) - n_sub - n_del)
@@ -145,6 +119,180 @@ def compute_wer(ref, hyp, normalize=False):
     return wer * 100, n_sub * 100, n_ins * 100, n_del * 100
 
 
+def edit_distance_matrix(ref_ids, hyp_ids):
+    """Compute the Levenshtein distance matrix between two ID sequences.
+
+    Each row is computed at once; insertions within a row are resolved
+    by a cumulative minimum over d[i][k] - k.
+
+    Args:
+        ref_ids (np.ndarray): `[R]`
+        hyp_ids (np.ndarray): `[H]`
+    Returns:
+        d (np.ndarray): `[R + 1, H + 1]`, where d[i][j] is the distance
+            between ref_ids[:i] and hyp_ids[:j]
+
+    """
+    R, H = len(ref_ids), len(hyp_ids)
+    pos = np.arange(H + 1, dtype=np.int64)
+    d = np.zeros((R + 1, H + 1), dtype=np.int64)
+    d[0] = pos
+    for i in range(1, R + 1):
+        # substitution (or match) and deletion
+        d[i, 0] = i
+        d[i, 1:] = np.minimum(d[i - 1, :-1] + (hyp_ids != ref_ids[i - 1]), d[i - 1, 1:] + 1)
+        # insertion
+        d[i] = np.minimum.accumulate(d[i] - pos) + pos
+    return d
+
+
+def edit_distance_batch(refs, hyps):
+    """Compute Levenshtein distances of many ID sequence pairs at once.
+
+    All pairs are padded into one batch, and each row of their distance
+    matrices is computed for all pairs at once (see edit_distance_matrix).
+
+    Args:
+        refs (list): length `N`, each of which contains reference IDs
+        hyps (list): length `N`, each of which contains hypothesis IDs
+    Returns:
+        dists (np.ndarray): `[N]`
+
+    """
+    assert len(refs) == len(hyps)
+    N = len(refs)
+    rlens = np.array([len(r) for r in refs], dtype=np.int64)
+    hlens = np.array([len(h) for h in hyps], dtype=np.int64)
+    R = int(rlens.max()) if N > 0 else 0
+    H = int(hlens.max()) if N > 0 else 0
+
+    # NOTE: paddings of refs and hyps never match each other
+    ref_ids = np.full((N, R), -1, dtype=np.int64)
+    hyp_ids = np.full((N, H), -2, dtype=np.int64)
+    for n in range(N):
+        ref_ids[n, :rlens[n]] = refs[n]
+        hyp_ids[n, :hlens[n]] = hyps[n]
+
+    pos = np.arange(H + 1, dtype=np.int64)
+    d = np.tile(pos, (N, 1))  # `[N, H + 1]`
+    dists = d[np.arange(N), hlens]
+    for i in range(1, R + 1):
+        # substitution (or match) and deletion
+        d_new = np.empty_like(d)
+        d_new[:, 0] = i
+        d_new[:, 1:] = np.minimum(d[:, :-1] + (hyp_ids != ref_ids[:, i - 1:i]), d[:, 1:] + 1)
+        # insertion
+        d = np.minimum.accumulate(d_new - pos, axis=1) + pos
+        is_end = rlens == i
+        dists[is_end] = d[is_end, hlens[is_end]]
+    return dists
+
+
+def _compute_wer(args):
+    return compute_wer(*args)
+
+
+def compute_wer_batch(refs, hyps, n_workers=1, chunk_size=64):
+    """Compute Word Error Rates of many utterances.
+
+    Args:
+        refs (list): list of words in each reference transcript
+        hyps (list): list of words in each predicted transcript
+        n_workers (int): number of worker processes
+        chunk_size (int): number of utterances sent to a worker at once
+    Returns:
+        results (list): list of (wer, n_sub, n_ins, n_del) per utterance
+            in the same order as refs
+
+    """
+    assert len(refs) == len(hyps)
+    if n_workers <= 1 or len(refs) <= chunk_size:
+        return [compute_wer(ref, hyp) for ref, hyp in zip(refs, hyps)]
+    with multiprocessing.Pool(n_workers) as pool:
+        return pool.map(_compute_wer, zip(refs, hyps), chunksize=chunk_size)
+
+
+def read_trn(trn_path):
+    """Read a trn file line by line.
+
+    Args:
+        trn_path (str): path to the trn file
+    Yields:
+        text (str): transcript
+        utt_id (str): speaker-utterance ID
+
+    """
+    with codecs.open(trn_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line == '':
+                continue
+            text, utt_id = line.rsplit('(', 1)
+            yield text[:-1] if text.endswith(' ') else text, utt_id.rstrip(')')
+
+
+def score_trn(ref_trn_path, hyp_trn_path, unit='word', remove_space=False,
+              n_workers=1, chunk_size=1000):
+    """Score a pair of trn files in a streaming way.
+
+    Utterances are read and scored per chunk, so that large trn files
+    do not have to be loaded at once.
+
+    Args:
+        ref_trn_path (str): path to the reference trn file
+        hyp_trn_path (str): path to the hypothesis trn file written in the same order
+        unit (str): word/char
+        remove_space (bool): remove spaces before computing CER
+        n_workers (int): number of worker processes
+        chunk_size (int): number of utterances scored at once
+    Returns:
+        wer (float): Word (or Character) Error Rate
+        n_sub (float): substitution error rate
+        n_ins (float): insertion error rate
+        n_del (float): deletion error rate
+
+    """
+    def tokenize(text):
+        if unit == 'word':
+            return text.split(' ')
+        elif unit == 'char':
+            return list(text.replace(' ', '') if remove_space else text)
+        raise ValueError(unit)
+
+    err, n_sub, n_ins, n_del, n_ref = 0, 0, 0, 0, 0
+    pool = multiprocessing.Pool(n_workers) if n_workers > 1 else None
+    try:
+        pairs = zip(read_trn(ref_trn_path), read_trn(hyp_trn_path))
+        while True:
+            refs, hyps = [], []
+            for (ref, ref_id), (hyp, hyp_id) in itertools.islice(pairs, chunk_size):
+                if ref_id != hyp_id:
+                    raise ValueError('Utterance IDs do not match: %s, %s' % (ref_id, hyp_id))
+                refs.append(tokenize(ref))
+                hyps.append(tokenize(hyp))
+            if len(refs) == 0:
+                break
+            if pool is not None:
+                results = pool.map(_compute_wer, zip(refs, hyps),
+                                   chunksize=max(1, len(refs) // n_workers))
+            else:
+                results = [compute_wer(ref, hyp) for ref, hyp in zip(refs, hyps)]
+            for (err_b, sub_b, ins_b, del_b), ref in zip(results, refs):
+                err += err_b
+                n_sub += sub_b
+                n_ins += ins_b
+                n_del += del_b
+                n_ref += len(ref)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if n_ref == 0:
+        return 0., 0., 0., 0.
+    return err / n_ref, n_sub / n_ref, n_ins / n_ref, n_del / n_ref
+
+
 def wer_align(ref, hyp, normalize=False, double_byte=False):
     """Compute Word Error Rate.
 
@@ -6,11 +6,11 @@
 
 """Evaluate a phene-level model by PER."""
 
-import codecs
 import logging
 from tqdm import tqdm
 
 from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.evaluators.sharding import decode_sharded
 from neural_sp.utils import mkdir_join
 
 logger = logging.getLogger(__name__)
@@ -47,13 +47,19 @@ def eval_phone(models, dataset, recog_params, epoch,
         ref_trn_save_path = mkdir_join(recog_dir, 'ref.trn')
         hyp_trn_save_path = mkdir_join(recog_dir, 'hyp.trn')
 
-    per = 0
-    n_sub, n_ins, n_del = 0, 0, 0
-    n_phone = 0
-    if progressbar:
-        pbar = tqdm(total=len(dataset))
+    # states are carried over between utterances in the same session
+    carry_over = recog_params['recog_asr_state_carry_over'] or recog_params['recog_lm_state_carry_over']
+
+    def decode(dataset, f_ref, f_hyp, progressbar):
+        if carry_over:
+            # start from the same states in every shard as in serial decoding
+            for model in models:
+                model.reset_state_carry_over()
+
+        stats = {'n_err': 0, 'n_sub': 0, 'n_ins': 0, 'n_del': 0, 'n_phone': 0}
+        if progressbar:
+            pbar = tqdm(total=len(dataset))
 
-    with codecs.open(hyp_trn_save_path, 'w', encoding='utf-8') as f_hyp, codecs.open(ref_trn_save_path, 'w', encoding='utf-8') as f_ref:
         while True:
             batch, is_new_epoch = dataset.next(recog_params['recog_batch_size'])
             if streaming or recog_params['recog_chunk_sync']:
@@ -92,11 +98,11 @@ def eval_phone(models, dataset, recog_params, epoch,
                     per_b, sub_b, ins_b, del_b = compute_wer(ref=ref.split(' '),
                                                              hyp=hyp.split(' '),
                                                              normalize=False)
-                    per += per_b
-                    n_sub += sub_b
-                    n_ins += ins_b
-                    n_del += del_b
-                    n_phone += len(ref.split(' '))
+                    stats['n_err'] += per_b
+                    stats['n_sub'] += sub_b
+                    stats['n_ins'] += ins_b
+                    stats['n_del'] += del_b
+                    stats['n_phone'] += len(ref.split(' '))
 
                 if progressbar:
                     pbar.update(1)
@@ -104,8 +110,15 @@ def eval_phone(models, dataset, recog_params, epoch,
             if is_new_epoch:
                 break
 
-    if progressbar:
-        pbar.close()
+        if progressbar:
+            pbar.close()
+        return stats
+
+    stats = decode_sharded(decode, dataset, ref_trn_save_path, hyp_trn_save_path,
+                           recog_params['recog_n_shards'], progressbar, keep_sessions=carry_over)
+    per = stats['n_err']
+    n_sub, n_ins, n_del = stats['n_sub'], stats['n_ins'], stats['n_del']
+    n_phone = stats['n_phone']
 
     # Reset data counters
     dataset.reset()
@@ -40,7 +40,7 @@ def eval_ppl(models, dataset, batch_size=1, bptt=None,
         dataset (Dataset): evaluation dataset
         batch_size (int): batch size
         bptt (int): BPTT length
-        n_caches (int):
+        n_caches (int): number of cached positions for the continuous cache
         progressbar (bool): if True, visualize the progressbar
     Returns:
         ppl (float): Average perplexity
@@ -54,29 +54,21 @@ def eval_ppl(models, dataset, batch_size=1, bptt=None,
     total_loss = 0
     n_tokens = 0
     hidden = None  # for RNNLM
+    if is_lm and n_caches > 0:
+        models[0].reset_cache()
     if progressbar:
         pbar = tqdm(total=len(dataset))
     while True:
         if is_lm:
             ys, is_new_epoch = dataset.next(batch_size, bptt)
             bs, time = ys.shape[:2]
-            if n_caches > 0:
-                assert isinstance(models[0], RNNLM)
-                # NOTE: cache is not supported for GatedConvLM/TransformerLM now
-                for t in range(time - 1):
-                    loss, hidden = models[0](ys[:, t:t + 2], hidden, is_eval=True, n_caches=n_caches)[:2]
-                    total_loss += loss.item() * bs
-                    n_tokens += bs
-
-                    if progressbar:
-                        pbar.update(bs)
-            else:
-                loss, hidden = models[0](ys, hidden, is_eval=True)[:2]
-                total_loss += loss.item() * bs * (time - 1)
-                n_tokens += bs * (time - 1)
-
-                if progressbar:
-                    pbar.update(bs * (time - 1))
+            # NOTE: the continuous cache is computed over the whole BPTT segment at once
+            loss, hidden = models[0](ys, hidden, is_eval=True, n_caches=n_caches)[:2]
+            total_loss += loss.item() * bs * (time - 1)
+            n_tokens += bs * (time - 1)
+
+            if progressbar:
+                pbar.update(bs * (time - 1))
         else:
             batch, is_new_epoch = dataset.next(batch_size)
             bs = len(batch['ys'])
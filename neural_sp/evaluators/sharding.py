@@ -0,0 +1,126 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Parallel decoding of an evaluation set split into shards."""
+
+import codecs
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+import torch
+
+logger = logging.getLogger(__name__)
+
+# NOTE: set before forking workers so that they inherit the loaded models
+# as copy-on-write memory instead of receiving pickled copies
+_context = None
+
+
+def decode_sharded(decode_fn, dataset, ref_trn_save_path, hyp_trn_save_path,
+                   n_shards=1, progressbar=False, keep_sessions=False):
+    """Decode a dataset, optionally in parallel worker processes.
+
+    The dataset is split into contiguous shards, each of which is decoded by
+    a process forked after the models are loaded. The trn files of all shards
+    are concatenated in the original order of the dataset.
+    When CUDA has been initialized in the current process, the dataset is
+    decoded without forking since CUDA cannot be used in forked processes.
+    When states are carried over between utterances of the same session,
+    shards must be cut on session boundaries (keep_sessions=True) so that
+    every utterance sees the same context as in serial decoding.
+
+    Args:
+        decode_fn (callable): function to decode a dataset.
+            decode_fn(dataset, f_ref, f_hyp, progressbar) writes to the trn files
+            and returns a dictionary of statistics
+        dataset (Dataset): evaluation dataset
+        ref_trn_save_path (str): path to the reference trn file
+        hyp_trn_save_path (str): path to the hypothesis trn file
+        n_shards (int): number of worker processes.
+            1 means decoding in the current process.
+        progressbar (bool): visualize the progressbar
+        keep_sessions (bool): do not split a session into different shards
+    Returns:
+        stats (dict): statistics merged over all shards
+
+    """
+    if n_shards > 1 and torch.cuda.is_initialized():
+        # NOTE: CUDA cannot be used in forked processes
+        logger.warning('Sharded decoding is supported only on CPU. Decode in the current process.')
+        n_shards = 1
+    n_shards = min(n_shards, len(dataset))
+    shards = []
+    if n_shards > 1:
+        shards = [dataset.shard(i, n_shards, keep_sessions) for i in range(n_shards)]
+        shards = [shard for shard in shards if len(shard) > 0]
+        n_shards = len(shards)
+    if n_shards <= 1:
+        with codecs.open(hyp_trn_save_path, 'w', encoding='utf-8') as f_hyp, \
+                codecs.open(ref_trn_save_path, 'w', encoding='utf-8') as f_ref:
+            return decode_fn(dataset, f_ref, f_hyp, progressbar)
+
+    global _context
+    _context = (decode_fn, shards, ref_trn_save_path, hyp_trn_save_path,
+                max(1, torch.get_num_threads() // n_shards))
+    start_time = time.time()
+    try:
+        with multiprocessing.get_context('fork').Pool(n_shards) as pool:
+            stats_shards = pool.map(_decode_shard, range(n_shards))
+    finally:
+        _context = None
+    elapsed = time.time() - start_time
+    logger.info('Decoded %d utterances in %d shards (%.2f sec, RTF: %.4f)' %
+                (len(dataset), n_shards, elapsed, elapsed / (dataset.n_frames * 0.01)))
+
+    # Merge trn files in the original order
+    for trn_save_path in [ref_trn_save_path, hyp_trn_save_path]:
+        with open(trn_save_path, 'wb') as f:
+            for shard_id in range(n_shards):
+                with open(trn_save_path + '.' + str(shard_id), 'rb') as f_shard:
+                    shutil.copyfileobj(f_shard, f)
+                os.remove(trn_save_path + '.' + str(shard_id))
+
+    return merge_stats(stats_shards)
+
+
+def _decode_shard(shard_id):
+    decode_fn, shards, ref_trn_save_path, hyp_trn_save_path, n_threads = _context
+    torch.set_num_threads(n_threads)
+    dataset = shards[shard_id]
+
+    start_time = time.time()
+    with codecs.open(hyp_trn_save_path + '.' + str(shard_id), 'w', encoding='utf-8') as f_hyp, \
+            codecs.open(ref_trn_save_path + '.' + str(shard_id), 'w', encoding='utf-8') as f_ref:
+        with torch.no_grad():
+            stats = decode_fn(dataset, f_ref, f_hyp, False)
+    elapsed = time.time() - start_time
+    logger.info('Shard %d: %d utterances (%.2f sec, RTF: %.4f)' %
+                (shard_id, len(dataset), elapsed, elapsed / (dataset.n_frames * 0.01)))
+    return stats
+
+
+def merge_stats(stats_shards):
+    """Merge statistics of shards.
+
+    Integers are summed up and lists are concatenated in the order of shards
+    so that the results are identical to those of serial decoding.
+
+    Args:
+        stats_shards (list): dictionaries of statistics returned by decode_fn
+    Returns:
+        stats (dict): merged statistics
+
+    """
+    stats = {}
+    for stats_shard in stats_shards:
+        for k, v in stats_shard.items():
+            if k not in stats:
+                stats[k] = list(v) if isinstance(v, list) else v
+            else:
+                stats[k] += v
+    return stats
@@ -6,13 +6,13 @@
 
 """Evaluate the word-level model by WER."""
 
-import codecs
 import copy
 import logging
 import numpy as np
 from tqdm import tqdm
 
-from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.evaluators.edit_distance import compute_wer_batch
+from neural_sp.evaluators.sharding import decode_sharded
 from neural_sp.evaluators.resolving_unk import resolve_unk
 from neural_sp.utils import mkdir_join
 
@@ -56,12 +56,22 @@ def eval_word(models, dataset, recog_params, epoch,
     wer, cer = 0, 0
     n_sub_w, n_ins_w, n_del_w = 0, 0, 0
     n_sub_c, n_ins_c, n_del_c = 0, 0, 0
-    n_word, n_char = 0, 0
-    n_oov_total = 0
-    if progressbar:
-        pbar = tqdm(total=len(dataset))
 
-    with codecs.open(hyp_trn_save_path, 'w', encoding='utf-8') as f_hyp, codecs.open(ref_trn_save_path, 'w', encoding='utf-8') as f_ref:
+    # states are carried over between utterances in the same session
+    carry_over = recog_params['recog_asr_state_carry_over'] or recog_params['recog_lm_state_carry_over']
+
+    def decode(dataset, f_ref, f_hyp, progressbar):
+        if carry_over:
+            # start from the same states in every shard as in serial decoding
+            for model in models:
+                model.reset_state_carry_over()
+
+        # NOTE: statistics are accumulated per utterance and scored after decoding
+        stats = {'n_word': 0, 'n_char': 0, 'n_oov_total': 0,
+                 'refs_w': [], 'hyps_w': [], 'refs_c': [], 'hyps_c': []}
+        if progressbar:
+            pbar = tqdm(total=len(dataset))
+
         while True:
             batch, is_new_epoch = dataset.next(recog_params['recog_batch_size'])
             if streaming or recog_params['recog_chunk_sync']:
@@ -82,7 +92,7 @@ def eval_word(models, dataset, recog_params, epoch,
                 ref = batch['text'][b]
                 hyp = dataset.idx2token[0](best_hyps_id[b])
 
-                n_oov_total += hyp.count('<unk>')
+                stats['n_oov_total'] += hyp.count('<unk>')
 
                 # Resolving UNK
                 if recog_params['recog_resolving_unk'] and '<unk>' in hyp:
@@ -114,14 +124,9 @@ def eval_word(models, dataset, recog_params, epoch,
                     if dataset.corpus == 'csj':
                         ref_char = ref.replace(' ', '')
                         hyp_char = hyp.replace(' ', '')
-                    cer_b, sub_b, ins_b, del_b = compute_wer(ref=list(ref_char),
-                                                             hyp=list(hyp_char),
-                                                             normalize=False)
-                    cer += cer_b
-                    n_sub_c += sub_b
-                    n_ins_c += ins_b
-                    n_del_c += del_b
-                    n_char += len(ref_char)
+                    stats['refs_c'].append(list(ref_char))
+                    stats['hyps_c'].append(list(hyp_char))
+                    stats['n_char'] += len(ref_char)
 
                 # Write to trn
                 speaker = str(batch['speakers'][b]).replace('-', '_')
@@ -138,14 +143,9 @@ def eval_word(models, dataset, recog_params, epoch,
 
                 if not streaming:
                     # Compute WER
-                    wer_b, sub_b, ins_b, del_b = compute_wer(ref=ref.split(' '),
-                                                             hyp=hyp.split(' '),
-                                                             normalize=False)
-                    wer += wer_b
-                    n_sub_w += sub_b
-                    n_ins_w += ins_b
-                    n_del_w += del_b
-                    n_word += len(ref.split(' '))
+                    stats['refs_w'].append(ref.split(' '))
+                    stats['hyps_w'].append(hyp.split(' '))
+                    stats['n_word'] += len(ref.split(' '))
 
                 if progressbar:
                     pbar.update(1)
@@ -153,13 +153,32 @@ def eval_word(models, dataset, recog_params, epoch,
             if is_new_epoch:
                 break
 
-    if progressbar:
-        pbar.close()
+        if progressbar:
+            pbar.close()
+        return stats
+
+    stats = decode_sharded(decode, dataset, ref_trn_save_path, hyp_trn_save_path,
+                           recog_params['recog_n_shards'], progressbar, keep_sessions=carry_over)
 
     # Reset data counters
     dataset.reset()
 
+    n_word, n_char = stats['n_word'], stats['n_char']
+    n_oov_total = stats['n_oov_total']
+
     if not streaming:
+        n_workers = recog_params['recog_n_score_workers']
+        for wer_b, sub_b, ins_b, del_b in compute_wer_batch(stats['refs_w'], stats['hyps_w'], n_workers):
+            wer += wer_b
+            n_sub_w += sub_b
+            n_ins_w += ins_b
+            n_del_w += del_b
+        for cer_b, sub_b, ins_b, del_b in compute_wer_batch(stats['refs_c'], stats['hyps_c'], n_workers):
+            cer += cer_b
+            n_sub_c += sub_b
+            n_ins_c += ins_b
+            n_del_c += del_b
+
         wer /= n_word
         n_sub_w /= n_word
         n_ins_w /= n_word
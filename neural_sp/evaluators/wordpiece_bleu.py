@@ -6,11 +6,11 @@
 
 """Evaluate the wordpiece-level model by BLEU."""
 
-import codecs
 import logging
 from tqdm import tqdm
 from nltk.translate.bleu_score import corpus_bleu, sentence_bleu
 
+from neural_sp.evaluators.sharding import decode_sharded
 from neural_sp.utils import mkdir_join
 
 logger = logging.getLogger(__name__)
@@ -50,17 +50,20 @@ def eval_wordpiece_bleu(models, dataset, recog_params, epoch,
         ref_trn_save_path = mkdir_join(recog_dir, 'ref.trn')
         hyp_trn_save_path = mkdir_join(recog_dir, 'hyp.trn')
 
-    s_bleu = 0
-    n_sentence = 0
-    if progressbar:
-        pbar = tqdm(total=len(dataset))
+    # states are carried over between utterances in the same session
+    carry_over = recog_params['recog_asr_state_carry_over'] or recog_params['recog_lm_state_carry_over']
 
-    # calculate sentence-level BLEU distribution based on input lengths
-    s_bleu_dist = {}
+    def decode(dataset, f_ref, f_hyp, progressbar):
+        if carry_over:
+            # start from the same states in every shard as in serial decoding
+            for model in models:
+                model.reset_state_carry_over()
+
+        # NOTE: sentence-level BLEU is kept with the input length of each sentence
+        stats = {'list_of_references': [], 'hypotheses': [], 's_bleus': []}
+        if progressbar:
+            pbar = tqdm(total=len(dataset))
 
-    list_of_references = []
-    hypotheses = []
-    with codecs.open(hyp_trn_save_path, 'w', encoding='utf-8') as f_hyp, codecs.open(ref_trn_save_path, 'w', encoding='utf-8') as f_ref:
         while True:
             batch, is_new_epoch = dataset.next(recog_params['recog_batch_size'])
             if streaming or recog_params['recog_chunk_sync']:
@@ -97,20 +100,14 @@ def eval_wordpiece_bleu(models, dataset, recog_params, epoch,
                 logger.debug('-' * 150)
 
                 if not streaming:
-                    list_of_references += [[ref.split(' ')]]
-                    hypotheses += [hyp.split(' ')]
-                    n_sentence += 1
+                    stats['list_of_references'] += [[ref.split(' ')]]
+                    stats['hypotheses'] += [hyp.split(' ')]
 
                     # Compute sentence-level BLEU
                     if fine_grained:
                         s_bleu_b = sentence_bleu([ref.split(' ')], hyp.split(' '))
-                        s_bleu += s_bleu_b * 100
-
                         xlen_bin = (batch['xlens'][b] // 200 + 1) * 200
-                        if xlen_bin in s_bleu_dist.keys():
-                            s_bleu_dist[xlen_bin] += [s_bleu_b / 100]
-                        else:
-                            s_bleu_dist[xlen_bin] = [s_bleu_b / 100]
+                        stats['s_bleus'].append((xlen_bin, s_bleu_b))
 
                 if progressbar:
                     pbar.update(1)
@@ -118,8 +115,24 @@ def eval_wordpiece_bleu(models, dataset, recog_params, epoch,
             if is_new_epoch:
                 break
 
-    if progressbar:
-        pbar.close()
+        if progressbar:
+            pbar.close()
+        return stats
+
+    stats = decode_sharded(decode, dataset, ref_trn_save_path, hyp_trn_save_path,
+                           recog_params['recog_n_shards'], progressbar, keep_sessions=carry_over)
+    list_of_references, hypotheses = stats['list_of_references'], stats['hypotheses']
+    n_sentence = len(hypotheses)
+
+    # calculate sentence-level BLEU distribution based on input lengths
+    s_bleu = 0
+    s_bleu_dist = {}
+    for xlen_bin, s_bleu_b in stats['s_bleus']:
+        s_bleu += s_bleu_b * 100
+        if xlen_bin in s_bleu_dist.keys():
+            s_bleu_dist[xlen_bin] += [s_bleu_b / 100]
+        else:
+            s_bleu_dist[xlen_bin] = [s_bleu_b / 100]
 
     # Reset data counters
     dataset.reset()
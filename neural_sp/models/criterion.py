@@ -19,8 +19,9 @@ import torch.nn.functional as F
 class MBR(torch.autograd.Function):
     """Minimum Bayes Risk (MBR) training.
 
-    Args:
-        vocab (int): number of nodes in softmax layer
+    The gradient of the expected risk w.r.t. the log-probability of each
+    hypothesis is attached only to the tokens of the hypothesis, so that
+    no dense one-hot tensors over the vocabulary are needed.
 
     """
     @staticmethod
@@ -29,25 +30,26 @@ class MBR(torch.autograd.Function):
 
         Args:
             log_probs (FloatTensor): `[N_best, L, vocab]`
-            hyps (LongTensor): `[N_best, L]`
+            hyps (LongTensor): `[N_best, L]`, padded with -1
             exp_risk (FloatTensor): `[1]` (for forward)
-            grad (FloatTensor): `[1]` (for backward)
+            grad (FloatTensor): `[N_best]`, gradient w.r.t. the log-probability
+                of each hypothesis (for backward)
         Returns:
             loss (FloatTensor): `[1]`
 
         """
-        device_id = torch.cuda.device_of(log_probs).idx
-        onehot = torch.eye(log_probs.size(-1)).cuda(device_id)[hyps]
-        grads = grad * onehot  # mask out other classes
-        log_probs = log_probs.requires_grad_()
-        ctx.save_for_backward(log_probs, grads)
-        return exp_risk
+        ctx.save_for_backward(hyps, grad)
+        ctx.size = log_probs.size()
+        return exp_risk.clone()
 
     @staticmethod
     def backward(ctx, grad_output):
-        input, grads, = ctx.saved_tensors
-        input.grad = grads
-        return input, None, None, None
+        hyps, grad = ctx.saved_tensors
+        grads = grad.new_zeros(ctx.size)
+        src = grad.view(-1, 1, 1).expand(hyps.size(0), hyps.size(1), 1)
+        src = src.masked_fill((hyps < 0).unsqueeze(2), 0)
+        grads.scatter_(2, hyps.clamp(min=0).unsqueeze(2), src)
+        return grads * grad_output, None, None, None
 
 
 def cross_entropy_lsm(logits, ys, lsm_prob, ignore_index, training, normalize_length=False):
@@ -135,6 +137,29 @@ def kldiv_lsm_ctc(logits, ylens):
     return loss_mean
 
 
+def interval_latency(aws):
+    """Compute the expected interval latency of monotonic attention.
+
+    For each output step, the squared expected delay between the current and
+    previous attended frames is summed over frames, i.e.,
+    sum_j (a_i[j] * sum_{k<j} a_{i-1}[k] * (j - k))^2.
+    The inner sum is computed as a double cumulative sum over time so that no
+    `[T, T]` pairwise tensors are allocated.
+
+    Args:
+        aws (FloatTensor): `[B, H, L, T]`
+    Returns:
+        loss (FloatTensor): `[1]`, averaged over mini-batch, heads, and output steps
+
+    """
+    aws_prev = torch.cat([aws.new_zeros(aws.size())[:, :, -1:], aws[:, :, :-1]], dim=2)
+    # sum_{k<j} a_{i-1}[k] * (j - k) = sum_{j'<=j} sum_{k<j'} a_{i-1}[k]
+    cum_prev = torch.cumsum(aws_prev, dim=-1) - aws_prev  # exclusive cumulative sum
+    exp_delay = torch.cumsum(cum_prev, dim=-1)  # `[B, H, L, T]`
+    loss = torch.pow(aws * exp_delay, 2).sum(-1)  # `[B, H, L]`
+    return torch.mean(loss)
+
+
 def focal_loss(logits, ys, ylens, alpha, gamma):
     """Compute focal loss.
 
@@ -8,6 +8,7 @@
 
 from collections import OrderedDict
 import logging
+import torch
 import torch.nn as nn
 
 from neural_sp.models.lm.lm_base import LMBase
@@ -40,9 +41,7 @@ class GatedConvLM(LMBase):
         # for cache
         self.cache_theta = 0.2  # smoothing parameter
         self.cache_lambda = 0.2  # cache weight
-        self.cache_ids = []
-        self.cache_keys = []
-        self.cache_attn = []
+        self.reset_cache()
 
         self.embed = nn.Embedding(self.vocab, args.emb_dim, padding_idx=self.pad)
         self.dropout_embed = nn.Dropout(p=args.dropout_in)
@@ -188,32 +187,45 @@ class GatedConvLM(LMBase):
             else:
                 raise ValueError(n)
 
-    def decode(self, ys, state=None, mems=None, incremental=False):
+    def decode(self, ys, state=None, mems=None, cache=None, incremental=False):
         """Decode function.
 
         Args:
             ys (LongTensor): `[B, L]`
-            state: dummy interfance for RNNLM
+            state (list): length `n_blocks`, each of which contains a FloatTensor `[B, in_ch, kernel_size-1, 1]`
+                inputs of each block at the last `kernel_size-1` steps. ys contains only new tokens when given.
+            mems: dummy interfance for TransformerXL
             cache: dummy interfance for TransformerLM/TransformerXL
-            incremental: dummy interfance for TransformerLM/TransformerXL
+            incremental (bool): ASR decoding mode
         Returns:
             logits (FloatTensor): `[B, L, vocab]`
             out (FloatTensor): `[B, L, d_model]` (for cache)
-            new_cache: dummy interfance for RNNLM/TransformerLM/TransformerXL
-            new_mems: dummy interfance for TransformerXL
+            new_state (list): length `n_blocks`, each of which contains a FloatTensor `[B, in_ch, kernel_size-1, 1]`
 
         """
         out = self.dropout_embed(self.embed(ys.long()))
         bs, max_ylen = out.size()[:2]
 
+        if state is None:
+            state = [None] * len(self.blocks)
+
         # NOTE: consider embed_dim as in_ch
         out = out.unsqueeze(3)
-        out = self.blocks(out.transpose(2, 1))  # [B, out_ch, T, 1]
-        out = out.transpose(2, 1).contiguous()  # `[B, T, out_ch, 1]`
+        out = out.transpose(2, 1)  # `[B, in_ch, L, 1]`
+        new_state = [None] * len(self.blocks)
+        for lth, block in enumerate(self.blocks):
+            if incremental:
+                # cache inputs of the last `kernel_size-1` steps
+                ctx = block.pad_left(out) if state[lth] is None else torch.cat([state[lth], out], dim=2)
+                new_state[lth] = ctx[:, :, ctx.size(2) - (block.kernel_size - 1):]
+            out = block(out, cache=state[lth])  # `[B, out_ch, L, 1]`
+        out = out.transpose(2, 1).contiguous()  # `[B, L, out_ch, 1]`
         out = out.squeeze(3)
         if self.adaptive_softmax is None:
             logits = self.output(out)
         else:
             logits = out
 
+        if incremental:
+            return logits, out, new_state
         return logits, out, None
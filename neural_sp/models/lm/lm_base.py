@@ -70,35 +70,12 @@ class LMBase(ModelBase):
         if predict_last:
             ys_out = ys_out[:, -1].unsqueeze(1)
             logits = logits[:, -1].unsqueeze(1)
+            out = out[:, -1].unsqueeze(1)
 
         # Compute XE sequence loss
-        if n_caches > 0 and len(self.cache_ids) > 0:
-            assert ys_out.size(1) == 1
-            assert ys_out.size(0) == 1
-            if self.adaptive_softmax is None:
-                probs = torch.softmax(logits, dim=-1)
-            else:
-                probs = self.adaptive_softmax.log_prob(logits).exp()
-            cache_probs = probs.new_zeros(probs.size())
-
-            # Truncate cache
-            self.cache_ids = self.cache_ids[-n_caches:]  # list of `[B, 1]`
-            self.cache_keys = self.cache_keys[-n_caches:]  # list of `[B, 1, n_units]`
-
-            # Compute inner-product over caches
-            cache_attn = torch.softmax(self.cache_theta * torch.matmul(
-                torch.cat(self.cache_keys, dim=1), out.transpose(2, 1)).squeeze(2), dim=1)
-
-            # For visualization
-            if len(self.cache_ids) == n_caches:
-                self.cache_attn += [cache_attn.cpu().numpy()]
-                self.cache_attn = self.cache_attn[-n_caches:]
-
-            # Sum all probabilities
-            for offset, idx in enumerate(self.cache_ids):
-                cache_probs[:, :, idx] += cache_attn[:, offset]
-            probs = (1 - self.cache_lambda) * probs + self.cache_lambda * cache_probs
-            loss = -torch.log(probs[:, :, ys_out[:, -1]])
+        if n_caches > 0:
+            loss = self.cache_loss(logits, out, ys_out, n_caches)
+            ppl = np.exp(loss.item())
         else:
             if self.adaptive_softmax is None:
                 loss, ppl = cross_entropy_lsm(logits, ys_out.contiguous(),
@@ -109,11 +86,6 @@ class LMBase(ModelBase):
                                              ys_out.contiguous().view(-1)).loss
                 ppl = np.exp(loss.item())
 
-        if n_caches > 0:
-            # Register to cache
-            self.cache_ids += [ys_out[0, -1].item()]
-            self.cache_keys += [out]
-
         # Compute token-level accuracy in teacher-forcing
         if self.adaptive_softmax is None:
             acc = compute_accuracy(logits, ys_out, pad=self.pad)
@@ -124,6 +96,85 @@ class LMBase(ModelBase):
         observation = {'loss.lm': loss.item(), 'acc.lm': acc, 'ppl.lm': ppl}
         return loss, new_state, observation
 
+    def reset_cache(self):
+        """Reset the continuous cache."""
+        self.cache_ids = None  # `[B, n_caches]`
+        self.cache_keys = None  # `[B, n_caches, n_units]`
+        self.cache_ptr = 0  # next slot of the ring buffer
+        self.cache_len = 0  # number of filled slots
+        # for visualization
+        self.cache_attn = None  # `[B, L, mlen+L]`
+        self.cache_attn_ids = None  # `[B, mlen+L]`
+
+    def cache_loss(self, logits, out, ys_out, n_caches):
+        """Compute XE loss with the continuous cache (neural cache model).
+
+        LM outputs are interpolated with the cache distribution over the last
+        n_caches positions of each stream. All positions in the segment are
+        computed at once, and then registered to a ring buffer for the next segment.
+
+        Args:
+            logits (FloatTensor): `[B, L, vocab]` (`[B, L, n_units]` for adaptive softmax)
+            out (FloatTensor): `[B, L, n_units]`
+            ys_out (LongTensor): `[B, L]`
+            n_caches (int): number of cached positions
+        Returns:
+            loss (FloatTensor): `[1]`
+
+        """
+        bs, qlen = ys_out.size()
+        if self.cache_keys is None or self.cache_keys.size()[:2] != (bs, n_caches):
+            self.reset_cache()
+            self.cache_ids = ys_out.new_zeros(bs, n_caches)
+            self.cache_keys = out.new_zeros(bs, n_caches, out.size(2))
+
+        if self.adaptive_softmax is None:
+            probs = torch.softmax(logits, dim=-1)
+        else:
+            probs = self.adaptive_softmax.log_prob(logits.contiguous().view(-1, logits.size(2))).exp()
+            probs = probs.view(bs, qlen, -1)
+
+        # Concatenate cached positions (in chronological order) and the current ones
+        mlen = self.cache_len
+        slots = (torch.arange(mlen, device=self.device) + self.cache_ptr - mlen) % n_caches
+        keys = torch.cat([self.cache_keys[:, slots], out], dim=1)  # `[B, mlen+L, n_units]`
+        ids = torch.cat([self.cache_ids[:, slots], ys_out], dim=1)  # `[B, mlen+L]`
+
+        # Each position attends to the previous n_caches positions
+        dist = (torch.arange(qlen, device=self.device) + mlen).unsqueeze(1) - \
+            torch.arange(mlen + qlen, device=self.device).unsqueeze(0)  # `[L, mlen+L]`
+        mask = (dist > 0) & (dist <= n_caches)
+        mask = mask.unsqueeze(0) & (ids != self.pad).unsqueeze(1)  # `[B, L, mlen+L]`
+
+        # Compute inner-product over caches
+        e = self.cache_theta * torch.matmul(out, keys.transpose(2, 1))  # `[B, L, mlen+L]`
+        NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
+        cache_attn = torch.softmax(e.masked_fill(mask == 0, NEG_INF), dim=-1)
+        cache_attn = cache_attn.masked_fill(mask == 0, 0)
+
+        # Sum probabilities of the same tokens
+        cache_probs = probs.new_zeros(probs.size()).scatter_add_(
+            2, ids.unsqueeze(1).expand(bs, qlen, mlen + qlen), cache_attn)
+        # NOTE: positions without any cache use the LM probabilities only
+        cache_lambda = self.cache_lambda * (mask.sum(2, keepdim=True) > 0).float()
+        probs = (1 - cache_lambda) * probs + cache_lambda * cache_probs
+        log_probs = torch.log(probs.gather(2, ys_out.unsqueeze(2)).squeeze(2))  # `[B, L]`
+        loss = -log_probs.masked_select(ys_out != self.pad).mean()
+
+        # For visualization
+        self.cache_attn = cache_attn
+        self.cache_attn_ids = ids
+
+        # Register to the ring buffer
+        n_new = min(qlen, n_caches)
+        slots = (torch.arange(n_new, device=self.device) + self.cache_ptr) % n_caches
+        self.cache_keys[:, slots] = out[:, -n_new:]
+        self.cache_ids[:, slots] = ys_out[:, -n_new:]
+        self.cache_ptr = (self.cache_ptr + n_new) % n_caches
+        self.cache_len = min(mlen + n_new, n_caches)
+
+        return loss
+
     def repackage_state(self, state):
         return state
 
@@ -131,7 +182,50 @@ class LMBase(ModelBase):
         # for TransformerXL
         self.mem_len = mem_len
 
-    def decode(self, ys, state=None, mems=None, incremental=False):
+    def init_cache(self, bs, max_len):
+        """Allocate key/value buffers of self-attention layers for incremental decoding.
+        (for TransformerLM/TransformerXL)
+
+        Args:
+            bs (int): number of hypotheses
+            max_len (int): initial capacity of the buffers
+        Returns:
+            cache (list): length `n_layers`, each of which contains a dict
+                key (FloatTensor): `[B, max_len, H, d_k]`
+                value (FloatTensor): `[B, max_len, H, d_k]`
+                length (int): number of cached positions
+                mlen (int): number of cached positions carried over from the previous segments
+                pos (int): absolute position of the next token (for TransformerLM)
+
+        """
+        return [dict(layer.self_attn.init_kv_cache(bs, max_len), mlen=0, pos=0) for layer in self.layers]
+
+    def truncate_cache(self, cache, mem_len):
+        """Keep keys and values of the last positions as memory for the next segment.
+        (for TransformerLM/TransformerXL)
+
+        This bounds the cost of carrying LM states over utterances in a long session
+        as segment-level recurrence in TransformerXL.
+
+        Args:
+            cache (list): see init_cache
+            mem_len (int): maximum number of positions to keep (0 means no limit)
+        Returns:
+            new_cache (list): see init_cache
+
+        """
+        new_cache = []
+        for cache_l in cache:
+            klen = cache_l['length']
+            start = max(0, klen - mem_len) if mem_len > 0 else 0
+            new_cache.append({'key': cache_l['key'][:, start:klen].clone(),
+                              'value': cache_l['value'][:, start:klen].clone(),
+                              'length': klen - start,
+                              'mlen': klen - start,
+                              'pos': cache_l['pos']})
+        return new_cache
+
+    def decode(self, ys, state=None, mems=None, cache=None, incremental=False):
         raise NotImplementedError
 
     def predict(self, ys, state=None, mems=None, cache=None):
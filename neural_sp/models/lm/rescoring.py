@@ -0,0 +1,193 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Batched N-best rescoring with external language models."""
+
+import logging
+import numpy as np
+import torch
+
+from neural_sp.models.lm.gated_convlm import GatedConvLM
+from neural_sp.models.lm.rnnlm import RNNLM
+from neural_sp.models.lm.transformer_xl import TransformerXL
+from neural_sp.models.lm.transformerlm import TransformerLM
+from neural_sp.models.seq2seq.decoders.beam_search import reorder_lmstate
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+from neural_sp.models.torch_utils import tensor2np
+
+logger = logging.getLogger(__name__)
+
+
+class LMRescorer(object):
+    """Score N-best hypotheses of one or more utterances with an LM at once.
+
+    Hypotheses are merged into a prefix trie so that shared prefixes are fed
+    to the LM only once. All nodes at the same depth are processed in a single
+    LM call, and their child tokens are scored by a single gather.
+    When use_trie=False, all hypotheses are scored as one padded batch instead.
+
+    Args:
+        lm (LMBase): RNNLM/TransformerLM/TransformerXL/GatedConvLM
+        use_trie (bool): share computation of common prefixes among hypotheses
+
+    """
+
+    def __init__(self, lm, use_trie=True):
+
+        super(LMRescorer, self).__init__()
+
+        self.lm = lm
+        self.device = lm.device
+
+        if not use_trie:
+            self.incremental = None
+        elif isinstance(lm, RNNLM) or isinstance(lm, GatedConvLM):
+            self.incremental = 'rnn'  # feed the last token with the recurrent/convolution state
+        elif isinstance(lm, TransformerLM) or isinstance(lm, TransformerXL):
+            self.incremental = 'transformer'
+        else:
+            self.incremental = None
+
+    def log_softmax(self, logits):
+        """Normalize LM outputs.
+
+        Args:
+            logits (FloatTensor): `[B, (L), vocab]` or `[B, (L), d_model]` for adaptive softmax
+        Returns:
+            log_probs (FloatTensor): `[B, (L), vocab]`
+
+        """
+        if self.lm.adaptive_softmax is None:
+            return torch.log_softmax(logits, dim=-1)
+        log_probs = self.lm.adaptive_softmax.log_prob(logits.contiguous().view(-1, logits.size(-1)))
+        return log_probs.view(logits.size()[:-1] + (-1,))
+
+    def score(self, ys, reverse=False):
+        """Compute LM log probabilities of token sequences.
+
+        Args:
+            ys (list): length `N`, each of which contains a list of token indices
+                including <sos> at the beginning
+            reverse (bool): score sequences in the reversed order (for backward LMs)
+        Returns:
+            scores (np.ndarray): `[N]`, sum of log probabilities of tokens except for the first one
+            ylens (np.ndarray): `[N]`, number of scored tokens
+
+        """
+        if reverse:
+            ys = [y[::-1] for y in ys]
+        ys = [list(y) for y in ys]
+        ylens = np.array([max(len(y) - 1, 0) for y in ys], dtype=np.int64)
+
+        if len(ys) == 0:
+            return np.zeros(0, dtype=np.float32), ylens
+
+        with torch.no_grad():
+            if self.incremental is None:
+                scores = self._score_padded(ys, ylens)
+            else:
+                scores = self._score_trie(ys)
+        return scores, ylens
+
+    def _score_padded(self, ys, ylens):
+        """Score all sequences as one padded mini-batch."""
+        scores = np.zeros(len(ys), dtype=np.float32)
+        idx = [i for i in range(len(ys)) if ylens[i] > 0]
+        if len(idx) == 0:
+            return scores
+
+        ys = [np2tensor(np.fromiter(ys[i], dtype=np.int64), self.device) for i in idx]
+        ys_in = pad_list([y[:-1] for y in ys], self.lm.pad)  # `[N, L-1]`
+        ys_out = pad_list([y[1:] for y in ys], -1)  # `[N, L-1]`
+
+        logits = self.lm.decode(ys_in, None)[0]
+        log_probs = self.log_softmax(logits)  # `[N, L-1, vocab]`
+        scores_lm = log_probs.gather(2, ys_out.clamp(min=0).unsqueeze(2)).squeeze(2)
+        scores_lm = scores_lm.masked_fill(ys_out < 0, 0).sum(1)  # `[N]`
+        scores[idx] = tensor2np(scores_lm)
+        return scores
+
+    def _score_trie(self, ys):
+        """Score all sequences by expanding their prefix trie depth by depth."""
+        # Build a prefix trie (the first tokens are roots)
+        tokens, parents, children = [], [], []
+        levels = [[]]
+        roots = {}
+        leaves = []
+        for y in ys:
+            node = roots.get(y[0])
+            if node is None:
+                node = roots[y[0]] = len(tokens)
+                tokens.append(y[0])
+                parents.append(-1)
+                children.append({})
+                levels[0].append(node)
+            for d, token in enumerate(y[1:], 1):
+                child = children[node].get(token)
+                if child is None:
+                    child = children[node][token] = len(tokens)
+                    tokens.append(token)
+                    parents.append(node)
+                    children.append({})
+                    if len(levels) == d:
+                        levels.append([])
+                    levels[d].append(child)
+                node = child
+            leaves.append(node)
+
+        node_scores = torch.zeros(len(tokens), device=self.device)
+        rows = {}  # node index -> row index in the LM state of the current depth
+        lmstate, prefix = None, None
+        for d in range(len(levels) - 1):
+            expand = [n for n in levels[d] if len(children[n]) > 0]
+            y = np2tensor(np.array([tokens[n] for n in expand], dtype=np.int64), self.device).unsqueeze(1)
+            if d > 0:
+                parent_rows = np2tensor(np.array([rows[parents[n]] for n in expand], dtype=np.int64), self.device)
+                lmstate = reorder_lmstate(lmstate, parent_rows)
+            if self.incremental == 'rnn':
+                logits, _, lmstate = self.lm.decode(y, lmstate, incremental=True)
+            else:
+                prefix = y if d == 0 else torch.cat([prefix.index_select(0, parent_rows), y], dim=1)
+                logits, _, lmstate = self.lm.decode(prefix, None, cache=lmstate, incremental=True)
+            log_probs = self.log_softmax(logits[:, -1])  # `[n_nodes, vocab]`
+            rows = {n: i for i, n in enumerate(expand)}
+
+            # Score all child tokens at this depth at once
+            child_ids, parent_ids, child_rows, child_tokens = [], [], [], []
+            for i, n in enumerate(expand):
+                for token, child in children[n].items():
+                    child_ids.append(child)
+                    parent_ids.append(n)
+                    child_rows.append(i)
+                    child_tokens.append(token)
+            child_ids = np2tensor(np.array(child_ids, dtype=np.int64), self.device)
+            parent_ids = np2tensor(np.array(parent_ids, dtype=np.int64), self.device)
+            child_rows = np2tensor(np.array(child_rows, dtype=np.int64), self.device)
+            child_tokens = np2tensor(np.array(child_tokens, dtype=np.int64), self.device)
+            node_scores[child_ids] = node_scores[parent_ids] + log_probs[child_rows, child_tokens]
+
+        return tensor2np(node_scores)[leaves]
+
+    def rescore(self, hyps, lm_weight, reverse=False, tag='', length_norm=True):
+        """Add LM scores to hypotheses in-place.
+
+        Args:
+            hyps (list): length `N`, each of which contains a dict with
+                hyp (list): token indices including <sos>
+                score (float): total score
+            lm_weight (float): weight of LM score
+            reverse (bool): score hypotheses in the reversed order (for backward LMs)
+            tag (str): suffix of the key to store LM scores (`score_lm_` + tag)
+            length_norm (bool): normalize LM scores by the number of scored tokens
+
+        """
+        scores, ylens = self.score([h['hyp'] for h in hyps], reverse=reverse)
+        if length_norm:
+            scores = scores / np.maximum(ylens, 1)
+        for h, score_lm in zip(hyps, scores.tolist()):
+            h['score'] += score_lm * lm_weight
+            h['score_lm_' + tag] = score_lm
@@ -63,9 +63,7 @@ class TransformerXL(LMBase):
         # for cache
         self.cache_theta = 0.2  # smoothing parameter
         self.cache_lambda = 0.2  # cache weight
-        self.cache_ids = []
-        self.cache_keys = []
-        self.cache_attn = []
+        self.reset_cache()
 
         # positional embedding
         self.pos_emb = XLPositionalEmbedding(self.d_model, args.dropout_in)
@@ -199,17 +197,18 @@ class TransformerXL(LMBase):
             ys (LongTensor): `[B, L]`
             state (list): dummy interfance for RNNLM
             mems (list): length `n_layers`, each of which contains a FloatTensor `[B, mlen, d_model]`
-            cache (list): length `L`, each of which contains a FloatTensor `[B, L-1, d_model]`
+            cache (list): key/value buffers of each layer (see init_cache).
+                Only positions of ys that are not cached yet are fed to the model.
             incremental (bool): ASR decoding mode
         Returns:
-            logits (FloatTensor): `[B, L, vocab]`
-            out (FloatTensor): `[B, L, d_model]`
-            new_cache (list): length `n_layers`, each of which contains a FloatTensor `[B, L, d_model]`
+            logits (FloatTensor): `[B, L, vocab]` (only new positions in the incremental mode)
+            out (FloatTensor): `[B, L, d_model]` (only new positions in the incremental mode)
+            new_cache (list): key/value buffers updated in-place
 
         """
         # for ASR decoding
-        if cache is None:
-            cache = [None] * self.n_layers  # 1-th to L-th layer
+        if incremental:
+            return self._decode_incremental(ys, mems, cache)
 
         if mems is None:
             mems = self.init_memory()
@@ -218,8 +217,6 @@ class TransformerXL(LMBase):
             mlen = mems[0].size(1)
 
         bs, ylen = ys.size()[:2]
-        if incremental and cache[0] is not None:
-            ylen = cache[0].size(1) + 1
 
         # Create the self-attention mask
         causal_mask = ys.new_ones(ylen, ylen + mlen).byte()
@@ -230,16 +227,11 @@ class TransformerXL(LMBase):
         pos_embs = self.pos_emb(ys, mlen=mlen, zero_center_offset=self.zero_center_offset)
 
         new_mems = [None] * self.n_layers
-        new_cache = [None] * self.n_layers
         hidden_states = [out]
         for lth, (mem, layer) in enumerate(zip(mems, self.layers)):
-            if incremental and mlen > 0 and mem.size(0) != bs:
-                mem = mem.repeat([bs, 1, 1])
-            out = layer(out, causal_mask, cache=cache[lth],
+            out = layer(out, causal_mask,
                         pos_embs=pos_embs, memory=mem, u_bias=self.u_bias, v_bias=self.v_bias)
-            if incremental:
-                new_cache[lth] = out
-            elif lth < self.n_layers - 1:
+            if lth < self.n_layers - 1:
                 hidden_states.append(out)
                 # NOTE: outputs from the last layer is not used for memory
             if not self.training and layer.yy_aws is not None:
@@ -250,13 +242,66 @@ class TransformerXL(LMBase):
         else:
             logits = out
 
-        if incremental:
-            # NOTE: do not update memory here during ASR decoding
-            return logits, out, new_cache
+        # Update memory
+        new_mems = self.update_memory(mems, hidden_states)
+        return logits, out, new_mems
+
+    def _decode_incremental(self, ys, mems=None, cache=None):
+        """Decode new positions with key/value buffers of the previous positions.
+
+        Args:
+            ys (LongTensor): `[B, L]`, all tokens after the memory
+            mems (list): length `n_layers`, each of which contains a FloatTensor `[B, mlen, d_model]`.
+                Used only when cache is None, and then stored in the key/value buffers as memory.
+            cache (list): see init_cache
+        Returns:
+            logits (FloatTensor): `[B, L_new, vocab]`
+            out (FloatTensor): `[B, L_new, d_model]`
+            cache (list): see init_cache
+
+        """
+        bs = ys.size(0)
+        if cache is None:
+            cache = self.init_cache(bs, ys.size(1))
+            if mems is not None and mems[0].dim() > 1 and mems[0].size(1) > 0:
+                for cache_l in cache:
+                    cache_l['mlen'] = mems[0].size(1)
+            else:
+                mems = None
+        else:
+            mems = None  # already in the cache
+        if mems is None:
+            mems = [None] * self.n_layers
+        mlen = cache[0]['mlen']
+        offset = cache[0]['length'] if mems[0] is None else mlen  # number of positions before ys_new
+        ys_new = ys[:, offset - mlen:]
+        qlen = ys_new.size(1)
+
+        # NOTE: the newest position attends to all previous positions without a mask
+        causal_mask = None
+        if qlen > 1:
+            causal_mask = ys.new_ones(qlen, offset + qlen).byte()
+            causal_mask = torch.tril(causal_mask, diagonal=offset, out=causal_mask).unsqueeze(0)
+            causal_mask = causal_mask.repeat([bs, 1, 1])
+
+        out = self.dropout_emb(self.embed(ys_new.long()) * self.scale)
+        pos_embs = self.pos_emb(ys, mlen=mlen, zero_center_offset=self.zero_center_offset)
+
+        for lth, (mem, layer) in enumerate(zip(mems, self.layers)):
+            if mem is not None and mem.size(0) != bs:
+                mem = mem.repeat([bs, 1, 1])
+            out = layer(out, causal_mask, pos_embs=pos_embs, memory=mem,
+                        u_bias=self.u_bias, v_bias=self.v_bias, kv_cache=cache[lth])
+            if not self.training and layer.yy_aws is not None:
+                setattr(self, 'yy_aws_layer%d' % lth, tensor2np(layer.yy_aws))
+        out = self.norm_out(out)
+        if self.adaptive_softmax is None:
+            logits = self.output(out)
         else:
-            # Update memory
-            new_mems = self.update_memory(mems, hidden_states)
-            return logits, out, new_mems
+            logits = out
+
+        # NOTE: do not update memory here during ASR decoding
+        return logits, out, cache
 
     def plot_attention(self, n_cols=4):
         """Plot attention for each head in all layers."""
@@ -57,9 +57,7 @@ class TransformerLM(LMBase):
         # for cache
         self.cache_theta = 0.2  # smoothing parameter
         self.cache_lambda = 0.2  # cache weight
-        self.cache_ids = []
-        self.cache_keys = []
-        self.cache_attn = []
+        self.reset_cache()
 
         self.embed = nn.Embedding(self.vocab, self.d_model, padding_idx=self.pad)
         self.pos_enc = PositionalEncoding(self.d_model, args.dropout_in, args.transformer_pe_type,
@@ -191,25 +189,24 @@ class TransformerLM(LMBase):
             ys (LongTensor): `[B, L]`
             state (list): dummy interfance for RNNLM
             mems (list): length `n_layers`, each of which contains a FloatTensor `[B, mlen, d_model]`
-            cache (list): length `L`, each of which contains a FloatTensor `[B, L-1, d_model]`
+            cache (list): key/value buffers of each layer (see init_cache).
+                Only positions of ys that are not cached yet are fed to the model.
             incremental (bool): ASR decoding mode
         Returns:
-            logits (FloatTensor): `[B, L, vocab]`
-            out (FloatTensor): `[B, L, d_model]`
-            new_cache (list): length `n_layers`, each of which contains a FloatTensor `[B, L, d_model]`
+            logits (FloatTensor): `[B, L, vocab]` (only new positions in the incremental mode)
+            out (FloatTensor): `[B, L, d_model]` (only new positions in the incremental mode)
+            new_cache (list): key/value buffers updated in-place
 
         """
         # for ASR decoding
-        if cache is None:
-            cache = [None] * self.n_layers  # 1-th to L-th layer
+        if incremental:
+            return self._decode_incremental(ys, cache)
 
         if mems is None:
             mems = self.init_memory()
 
         # Create the self-attention mask
         bs, ylen = ys.size()[:2]
-        if incremental and cache[0] is not None:
-            ylen = cache[0].size(1) + 1
         causal_mask = ys.new_ones(ylen, ylen).byte()
         causal_mask = torch.tril(causal_mask, diagonal=0, out=causal_mask).unsqueeze(0)
         causal_mask = causal_mask.repeat([bs, 1, 1])
@@ -217,13 +214,10 @@ class TransformerLM(LMBase):
         out = self.pos_enc(self.embed(ys.long()))
 
         new_mems = [None] * self.n_layers
-        new_cache = [None] * self.n_layers
         hidden_states = [out]
         for lth, (mem, layer) in enumerate(zip(mems, self.layers)):
-            out = layer(out, causal_mask, cache=cache[lth], memory=mem)
-            if incremental:
-                new_cache[lth] = out
-            elif lth < self.n_layers - 1:
+            out = layer(out, causal_mask, memory=mem)
+            if lth < self.n_layers - 1:
                 hidden_states.append(out)
                 # NOTE: outputs from the last layer is not used for memory
             if not self.training and layer.yy_aws is not None:
@@ -234,16 +228,65 @@ class TransformerLM(LMBase):
         else:
             logits = out
 
-        if incremental:
-            # NOTE: do not update memory here during ASR decoding
-            return logits, out, new_cache
-        elif self.mem_len > 0:
+        if self.mem_len > 0:
             # Update memory
             new_mems = self.update_memory(mems, hidden_states)
             return logits, out, new_mems
         else:
             return logits, out, mems
 
+    def _decode_incremental(self, ys, cache=None):
+        """Decode new positions with key/value buffers of the previous positions.
+
+        Args:
+            ys (LongTensor): `[B, L]`, all tokens after the memory
+            cache (list): see init_cache
+        Returns:
+            logits (FloatTensor): `[B, L_new, vocab]`
+            out (FloatTensor): `[B, L_new, d_model]`
+            cache (list): see init_cache
+
+        """
+        bs = ys.size(0)
+        if cache is None:
+            cache = self.init_cache(bs, ys.size(1))
+        offset = cache[0]['length']  # number of cached positions
+        ys_new = ys[:, offset - cache[0]['mlen']:]
+        qlen = ys_new.size(1)
+
+        # NOTE: the newest position attends to all cached positions without a mask
+        causal_mask = None
+        if qlen > 1:
+            causal_mask = ys.new_ones(qlen, offset + qlen).byte()
+            causal_mask = torch.tril(causal_mask, diagonal=offset, out=causal_mask).unsqueeze(0)
+            causal_mask = causal_mask.repeat([bs, 1, 1])
+
+        # NOTE: keys/values kept by truncate_cache were computed at their original positions,
+        # so new tokens continue from the absolute position instead of the number of cached ones
+        pos = cache[0]['pos']
+        if self.pos_enc.pe_type == 'add' and pos + qlen > self.pos_enc.pe.size(1):
+            logger.warning('Position %d exceeds the positional encoding table. '
+                           'Positions are counted from the memory.' % (pos + qlen))
+            pos = offset
+        if '1dconv' in self.pos_enc.pe_type:
+            out = self.pos_enc(self.embed(ys.long()))[:, -qlen:]
+        else:
+            out = self.pos_enc(self.embed(ys_new.long()), offset=pos)
+
+        for lth, layer in enumerate(self.layers):
+            out = layer(out, causal_mask, kv_cache=cache[lth])
+            if not self.training and layer.yy_aws is not None:
+                setattr(self, 'yy_aws_layer%d' % lth, tensor2np(layer.yy_aws))
+            cache[lth]['pos'] = pos + qlen
+        out = self.norm_out(out)
+        if self.adaptive_softmax is None:
+            logits = self.output(out)
+        else:
+            logits = out
+
+        # NOTE: do not update memory here during ASR decoding
+        return logits, out, cache
+
     def plot_attention(self, n_cols=4):
         """Plot attention for each head in all layers."""
         from matplotlib import pyplot as plt
@@ -9,6 +9,7 @@
 import numpy as np
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 
 
 class AttentionMechanism(nn.Module):
@@ -98,12 +99,17 @@ class AttentionMechanism(nn.Module):
                 cache=False, mode='', trigger_point=None):
         """Forward pass.
 
+        Key and value can be shared among hypotheses of the same utterance
+        during beam search. In this case, they have a smaller batch size than
+        query, and the hypotheses of the b-th utterance are laid out in
+        `[b * n_hyps, (b + 1) * n_hyps)` of query.
+
         Args:
-            key (FloatTensor): `[B, klen, kdim]`
+            key (FloatTensor): `[B_k, klen, kdim]`
             klens (IntTensor): `[B]`
-            value (FloatTensor): `[B, klen, vdim]`
-            query (FloatTensor): `[B, 1, qdim]`
-            mask (ByteTensor): `[B, qlen, klen]`
+            value (FloatTensor): `[B_k, klen, vdim]`
+            query (FloatTensor): `[B, 1, qdim]`, where `B = B_k * n_hyps`
+            mask (ByteTensor): `[B_k, qlen, klen]`
             aw_prev (FloatTensor): `[B, 1 (H), 1 (qlen), klen]`
             cache (bool): cache key and mask
             mode: dummy interface for MoChA/MMA
@@ -115,8 +121,8 @@ class AttentionMechanism(nn.Module):
             p_choose_i: dummy interface for MoChA/MMA
 
         """
-        bs, klen = key.size()[:2]
-        qlen = query.size(1)
+        klen = key.size(1)
+        bs, qlen = query.size()[:2]
 
         if aw_prev is None:
             aw_prev = key.new_zeros(bs, 1, klen)
@@ -132,52 +138,63 @@ class AttentionMechanism(nn.Module):
                 self.key = key
             self.mask = mask
             if mask is not None:
-                assert self.mask.size() == (bs, 1, klen), (self.mask.size(), (bs, 1, klen))
+                assert self.mask.size() == (key.size(0), 1, klen), (self.mask.size(), (key.size(0), 1, klen))
 
-        # for batch beam search decoding
-        if self.key.size(0) != query.size(0):
-            self.key = self.key[0: 1, :, :].repeat([query.size(0), 1, 1])
+        # NOTE: hypotheses are folded into an additional axis so that the encoder-side
+        # features are broadcast to them instead of being copied for each hypothesis
+        bs_k = self.key.size(0)
+        assert bs % bs_k == 0, (bs, bs_k)
+        n_hyps = bs // bs_k
 
         if self.atype == 'no':
             raise NotImplementedError
 
         elif self.atype in ['add', 'triggered_attention']:
-            tmp = self.key.unsqueeze(1) + self.w_query(query).unsqueeze(2)
-            e = self.v(torch.tanh(tmp)).squeeze(3)
+            query = self.w_query(query).view(bs_k, n_hyps, qlen, 1, -1)
+            tmp = self.key.unsqueeze(1).unsqueeze(1) + query  # `[B_k, n_hyps, qlen, klen, adim]`
+            e = self.v(torch.tanh(tmp)).squeeze(4)
 
         elif self.atype == 'location':
             conv_feat = self.conv(aw_prev.unsqueeze(1)).squeeze(2)  # `[B, ch, klen]`
             conv_feat = conv_feat.transpose(2, 1).contiguous().unsqueeze(1)  # `[B, 1, klen, ch]`
-            tmp = self.key.unsqueeze(1) + self.w_query(query).unsqueeze(2)
-            e = self.v(torch.tanh(tmp + self.w_conv(conv_feat))).squeeze(3)
+            conv_feat = self.w_conv(conv_feat).view(bs_k, n_hyps, 1, klen, -1)
+            query = self.w_query(query).view(bs_k, n_hyps, qlen, 1, -1)
+            tmp = self.key.unsqueeze(1).unsqueeze(1) + query  # `[B_k, n_hyps, qlen, klen, adim]`
+            e = self.v(torch.tanh(tmp + conv_feat)).squeeze(4)
 
         elif self.atype == 'dot':
-            e = torch.bmm(self.w_query(query), self.key.transpose(2, 1))
+            query = self.w_query(query).view(bs_k, n_hyps, qlen, -1)
+            e = torch.einsum("bnid,bjd->bnij", (query, self.key))
 
         elif self.atype in ['luong_dot', 'luong_general']:
-            e = torch.bmm(query, self.key.transpose(2, 1))
+            query = query.view(bs_k, n_hyps, qlen, -1)
+            e = torch.einsum("bnid,bjd->bnij", (query, self.key))
 
         elif self.atype == 'luong_concat':
-            query = query.repeat([1, klen, 1])
-            e = self.v(torch.tanh(self.w(torch.cat([self.key, query], dim=-1)))).transpose(2, 1)
-        assert e.size() == (bs, qlen, klen), (e.size(), (bs, qlen, klen))
+            # NOTE: w([key; query]) is decomposed into w_k(key) + w_q(query)
+            w_k, w_q = self.w.weight.split([self.key.size(2), query.size(2)], dim=1)
+            tmp = F.linear(self.key, w_k).unsqueeze(1).unsqueeze(1) + \
+                F.linear(query, w_q).view(bs_k, n_hyps, qlen, 1, -1)
+            e = self.v(torch.tanh(tmp)).squeeze(4)
+        assert e.size() == (bs_k, n_hyps, qlen, klen), (e.size(), (bs_k, n_hyps, qlen, klen))
 
         NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
 
         # Mask the right part from the trigger point
         if self.atype == 'triggered_attention':
             assert trigger_point is not None
+            e_ = e.view(bs, qlen, klen)
             for b in range(bs):
-                e[b, :, trigger_point[b] + self.lookahead + 1:] = NEG_INF
+                e_[b, :, trigger_point[b] + self.lookahead + 1:] = NEG_INF
 
         # Compute attention weights, context vector
         if self.mask is not None:
-            e = e.masked_fill_(self.mask == 0, NEG_INF)
+            e = e.masked_fill_(self.mask.unsqueeze(1) == 0, NEG_INF)
         if self.sigmoid_smoothing:
             aw = torch.sigmoid(e) / torch.sigmoid(e).sum(-1).unsqueeze(-1)
         else:
             aw = torch.softmax(e * self.sharpening_factor, dim=-1)
         aw = self.dropout(aw)
-        cv = torch.bmm(aw, value)
+        cv = torch.einsum("bnij,bjd->bnid", (aw, value)).contiguous().view(bs, qlen, -1)
 
-        return cv, aw.unsqueeze(1), None, None
+        return cv, aw.view(bs, 1, qlen, klen), None, None
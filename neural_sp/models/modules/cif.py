@@ -50,15 +50,51 @@ class CIF(nn.Module):
         else:
             logger.info('Parameter initialization is skipped.')
 
+        # for incremental mode
+        self.n_tokens = None
+
     def reset_parameters(self):
         """Initialize parameters with Xavier uniform distribution."""
         logger.info('===== Initialize %s with Xavier uniform distribution =====' % self.__class__.__name__)
         for n, p in self.named_parameters():
             init_with_xavier_uniform(n, p)
 
+    def reset(self):
+        self.n_tokens = None
+
+    def integrate(self, alpha, offset, ymax):
+        """Integrate weights of all frames into tokens in parallel.
+
+        The j-th frame covers the interval [c_{j-1}, c_{j}) of the cumulative
+        sum c of weights, and the k-th token fires at c = (k + 1) * beta.
+        The weight of the j-th frame for the k-th token is therefore the length
+        of the overlap between [c_{j-1}, c_{j}) and [k * beta, (k + 1) * beta).
+        A frame is split into two (or more) tokens when a boundary is located.
+
+        Args:
+            alpha (FloatTensor): `[B, T]`
+            offset (LongTensor): `[B]` index of the first token to integrate
+            ymax (int): number of tokens to integrate
+        Returns:
+            aws (FloatTensor): `[B, ymax, T]`
+
+        """
+        alpha_accum = alpha.cumsum(1)
+        alpha_accum_prev = alpha_accum - alpha
+        token_idx = offset.unsqueeze(1) + torch.arange(ymax, device=alpha.device).unsqueeze(0)
+        lower = token_idx.float().unsqueeze(2) * self.beta  # `[B, ymax, 1]`
+        aws = torch.min(alpha_accum.unsqueeze(1), lower + self.beta) - \
+            torch.max(alpha_accum_prev.unsqueeze(1), lower)
+        return aws.clamp(min=0)
+
     def forward(self, eouts, elens, ylens=None, mode='parallel'):
         """Forward pass.
 
+        In the incremental mode, the next token of each utterance is fired at
+        every call until reset() is called. The last token is fired when the
+        remaining weights are more than 0.5 at the end of the utterance.
+        Utterances without any fired token return zero vectors.
+
         Args:
             eouts (FloatTensor): `[B, T, enc_dim]`
             elens (IntTensor): `[B]`
@@ -71,89 +107,41 @@ class CIF(nn.Module):
 
         """
         bs, xmax, enc_dim = eouts.size()
+        device = eouts.device
 
         # 1d conv
         conv_feat = self.conv1d(eouts.transpose(2, 1)).transpose(2, 1)  # `[B, T, enc_dim]`
         conv_feat = torch.relu(self.norm(conv_feat))
         alpha = torch.sigmoid(self.proj(conv_feat)).squeeze(2)  # `[B, T]`
 
+        # padding
+        mask = make_pad_mask(elens.to(device))
+
         # normalization
         if mode == 'parallel':
-            # padding
             assert ylens is not None
-            device = eouts.device
             ylens = ylens.to(device)
-            mask = make_pad_mask(elens.to(device))
             alpha = alpha.clone().masked_fill_(mask == 0, 0)
 
             alpha_norm = alpha / alpha.sum(1, keepdim=True) * ylens.float().unsqueeze(1)
             ymax = int(ylens.max().item())
+            aws = self.integrate(alpha_norm, alpha.new_zeros(bs, dtype=torch.int64), ymax)
+            # skip tokens beyond the reference length
+            aws = aws.masked_fill(make_pad_mask(ylens).unsqueeze(2) == 0, 0)
         elif mode == 'incremental':
-            alpha_norm = alpha  # infernece time
-            ymax = 1
-            if bs > 1:
-                raise NotImplementedError('Batch mode is not supported.')
-                # TODO(hirofumi0810): support batch mode
+            alpha_norm = alpha.masked_fill(mask == 0, 0)  # infernece time
+            if self.n_tokens is None or self.n_tokens.size(0) != bs:
+                self.n_tokens = torch.zeros(bs, dtype=torch.int64, device=device)
+            aws = self.integrate(alpha_norm, self.n_tokens, 1)
+            alpha_sum = alpha_norm.sum(1)
+            fired = alpha_sum >= (self.n_tokens + 1).float() * self.beta
+            # tail handling
+            fired |= (alpha_sum - self.n_tokens.float() * self.beta) >= 0.5
+            aws = aws.masked_fill(fired.view(bs, 1, 1) == 0, 0)
+            self.n_tokens += fired.long()
         else:
             raise ValueError(mode)
 
-        cv = eouts.new_zeros(bs, ymax + 1, enc_dim)
-        aws = eouts.new_zeros(bs, ymax + 1, xmax)
-        n_tokens = torch.zeros(bs, dtype=torch.int64)
-        state = eouts.new_zeros(bs, self.enc_dim)
-        alpha_accum = eouts.new_zeros(bs)
-        for j in range(xmax):
-            alpha_accum_prev = alpha_accum
-            alpha_accum += alpha_norm[:, j]
-
-            if mode == 'parallel' and (alpha_accum >= self.beta).sum() == 0:
-                # No boundary is located in all utterances in mini-batch
-                # Carry over to the next frame
-                state += alpha_norm[:, j, None] * eouts[:, j]
-                aws[:, n_tokens, j] += alpha_norm[:, j]
-            else:
-                for b in range(bs):
-                    # skip the padding region
-                    if j > elens[b] - 1:
-                        continue
-
-                    # skip all-fired utterance
-                    if mode == 'parallel' and n_tokens[b].item() >= ylens[b]:
-                        continue
-
-                    if alpha_accum[b] < self.beta:
-                        # No boundary is located
-                        # Carry over to the next frame
-                        state[b] += alpha_norm[b, j, None] * eouts[b, j]
-                        aws[b, n_tokens[b], j] += alpha_norm[b, j]
-
-                        # tail handling
-                        if mode == 'incremental' and j == elens[b] - 1:
-                            if alpha_accum[b] >= 0.5:
-                                n_tokens[b] += 1
-                                cv[b, n_tokens[b]] = state[b]
-                            break
-                    else:
-                        # A boundary is located
-                        ak1 = 1 - alpha_accum_prev[b]
-                        ak2 = alpha_norm[b, j] - ak1
-                        cv[b, n_tokens[b]] = state[b] + ak1 * eouts[b, j]
-                        aws[b, n_tokens[b], j] += ak1
-                        n_tokens[b] += 1
-                        # Carry over to the next frame
-                        state[b] = ak2 * eouts[b, j]
-                        alpha_accum[b] = ak2
-                        aws[b, n_tokens[b], j] += ak2
-
-                        if mode == 'incremental':
-                            break
-
-                if mode == 'incremental' and n_tokens[0] >= 1:
-                    break
-                    # TODO(hirofumi0810): support batch mode
-
-        # truncate
-        cv = cv[:, :ymax]
-        aws = aws[:, :ymax]
+        cv = torch.bmm(aws, eouts)
 
         return cv, alpha, aws
@@ -8,7 +8,6 @@
 
 import logging
 import math
-import numpy as np
 import torch
 import torch.nn as nn
 
@@ -65,10 +64,10 @@ class GMMAttention(nn.Module):
         """Forward pass.
 
         Args:
-            key (FloatTensor): `[B, klen, kdim]`
-            value (FloatTensor): `[B, klen, vdim]`
-            query (FloatTensor): `[B, 1, qdim]`
-            mask (ByteTensor): `[B, qmax, klen]`
+            key (FloatTensor): `[B_k, klen, kdim]`
+            value (FloatTensor): `[B_k, klen, vdim]`
+            query (FloatTensor): `[B, 1, qdim]`, where `B = B_k * n_hyps`
+            mask (ByteTensor): `[B_k, qmax, klen]`
             aw_prev (FloatTensor): `[B, klen, 1]`
             cache (bool): cache key and mask
             mode: dummy interface for MoChA/MMA
@@ -80,7 +79,9 @@ class GMMAttention(nn.Module):
             p_choose_i: dummy interface for MoChA/MMA
 
         """
-        bs, klen = key.size()[:2]
+        bs = query.size(0)
+        bs_k, klen = key.size()[:2]
+        n_hyps = bs // bs_k
 
         if self.myu is None:
             myu_prev = key.new_zeros(bs, 1, self.n_mix)
@@ -89,7 +90,7 @@ class GMMAttention(nn.Module):
 
         self.mask = mask
         if self.mask is not None:
-            assert self.mask.size() == (bs, 1, klen), (self.mask.size(), (bs, 1, klen))
+            assert self.mask.size() == (bs_k, 1, klen), (self.mask.size(), (bs_k, 1, klen))
 
         w = torch.softmax(self.ffn_gamma(query), dim=-1)  # `[B, 1, n_mix]`
         v = torch.exp(self.ffn_beta(query))  # `[B, 1, n_mix]`
@@ -105,9 +106,11 @@ class GMMAttention(nn.Module):
         aw = aw.sum(2).unsqueeze(1)  # `[B, 1, klen]`
 
         # Compute context vector
+        # NOTE: value is shared among hypotheses of the same utterance in beam search
+        aw = aw.view(bs_k, n_hyps, klen)
         if self.mask is not None:
-            NEG_INF = float(np.finfo(torch.tensor(0, dtype=myu.dtype).numpy().dtype).min)
-            aw = aw.masked_fill_(self.mask == 0, NEG_INF)
-        cv = torch.bmm(aw, value)
+            aw = aw.masked_fill_(self.mask == 0, 0)
+        cv = torch.bmm(aw, value).view(bs, 1, -1)
+        aw = aw.view(bs, 1, klen)
 
         return cv, aw.unsqueeze(2), None, None
@@ -16,6 +16,7 @@ import random
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from torch.autograd.function import once_differentiable
 
 from neural_sp.models.modules.causal_conv import CausalConv1d
 
@@ -103,56 +104,59 @@ class MonotonicEnergy(nn.Module):
         """Compute monotonic energy.
 
         Args:
-            key (FloatTensor): `[B, klen, kdim]`
-            query (FloatTensor): `[B, qlen, qdim]`
-            mask (ByteTensor): `[B, qlen, klen]`
+            key (FloatTensor): `[B_k, klen, kdim]`
+            query (FloatTensor): `[B, qlen, qdim]`, where `B = B_k * n_hyps`
+            mask (ByteTensor): `[B_k, qlen, klen]`
             cache (bool): cache key and mask
         Returns:
             e (FloatTensor): `[B, H_ma, qlen, klen]`
 
         """
-        bs, klen, kdim = key.size()
-        qlen = query.size(1)
+        bs, qlen = query.size()[:2]
 
         # Pre-computation of encoder-side features for computing scores
         if self.key is None or not cache:
+            bs_k, klen = key.size()[:2]
             # 1d conv
             if self.conv1d is not None:
                 key = torch.relu(self.conv1d(key))
-            key = self.w_key(key).view(bs, -1, self.n_heads, self.d_k)
-            self.key = key.transpose(2, 1).contiguous()  # `[B, H_ma, klen, d_k]`
+            key = self.w_key(key).view(bs_k, -1, self.n_heads, self.d_k)
+            self.key = key.transpose(2, 1).contiguous()  # `[B_k, H_ma, klen, d_k]`
             self.mask = mask
             if mask is not None:
-                self.mask = self.mask.unsqueeze(1).repeat([1, self.n_heads, 1, 1])  # `[B, H_ma, qlen, klen]`
-                assert self.mask.size() == (bs, self.n_heads, qlen, klen), \
-                    (self.mask.size(), (bs, self.n_heads, qlen, klen))
-
-        query = self.w_query(query).view(bs, -1, self.n_heads, self.d_k)
-        query = query.transpose(2, 1).contiguous()  # `[B, H_ma, qlen, d_k]`
+                self.mask = self.mask.unsqueeze(1).repeat([1, self.n_heads, 1, 1])  # `[B_k, H_ma, qlen, klen]`
+                assert self.mask.size() == (bs_k, self.n_heads, mask.size(1), klen), \
+                    (self.mask.size(), (bs_k, self.n_heads, mask.size(1), klen))
+        bs_k, _, klen = self.key.size()[:3]
+        n_hyps = bs // bs_k
+
+        # NOTE: hypotheses are folded into an additional axis so that key
+        # is broadcast to them instead of being copied for each hypothesis
+        query = self.w_query(query).view(bs_k, n_hyps, -1, self.n_heads, self.d_k)
+        query = query.transpose(3, 2)  # `[B_k, n_hyps, H_ma, qlen, d_k]`
+        k = self.key
         m = self.mask
+        # Truncate encoder memories
+        if boundary_leftmost > 0:
+            k = k[:, :, boundary_leftmost:]
+            klen = k.size(2)
+            if m is not None:
+                m = m[:, :, :, boundary_leftmost:]
 
         if self.atype == 'add':
-            k = self.key.unsqueeze(2)  # `[B, H_ma, 1, klen, d_k]`
-            # Truncate encoder memories
-            if boundary_leftmost > 0:
-                k = k[:, :, :, boundary_leftmost:]
-                klen = k.size(3)
-                if m is not None:
-                    m = m[:, :, :, boundary_leftmost:]
-            e = torch.relu(k + query.unsqueeze(3))  # `[B, H_ma, qlen, klen, d_k]`
-            e = e.permute(0, 2, 3, 1, 4).contiguous().view(bs, qlen, klen, -1)
-            e = self.v(e).permute(0, 3, 1, 2)  # `[B, qlen, klen, H_ma]`
+            k = k.unsqueeze(1).unsqueeze(3)  # `[B_k, 1, H_ma, 1, klen, d_k]`
+            e = torch.relu(k + query.unsqueeze(4))  # `[B_k, n_hyps, H_ma, qlen, klen, d_k]`
+            e = e.permute(0, 1, 3, 4, 2, 5).contiguous().view(bs_k, n_hyps, qlen, klen, -1)
+            e = self.v(e).permute(0, 1, 4, 2, 3)  # `[B_k, n_hyps, H_ma, qlen, klen]`
         elif self.atype == 'scaled_dot':
-            k = self.key.transpose(3, 2)
-            e = torch.matmul(query, k) / self.scale
+            e = torch.einsum("bnhid,bhjd->bnhij", (query, k)) / self.scale
 
         if self.r is not None:
             e = e + self.r
         if m is not None:
             NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
-            e = e.masked_fill_(m == 0, NEG_INF)
-        assert e.size() == (bs, self.n_heads, qlen, klen), \
-            (e.size(), (bs, self.n_heads, qlen, klen))
+            e = e.masked_fill_(m.unsqueeze(1) == 0, NEG_INF)
+        e = e.contiguous().view(bs, self.n_heads, qlen, klen)
         return e
 
 
@@ -215,51 +219,53 @@ class ChunkEnergy(nn.Module):
         """Compute chunkwise energy.
 
         Args:
-            key (FloatTensor): `[B, klen, kdim]`
-            query (FloatTensor): `[B, qlen, qdim]`
-            mask (ByteTensor): `[B, qlen, klen]`
+            key (FloatTensor): `[B_k, klen, kdim]`
+            query (FloatTensor): `[B, qlen, qdim]`, where `B = B_k * n_hyps`
+            mask (ByteTensor): `[B_k, qlen, klen]`
             cache (bool): cache key and mask
         Returns:
             e (FloatTensor): `[B, H_ca, qlen, klen]`
 
         """
-        bs, klen, kdim = key.size()
-        qlen = query.size(1)
+        bs, qlen = query.size()[:2]
 
         # Pre-computation of encoder-side features for computing scores
         if self.key is None or not cache:
-            key = self.w_key(key).view(bs, -1, self.n_heads, self.d_k)
-            self.key = key.transpose(2, 1).contiguous()  # `[B, H_ca, klen, d_k]`
+            bs_k, klen = key.size()[:2]
+            key = self.w_key(key).view(bs_k, -1, self.n_heads, self.d_k)
+            self.key = key.transpose(2, 1).contiguous()  # `[B_k, H_ca, klen, d_k]`
             self.mask = mask
             if mask is not None:
-                self.mask = self.mask.unsqueeze(1).repeat([1, self.n_heads, 1, 1])  # `[B, H_ca, qlen, klen]`
-                assert self.mask.size() == (bs, self.n_heads, qlen, klen), \
-                    (self.mask.size(), (bs, self.n_heads, qlen, klen))
-
-        query = self.w_query(query).view(bs, -1, self.n_heads, self.d_k)
-        query = query.transpose(2, 1).contiguous()  # `[B, H_ca, qlen, d_k]`
+                self.mask = self.mask.unsqueeze(1).repeat([1, self.n_heads, 1, 1])  # `[B_k, H_ca, qlen, klen]`
+                assert self.mask.size() == (bs_k, self.n_heads, mask.size(1), klen), \
+                    (self.mask.size(), (bs_k, self.n_heads, mask.size(1), klen))
+        bs_k = self.key.size(0)
+        n_hyps = bs // bs_k
+
+        # NOTE: hypotheses are folded into an additional axis so that key
+        # is broadcast to them instead of being copied for each hypothesis
+        query = self.w_query(query).view(bs_k, n_hyps, -1, self.n_heads, self.d_k)
+        query = query.transpose(3, 2)  # `[B_k, n_hyps, H_ca, qlen, d_k]`
+        # Truncate
+        k = self.key[:, :, boundary_leftmost:boundary_rightmost]
+        klen = k.size(2)
         m = self.mask
+        if m is not None:
+            m = m[:, :, :, boundary_leftmost:boundary_rightmost]
 
         if self.atype == 'add':
-            k = self.key.unsqueeze(2)  # `[B, H_ca, 1, klen, d_k]`
-            # Truncate
-            k = k[:, :, :, boundary_leftmost:boundary_rightmost]
-            klen = k.size(3)
-            if m is not None:
-                m = m[:, :, :, boundary_leftmost:boundary_rightmost]
-
-            r = torch.relu(k + query.unsqueeze(3))  # `[B, H_ca, qlen, klen, d_k]`
-            r = r.permute(0, 2, 3, 1, 4).contiguous().view(bs, qlen, klen, -1)  # `[B, qlen, klen, H_ca * d_k]`
-            r = self.v(r).permute(0, 3, 1, 2).contiguous()  # `[B, H_ca, qlen, klen]`
+            k = k.unsqueeze(1).unsqueeze(3)  # `[B_k, 1, H_ca, 1, klen, d_k]`
+            r = torch.relu(k + query.unsqueeze(4))  # `[B_k, n_hyps, H_ca, qlen, klen, d_k]`
+            r = r.permute(0, 1, 3, 4, 2, 5).contiguous().view(
+                bs_k, n_hyps, qlen, klen, -1)  # `[B_k, n_hyps, qlen, klen, H_ca * d_k]`
+            r = self.v(r).permute(0, 1, 4, 2, 3)  # `[B_k, n_hyps, H_ca, qlen, klen]`
         elif self.atype == 'scaled_dot':
-            k = self.key.transpose(3, 2)
-            r = torch.matmul(query, k) / self.scale
+            r = torch.einsum("bnhid,bhjd->bnhij", (query, k)) / self.scale
 
         if m is not None:
             NEG_INF = float(np.finfo(torch.tensor(0, dtype=r.dtype).numpy().dtype).min)
-            r = r.masked_fill_(m == 0, NEG_INF)
-        assert r.size() == (bs, self.n_heads, qlen, klen), \
-            (r.size(), (bs, self.n_heads, qlen, klen))
+            r = r.masked_fill_(m.unsqueeze(1) == 0, NEG_INF)
+        r = r.contiguous().view(bs, self.n_heads, qlen, klen)
         return r
 
 
@@ -304,6 +310,8 @@ class MoChA(nn.Module):
         decot (bool): delay constrainted training (DeCoT)
         lookahead (int): lookahead frames for DeCoT
         share_chunkwise_attention (int): share CA heads among MA heads
+        query_block_size (int): number of query steps to compute chunkwise
+            attention at once in the parallel mode. 0 means all steps.
 
     """
 
@@ -312,7 +320,8 @@ class MoChA(nn.Module):
                  conv1d=False, init_r=-4, eps=1e-6, noise_std=1.0,
                  no_denominator=False, sharpening_factor=1.0,
                  dropout=0., dropout_head=0., bias=True, param_init='',
-                 decot=False, lookahead=2, share_chunkwise_attention=False):
+                 decot=False, lookahead=2, share_chunkwise_attention=False,
+                 query_block_size=0):
 
         super().__init__()
 
@@ -332,6 +341,7 @@ class MoChA(nn.Module):
         self.decot = decot
         self.lookahead = lookahead
         self.share_ca = share_chunkwise_attention
+        self.query_block_size = query_block_size
 
         if n_heads_mono >= 1:
             self.monotonic_energy = MonotonicEnergy(
@@ -360,6 +370,7 @@ class MoChA(nn.Module):
         self.dropout_attn = nn.Dropout(p=dropout)  # for beta
         self.dropout_head = dropout_head
 
+        self.value = None
         self.bd_offset = 0
         self.key_prev_tail = None
 
@@ -380,6 +391,7 @@ class MoChA(nn.Module):
             self.monotonic_energy.reset()
         if self.chunk_energy is not None:
             self.chunk_energy.reset()
+        self.value = None
         self.bd_offset = 0
         self.key_prev_tail = None
 
@@ -410,23 +422,22 @@ class MoChA(nn.Module):
     def parallel(self, e_ma, aw_prev, trigger_point):
         bs, n_heads_ma, qlen, klen = e_ma.size()
         p_choose = torch.sigmoid(add_gaussian_noise(e_ma, self.noise_std))  # `[B, H_ma, qlen, klen]`
-        alpha = []
 
         # safe_cumprod computes cumprod in logspace with numeric checks
         cumprod_1mp_choose = safe_cumprod(1 - p_choose, eps=self.eps)  # `[B, H_ma, qlen, klen]`
+        # Compute the terms of the recurrence relation for all query steps at once
+        numer = p_choose * cumprod_1mp_choose
+        if self.no_denom:
+            denom = e_ma.new_ones(1, 1, 1, 1)
+        else:
+            denom = torch.clamp(cumprod_1mp_choose, min=self.eps, max=1.0)
+        # Mask the right part from the trigger point
+        if self.decot and trigger_point is not None:
+            trigger_mask = torch.arange(klen, device=e_ma.device).unsqueeze(0) > \
+                (trigger_point.to(e_ma.device).long() + self.lookahead).unsqueeze(1)  # `[B, klen]`
+            numer = numer.masked_fill(trigger_mask[:, None, None], 0)
         # Compute recurrence relation solution
-        for i in range(qlen):
-            denom = 1 if self.no_denom else torch.clamp(
-                cumprod_1mp_choose[:, :, i:i + 1], min=self.eps, max=1.0)
-            aw_prev = p_choose[:, :, i:i + 1] * cumprod_1mp_choose[:, :, i:i + 1] * torch.cumsum(
-                aw_prev / denom, dim=-1)  # `[B, H_ma, 1, klen]`
-            # Mask the right part from the trigger point
-            if self.decot and trigger_point is not None:
-                for b in range(bs):
-                    aw_prev[b, :, :, trigger_point[b] + self.lookahead + 1:] = 0
-            alpha.append(aw_prev)
-
-        alpha = torch.cat(alpha, dim=2) if qlen > 1 else alpha[-1]  # `[B, H_ma, qlen, klen]`
+        alpha = MonotonicAttentionRecurrence.apply(numer, denom, aw_prev)  # `[B, H_ma, qlen, klen]`
         return alpha, p_choose
 
     def hard(self, e_ma, aw_prev, eps_wait):
@@ -461,23 +472,22 @@ class MoChA(nn.Module):
             alpha = p_choose_i * exclusive_cumprod(1 - p_choose_i)  # `[B, H_ma, 1 (qlen), klen]`
 
         if eps_wait > 0:
-            for b in range(bs):
-                # no boundary until the last frame for all heads
-                if alpha[b].sum() == 0:
-                    continue
-
-                leftmost = alpha[b, :, 0].nonzero()[:, -1].min().item()
-                rightmost = alpha[b, :, 0].nonzero()[:, -1].max().item()
-                for h in range(self.n_heads_ma):
-                    # no bondary at the h-th head
-                    if alpha[b, h, 0].sum().item() == 0:
-                        alpha[b, h, 0, min(rightmost, leftmost + eps_wait)] = 1
-                        continue
-
-                    # surpass acceptable latency
-                    if alpha[b, h, 0].nonzero()[:, -1].min().item() >= leftmost + eps_wait:
-                        alpha[b, h, 0, :] = 0  # reset
-                        alpha[b, h, 0, leftmost + eps_wait] = 1
+            # Head-synchronous decoding: heads without any boundary or with a boundary
+            # surpassing acceptable latency from the leftmost boundary in the same
+            # utterance attend to the frame at leftmost + eps_wait (or the rightmost boundary)
+            is_bd = alpha[:, :, 0] != 0  # `[B, H_ma, klen]`
+            has_bd = is_bd.sum(-1) > 0  # `[B, H_ma]`
+            pos = torch.arange(klen, device=alpha.device)
+            bd = (is_bd.long().cumsum(-1) == 0).sum(-1)  # first boundary (klen if none) `[B, H_ma]`
+            leftmost = bd.min(-1, keepdim=True)[0]  # `[B, 1]`
+            rightmost = (is_bd.long() * pos).max(-1)[0].max(-1, keepdim=True)[0]  # `[B, 1]`
+            # skip utterances without any boundary for all heads
+            no_bd = (has_bd == 0) & (has_bd.sum(-1, keepdim=True) > 0)
+            late = has_bd & (bd >= leftmost + eps_wait)
+            bd_new = torch.where(no_bd, torch.min(rightmost, leftmost + eps_wait), leftmost + eps_wait)
+            alpha[:, :, 0] = torch.where((no_bd | late).unsqueeze(-1),
+                                         (pos == bd_new.unsqueeze(-1)).type_as(alpha),
+                                         alpha[:, :, 0])
 
         return alpha, None
 
@@ -486,13 +496,18 @@ class MoChA(nn.Module):
                 efficient_decoding=False):
         """Forward pass.
 
+        Key and value can be shared among hypotheses of the same utterance
+        during beam search. In this case, they have a smaller batch size than
+        query, and the hypotheses of the b-th utterance are laid out in
+        `[b * n_hyps, (b + 1) * n_hyps)` of query.
+
         Args:
-            key (FloatTensor): `[B, klen, kdim]`
-            value (FloatTensor): `[B, klen, vdim]`
-            query (FloatTensor): `[B, qlen, qdim]`
-            mask (ByteTensor): `[B, qlen, klen]`
+            key (FloatTensor): `[B_k, klen, kdim]`
+            value (FloatTensor): `[B_k, klen, vdim]`
+            query (FloatTensor): `[B, qlen, qdim]`, where `B = B_k * n_hyps`
+            mask (ByteTensor): `[B_k, qlen, klen]`
             aw_prev (FloatTensor): `[B, H_ma, 1, klen]`
-            cache (bool): cache key and mask
+            cache (bool): cache key, value, and mask
             mode (str): recursive/parallel/hard
             trigger_point (IntTensor): `[B]`
             eps_wait (int): wait time delay for head-synchronous decoding in MMA
@@ -503,9 +518,16 @@ class MoChA(nn.Module):
             p_choose (FloatTensor): `[B, H_ma, qlen, klen]`
 
         """
-        bs, klen = key.size()[:2]
-        qlen = query.size(1)
+        bs, qlen = query.size()[:2]
+        bs_k, klen = key.size()[:2]
+        n_hyps = bs // bs_k
         tail_len = self.key_prev_tail.size(1) if self.key_prev_tail is not None else 0
+        key_prev_tail = None
+        if self.key_prev_tail is not None:
+            # tails of multiple streams are stacked during batched streaming decoding
+            key_prev_tail = self.key_prev_tail
+            if key_prev_tail.size(0) != bs_k:
+                key_prev_tail = key_prev_tail[0:1].repeat([bs_k, 1, 1])
 
         if aw_prev is None:
             # aw_prev = [1, 0, 0 ... 0]
@@ -551,7 +573,7 @@ class MoChA(nn.Module):
 
             if mode == 'hard':
                 if self.key_prev_tail is not None:
-                    key_ = torch.cat([self.key_prev_tail[0:1].repeat([bs, 1, 1]), key], dim=1)
+                    key_ = torch.cat([key_prev_tail, key], dim=1)
                 else:
                     key_ = key
                 e_ca = self.chunk_energy(key_, query, mask, cache=cache,
@@ -580,11 +602,21 @@ class MoChA(nn.Module):
             else:
                 beta = efficient_chunkwise_attention(alpha_masked, e_ca, mask, self.w,
                                                      self.n_heads_ca, self.sharpening_factor,
-                                                     self.share_ca)
+                                                     self.share_ca, self.query_block_size)
             beta = self.dropout_attn(beta)  # `[B, H_ma * H_ca, qlen, klen]`
 
-            if efficient_decoding and mode == 'hard':
-                value = value[:, max(0, self.bd_offset + bd_leftmost - self.w + 1):self.bd_offset + bd_rightmost + 1]
+        # Project value once per utterance
+        if self.n_heads_ma * self.n_heads_ca > 1:
+            if self.value is None or not cache:
+                self.value = self.w_value(value).view(bs_k, -1, self.n_heads_ma * self.n_heads_ca, self.d_k)
+                self.value = self.value.transpose(2, 1).contiguous()  # `[B_k, H_ma * H_ca, klen, d_k]`
+            value = self.value
+        else:
+            value = value.unsqueeze(1)  # `[B_k, 1, klen, vdim]`
+        if self.chunk_energy is not None and efficient_decoding and mode == 'hard':
+            value = value[:, :, max(0, self.bd_offset + bd_leftmost - self.w + 1):self.bd_offset + bd_rightmost + 1]
+        if self.n_heads_ma * self.n_heads_ca == 1 and self.w != 1 and self.key_prev_tail is not None:
+            value = torch.cat([key_prev_tail.unsqueeze(1), value], dim=2)
 
         # Update after calculating beta
         bd_offset_old = self.bd_offset
@@ -592,21 +624,14 @@ class MoChA(nn.Module):
             self.bd_offset += alpha[:, :, 0, self.bd_offset:].nonzero()[:, -1].min().item()
 
         # Compute context vector
+        # NOTE: hypotheses are folded into an additional axis so that value
+        # is broadcast to them instead of being copied for each hypothesis
+        aw = alpha if self.w == 1 else beta
+        aw = aw.view(bs_k, n_hyps, aw.size(1), qlen, aw.size(3))
+        cv = torch.einsum("bnhij,bhjd->bnihd", (aw, value))  # `[B_k, n_hyps, qlen, H_ma * H_ca, d_k]`
+        cv = cv.contiguous().view(bs, qlen, -1)
         if self.n_heads_ma * self.n_heads_ca > 1:
-            value = self.w_value(value).view(bs, -1, self.n_heads_ma * self.n_heads_ca, self.d_k)
-            value = value.transpose(2, 1).contiguous()  # `[B, H_ma * H_ca, klen, d_k]`
-            cv = torch.matmul(alpha if self.w == 1 else beta, value)  # `[B, H_ma * H_ca, qlen, d_k]`
-            cv = cv.transpose(2, 1).contiguous().view(bs, -1, self.n_heads_ma * self.n_heads_ca * self.d_k)
             cv = self.w_out(cv)  # `[B, qlen, adim]`
-        else:
-            if self.w == 1:
-                cv = torch.bmm(alpha.squeeze(1), value)  # `[B, 1, adim]`
-            else:
-                if self.key_prev_tail is not None:
-                    value_ = torch.cat([self.key_prev_tail[0:1].repeat([bs, 1, 1]), value], dim=1)
-                    cv = torch.bmm(beta.squeeze(1), value_)  # `[B, 1, adim]`
-                else:
-                    cv = torch.bmm(beta.squeeze(1), value)  # `[B, 1, adim]`
 
         assert alpha.size() == (bs, self.n_heads_ma, qlen, klen), \
             (alpha.size(), (bs, self.n_heads_ma, qlen, klen))
@@ -714,8 +739,190 @@ def moving_sum(x, back, forward):
     return x_sum
 
 
+def reverse_cumsum(x):
+    """Reverse cumulative summation [a, b, c] => [a + b + c, b + c, c].
+
+        Args:
+            x (FloatTensor): `[..., klen]`
+        Returns:
+            x (FloatTensor): `[..., klen]`
+
+    """
+    return torch.cumsum(x.flip(-1), dim=-1).flip(-1)
+
+
+def sum_to_size(x, size):
+    """Sum up broadcast dimensions of x so that it has the given size."""
+    for dim, n in enumerate(size):
+        if n == 1 and x.size(dim) > 1:
+            x = x.sum(dim, keepdim=True)
+    return x
+
+
+class MonotonicAttentionRecurrence(torch.autograd.Function):
+    """Solve the recurrence relation of monotonic attention in parallel mode.
+
+        alpha_i = numer_i * cumsum(alpha_{i-1} / denom_i)
+
+    Only inputs and outputs are saved for backward, and cumulative sums of
+    each query step are recomputed in the backward pass instead of keeping
+    intermediate tensors of all query steps in the computation graph.
+
+    """
+    @staticmethod
+    def forward(ctx, numer, denom, aw_prev):
+        """Forward pass.
+
+        Args:
+            numer (FloatTensor): `[B, H_ma, qlen, klen]`
+            denom (FloatTensor): `[B, H_ma, qlen, klen]` or `[1, 1, 1, 1]`
+            aw_prev (FloatTensor): `[B, H_ma, 1, klen]`
+        Returns:
+            alpha (FloatTensor): `[B, H_ma, qlen, klen]`
+
+        """
+        qlen = numer.size(2)
+        denom_i = denom
+        alpha = numer.new_zeros(numer.size())
+        for i in range(qlen):
+            if denom.size(2) > 1:
+                denom_i = denom[:, :, i:i + 1]
+            alpha[:, :, i:i + 1] = numer[:, :, i:i + 1] * torch.cumsum(
+                (alpha[:, :, i - 1:i] if i > 0 else aw_prev) / denom_i, dim=-1)
+        ctx.save_for_backward(numer, denom, aw_prev, alpha)
+        return alpha
+
+    @staticmethod
+    @once_differentiable
+    def backward(ctx, grad_alpha):
+        numer, denom, aw_prev, alpha = ctx.saved_tensors
+        qlen = numer.size(2)
+        denom_i = denom
+        grad_numer = torch.zeros_like(numer)
+        grad_denom = torch.zeros_like(numer) if ctx.needs_input_grad[1] else None
+        grad_aw_prev = torch.zeros_like(aw_prev)
+        for i in range(qlen - 1, -1, -1):
+            if denom.size(2) > 1:
+                denom_i = denom[:, :, i:i + 1]
+            aw_prev_i = (alpha[:, :, i - 1:i] if i > 0 else aw_prev) / denom_i
+            grad = grad_alpha[:, :, i:i + 1] + grad_aw_prev
+            grad_numer[:, :, i:i + 1] = grad * torch.cumsum(aw_prev_i, dim=-1)
+            grad_cumsum = reverse_cumsum(grad * numer[:, :, i:i + 1])
+            grad_aw_prev = grad_cumsum / denom_i
+            if grad_denom is not None:
+                grad_denom[:, :, i:i + 1] = -grad_aw_prev * aw_prev_i
+        return grad_numer, grad_denom, grad_aw_prev
+
+
+class ChunkwiseAttention(torch.autograd.Function):
+    """Compute chunkwise attention over expected monotonic attention in parallel mode.
+
+    Query steps are processed in blocks to bound the memory for intermediate
+    tensors, and only inputs are saved for backward. The intermediate tensors
+    of each block are recomputed in the backward pass.
+
+    """
+    @staticmethod
+    def forward(ctx, alpha, u, chunk_size, sharpening_factor, block_size):
+        """Forward pass.
+
+        Args:
+            alpha (FloatTensor): `[B, H_ma, 1, qlen, klen]`
+            u (FloatTensor): `[B, H_ma or 1, H_ca, qlen, klen]`
+            chunk_size (int): window size for chunkwise attention
+            sharpening_factor (float): sharping factor for beta calculation
+            block_size (int): number of query steps computed at once
+        Returns:
+            beta (FloatTensor): `[B, H_ma, H_ca, qlen, klen]`
+
+        """
+        bs, n_heads_mono, _, qlen, klen = alpha.size()
+        block_size = qlen if block_size <= 0 else block_size
+        beta = alpha.new_zeros(bs, n_heads_mono, u.size(2), qlen, klen)
+        for s in range(0, qlen, block_size):
+            beta[:, :, :, s:s + block_size] = chunkwise_attention_block(
+                alpha[:, :, :, s:s + block_size], u[:, :, :, s:s + block_size],
+                chunk_size, sharpening_factor)[0]
+        ctx.save_for_backward(alpha, u)
+        ctx.chunk_size = chunk_size
+        ctx.sharpening_factor = sharpening_factor
+        ctx.block_size = block_size
+        return beta
+
+    @staticmethod
+    @once_differentiable
+    def backward(ctx, grad_beta):
+        alpha, u = ctx.saved_tensors
+        qlen = alpha.size(3)
+        grad_alpha = torch.zeros_like(alpha)
+        grad_u = torch.zeros_like(u)
+        for s in range(0, qlen, ctx.block_size):
+            alpha_blk = alpha[:, :, :, s:s + ctx.block_size]
+            u_blk = u[:, :, :, s:s + ctx.block_size]
+            grad_beta_blk = grad_beta[:, :, :, s:s + ctx.block_size]
+            _, u_argmax, softmax_exp, softmax_exp_clamped, softmax_denominators, inner_items, inner_sum = \
+                chunkwise_attention_block(alpha_blk, u_blk, ctx.chunk_size, ctx.sharpening_factor)
+
+            # beta = softmax_exp_clamped * inner_sum
+            grad_inner_items = lookback_sum(grad_beta_blk * softmax_exp_clamped, ctx.chunk_size)
+            grad_softmax_exp = sum_to_size(grad_beta_blk * inner_sum, u_blk.size())
+            # inner_items = alpha * sharpening_factor / softmax_denominators
+            grad_alpha[:, :, :, s:s + ctx.block_size] = sum_to_size(
+                grad_inner_items * ctx.sharpening_factor / softmax_denominators, alpha_blk.size())
+            grad_denominators = sum_to_size(-grad_inner_items * inner_items / softmax_denominators,
+                                            u_blk.size())
+            grad_softmax_exp += lookahead_sum(grad_denominators, ctx.chunk_size)
+            # gradient through clamping and shifting
+            grad_u_blk = grad_softmax_exp * softmax_exp * (softmax_exp >= 1e-5).type_as(softmax_exp)
+            grad_u[:, :, :, s:s + ctx.block_size] = grad_u_blk.scatter_add(
+                -1, u_argmax, -grad_u_blk.sum(-1, keepdim=True))
+        return grad_alpha, grad_u, None, None, None
+
+
+def lookback_sum(x, chunk_size):
+    """Sum x over the chunk [j - chunk_size + 1, j] (or [0, j] if chunk_size is -1)."""
+    if chunk_size == -1:
+        return torch.cumsum(x, dim=-1)
+    return moving_sum(x, back=chunk_size - 1, forward=0)
+
+
+def lookahead_sum(x, chunk_size):
+    """Sum x over the chunk [j, j + chunk_size - 1] (or [j, klen) if chunk_size is -1)."""
+    if chunk_size == -1:
+        return reverse_cumsum(x)
+    return moving_sum(x, back=0, forward=chunk_size - 1)
+
+
+def chunkwise_attention_block(alpha, u, chunk_size, sharpening_factor):
+    """Compute chunkwise attention and its intermediate tensors for a block of query steps.
+
+    Args:
+        alpha (FloatTensor): `[B, H_ma, 1, qlen, klen]`
+        u (FloatTensor): `[B, H_ma or 1, H_ca, qlen, klen]`
+        chunk_size (int): window size for chunkwise attention
+        sharpening_factor (float): sharping factor for beta calculation
+    Returns:
+        beta (FloatTensor): `[B, H_ma, H_ca, qlen, klen]`
+        intermediate tensors for the backward pass
+
+    """
+    # Shift logits to avoid overflow
+    u_max, u_argmax = torch.max(u, dim=-1, keepdim=True)
+    softmax_exp = torch.exp(u - u_max)
+    # Limit the range for numerical stability
+    softmax_exp_clamped = torch.clamp(softmax_exp, min=1e-5)
+    # Compute chunkwise softmax denominators
+    softmax_denominators = lookback_sum(softmax_exp_clamped, chunk_size)
+    # Compute \beta_{i, :}. emit_probs are \alpha_{i, :}.
+    inner_items = alpha * sharpening_factor / softmax_denominators
+    inner_sum = lookahead_sum(inner_items, chunk_size)
+    beta = softmax_exp_clamped * inner_sum
+    return beta, u_argmax, softmax_exp, softmax_exp_clamped, softmax_denominators, inner_items, inner_sum
+
+
 def efficient_chunkwise_attention(alpha, u, mask, chunk_size, n_heads_chunk,
-                                  sharpening_factor, share_chunkwise_attention):
+                                  sharpening_factor, share_chunkwise_attention,
+                                  block_size=0):
     """Compute chunkwise attention efficiently by clipping logits at training time.
 
     Args:
@@ -726,6 +933,8 @@ def efficient_chunkwise_attention(alpha, u, mask, chunk_size, n_heads_chunk,
         n_heads_chunk (int): number of chunkwise attention heads
         sharpening_factor (float): sharping factor for beta calculation
         share_chunkwise_attention (int): share CA heads among MA heads
+        block_size (int): number of query steps computed at once.
+            0 means all steps.
     Returns:
         beta (FloatTensor): `[B, H_ma * H_ca, qlen, klen]`
 
@@ -733,32 +942,10 @@ def efficient_chunkwise_attention(alpha, u, mask, chunk_size, n_heads_chunk,
     bs, n_heads_mono, qlen, klen = alpha.size()
     alpha = alpha.unsqueeze(2)  # `[B, H_ma, 1, qlen, klen]`
     u = u.unsqueeze(1)  # `[B, 1, (H_ma*)H_ca, qlen, klen]`
-    if n_heads_chunk > 1:
-        alpha = alpha.repeat([1, 1, n_heads_chunk, 1, 1])
     if n_heads_mono > 1 and not share_chunkwise_attention:
         u = u.view(bs, n_heads_mono, n_heads_chunk, qlen, klen)
-    # Shift logits to avoid overflow
-    u -= torch.max(u, dim=-1, keepdim=True)[0]
-    # Limit the range for numerical stability
-    softmax_exp = torch.clamp(torch.exp(u), min=1e-5)
-    # Compute chunkwise softmax denominators
-    if chunk_size == -1:
-        # infinite lookback attention
-        # inner_items = alpha * sharpening_factor / torch.cumsum(softmax_exp, dim=-1)
-        # beta = softmax_exp * torch.cumsum(inner_items.flip(dims=[-1]), dim=-1).flip(dims=[-1])
-        # beta = beta.masked_fill(mask.unsqueeze(1), 0)
-        # beta = beta / beta.sum(dim=-1, keepdim=True)
-
-        softmax_denominators = torch.cumsum(softmax_exp, dim=-1)
-        # Compute \beta_{i, :}. emit_probs are \alpha_{i, :}.
-        beta = softmax_exp * moving_sum(alpha * sharpening_factor / softmax_denominators,
-                                        back=0, forward=klen - 1)
-    else:
-        softmax_denominators = moving_sum(softmax_exp,
-                                          back=chunk_size - 1, forward=0)
-        # Compute \beta_{i, :}. emit_probs are \alpha_{i, :}.
-        beta = softmax_exp * moving_sum(alpha * sharpening_factor / softmax_denominators,
-                                        back=0, forward=chunk_size - 1)
+    # NOTE: alpha and u are broadcast to `[B, H_ma, H_ca, qlen, klen]`
+    beta = ChunkwiseAttention.apply(alpha, u, chunk_size, sharpening_factor, block_size)
     return beta.view(bs, -1, qlen, klen)
 
 
@@ -769,7 +956,7 @@ def hard_chunkwise_attention(alpha, u, mask, chunk_size, n_heads_chunk,
     Args:
         alpha (FloatTensor): `[B, H_ma, qlen, klen]`
         u (FloatTensor): `[B, (H_ma*)H_ca, qlen, klen]`
-        mask (ByteTensor): `[B, qlen, klen]`
+        mask (ByteTensor): `[B_k, qlen, klen]`
         chunk_size (int): window size for chunkwise attention
         n_heads_chunk (int): number of chunkwise attention heads
         sharpening_factor (float): sharping factor for beta calculation
@@ -789,18 +976,23 @@ def hard_chunkwise_attention(alpha, u, mask, chunk_size, n_heads_chunk,
         else:
             u = u.view(bs, n_heads_mono, n_heads_chunk, qlen, klen)
 
-    mask = alpha.clone().byte()  # `[B, H_ma, H_ca, qlen, klen]`
-    for b in range(bs):
-        for h in range(n_heads_mono):
-            if alpha[b, h, 0, 0].sum() > 0:
-                boundary = alpha[b, h, 0, 0].nonzero()[:, -1].min().item()
-                if chunk_size == -1:
-                    # infinite lookback attention
-                    mask[b, h, :, 0, 0:boundary + 1] = 1
-                else:
-                    mask[b, h, :, 0, max(0, boundary - chunk_size + 1):boundary + 1] = 1
+    mask_pad = mask
+    # Attend to the chunk ending at the boundary (the first attended frame) of each head
+    is_bd = alpha != 0  # `[B, H_ma, H_ca, qlen, klen]`
+    bd = (is_bd.long().cumsum(-1) == 0).sum(-1, keepdim=True)  # `[B, H_ma, H_ca, qlen, 1]`
+    pos = torch.arange(klen, device=u.device)
+    in_chunk = (pos <= bd) & (bd < klen)
+    if chunk_size != -1:
+        in_chunk = in_chunk & (pos > bd - chunk_size)
+    mask = is_bd | in_chunk
 
     NEG_INF = float(np.finfo(torch.tensor(0, dtype=u.dtype).numpy().dtype).min)
     u = u.masked_fill(mask == 0, NEG_INF)
+    # Exclude padded frames from the uniform distribution when no boundary is detected
+    if mask_pad is not None and mask_pad.size(-1) == klen:
+        # NOTE: mask_pad is shared among hypotheses of the same utterance in beam search
+        bs_k = mask_pad.size(0)
+        u = u.view(bs_k, -1, n_heads_chunk, qlen, klen).masked_fill(
+            mask_pad.view(bs_k, 1, 1, -1, klen) == 0, float('-inf'))
     beta = torch.softmax(u, dim=-1)
     return beta.view(bs, -1, qlen, klen)
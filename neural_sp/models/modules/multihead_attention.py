@@ -90,20 +90,76 @@ class MultiheadAttentionMechanism(nn.Module):
         self.value = None
         self.mask = None
 
+    def init_kv_cache(self, bs, max_len):
+        """Allocate key/value buffers for incremental decoding.
+
+        Args:
+            bs (int): batch size (number of hypotheses)
+            max_len (int): initial capacity of the buffers
+        Returns:
+            kv_cache (dict):
+                key (FloatTensor): `[B, max_len, H, d_k]`
+                value (FloatTensor): `[B, max_len, H, d_k]`
+                length (int): number of cached positions
+
+        """
+        w = self.w_key.weight
+        return {'key': w.new_zeros(bs, max_len, self.n_heads, self.d_k),
+                'value': w.new_zeros(bs, max_len, self.n_heads, self.d_k),
+                'length': 0}
+
+    def append_kv_cache(self, kv_cache, key, value):
+        """Project new positions and append them to the key/value buffers in-place.
+
+        Args:
+            kv_cache (dict): see init_kv_cache
+            key (FloatTensor): `[B, klen_new, kdim]`
+            value (FloatTensor): `[B, klen_new, vdim]`
+        Returns:
+            klen (int): number of cached positions after appending
+
+        """
+        bs, klen_new = key.size()[:2]
+        start = kv_cache['length']
+        end = start + klen_new
+        capacity = kv_cache['key'].size(1)
+        if end > capacity:
+            # double the capacity (rarely happens if max_len is set properly)
+            n_pad = max(capacity, end - capacity)
+            kv_cache['key'] = torch.cat([kv_cache['key'], kv_cache['key'].new_zeros(
+                bs, n_pad, self.n_heads, self.d_k)], dim=1)
+            kv_cache['value'] = torch.cat([kv_cache['value'], kv_cache['value'].new_zeros(
+                bs, n_pad, self.n_heads, self.d_k)], dim=1)
+        kv_cache['key'][:, start:end] = self.w_key(key).view(bs, -1, self.n_heads, self.d_k)
+        kv_cache['value'][:, start:end] = self.w_value(value).view(bs, -1, self.n_heads, self.d_k)
+        kv_cache['length'] = end
+        return end
+
     def forward(self, key, value, query, mask, aw_prev=None,
-                cache=False, mode='', trigger_point=None, eps_wait=-1):
+                cache=False, mode='', trigger_point=None, eps_wait=-1, kv_cache=None):
         """Forward pass.
 
+        Key and value can be shared among hypotheses of the same utterance
+        during beam search. In this case, they have a smaller batch size than
+        query, and the hypotheses of the b-th utterance are laid out in
+        `[b * n_hyps, (b + 1) * n_hyps)` of query.
+
         Args:
-            key (FloatTensor): `[B, klen, kdim]`
-            value (FloatTensor): `[B, klen, vdim]`
-            query (FloatTensor): `[B, qlen, qdim]`
-            mask (ByteTensor): `[B, qlen, klen]`
+            key (FloatTensor): `[B_k, klen, kdim]`
+            value (FloatTensor): `[B_k, klen, vdim]`
+            query (FloatTensor): `[B, qlen, qdim]`, where `B = B_k * n_hyps`
+            mask (ByteTensor): `[B_k, qlen, klen]`
             aw_prev: dummy interface
             cache (bool): cache key, value, and mask
             mode: dummy interface for MoChA/MMA
             trigger_point: dummy interface for MoChA/MMA
             eps_wait: dummy interface for MMA
+            kv_cache (dict): preallocated buffers for incremental self-attention
+                key (FloatTensor): `[B, max_len, H, d_k]`
+                value (FloatTensor): `[B, max_len, H, d_k]`
+                length (int): number of cached positions
+                key/value are projected only for new positions and appended in-place.
+                mask must cover all the cached positions in this case.
         Returns:
             cv (FloatTensor): `[B, qlen, vdim]`
             aw (FloatTensor): `[B, H, qlen, klen]`
@@ -111,45 +167,59 @@ class MultiheadAttentionMechanism(nn.Module):
             p_choose: dummy interface for MoChA/MMA
 
         """
-        bs, klen = key.size()[: 2]
-        qlen = query.size(1)
+        bs, qlen = query.size()[: 2]
+        bs_k, klen = key.size()[: 2]
 
-        if self.key is None or not cache:
-            self.key = self.w_key(key).view(bs, -1, self.n_heads, self.d_k)  # `[B, klen, H, d_k]`
-            self.value = self.w_value(value).view(bs, -1, self.n_heads, self.d_k)  # `[B, klen, H, d_k]`
+        if kv_cache is not None:
+            klen = self.append_kv_cache(kv_cache, key, value)
+            self.key = kv_cache['key'][:, :klen]  # `[B_k, klen, H, d_k]`
+            self.value = kv_cache['value'][:, :klen]  # `[B_k, klen, H, d_k]`
+            self.mask = mask
+            if self.mask is not None:
+                self.mask = self.mask.unsqueeze(3).repeat([1, 1, 1, self.n_heads])
+                assert self.mask.size() == (bs_k, qlen, klen, self.n_heads), \
+                    (self.mask.size(), (bs_k, qlen, klen, self.n_heads))
+        elif self.key is None or not cache:
+            self.key = self.w_key(key).view(bs_k, -1, self.n_heads, self.d_k)  # `[B_k, klen, H, d_k]`
+            self.value = self.w_value(value).view(bs_k, -1, self.n_heads, self.d_k)  # `[B_k, klen, H, d_k]`
             self.mask = mask
             if self.mask is not None:
                 self.mask = self.mask.unsqueeze(3).repeat([1, 1, 1, self.n_heads])
-                assert self.mask.size() == (bs, qlen, klen, self.n_heads), \
-                    (self.mask.size(), (bs, qlen, klen, self.n_heads))
+                assert self.mask.size() == (bs_k, self.mask.size(1), klen, self.n_heads), \
+                    (self.mask.size(), (bs_k, self.mask.size(1), klen, self.n_heads))
+        bs_k, klen = self.key.size()[: 2]
 
-        query = self.w_query(query).view(bs, -1, self.n_heads, self.d_k)  # `[B, qlen, H, d_k]`
+        # NOTE: hypotheses are folded into an additional axis so that key and value
+        # are broadcast to them instead of being copied for each hypothesis
+        assert bs % bs_k == 0, (bs, bs_k)
+        n_hyps = bs // bs_k
+        query = self.w_query(query).view(bs_k, n_hyps, qlen, self.n_heads, self.d_k)  # `[B_k, n_hyps, qlen, H, d_k]`
 
         if self.atype == 'scaled_dot':
-            e = torch.einsum("bihd,bjhd->bijh", (query, self.key)) / self.scale  # `[B, qlen, klen, H]`
+            e = torch.einsum("bnihd,bjhd->bnijh", (query, self.key)) / self.scale  # `[B_k, n_hyps, qlen, klen, H]`
         elif self.atype == 'add':
-            key = self.key.unsqueeze(1)  # `[B, 1, klen, H, d_k]`
-            query = query.unsqueeze(2)  # `[B, qlen, 1, H, d_k]`
-            tmp = torch.tanh(key + query).view(bs, qlen, klen, -1)  # `[B, qlen, klen, H, d_k]`
-            e = self.v(tmp)  # `[B, qlen, klen, H]`
+            key = self.key.unsqueeze(1).unsqueeze(1)  # `[B_k, 1, 1, klen, H, d_k]`
+            query = query.unsqueeze(3)  # `[B_k, n_hyps, qlen, 1, H, d_k]`
+            tmp = torch.tanh(key + query).view(bs_k, n_hyps, qlen, klen, -1)  # `[B_k, n_hyps, qlen, klen, H * d_k]`
+            e = self.v(tmp)  # `[B_k, n_hyps, qlen, klen, H]`
 
         # Compute attention weights
         if self.mask is not None:
             NEG_INF = float(np.finfo(torch.tensor(0, dtype=e.dtype).numpy().dtype).min)
-            e = e.masked_fill_(self.mask == 0, NEG_INF)  # `[B, qlen, klen, H]`
-        aw = torch.softmax(e, dim=2)
+            e = e.masked_fill_(self.mask.unsqueeze(1) == 0, NEG_INF)  # `[B_k, n_hyps, qlen, klen, H]`
+        aw = torch.softmax(e, dim=3)
         aw = self.dropout_attn(aw)
         aw_masked = aw.clone()
 
         # mask out each head independently (HeadDrop)
         if self.dropout_head > 0 and self.training:
-            aw_masked = aw_masked.permute(0, 3, 1, 2)
+            aw_masked = aw_masked.view(bs, qlen, klen, self.n_heads).permute(0, 3, 1, 2)
             aw_masked = headdrop(aw_masked, self.n_heads, self.dropout_head)  # `[B, H, qlen, klen]`
-            aw_masked = aw_masked.permute(0, 2, 3, 1)
+            aw_masked = aw_masked.permute(0, 2, 3, 1).contiguous().view(bs_k, n_hyps, qlen, klen, self.n_heads)
 
-        cv = torch.einsum("bijh,bjhd->bihd", (aw_masked, self.value))  # `[B, qlen, H, d_k]`
+        cv = torch.einsum("bnijh,bjhd->bnihd", (aw_masked, self.value))  # `[B_k, n_hyps, qlen, H, d_k]`
         cv = cv.contiguous().view(bs, -1, self.n_heads * self.d_k)  # `[B, qlen, H * d_k]`
         cv = self.w_out(cv)
-        aw = aw.permute(0, 3, 1, 2)  # `[B, H, qlen, klen]`
+        aw = aw.view(bs, qlen, klen, self.n_heads).permute(0, 3, 1, 2)  # `[B, H, qlen, klen]`
 
         return cv, aw, None, None
@@ -69,11 +69,14 @@ class PositionalEncoding(nn.Module):
 
         logger.info('Positional encoding: %s' % pe_type)
 
-    def forward(self, xs, scale=True):
+    def forward(self, xs, scale=True, offset=0):
         """Forward pass.
 
         Args:
             xs (FloatTensor): `[B, T, d_model]`
+            scale (bool): multiply inputs by sqrt(d_model)
+            offset (int or LongTensor): position index of the first frame (for incremental decoding).
+                LongTensor of size `[B]` gives a different offset to each sequence.
         Returns:
             xs (FloatTensor): `[B, T, d_model]`
 
@@ -86,7 +89,11 @@ class PositionalEncoding(nn.Module):
             xs = self.dropout(xs)
             return xs
         elif self.pe_type == 'add':
-            xs = xs + self.pe[:, :xs.size(1)]
+            if torch.is_tensor(offset):
+                pos_idxs = offset.unsqueeze(1) + torch.arange(xs.size(1), device=offset.device)
+                xs = xs + self.pe[0, pos_idxs]
+            else:
+                xs = xs + self.pe[:, offset:offset + xs.size(1)]
             xs = self.dropout(xs)
         elif '1dconv' in self.pe_type:
             xs = self.pe(xs)
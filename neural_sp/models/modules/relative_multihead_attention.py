@@ -13,6 +13,7 @@ import torch
 import torch.nn as nn
 
 from neural_sp.models.modules.mocha import headdrop
+from neural_sp.models.modules.multihead_attention import MultiheadAttentionMechanism
 
 
 logger = logging.getLogger(__name__)
@@ -86,6 +87,10 @@ class RelativeMultiheadAttentionMechanism(nn.Module):
             if bias:
                 nn.init.constant_(self.w_pos.bias, 0.)
 
+    # NOTE: key/value buffers have the same layout as MultiheadAttentionMechanism
+    init_kv_cache = MultiheadAttentionMechanism.init_kv_cache
+    append_kv_cache = MultiheadAttentionMechanism.append_kv_cache
+
     def _rel_shift(self, xs):
         """Calculate relative positional attention efficiently.
 
@@ -105,22 +110,34 @@ class RelativeMultiheadAttentionMechanism(nn.Module):
                       .view_as(xs))
         return xs_shifted.view(qlen, klen, bs, n_heads).permute(2, 0, 1, 3)
 
-    def forward(self, key, query, pos_embs, mask, u_bias=None, v_bias=None):
+    def forward(self, key, query, pos_embs, mask, u_bias=None, v_bias=None, kv_cache=None):
         """Forward pass.
 
         Args:
             cat (FloatTensor): `[B, mlen+qlen, kdim]`
             mask (ByteTensor): `[B, qlen, mlen+qlen]`
-            pos_embs (LongTensor): `[qlen, 1, d_model]`
+            pos_embs (LongTensor): `[mlen+qlen, 1, d_model]`
             u_bias (nn.Parameter): `[H, d_k]`
             v_bias (nn.Parameter): `[H, d_k]`
+            kv_cache (dict): key/value buffers for incremental decoding (see init_kv_cache).
+                Keys and values of the new positions in cat are appended in-place,
+                and the cached positions are regarded as memory.
+                mask and pos_embs must cover all the cached positions in this case.
         Returns:
             cv (FloatTensor): `[B, qlen, vdim]`
             aw (FloatTensor): `[B, H, qlen, mlen+qlen]`
 
         """
         bs, qlen = query.size()[:2]
-        mlen = key.size(1) - qlen
+        q = self.w_query(key[:, -qlen:]).view(bs, -1, self.n_heads, self.d_k)  # `[B, qlen, H, d_k]`
+        if kv_cache is not None:
+            klen = self.append_kv_cache(kv_cache, key, key)
+            k = kv_cache['key'][:, :klen]  # `[B, mlen+qlen, H, d_k]`
+            v = kv_cache['value'][:, :klen]  # `[B, mlen+qlen, H, d_k]`
+        else:
+            k = self.w_key(key).view(bs, -1, self.n_heads, self.d_k)  # `[B, mlen+qlen, H, d_k]`
+            v = self.w_value(key).view(bs, -1, self.n_heads, self.d_k)  # `[B, mlen+qlen, H, d_k]`
+        mlen = k.size(1) - qlen
         # NOTE: cat already includes memory, i.e., klen=mlen+qlen
 
         if mask is not None:
@@ -128,10 +145,6 @@ class RelativeMultiheadAttentionMechanism(nn.Module):
             assert mask.size() == (bs, qlen, mlen + qlen, self.n_heads), \
                 (mask.size(), (bs, qlen, mlen + qlen, self.n_heads))
 
-        k = self.w_key(key).view(bs, -1, self.n_heads, self.d_k)  # `[B, mlen+qlen, H, d_k]`
-        v = self.w_value(key).view(bs, -1, self.n_heads, self.d_k)  # `[B, mlen+qlen, H, d_k]`
-        q = self.w_query(key[:, -qlen:]).view(bs, -1, self.n_heads, self.d_k)  # `[B, qlen, H, d_k]`
-
         if self.xl_like:
             _pos_embs = self.w_pos(pos_embs)
         else:
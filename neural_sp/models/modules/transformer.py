@@ -47,6 +47,7 @@ class TransformerDecoderBlock(nn.Module):
         mocha_no_denominator (bool): remove demominator in hard monotonic attention
         mocha_1dconv (bool): 1dconv for MMA
         share_chunkwise_attention (bool): share chunkwise attention in the same layer of MMA
+        mocha_query_block_size (int): number of query steps to compute chunkwise attention at once in MMA
         lm_fusion (str): type of LM fusion
         ffn_bottleneck_dim (int): bottleneck dimension for the light-weight FFN layer
 
@@ -60,6 +61,7 @@ class TransformerDecoderBlock(nn.Module):
                  mocha_init_r=2, mocha_eps=1e-6, mocha_std=1.0,
                  mocha_no_denominator=False, mocha_1dconv=False,
                  dropout_head=0, share_chunkwise_attention=False,
+                 mocha_query_block_size=0,
                  lm_fusion='', ffn_bottleneck_dim=0):
 
         super().__init__()
@@ -103,7 +105,8 @@ class TransformerDecoderBlock(nn.Module):
                                       dropout=dropout_att,
                                       dropout_head=dropout_head,
                                       param_init=param_init,
-                                      share_chunkwise_attention=share_chunkwise_attention)
+                                      share_chunkwise_attention=share_chunkwise_attention,
+                                      query_block_size=mocha_query_block_size)
             else:
                 self.src_attn = MHA(kdim=d_model,
                                     qdim=d_model,
@@ -170,7 +173,8 @@ class TransformerDecoderBlock(nn.Module):
     def forward(self, ys, yy_mask, xs=None, xy_mask=None, cache=None,
                 xy_aws_prev=None,
                 mode='hard', eps_wait=-1, lmout=None,
-                pos_embs=None, memory=None, u_bias=None, v_bias=None):
+                pos_embs=None, memory=None, u_bias=None, v_bias=None,
+                kv_cache=None, cache_src=False):
         """Transformer decoder forward pass.
 
         Args:
@@ -187,6 +191,11 @@ class TransformerDecoderBlock(nn.Module):
             memory (FloatTensor): `[B, L_prev, d_model]`
             u_bias (FloatTensor): global parameter for TransformerXL
             v_bias (FloatTensor): global parameter for TransformerXL
+            kv_cache (dict): key/value buffers of self-attention for incremental decoding.
+                ys contains only new positions, and yy_mask and pos_embs cover all the cached positions.
+                See MultiheadAttentionMechanism.init_kv_cache.
+            cache_src (bool): cache key, value, and mask of the source-target attention.
+                xs can have a smaller batch size than ys in this case (see MultiheadAttentionMechanism).
         Returns:
             out (FloatTensor): `[B, L, d_model]`
 
@@ -219,9 +228,10 @@ class TransformerDecoderBlock(nn.Module):
 
         # self-attention
         if self.memory_transformer:
-            out, self._yy_aws = self.self_attn(cat, ys_q, pos_embs, yy_mask, u_bias, v_bias)
+            out, self._yy_aws = self.self_attn(cat, ys_q, pos_embs, yy_mask, u_bias, v_bias,
+                                               kv_cache=kv_cache)
         else:
-            out, self._yy_aws = self.self_attn(ys, ys, ys_q, mask=yy_mask)[:2]  # k/v/q
+            out, self._yy_aws = self.self_attn(ys, ys, ys_q, mask=yy_mask, kv_cache=kv_cache)[:2]  # k/v/q
         out = self.dropout(out) + residual
 
         # attention over encoder stacks
@@ -230,7 +240,7 @@ class TransformerDecoderBlock(nn.Module):
             out = self.norm2(out)
             out, self._xy_aws, self._xy_aws_beta, self._xy_aws_p_choose = self.src_attn(
                 xs, xs, out, mask=xy_mask,  # k/v/q
-                aw_prev=xy_aws_prev, mode=mode, eps_wait=eps_wait)
+                aw_prev=xy_aws_prev, mode=mode, eps_wait=eps_wait, cache=cache_src)
             out = self.dropout(out) + residual
 
         # LM integration
@@ -70,9 +70,38 @@ class BeamSearch(object):
     def update_rnnlm_state_batch(self, lm, hyps, y):
         lmout, lmstate, scores_lm = None, None, None
         if lm is not None:
-            if hyps[0]['lmstate'] is not None:
-                lm_hxs = torch.cat([beam['lmstate']['hxs'] for beam in hyps], dim=1)
-                lm_cxs = torch.cat([beam['lmstate']['cxs'] for beam in hyps], dim=1)
-                lmstate = {'hxs': lm_hxs, 'cxs': lm_cxs}
+            if any(beam['lmstate'] is not None for beam in hyps):
+                # NOTE: zero states are equivalent to no initial states
+                zero_state = lm.zero_state(1)
+                lmstate = {k: torch.cat([beam['lmstate'][k] if beam['lmstate'] is not None
+                                         else zero_state[k] for beam in hyps], dim=1)
+                           if zero_state[k] is not None else None for k in ['hxs', 'cxs']}
             lmout, lmstate, scores_lm = lm.predict(y, lmstate)
         return lmout, lmstate, scores_lm
+
+
+def reorder_lmstate(lmstate, ids):
+    """Reorder LM states along the hypothesis dimension.
+
+    Args:
+        lmstate:
+            - RNNLM: dict
+                hxs (FloatTensor): `[n_layers, n_hyps, n_units]`
+                cxs (FloatTensor): `[n_layers, n_hyps, n_units]`
+            - TransformerLM/TransformerXL (list): length `n_layers`, each of which contains a dict
+                of key/value buffers `[n_hyps, max_len, H, d_k]` (see LMBase.init_cache)
+            - GatedConvLM (list): length `n_blocks`, each of which contains a tensor `[n_hyps, in_ch, kernel_size-1, 1]`
+        ids (LongTensor): `[n_hyps_new]`, indices of parent hypotheses
+    Returns:
+        new_lmstate: same format as lmstate
+
+    """
+    if lmstate is None:
+        return None
+    if isinstance(lmstate, dict):
+        return {k: v.index_select(1, ids) if v is not None else None
+                for k, v in lmstate.items()}
+    if isinstance(lmstate[0], dict):
+        return [{k: v.index_select(0, ids) if torch.is_tensor(v) else v
+                 for k, v in lmstate_l.items()} for lmstate_l in lmstate]
+    return [lmstate_l.index_select(0, ids) for lmstate_l in lmstate]
@@ -54,6 +54,7 @@ def build_decoder(args, special_symbols, enc_n_units, vocab,
             latency_loss_weight=args.mocha_latency_loss_weight,
             mocha_first_layer=args.mocha_first_layer,
             share_chunkwise_attention=getattr(args, 'share_chunkwise_attention', False),
+            mocha_query_block_size=getattr(args, 'mocha_query_block_size', 0),
             external_lm=external_lm,
             lm_fusion=args.lm_fusion)
 
@@ -15,6 +15,7 @@ import torch
 import torch.nn as nn
 
 from neural_sp.models.criterion import kldiv_lsm_ctc
+from neural_sp.models.seq2seq.decoders.beam_search import reorder_lmstate
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import make_pad_mask
 from neural_sp.models.torch_utils import np2tensor
@@ -84,8 +85,7 @@ class CTC(DecoderBase):
         else:
             self.output = nn.Linear(enc_n_units, vocab)
 
-        import warpctc_pytorch
-        self.warpctc_loss = warpctc_pytorch.CTCLoss(size_average=True)
+        self.warpctc_loss = None  # imported lazily so that decoding does not require warpctc_pytorch
 
         self.forced_aligner = CTCForcedAligner()
 
@@ -127,6 +127,9 @@ class CTC(DecoderBase):
         return loss, trigger_points
 
     def loss_fn(self, logits, ys_ctc, elens, ylens):
+        if self.warpctc_loss is None:
+            import warpctc_pytorch
+            self.warpctc_loss = warpctc_pytorch.CTCLoss(size_average=True)
         loss = self.warpctc_loss(logits.transpose(1, 0),  # time-major
                                  ys_ctc, elens.cpu(), ylens).to(self.device)
         # NOTE: ctc loss has already been normalized by bs
@@ -209,17 +212,24 @@ class CTC(DecoderBase):
                     nbest=1, refs_id=None, utt_ids=None, speakers=None):
         """Beam search decoding.
 
+        All utterances in a mini-batch are decoded at once. Prefixes are held in
+        `[B, beam_width]` slots, and blank/non-blank scores are kept as tensors.
+        Prefixes that collapse to the same label sequence are merged by their
+        hash keys at every frame.
+
         Args:
             eouts (FloatTensor): `[B, T, enc_n_units]`
-            elens (list): length `B`
+            elens (IntTensor): `[B]`
             params (dict):
                 recog_beam_width (int): size of beam
                 recog_length_penalty (float): length penalty
                 recog_lm_weight (float): weight of first path LM score
                 recog_lm_second_weight (float): weight of second path LM score
                 recog_lm_bwd_weight (float): weight of second path backward LM score
+                recog_ctc_blank_skip_threshold (float): skip label extension at frames
+                    where the blank posterior exceeds this value
             idx2token (): converter from index to token
-            lm: firsh path LM
+            lm: firsh path LM (RNNLM)
             lm_second: second path LM
             lm_second_rev: secoding path backward LM
             nbest (int):
@@ -227,148 +237,298 @@ class CTC(DecoderBase):
             utt_ids (list): utterance id list
             speakers (list): speaker list
         Returns:
-            best_hyps (list): Best path hypothesis. `[B, L]`
+            best_hyps (list): A list of length `[B]`, which contains arrays of size `[L]`
 
         """
-        bs = eouts.size(0)
-
-        beam_width = params['recog_beam_width']
-        lp_weight = params['recog_length_penalty']
         lm_weight = params['recog_lm_weight']
         lm_weight_second = params['recog_lm_second_weight']
+        lp_weight = params['recog_length_penalty']
 
-        if lm is not None:
-            assert lm_weight > 0
-            lm.eval()
         if lm_second is not None:
             assert lm_weight_second > 0
             lm_second.eval()
 
-        best_hyps = []
-        log_probs = torch.log_softmax(self.output(eouts), dim=-1)
-        for b in range(bs):
-            # Elements in the beam are (prefix, (p_b, p_no_blank))
-            # Initialize the beam with the empty sequence, a probability of
-            # 1 for ending in blank and zero for ending in non-blank (in log space).
-            beam = [{'hyp': [self.eos],  # <eos> is used for LM
-                     'p_b': LOG_1,
-                     'p_nb': LOG_0,
-                     'score_lm': LOG_1,
-                     'lmstate': None}]
+        end_hyps_batch = self._prefix_beam_search(eouts, elens, params, lm)
 
-            for t in range(elens[b]):
-                new_beam = []
-
-                # Pick up the top-k scores
-                log_probs_topk, topk_ids = torch.topk(
-                    log_probs[b:b + 1, t], k=min(beam_width, self.vocab), dim=-1, largest=True, sorted=True)
-
-                for i_beam in range(len(beam)):
-                    hyp = beam[i_beam]['hyp'][:]
-                    p_b = beam[i_beam]['p_b']
-                    p_nb = beam[i_beam]['p_nb']
-                    score_lm = beam[i_beam]['score_lm']
-
-                    # case 1. hyp is not extended
-                    new_p_b = np.logaddexp(p_b + log_probs[b, t, self.blank].item(),
-                                           p_nb + log_probs[b, t, self.blank].item())
-                    if len(hyp) > 1:
-                        new_p_nb = p_nb + log_probs[b, t, hyp[-1]].item()
-                    else:
-                        new_p_nb = LOG_0
-                    score_ctc = np.logaddexp(new_p_b, new_p_nb)
-                    score_lp = len(hyp[1:]) * lp_weight
-                    new_beam.append({'hyp': hyp,
-                                     'score': score_ctc + score_lm + score_lp,
-                                     'p_b': new_p_b,
-                                     'p_nb': new_p_nb,
-                                     'score_ctc': score_ctc,
-                                     'score_lm': score_lm,
-                                     'score_lp': score_lp,
-                                     'lmstate': beam[i_beam]['lmstate']})
-
-                    # Update LM states for shallow fusion
-                    if lm is not None:
-                        _, lmstate, lm_log_probs = lm.predict(
-                            eouts.new_zeros(1, 1).fill_(hyp[-1]), beam[i_beam]['lmstate'])
-                    else:
-                        lmstate = None
-
-                    # case 2. hyp is extended
-                    new_p_b = LOG_0
-                    for c in tensor2np(topk_ids)[0]:
-                        p_t = log_probs[b, t, c].item()
-
-                        if c == self.blank:
-                            continue
-
-                        c_prev = hyp[-1] if len(hyp) > 1 else None
-                        if c == c_prev:
-                            new_p_nb = p_b + p_t
-                            # TODO(hirofumi): apply character LM here
-                        else:
-                            new_p_nb = np.logaddexp(p_b + p_t, p_nb + p_t)
-                            # TODO(hirofumi): apply character LM here
-                            if c == self.space:
-                                pass
-                                # TODO(hirofumi): apply word LM here
-
-                        score_ctc = np.logaddexp(new_p_b, new_p_nb)
-                        score_lp = (len(hyp[1:]) + 1) * lp_weight
-                        if lm_weight > 0 and lm is not None:
-                            local_score_lm = lm_log_probs[0, 0, c].item() * lm_weight
-                            score_lm += local_score_lm
-                        new_beam.append({'hyp': hyp + [c],
-                                         'score': score_ctc + score_lm + score_lp,
-                                         'p_b': new_p_b,
-                                         'p_nb': new_p_nb,
-                                         'score_ctc': score_ctc,
-                                         'score_lm': score_lm,
-                                         'score_lp': score_lp,
-                                         'lmstate': lmstate})
-
-                # Pruning
-                beam = sorted(new_beam, key=lambda x: x['score'], reverse=True)[:beam_width]
-
-            # Rescoing alignments
-            if lm_second is not None:
-                new_beam = []
-                for i_beam in range(len(beam)):
-                    ys = [np2tensor(np.fromiter(beam[i_beam]['hyp'], dtype=np.int64), self.device)]
-                    ys_pad = pad_list(ys, lm_second.pad)
-                    _, _, lm_log_probs = lm_second.predict(ys_pad, None)
-                    score_ctc = np.logaddexp(beam[i_beam]['p_b'], beam[i_beam]['p_nb'])
-                    score_lm = lm_log_probs.sum() * lm_weight_second
-                    score_lp = len(beam[i_beam]['hyp'][1:]) * lp_weight
-                    new_beam.append({'hyp': beam[i_beam]['hyp'],
-                                     'score': score_ctc + score_lm + score_lp,
-                                     'score_ctc': score_ctc,
-                                     'score_lp': score_lp,
-                                     'score_lm': score_lm})
-                beam = sorted(new_beam, key=lambda x: x['score'], reverse=True)
-
-            best_hyps.append(np.array(beam[0]['hyp'][1:]))
+        # Rescoing alignments of all utterances at once
+        if lm_second is not None:
+            self.lm_rescoring([hyp for end_hyps in end_hyps_batch for hyp in end_hyps],
+                              lm_second, lm_weight_second, tag='second', length_norm=False)
+
+        best_hyps = []
+        for b, end_hyps in enumerate(end_hyps_batch):
+            end_hyps = sorted(end_hyps, key=lambda x: x['score'], reverse=True)
+            best_hyps.append(np.array(end_hyps[0]['hyp'][1:]))
 
             if idx2token is not None:
                 if utt_ids is not None:
                     logger.info('Utt-id: %s' % utt_ids[b])
                 assert self.vocab == idx2token.vocab
                 logger.info('=' * 200)
-                for k in range(len(beam)):
+                for k in range(len(end_hyps)):
                     if refs_id is not None:
                         logger.info('Ref: %s' % idx2token(refs_id[b]))
-                    logger.info('Hyp: %s' % idx2token(beam[k]['hyp'][1:]))
-                    logger.info('log prob (hyp): %.7f' % beam[k]['score'])
-                    logger.info('log prob (hyp, ctc): %.7f' % (beam[k]['score_ctc']))
-                    logger.info('log prob (hyp, lp): %.7f' % (beam[k]['score_lp'] * lp_weight))
+                    logger.info('Hyp: %s' % idx2token(end_hyps[k]['hyp'][1:]))
+                    logger.info('log prob (hyp): %.7f' % end_hyps[k]['score'])
+                    logger.info('log prob (hyp, ctc): %.7f' % (end_hyps[k]['score_ctc']))
+                    logger.info('log prob (hyp, lp): %.7f' % (end_hyps[k]['score_lp'] * lp_weight))
                     if lm is not None:
-                        logger.info('log prob (hyp, first-path lm): %.7f' % (beam[k]['score_lm'] * lm_weight))
+                        logger.info('log prob (hyp, first-path lm): %.7f' % (end_hyps[k]['score_lm'] * lm_weight))
                     if lm_second is not None:
                         logger.info('log prob (hyp, second-path lm): %.7f' %
-                                    (beam[k]['score_lm_second'] * lm_weight_second))
+                                    (end_hyps[k]['score_lm_second'] * lm_weight_second))
                     logger.info('-' * 50)
 
-        return np.array(best_hyps)
+        return best_hyps
+
+    def _prefix_beam_search(self, eouts, elens, params, lm=None):
+        """Run prefix beam search over all utterances in a mini-batch.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+            elens (IntTensor): `[B]`
+            params (dict): hyperparameters for decoding (see beam_search())
+            lm: firsh path LM (RNNLM)
+        Returns:
+            end_hyps_batch (list): A list of length `[B]`, which contains lists of
+                surviving prefixes (dict) in each utterance
+
+        """
+        bs, xmax = eouts.size()[:2]
+
+        beam_width = params['recog_beam_width']
+        lp_weight = params['recog_length_penalty']
+        lm_weight = params['recog_lm_weight']
+        blank_threshold = params['recog_ctc_blank_skip_threshold']
+
+        if lm is not None:
+            assert lm_weight > 0
+            lm.eval()
+
+        if not isinstance(elens, torch.Tensor):
+            elens = torch.IntTensor(elens)
+        log_probs = torch.log_softmax(self.output(eouts), dim=-1)
+        mask = make_pad_mask(elens.to(self.device))  # `[B, T]`
+        # NOTE: padded frames are regarded as blank frames with probability 1,
+        # which does not change the CTC score of any prefix
+        log_probs = log_probs.masked_fill(~mask.unsqueeze(2), LOG_0)
+        log_probs[:, :, self.blank] = log_probs[:, :, self.blank].masked_fill(~mask, LOG_1)
+        # frames where no label extension is performed
+        skip = ~mask | (log_probs[:, :, self.blank].exp() > blank_threshold)  # `[B, T]`
+
+        beam = _PrefixBeam(bs, beam_width, xmax, self.blank, self.eos, self.device)
+
+        # Initialize LM states with <eos> (shared with <sos>)
+        lmstate, lm_log_probs = None, None
+        if lm is not None:
+            y_lm = eouts.new_zeros(bs * beam_width, 1, dtype=torch.int64).fill_(self.eos)
+            _, lmstate, lm_log_probs = lm.predict(y_lm, None)
+            lm_log_probs = lm_log_probs[:, 0]  # `[B * beam, vocab]`
+
+        for t in range(xmax):
+            if skip[:, t].all():
+                beam.update_no_extension(log_probs[:, t])
+                continue
+            lmstate, lm_log_probs = beam.update(log_probs[:, t], skip[:, t], min(beam_width, self.vocab),
+                                                lp_weight, lm_weight, lm, lmstate, lm_log_probs)
+
+        # Finalize
+        scores_ctc = torch.logaddexp(beam.p_b, beam.p_nb)  # `[B, beam]`
+        scores_lm = beam.score_lm
+        scores_lp = beam.ylens.float()
+        scores = scores_ctc + scores_lm * lm_weight + scores_lp * lp_weight
+        scores, scores_ctc, scores_lm, scores_lp = map(tensor2np, [scores, scores_ctc, scores_lm, scores_lp])
+        alive = tensor2np(beam.alive)
+        ylens = tensor2np(beam.ylens)
+        ys = tensor2np(beam.ys)
+
+        end_hyps_batch = []
+        for b in range(bs):
+            end_hyps = []
+            for k in range(beam_width):
+                if not alive[b, k]:
+                    continue
+                end_hyps.append({'hyp': [self.eos] + ys[b, k, :ylens[b, k]].tolist(),
+                                 'score': scores[b, k],
+                                 'score_ctc': scores_ctc[b, k],
+                                 'score_lm': scores_lm[b, k],
+                                 'score_lp': scores_lp[b, k]})
+            end_hyps_batch.append(end_hyps)
+
+        return end_hyps_batch
+
+
+class _PrefixBeam(object):
+    """Prefix table for batched CTC prefix beam search.
+
+    Each utterance owns `beam_width` slots. A prefix is identified by a key built
+    from two rolling hashes over its labels, so that prefixes reached through
+    different alignments are merged without comparing label sequences.
+
+    Args:
+        bs (int): batch size
+        beam_width (int): size of beam
+        xmax (int): maximum number of frames
+        blank (int): index for <blank>
+        eos (int): index for <eos> (shared with <sos>)
+        device: torch device
+
+    """
+
+    BASE = 1000003
+    MOD1 = 1000000007
+    MOD2 = 998244353
+
+    def __init__(self, bs, beam_width, xmax, blank, eos, device):
+        self.bs = bs
+        self.beam_width = beam_width
+        self.blank = blank
+        self.eos = eos
+
+        # Initialize the beam with the empty sequence, a probability of
+        # 1 for ending in blank and zero for ending in non-blank (in log space).
+        self.p_b = torch.full((bs, beam_width), LOG_0, device=device)
+        self.p_b[:, 0] = LOG_1
+        self.p_nb = torch.full((bs, beam_width), LOG_0, device=device)
+        self.score_lm = torch.zeros((bs, beam_width), device=device)
+        self.alive = torch.zeros((bs, beam_width), dtype=torch.bool, device=device)
+        self.alive[:, 0] = True
+        self.ys = torch.zeros((bs, beam_width, max(xmax, 1)), dtype=torch.int64, device=device)
+        self.ylens = torch.zeros((bs, beam_width), dtype=torch.int64, device=device)
+        self.h1 = torch.zeros((bs, beam_width), dtype=torch.int64, device=device)
+        self.h2 = torch.zeros((bs, beam_width), dtype=torch.int64, device=device)
+
+    @property
+    def ys_last(self):
+        """Last labels of prefixes (<eos> for the empty prefix). `[B, beam]`"""
+        ys_last = self.ys.gather(2, (self.ylens - 1).clamp(min=0).unsqueeze(2)).squeeze(2)
+        return ys_last.masked_fill(self.ylens == 0, self.eos)
+
+    def _no_extension(self, log_probs_t):
+        lp_blank = log_probs_t[:, self.blank].unsqueeze(1)
+        lp_last = log_probs_t.gather(1, self.ys_last).masked_fill(self.ylens == 0, LOG_0)
+        p_b = torch.logaddexp(self.p_b, self.p_nb) + lp_blank
+        p_nb = self.p_nb + lp_last
+        return p_b, p_nb
+
+    def update_no_extension(self, log_probs_t):
+        """Update scores at a frame where no prefix is extended.
+
+        Args:
+            log_probs_t (FloatTensor): `[B, vocab]`
+
+        """
+        self.p_b, self.p_nb = self._no_extension(log_probs_t)
+
+    def update(self, log_probs_t, skip_t, topk, lp_weight, lm_weight,
+               lm=None, lmstate=None, lm_log_probs=None):
+        """Extend prefixes with the top-k labels, merge and prune them.
+
+        Args:
+            log_probs_t (FloatTensor): `[B, vocab]`
+            skip_t (BoolTensor): `[B]`, utterances whose prefixes are not extended
+            topk (int): number of candidate labels per frame
+            lp_weight (float): weight of length penalty
+            lm_weight (float): weight of first path LM score
+            lm: first path LM (RNNLM)
+            lmstate (dict): LM states after consuming each prefix
+                hxs (FloatTensor): `[n_layers, B * beam, n_units]`
+                cxs (FloatTensor): `[n_layers, B * beam, n_units]`
+            lm_log_probs (FloatTensor): `[B * beam, vocab]`, next-label LM scores of each prefix
+        Returns:
+            lmstate (dict): LM states for the pruned prefixes
+            lm_log_probs (FloatTensor): `[B * beam, vocab]`
+
+        """
+        bs, beam_width = self.bs, self.beam_width
+        n_ext = beam_width * topk
+
+        # case 1. prefixes are not extended
+        p_b_ne, p_nb_ne = self._no_extension(log_probs_t)
+
+        # case 2. prefixes are extended by one of the top-k labels
+        lp_topk, topk_ids = torch.topk(log_probs_t, k=topk, dim=-1, largest=True, sorted=True)
+        topk_ids_ext = topk_ids.unsqueeze(1).expand(bs, beam_width, topk)
+        repeated = (topk_ids_ext == self.ys_last.unsqueeze(2)) & (self.ylens > 0).unsqueeze(2)
+        p_nb_ext = torch.where(repeated,
+                               self.p_b.unsqueeze(2).expand(bs, beam_width, topk),
+                               torch.logaddexp(self.p_b, self.p_nb).unsqueeze(2).expand(bs, beam_width, topk))
+        p_nb_ext = p_nb_ext + lp_topk.unsqueeze(1)
+        p_b_ext = torch.full_like(p_nb_ext, LOG_0)
+        score_lm_ext = self.score_lm.unsqueeze(2).expand(bs, beam_width, topk)
+        if lm is not None:
+            score_lm_ext = score_lm_ext + lm_log_probs.view(bs, beam_width, -1).gather(2, topk_ids_ext)
+        alive_ext = self.alive.unsqueeze(2) & (topk_ids_ext != self.blank) & ~skip_t.view(bs, 1, 1)
+        h1_ext = (self.h1.unsqueeze(2) * self.BASE + topk_ids_ext + 1) % self.MOD1
+        h2_ext = (self.h2.unsqueeze(2) * self.BASE + topk_ids_ext + 1) % self.MOD2
+
+        def _cat(x_ne, x_ext):
+            return torch.cat([x_ne, x_ext.reshape(bs, n_ext)], dim=1)
+
+        p_b = _cat(p_b_ne, p_b_ext)
+        p_nb = _cat(p_nb_ne, p_nb_ext)
+        score_lm = _cat(self.score_lm, score_lm_ext)
+        alive = _cat(self.alive, alive_ext)
+        h1 = _cat(self.h1, h1_ext)
+        h2 = _cat(self.h2, h2_ext)
+        ylens = _cat(self.ylens, (self.ylens + 1).unsqueeze(2).expand(bs, beam_width, topk))
+        is_ext = _cat(torch.zeros_like(self.alive), torch.ones_like(alive_ext))
+        slots = torch.arange(beam_width, device=p_b.device)
+        parent = _cat(slots.unsqueeze(0).expand(bs, beam_width),
+                      slots.view(1, beam_width, 1).expand(bs, beam_width, topk))
+        tokens = _cat(torch.zeros_like(self.ylens), topk_ids_ext)
+
+        # Merge prefixes sharing the same key
+        # NOTE: unextended entries are sorted before extended ones with the same key.
+        # Dead entries get unique negative keys so that they are never merged.
+        n_entries = beam_width + n_ext
+        keys = (h1 * self.MOD2 + h2) * 2 + is_ext.long()
+        dead_keys = -2 * torch.arange(1, n_entries + 1, device=keys.device).unsqueeze(0).expand(bs, n_entries)
+        keys = torch.where(alive, keys, dead_keys)
+        keys, order = torch.sort(keys, dim=1)
+        p_b, p_nb, score_lm, alive = [x.gather(1, order) for x in [p_b, p_nb, score_lm, alive]]
+        h1, h2, ylens, is_ext, parent, tokens = [x.gather(1, order)
+                                                 for x in [h1, h2, ylens, is_ext, parent, tokens]]
+        # NOTE: a label sequence is reached by at most two entries, itself without
+        # extension and its parent prefix extended by the last label, because slots
+        # hold distinct prefixes and candidate labels are distinct
+        dup = (keys[:, 1:] // 2) == (keys[:, :-1] // 2)  # `[B, n_entries - 1]`
+        p_b = torch.cat([torch.where(dup, torch.logaddexp(p_b[:, :-1], p_b[:, 1:]), p_b[:, :-1]),
+                         p_b[:, -1:]], dim=1)
+        p_nb = torch.cat([torch.where(dup, torch.logaddexp(p_nb[:, :-1], p_nb[:, 1:]), p_nb[:, :-1]),
+                          p_nb[:, -1:]], dim=1)
+        alive = torch.cat([alive[:, :1], alive[:, 1:] & ~dup], dim=1)
+
+        # Pruning
+        scores = torch.logaddexp(p_b, p_nb) + score_lm * lm_weight + ylens.float() * lp_weight
+        scores = scores.masked_fill(~alive, float('-inf'))
+        _, sel = torch.topk(scores, k=beam_width, dim=1, largest=True, sorted=True)
+        self.p_b, self.p_nb, self.score_lm, self.alive = [x.gather(1, sel) for x in [p_b, p_nb, score_lm, alive]]
+        self.h1, self.h2, ylens, is_ext, parent, tokens = [x.gather(1, sel)
+                                                           for x in [h1, h2, ylens, is_ext, parent, tokens]]
+
+        # Append labels to extended prefixes
+        ys = self.ys.gather(1, parent.unsqueeze(2).expand_as(self.ys))
+        pos = (ylens - 1).clamp(min=0).unsqueeze(2)
+        ys.scatter_(2, pos, torch.where(is_ext, tokens, ys.gather(2, pos).squeeze(2)).unsqueeze(2))
+        self.ys = ys
+        self.ylens = ylens
+
+        # Update LM states for shallow fusion in a single batch
+        if lm is not None:
+            parent_ids = (torch.arange(bs, device=parent.device) * beam_width).unsqueeze(1) + parent
+            parent_ids = parent_ids.view(-1)
+            lmstate = reorder_lmstate(lmstate, parent_ids)
+            lm_log_probs = lm_log_probs.index_select(0, parent_ids)
+            ext_ids = (is_ext & self.alive).view(-1).nonzero().squeeze(1)
+            if ext_ids.size(0) > 0:
+                _, lmstate_ext, lm_log_probs_ext = lm.predict(tokens.view(-1).index_select(0, ext_ids).unsqueeze(1),
+                                                              reorder_lmstate(lmstate, ext_ids))
+                lm_log_probs = lm_log_probs.index_copy(0, ext_ids, lm_log_probs_ext[:, 0])
+                lmstate = {k: v.index_copy(1, ext_ids, lmstate_ext[k]) if v is not None else None
+                           for k, v in lmstate.items()}
+
+        return lmstate, lm_log_probs
 
 
 def _label_to_path(labels, blank):
@@ -689,3 +849,136 @@ class CTCPrefixScore(object):
         # return the log prefix probability and CTC states, where the label axis
         # of the CTC states is moved to the first axis to slice it easily
         return log_psi, np.rollaxis(r, 2)
+
+
+class BatchCTCPrefixScore(object):
+    """Compute CTC label sequence scores for all hypotheses at once.
+
+    Batched version of CTCPrefixScore. Hypotheses of all utterances in a
+    mini-batch are laid out in `[B * beam_width]` slots, where the k-th slot of
+    the b-th utterance is `b * beam_width + k`. The forward variables of all
+    hypotheses and candidates are updated as one tensor on the device of log_probs.
+
+    Args:
+        log_probs (FloatTensor): `[B, T, vocab]`
+        xlens (IntTensor): `[B]`
+        blank (int): index of <blank>
+        eos (int): index of <eos>
+        beam_width (int): number of hypotheses per utterance
+        backward (bool): score label sequences in the backward order
+
+    [Reference]:
+        https://github.com/espnet/espnet
+    """
+
+    def __init__(self, log_probs, xlens, blank, eos, beam_width, backward=False):
+
+        self.blank = blank
+        self.eos = eos
+        self.beam_width = beam_width
+        self.log0 = LOG_0
+
+        bs, xmax = log_probs.size()[:2]
+        xlens = [int(xlens[b]) for b in range(bs)]
+        if backward:
+            log_probs = log_probs.clone()
+            for b in range(bs):
+                log_probs[b, :xlens[b]] = torch.flip(log_probs[b, :xlens[b]], dims=[0])
+        # NOTE: padded frames emit <blank> with probability 1 in the blank transition so that
+        # the forward variables at the last frame equal those at xlens - 1
+        mask = make_pad_mask(torch.IntTensor(xlens).to(log_probs.device))  # `[B, T]`
+        x_blank = log_probs[:, :, blank].masked_fill(mask == 0, 0)
+        self.log_probs = log_probs.masked_fill(mask.unsqueeze(2) == 0, self.log0)
+        self.xmax = xmax
+
+        # index of utterances for each slot
+        self.utt_ids = torch.arange(bs, device=log_probs.device).repeat_interleave(beam_width)
+        self.x_blank = x_blank.index_select(0, self.utt_ids).transpose(0, 1)  # `[T, B * beam]`
+
+    def initial_state(self):
+        """Obtain initial CTC states.
+
+        Returns:
+            ctc_states (FloatTensor): `[B * beam, T, 2]`
+
+        """
+        # initial CTC state is made of a frame x 2 tensor that corresponds to
+        # r_t^n(<sos>) and r_t^b(<sos>), where 0 and 1 of axis=2 represent
+        # superscripts n and b (non-blank and blank), respectively.
+        r = self.x_blank.new_full((self.xmax, 2, self.x_blank.size(1)), self.log0)
+        r[:, 1] = torch.cumsum(self.x_blank, dim=0)
+        return r.permute(2, 0, 1).contiguous()
+
+    def __call__(self, ylen, ys_last, r_prev, cand_ids=None):
+        """Compute CTC prefix scores for next labels.
+
+        Args:
+            ylen (int): length of prefix label sequences (excluding <sos>)
+            ys_last (LongTensor): `[B * beam]`, last label of each prefix
+            r_prev (FloatTensor): `[B * beam, T, 2]`, previous CTC states
+            cand_ids (LongTensor): `[B * beam, n_cands]`, candidate labels.
+                All labels in the vocabulary are scored if None.
+        Returns:
+            log_psi (FloatTensor): `[B * beam, n_cands]`, CTC prefix scores
+            ctc_states (FloatTensor): `[B * beam, n_cands, T, 2]`
+
+        """
+        n_hyps = r_prev.size(0)
+        xmax = self.xmax
+
+        # log probabilities of candidates
+        if cand_ids is None:
+            xs = self.log_probs.index_select(0, self.utt_ids)  # `[B * beam, T, vocab]`
+            cand_ids = torch.arange(xs.size(2), device=xs.device).unsqueeze(0).expand(n_hyps, -1)
+        else:
+            xs = self.log_probs[self.utt_ids[:, None, None],
+                                torch.arange(xmax, device=cand_ids.device)[None, :, None],
+                                cand_ids[:, None, :]]  # `[B * beam, T, n_cands]`
+        xs = xs.transpose(0, 1)  # `[T, B * beam, n_cands]`
+        n_cands = cand_ids.size(1)
+
+        # new CTC states are prepared as a frame x (n or b) x hyps x n_labels tensor
+        # that corresponds to r_t^n(h) and r_t^b(h).
+        r = xs.new_full((xmax, 2, n_hyps, n_cands), self.log0)
+        if ylen == 0:
+            r[0, 0] = xs[0]
+
+        # prepare forward probabilities for the last label
+        r_prev = r_prev.transpose(0, 1)  # `[T, B * beam, 2]`
+        r_sum = torch.logaddexp(r_prev[:, :, 0], r_prev[:, :, 1])  # `[T, B * beam]`
+        log_phi = r_sum.unsqueeze(2).repeat([1, 1, n_cands])  # `[T, B * beam, n_cands]`
+        if ylen > 0:
+            is_last = (cand_ids == ys_last.unsqueeze(1)).unsqueeze(0)  # `[1, B * beam, n_cands]`
+            log_phi = torch.where(is_last, r_prev[:, :, 1:2].expand_as(log_phi), log_phi)
+
+        start = max(ylen, 1)
+        end = xmax
+
+        # compute forward probabilities log(r_t^n(h)) and log(r_t^b(h))
+        x_blank = self.x_blank.unsqueeze(2)  # `[T, B * beam, 1]`
+        for t in range(start, end):
+            r[t, 0] = torch.logaddexp(r[t - 1, 0], log_phi[t - 1]) + xs[t]
+            r[t, 1] = torch.logaddexp(r[t - 1, 0], r[t - 1, 1]) + x_blank[t]
+
+        # compute log prefix probabilites log(psi)
+        log_psi = torch.logsumexp(torch.cat([r[start - 1, 0].unsqueeze(0),
+                                             log_phi[start - 1:end - 1] + xs[start:end]], dim=0), dim=0)
+
+        # get P(...eos|X) that ends with the prefix itself
+        log_psi = torch.where(cand_ids == self.eos, r_sum[-1].unsqueeze(1).expand_as(log_psi), log_psi)
+
+        return log_psi, r.permute(2, 3, 0, 1)
+
+    @staticmethod
+    def select_state(ctc_states, parent_ids, cand_ids):
+        """Select CTC states of the extended hypotheses.
+
+        Args:
+            ctc_states (FloatTensor): `[B * beam, n_cands, T, 2]`
+            parent_ids (LongTensor): `[B * beam]`, indices of parent hypotheses
+            cand_ids (LongTensor): `[B * beam]`, indices of selected candidates
+        Returns:
+            ctc_states (FloatTensor): `[B * beam, T, 2]`
+
+        """
+        return ctc_states[parent_ids, cand_ids]
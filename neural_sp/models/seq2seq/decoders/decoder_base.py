@@ -13,8 +13,8 @@ import torch
 import shutil
 
 from neural_sp.models.base import ModelBase
-from neural_sp.models.torch_utils import np2tensor
-from neural_sp.models.torch_utils import pad_list
+from neural_sp.models.lm.rescoring import LMRescorer
+from neural_sp.models.torch_utils import make_pad_mask
 
 import matplotlib
 matplotlib.use('Agg')
@@ -34,6 +34,27 @@ class DecoderBase(ModelBase):
     def reset_session(self):
         self.new_session = True
 
+    def reset_state_carry_over(self):
+        """Do not carry over states to the next utterance."""
+        self.prev_spk = ''
+
+    def get_cache(self):
+        """Return decoder states carried over between streaming chunks."""
+        cache = {k: getattr(self, k) for k in ['n_frames', 'chunk_size', 'dstates_final',
+                                               'lmstate_final', 'ctc_prefix_scorer']
+                 if hasattr(self, k)}
+        if hasattr(getattr(self, 'score', None), 'key_prev_tail'):
+            cache['key_prev_tail'] = self.score.key_prev_tail  # for MoChA
+        return cache
+
+    def set_cache(self, cache):
+        """Restore decoder states returned by get_cache()."""
+        for k, v in cache.items():
+            if k == 'key_prev_tail':
+                self.score.key_prev_tail = v
+            else:
+                setattr(self, k, v)
+
     def greedy(self, eouts, elens, max_len_ratio):
         raise NotImplementedError
 
@@ -194,19 +215,98 @@ class DecoderBase(ModelBase):
         _, topk_ids = torch.topk(probs, k=topk, dim=-1, largest=True, sorted=True)
         return probs, topk_ids
 
-    def lm_rescoring(self, hyps, lm, lm_weight, reverse=False, tag=''):
-        for i in range(len(hyps)):
-            ys = hyps[i]['hyp']  # include <sos>
-            if reverse:
-                ys = ys[::-1]
+    def reduce_blank_frames(self, eouts, elens, threshold, merge=False):
+        """Drop or merge encoder frames dominated by CTC blank.
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_units]`
+            elens (IntTensor): `[B]`
+            threshold (float): frames whose blank probability exceeds this value are reduced
+            merge (bool): merge each run of blank frames into a single averaged frame
+                instead of dropping it
+        Returns:
+            eouts (FloatTensor): `[B, T', enc_units]`
+            elens (IntTensor): `[B]`
+
+        """
+        new_ids, elens_new = self.blank_frame_ids(eouts, elens, threshold, merge)
+        return self.reduce_frames(eouts, new_ids, elens_new), elens_new
+
+    def blank_frame_ids(self, eouts, elens, threshold, merge=False):
+        """Assign encoder frames to reduced frames based on CTC blank posteriors.
+
+        The same assignment can be applied to encoder outputs of other models
+        (e.g., ensemble models) having the same frame rate with reduce_frames().
+
+        Args:
+            eouts (FloatTensor): `[B, T, enc_units]`
+            elens (IntTensor): `[B]`
+            threshold (float): frames whose blank probability exceeds this value are reduced
+            merge (bool): merge each run of blank frames into a single averaged frame
+                instead of dropping it
+        Returns:
+            new_ids (LongTensor): `[B, T]`, index of the reduced frame each frame is averaged into.
+                Frames not used are assigned to `T'`.
+            elens (IntTensor): `[B]`
+
+        """
+        bs = eouts.size(0)
+        blank_probs = self.ctc_probs(eouts)[:, :, self.ctc.blank]  # `[B, T]`
+        mask = make_pad_mask(elens.to(eouts.device))
+        is_blank = (blank_probs > threshold) & mask
+
+        # a new frame starts at every non-blank frame (and at the head of every blank run when merging)
+        if merge:
+            is_blank_prev = torch.cat([is_blank.new_zeros(bs, 1), is_blank[:, :-1]], dim=1)
+            starts = mask & (~is_blank | ~is_blank_prev)
+            used = mask
+        else:
+            # keep at least one frame per utterance
+            all_blank = (is_blank | ~mask).all(dim=1)
+            if all_blank.any():
+                t_min = blank_probs.masked_fill(~mask, 2.).argmin(dim=1)
+                is_blank[all_blank, t_min[all_blank]] = False
+            starts = mask & ~is_blank
+            used = starts
+        elens_new = starts.sum(dim=1)
+        tmax = int(elens_new.max())
+        new_ids = (starts.long().cumsum(dim=1) - 1).masked_fill(~used, tmax)
+        return new_ids, elens_new.to(elens.device, elens.dtype)
+
+    @staticmethod
+    def reduce_frames(eouts, new_ids, elens):
+        """Average encoder frames sharing the same index returned by blank_frame_ids().
 
-            ys = [np2tensor(np.fromiter(ys, dtype=np.int64), self.device)]
-            ys_in = pad_list([y[:-1] for y in ys], -1)  # `[1, L-1]`
-            ys_out = pad_list([y[1:] for y in ys], -1)  # `[1, L-1]`
+        Args:
+            eouts (FloatTensor): `[B, T, enc_units]`
+            new_ids (LongTensor): `[B, T]`
+            elens (IntTensor): `[B]`, lengths after reduction
+        Returns:
+            eouts (FloatTensor): `[B, T', enc_units]`
+
+        """
+        bs, xmax, enc_units = eouts.size()
+        assert new_ids.size() == (bs, xmax)
+        tmax = int(elens.max())
+        # unused frames go to a dummy index
+        eouts_new = eouts.new_zeros(bs, tmax + 1, enc_units).scatter_add_(
+            1, new_ids.unsqueeze(2).expand(bs, xmax, enc_units), eouts)
+        counts = eouts.new_zeros(bs, tmax + 1).scatter_add_(1, new_ids, (new_ids < tmax).float())
+        return eouts_new[:, :tmax] / counts[:, :tmax].clamp(min=1).unsqueeze(2)
+
+    def lm_rescoring(self, hyps, lm, lm_weight, reverse=False, tag='', length_norm=True):
+        """Rescore N-best hypotheses with an external LM in-place.
 
-            lmout, lmstate, scores_lm = lm.predict(ys_in, None)
-            score_lm = sum([scores_lm[0, t, ys_out[0, t]] for t in range(ys_out.size(1))])
-            score_lm /= ys_out.size(1)
+        All hypotheses (possibly from several utterances) are scored at once.
+        See LMRescorer for details.
 
-            hyps[i]['score'] += score_lm * lm_weight
-            hyps[i]['score_lm_' + tag] = score_lm
+        Args:
+            hyps (list): length `N`, each of which contains a dict
+            lm (LMBase): second path LM
+            lm_weight (float): weight of LM score
+            reverse (bool): score hypotheses in the reversed order
+            tag (str): suffix of the key to store LM scores
+            length_norm (bool): normalize LM scores by the number of tokens
+
+        """
+        LMRescorer(lm).rescore(hyps, lm_weight, reverse=reverse, tag=tag, length_norm=length_norm)
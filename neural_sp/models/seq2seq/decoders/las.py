@@ -14,9 +14,10 @@ import random
 import torch
 import torch.nn as nn
 
-from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.evaluators.edit_distance import edit_distance_batch
 from neural_sp.models.criterion import cross_entropy_lsm
 from neural_sp.models.criterion import distillation
+from neural_sp.models.criterion import interval_latency
 from neural_sp.models.criterion import MBR
 # from neural_sp.models.criterion import minimum_bayes_risk
 from neural_sp.models.lm.rnnlm import RNNLM
@@ -28,7 +29,9 @@ from neural_sp.models.modules.initialization import init_with_uniform
 from neural_sp.models.modules.mocha import MoChA
 from neural_sp.models.modules.multihead_attention import MultiheadAttentionMechanism
 from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
+from neural_sp.models.seq2seq.decoders.beam_search import reorder_lmstate
 from neural_sp.models.seq2seq.decoders.ctc import CTC
+from neural_sp.models.seq2seq.decoders.ctc import BatchCTCPrefixScore
 from neural_sp.models.seq2seq.decoders.ctc import CTCPrefixScore
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import append_sos_eos
@@ -172,7 +175,6 @@ class RNNDecoder(DecoderBase):
         self.prev_spk = ''
         self.dstates_final = None
         self.lmstate_final = None
-        self.lmmemory = None
 
         # for attention plot
         self.aws_dict = {}
@@ -467,65 +469,50 @@ class RNNDecoder(DecoderBase):
             N_best = recog_params['recog_beam_width']
             alpha = 1.0
             assert N_best >= 2
-            loss_mbr = 0.
-            loss_ce = 0.
             bs = eouts.size(0)
-            for b in range(bs):
-                # 1. beam search
-                self.eval()
-                with torch.no_grad():
-                    nbest_hyps_id, _, log_scores = self.beam_search(
-                        eouts[b:b + 1], elens[b:b + 1], params=recog_params,
-                        nbest=N_best, exclude_eos=True)
-                nbest_hyps_id_b = [np.fromiter(y, dtype=np.int64) for y in nbest_hyps_id[0]]
-                log_scores_b = np2tensor(np.array(log_scores[0], dtype=np.float32), self.device)
-                scores_b_norm = torch.softmax(alpha * log_scores_b, dim=-1)  # `[N_best]`
-                # print((scores_b_norm * 100).int())
-
-                # 2. calculate expected WER
-                wers_b = np2tensor(np.array([
-                    compute_wer(ref=idx2token(ys[b]).split(' '),
-                                hyp=idx2token(nbest_hyps_id_b[n]).split(' '))[0] / 100
-                    for n in range(N_best)], dtype=np.float32), self.device)
-                exp_wer_b = (scores_b_norm * wers_b).sum()
-                grad_b = (scores_b_norm * (wers_b - exp_wer_b)).sum()
-                # print(wers_b)
-                # print(exp_wer_b)
-                # print(scores_b_norm * (wers_b - exp_wer_b))
-                # print(grad_b)
-
-                # 3. forward pass (teacher-forcing with hypotheses)
-                self.train()
-                logits_b = self.forward_mbr(eouts[b:b + 1].repeat([N_best, 1, 1]),
-                                            elens[b:b + 1].repeat([N_best]),
-                                            nbest_hyps_id_b)
-                log_probs_b = torch.log_softmax(logits_b, dim=-1)  # `[nbest, L, vocab]`
-
-                # 4. backward pass (attach gradient)
-                _eos = eouts.new_zeros((1,), dtype=torch.int64).fill_(self.eos)
-                nbest_hyps_id_b_pad = pad_list([torch.cat([np2tensor(y, self.device), _eos], dim=0)
-                                                for y in nbest_hyps_id_b], self.pad)
-                loss_mbr += self.mbr(log_probs_b, nbest_hyps_id_b_pad, exp_wer_b, grad_b)
-
-                # 4. calculate MBR loss
-                # loss_mbr_b, scores_b = minimum_bayes_risk(log_probs_b, nbest_hyps_id_b, wers_b,
-                #                                           self.eos, self.pad)
-                # loss_mbr += loss_mbr_b
-
-                # 5. CE loss regularization
-                loss_ce += self.forward_att(eouts[b:b + 1], elens[b:b + 1], ys[b:b + 1])[0]
-
-                # ys_out_b = append_sos_eos([ys[b]], self.eos, self.eos, self.pad, self.device)[1]
-                # ys_out_b = ys_out_b.repeat([N_best, 1])
-                # # NOTE: truncate to match the lengths
-                # ymax = min(logits_b.size(1), ys_out_b.size(1))
-                # logits_b = logits_b[:, :ymax].contiguous()
-                # ys_out_b = ys_out_b[:, :ymax].contiguous()
-                # for k in range(N_best):
-                #     loss_ce_k = cross_entropy_lsm(logits_b, ys_out_b, 0, self.pad, self.training)[0]
-                #     loss_ce += loss_ce_k * scores_b_norm[k]
 
+            # 1. beam search (all utterances at once)
+            self.eval()
+            with torch.no_grad():
+                nbest_hyps_id, _, log_scores = self.beam_search(
+                    eouts, elens, params=recog_params,
+                    nbest=N_best, exclude_eos=True)
+            nbest_hyps_id = [np.fromiter(y, dtype=np.int64) for b in range(bs) for y in nbest_hyps_id[b]]
+            log_scores = np2tensor(np.array(log_scores, dtype=np.float32), self.device)  # `[B, N_best]`
+            scores_norm = torch.softmax(alpha * log_scores, dim=-1)  # `[B, N_best]`
+
+            # 2. calculate expected WER
+            refs = [ys[b] for b in range(bs) for _ in range(N_best)]
+            if idx2token is not None:
+                # word-level risk
+                word2id = {}
+                refs = [[word2id.setdefault(w, len(word2id)) for w in idx2token(y).split(' ')] for y in refs]
+                hyps = [[word2id.setdefault(w, len(word2id)) for w in idx2token(y).split(' ')]
+                        for y in nbest_hyps_id]
+            else:
+                hyps = nbest_hyps_id
+            wers = np2tensor(edit_distance_batch(refs, hyps).astype(np.float32),
+                             self.device).view(bs, N_best)
+            exp_wer = (scores_norm * wers).sum(1)  # `[B]`
+            grad = scores_norm * (wers - exp_wer.unsqueeze(1))  # `[B, N_best]`
+
+            # 3. forward pass (teacher-forcing with all hypotheses at once)
+            self.train()
+            logits = self.forward_mbr(eouts.repeat_interleave(N_best, dim=0),
+                                      elens.repeat_interleave(N_best, dim=0),
+                                      nbest_hyps_id)
+            log_probs = torch.log_softmax(logits, dim=-1)  # `[B * N_best, L, vocab]`
+
+            # 4. backward pass (attach gradient)
+            _eos = eouts.new_zeros((1,), dtype=torch.int64).fill_(self.eos)
+            nbest_hyps_id_pad = pad_list([torch.cat([np2tensor(y, self.device), _eos], dim=0)
+                                          for y in nbest_hyps_id], -1)
             # NOTE: MBR loss is accumlated over N-best and mini-batch
+            loss_mbr = self.mbr(log_probs, nbest_hyps_id_pad, exp_wer.sum(), grad.view(-1))
+
+            # 5. CE loss regularization
+            loss_ce = self.forward_att(eouts, elens, ys)[0] * bs
+
             loss = loss_mbr + loss_ce * self.mbr_ce_weight
             observation['loss_mbr'] = tensor2scalar(loss_mbr)
             observation['loss_att'] = tensor2scalar(loss_ce)
@@ -723,15 +710,7 @@ class RNNDecoder(DecoderBase):
         loss_latency = 0.
         if self.latency_metric == 'interval':
             assert trigger_points is None
-            assert aws.size(1) == 1  # TODO: extend to multi-head
-            aws_prev = torch.cat([aws.new_zeros(aws.size())[:, :, -1:], aws.clone()[:, :, :-1]], dim=2)
-            aws_mat = aws_prev.unsqueeze(3) * aws.unsqueeze(4)  # `[B, H, L, T, T]`
-            delay_mat = aws.new_ones(xmax, xmax).float()
-            delay_mat = torch.tril(delay_mat, diagonal=-1, out=delay_mat)
-            delay_mat = torch.cumsum(delay_mat, dim=-2).unsqueeze(0)
-            delay_mat = delay_mat.unsqueeze(1).unsqueeze(2).expand_as(aws_mat)
-            loss_latency = torch.pow((aws_mat * delay_mat).sum(-1), 2).sum(-1)
-            loss_latency = torch.mean(loss_latency.squeeze(1))
+            loss_latency = interval_latency(aws)
         elif trigger_points is not None:
             js = torch.arange(xmax, dtype=torch.float, device=self.device)
             js = js.repeat([bs, n_heads, ymax, 1])
@@ -1020,26 +999,18 @@ class RNNDecoder(DecoderBase):
             scores (list):
 
         """
-        bs, xmax, _ = eouts.size()
-        n_models = len(ensmbl_decs) + 1
+        bs = eouts.size(0)
 
         beam_width = params['recog_beam_width']
         assert 1 <= nbest <= beam_width
         ctc_weight = params['recog_ctc_weight']
-        max_len_ratio = params['recog_max_len_ratio']
-        min_len_ratio = params['recog_min_len_ratio']
-        lp_weight = params['recog_length_penalty']
         cp_weight = params['recog_coverage_penalty']
-        cp_threshold = params['recog_coverage_threshold']
         length_norm = params['recog_length_norm']
         lm_weight = params['recog_lm_weight']
         lm_weight_second = params['recog_lm_second_weight']
         lm_weight_second_bwd = params['recog_lm_bwd_weight']
-        gnmt_decoding = params['recog_gnmt_decoding']
-        eos_threshold = params['recog_eos_threshold']
         asr_state_CO = params['recog_asr_state_carry_over']
         lm_state_CO = params['recog_lm_state_carry_over']
-        softmax_smoothing = params['recog_softmax_smoothing']
 
         if lm is not None:
             assert lm_weight > 0
@@ -1054,347 +1025,460 @@ class RNNDecoder(DecoderBase):
 
         if ctc_log_probs is not None:
             assert ctc_weight > 0
-            ctc_log_probs = tensor2np(ctc_log_probs)
+
+        # NOTE: all utterances are decoded at once unless ASR/LM states are
+        # carried over from the previous utterance, which requires decoding them one by one
+        if speakers is not None and (asr_state_CO or lm_state_CO):
+            batch_ids_list = [[b] for b in range(bs)]
+        else:
+            batch_ids_list = [list(range(bs))]
 
         nbest_hyps_idx, aws, scores = [], [], []
         eos_flags = []
-        for b in range(bs):
-            # Initialization per utterance
-            self.score.reset()
-            dstates = self.zero_state(1)
-            lmstate = None
-            ys = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(self.eos)  # for Transformer(XL) LM
-
-            # For joint CTC-Attention decoding
-            ctc_prefix_scorer = None
-            if ctc_log_probs is not None:
+        for batch_ids in batch_ids_list:
+            end_hyps_batch = self._beam_search_batch(
+                eouts[batch_ids], elens[batch_ids], params, lm,
+                ctc_log_probs[batch_ids] if ctc_log_probs is not None else None,
+                refs_id, [speakers[b] for b in batch_ids] if speakers is not None else None,
+                [eouts_e[batch_ids] for eouts_e in ensmbl_eouts],
+                [elens_e[batch_ids] for elens_e in ensmbl_elens],
+                ensmbl_decs, nbest, cache_states)
+
+            # second path LM rescoring of all hypotheses in the mini-batch at once
+            end_hyps_all = [hyp for end_hyps in end_hyps_batch for hyp in end_hyps]
+            if lm_second is not None:
+                self.lm_rescoring(end_hyps_all, lm_second, lm_weight_second, tag='second')
+            if lm_second_bwd is not None:
+                self.lm_rescoring(end_hyps_all, lm_second_bwd, lm_weight_second_bwd, tag='second_bwd')
+
+            for b, end_hyps in zip(batch_ids, end_hyps_batch):
+                # Sort by score
+                end_hyps = sorted(end_hyps, key=lambda x: x['score'], reverse=True)
+
+                if idx2token is not None:
+                    if utt_ids is not None:
+                        logger.info('Utt-id: %s' % utt_ids[b])
+                    assert self.vocab == idx2token.vocab
+                    logger.info('=' * 200)
+                    for k in range(len(end_hyps)):
+                        if refs_id is not None:
+                            logger.info('Ref: %s' % idx2token(refs_id[b]))
+                        logger.info('Hyp: %s' % idx2token(
+                            end_hyps[k]['hyp'][1:][::-1] if self.bwd else end_hyps[k]['hyp'][1:]))
+                        logger.info('log prob (hyp): %.7f' % end_hyps[k]['score'])
+                        logger.info('log prob (hyp, att): %.7f' % (end_hyps[k]['score_att'] * (1 - ctc_weight)))
+                        logger.info('log prob (hyp, cp): %.7f' % (end_hyps[k]['score_cp'] * cp_weight))
+                        if ctc_log_probs is not None:
+                            logger.info('log prob (hyp, ctc): %.7f' % (end_hyps[k]['score_ctc'] * ctc_weight))
+                        if lm is not None:
+                            logger.info('log prob (hyp, first-path lm): %.7f' % (end_hyps[k]['score_lm'] * lm_weight))
+                        if lm_second is not None:
+                            logger.info('log prob (hyp, second-path lm): %.7f' %
+                                        (end_hyps[k]['score_lm_second'] * lm_weight_second))
+                        if lm_second_bwd is not None:
+                            logger.info('log prob (hyp, second-path lm, reverse): %.7f' %
+                                        (end_hyps[k]['score_lm_second_bwd'] * lm_weight_second_bwd))
+                        logger.info('-' * 50)
+
+                # N-best list (truncate padded frames in attention weights)
+                elen = int(elens[b])
                 if self.bwd:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b][::-1], self.blank, self.eos)
+                    # Reverse the order
+                    nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:][::-1]) for n in range(nbest)]]
+                    aws += [[tensor2np(torch.cat(end_hyps[n]['aws'][1:][::-1], dim=2).squeeze(0))[:, :, :elen]
+                             for n in range(nbest)]]
                 else:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b], self.blank, self.eos)
-
-            # Ensemble initialization
-            ensmbl_dstate, ensmbl_cv = [], []
-            if n_models > 1:
-                for dec in ensmbl_decs:
-                    ensmbl_dstate += [dec.zero_state(1)]
-                    ensmbl_cv += [eouts.new_zeros(1, 1, dec.enc_n_units)]
-                    dec.score.reset()
-
-            if speakers is not None:
-                if speakers[b] == self.prev_spk:
-                    if asr_state_CO:
-                        dstates = self.dstates_final
-                    if lm_state_CO:
-                        if isinstance(lm, RNNLM):
-                            lmstate = self.lmstate_final
-                        elif isinstance(lm, TransformerLM):
-                            ys_prev = self.lmstate_final
-                            # Re-encode past tokens here
-                            _, lmstate, _ = lm.predict(ys_prev)
-                            ys = torch.cat([ys_prev, ys], dim=1)
-                        # elif isinstance(lm, TransformerXL):
-                        #     ys_prev = self.lmstate_final
-                        #     # Re-encode past tokens here
-                        #     _, lmstate, _ = lm.predict(ys_prev, mems=self.lmmemory)
-                        #     ys = torch.cat([ys_prev, ys], dim=1)
+                    nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:]) for n in range(nbest)]]
+                    aws += [[tensor2np(torch.cat(end_hyps[n]['aws'][1:], dim=2).squeeze(0))[:, :, :elen]
+                             for n in range(nbest)]]
+                if length_norm:
+                    scores += [[end_hyps[n]['score_att'] / len(end_hyps[n]['hyp'][1:]) for n in range(nbest)]]
                 else:
-                    self.dstates_final = None  # reset
-                    self.lmstate_final = None  # reset
-                    self.lmmemory = None  # reset
-                self.prev_spk = speakers[b]
+                    scores += [[end_hyps[n]['score_att'] for n in range(nbest)]]
 
-            helper = BeamSearch(beam_width, self.eos, ctc_weight, self.device)
-
-            end_hyps = []
-            hyps = [{'hyp': [self.eos],
-                     'ys': ys,
-                     'score': 0.,
-                     'score_att': 0.,
-                     'score_ctc': 0.,
-                     'score_lm': 0.,
-                     'dstates': dstates,
-                     'cv': eouts.new_zeros(1, 1, self.enc_n_units),
-                     'aws': [None],
-                     'lmstate': lmstate,
-                     'ensmbl_dstate': ensmbl_dstate,
-                     'ensmbl_cv': ensmbl_cv,
-                     'ensmbl_aws':[[None]] * (n_models - 1),
-                     'ctc_state': ctc_prefix_scorer.initial_state() if ctc_prefix_scorer is not None else None}]
-            ymax = math.ceil(elens[b] * max_len_ratio)
-            for i in range(ymax):
-                # batchfy all hypotheses for batch decoding
-                y = eouts.new_zeros((len(hyps), 1), dtype=torch.int64)
-                for j, beam in enumerate(hyps):
-                    if self.replace_sos and i == 0:
-                        prev_idx = refs_id[0][0]
-                    else:
-                        prev_idx = beam['hyp'][-1]
-                    y[j, 0] = prev_idx
-                cv = torch.cat([beam['cv'] for beam in hyps], dim=0)
-                aw = torch.cat([beam['aws'][-1] for beam in hyps], dim=0) if i > 0 else None
-                hxs = torch.cat([beam['dstates']['dstate'][0] for beam in hyps], dim=1)
-                if self.rnn_type == 'lstm':
-                    cxs = torch.cat([beam['dstates']['dstate'][1] for beam in hyps], dim=1)
-                dstates = {'dstate': (hxs, cxs)}
-
-                # Update LM states for LM fusion
-                lmout, lmstate, scores_lm = None, None, None
-                if lm is not None or self.lm is not None:
-                    if trfm_lm:
-                        y_lm = eouts.new_zeros((len(hyps), beam['ys'].size(1)), dtype=torch.int64)
-                        for j, cand in enumerate(hyps):
-                            y_lm[j, :] = cand['ys']
-                    else:
-                        y_lm = y
-
-                    if i > 0 or (i == 0 and trfm_lm and lm_state_CO and self.lmstate_final is not None):
-                        if isinstance(lm, RNNLM):
-                            lmstate = {'hxs': torch.cat([beam['lmstate']['hxs'] for beam in hyps], dim=1),
-                                       'cxs': torch.cat([beam['lmstate']['cxs'] for beam in hyps], dim=1)}
-                        elif trfm_lm:
-                            if isinstance(lm, TransformerLM):
-                                lmstate = [torch.cat([beam['lmstate'][lth] for beam in hyps], dim=0)
-                                           for lth in range(lm.n_layers)]
-                            elif i > 0:
-                                lmstate = [torch.cat([beam['lmstate'][lth] for beam in hyps], dim=0)
-                                           for lth in range(lm.n_layers)]
-
-                    if self.lm is not None:  # cold/deep fusion
-                        lmout, lmstate, scores_lm = self.lm.predict(y_lm, lmstate)
-                    elif lm is not None:  # shallow fusion
-                        lmout, lmstate, scores_lm = lm.predict(y_lm, lmstate,
-                                                               mems=self.lmmemory,
-                                                               cache=lmstate if cache_states else None)
-
-                # for the main model
-                dstates, cv, aw, attn_v, _, _ = self.decode_step(
-                    eouts[b:b + 1, :elens[b]].repeat([cv.size(0), 1, 1]),
-                    dstates, cv, self.dropout_emb(self.embed(y)), None, aw, lmout)
-                probs = torch.softmax(self.output(attn_v).squeeze(1) * softmax_smoothing, dim=1)
-
-                # for the ensemble
-                ensmbl_dstate, ensmbl_cv, ensmbl_aws = [], [], []
-                for i_e, dec in enumerate(ensmbl_decs):
-                    cv_e = torch.cat([beam['ensmbl_cv'][i_e] for beam in hyps], dim=0)
-                    aw_e = torch.cat([beam['ensmbl_aws'][i_e][-1] for beam in hyps], dim=0) if i > 0 else None
-                    hxs_e = torch.cat([beam['ensmbl_dstate'][i_e]['dstate'][0] for beam in hyps], dim=1)
-                    if self.rnn_type == 'lstm':
-                        cxs_e = torch.cat([beam['ensmbl_dstate'][i_e]['dstate'][1] for beam in hyps], dim=1)
-                    dstates_e = {'dstate': (hxs_e, cxs_e)}
-
-                    dstates_e, cv_e, aw_e, attn_v_e, _, _ = dec.decode_step(
-                        ensmbl_eouts[i_e][b:b + 1, :ensmbl_elens[i_e][b]].repeat([cv_e.size(0), 1, 1]),
-                        dstates_e, cv_e, dec.dropout_emb(dec.embed(y)), None, aw_e, lmout)
-
-                    ensmbl_dstate += [{'dstate': (dstates_e['dstate'][0][:, j:j + 1],
-                                                  dstates_e['dstate'][1][:, j:j + 1])}]
-                    ensmbl_cv += [cv_e[j:j + 1]]
-                    ensmbl_aws += [beam['ensmbl_aws'][i_e] + [aw_e[j:j + 1]]]
-                    probs += torch.softmax(dec.output(attn_v_e).squeeze(1), dim=1)
-                    # NOTE: sum in the probability scale (not log-scale)
-
-                # Ensemble
-                scores_att = torch.log(probs / n_models)
-
-                new_hyps = []
-                for j, beam in enumerate(hyps):
-                    # Attention scores
-                    total_scores_att = beam['score_att'] + scores_att[j:j + 1]
-                    total_scores = total_scores_att * (1 - ctc_weight)
+                # Check <eos>
+                eos_flags.append([(end_hyps[n]['hyp'][-1] == self.eos) for n in range(nbest)])
 
-                    # Add LM score <after> top-K selection
-                    total_scores_topk, topk_ids = torch.topk(
-                        total_scores, k=beam_width, dim=1, largest=True, sorted=True)
-                    if lm is not None:
-                        total_scores_lm = beam['score_lm'] + scores_lm[j, -1, topk_ids[0]]
-                        total_scores_topk += total_scores_lm * lm_weight
-                    else:
-                        total_scores_lm = eouts.new_zeros(beam_width)
-
-                    # Add length penalty
-                    if lp_weight > 0:
-                        if gnmt_decoding:
-                            lp = math.pow(6 + len(beam['hyp'][1:]), lp_weight) / math.pow(6, lp_weight)
-                            total_scores_topk /= lp
-                        else:
-                            total_scores_topk += (len(beam['hyp'][1:]) + 1) * lp_weight
-
-                    # Add coverage penalty
-                    if cp_weight > 0:
-                        aw_mat = torch.cat(beam['aws'][1:] + [aw[j:j + 1]], dim=2)  # `[B, H, L, T]`
-                        aw_mat = aw_mat[:, 0, :, :]  # `[B, L, T]`
-                        if gnmt_decoding:
-                            aw_mat = torch.log(aw_mat.sum(-1))
-                            cp = torch.where(aw_mat < 0, aw_mat, aw_mat.new_zeros(aw_mat.size())).sum()
-                            # TODO(hirofumi): mask by elens[b]
-                            total_scores_topk += cp * cp_weight
-                        else:
-                            # Recompute converage penalty at each step
-                            if cp_threshold == 0:
-                                cp = aw_mat.sum() / self.score.n_heads
-                            else:
-                                cp = torch.where(aw_mat > cp_threshold, aw_mat,
-                                                 aw_mat.new_zeros(aw_mat.size())).sum() / self.score.n_heads
-                            total_scores_topk += cp * cp_weight
-                    else:
-                        cp = 0.
-
-                    # Add CTC score
-                    new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
-                        beam['hyp'], topk_ids, beam['ctc_state'],
-                        total_scores_topk, ctc_prefix_scorer)
-
-                    for k in range(beam_width):
-                        idx = topk_ids[0, k].item()
-                        length_norm_factor = len(beam['hyp'][1:]) + 1 if length_norm else 1
-                        total_score = total_scores_topk[0, k].item() / length_norm_factor
-
-                        if idx == self.eos:
-                            # Exclude short hypotheses
-                            if len(beam['hyp'][1:]) < elens[b] * min_len_ratio:
-                                continue
-                            # EOS threshold
-                            max_score_no_eos = scores_att[j, :idx].max(0)[0].item()
-                            max_score_no_eos = max(max_score_no_eos, scores_att[j, idx + 1:].max(0)[0].item())
-                            if scores_att[j, idx].item() <= eos_threshold * max_score_no_eos:
-                                continue
+            # Store ASR/LM state
+            self.dstates_final = end_hyps[0]['dstates']
+            if isinstance(lm, RNNLM):
+                self.lmstate_final = end_hyps[0]['lmstate']
+            elif trfm_lm:
+                # keep keys/values of the last `mem_len` tokens as memory (the last <eos> is not cached)
+                self.lmstate_final = lm.truncate_cache(end_hyps[0]['lmstate'], lm.mem_len)
+                logger.info('Memory: %d' % self.lmstate_final[0]['length'])
 
-                        new_lmstate = None
-                        if lmstate is not None:
-                            if isinstance(lm, RNNLM) or isinstance(self.lm, RNNLM):
-                                new_lmstate = {'hxs': lmstate['hxs'][:, j:j + 1],
-                                               'cxs': lmstate['cxs'][:, j:j + 1]}
-                            elif trfm_lm:
-                                new_lmstate = [lmstate_l[j:j + 1] for lmstate_l in lmstate]
-                            else:
-                                raise ValueError
+        # Exclude <eos> (<sos> in case of the backward decoder)
+        if exclude_eos:
+            if self.bwd:
+                nbest_hyps_idx = [[nbest_hyps_idx[b][n][1:] if eos_flags[b][n]
+                                   else nbest_hyps_idx[b][n] for n in range(nbest)] for b in range(bs)]
+                aws = [[aws[b][n][:, 1:] if eos_flags[b][n] else aws[b][n] for n in range(nbest)] for b in range(bs)]
+            else:
+                nbest_hyps_idx = [[nbest_hyps_idx[b][n][:-1] if eos_flags[b][n]
+                                   else nbest_hyps_idx[b][n] for n in range(nbest)] for b in range(bs)]
+                aws = [[aws[b][n][:, :-1] if eos_flags[b][n] else aws[b][n] for n in range(nbest)] for b in range(bs)]
 
-                        ys = torch.cat([beam['ys'], eouts.new_zeros((1, 1), dtype=torch.int64).fill_(idx)], dim=-1)
+        return nbest_hyps_idx, aws, scores
 
-                        new_hyps.append(
-                            {'hyp': beam['hyp'] + [idx],
-                             'ys': ys,
-                             'score': total_score,
-                             'score_att': total_scores_att[0, idx].item(),
-                             'score_cp': cp,
-                             'score_ctc': total_scores_ctc[k].item(),
-                             'score_lm': total_scores_lm[k].item(),
-                             'dstates': {'dstate': (dstates['dstate'][0][:, j:j + 1],
-                                                    dstates['dstate'][1][:, j:j + 1])},
-                             'cv': cv[j:j + 1],
-                             'aws': beam['aws'] + [aw[j:j + 1]],
-                             'lmstate': new_lmstate,
-                             'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None,
-                             'ensmbl_dstate': ensmbl_dstate,
-                             'ensmbl_cv': ensmbl_cv,
-                             'ensmbl_aws': ensmbl_aws})
+    def _beam_search_batch(self, eouts, elens, params, lm, ctc_log_probs,
+                           refs_id, speakers, ensmbl_eouts, ensmbl_elens, ensmbl_decs,
+                           nbest, cache_states):
+        """Beam search over all utterances in a mini-batch at once.
 
-                # Local pruning
-                new_hyps_sorted = sorted(new_hyps, key=lambda x: x['score'], reverse=True)[:beam_width]
+        Hypotheses are laid out in `[B * beam_width]` slots, where the k-th slot of
+        the b-th utterance is `b * beam_width + k`. Slots without any active
+        hypothesis are kept as dummy entries and never selected.
 
-                # Remove complete hypotheses
-                new_hyps, end_hyps, is_finish = helper.remove_complete_hyp(
-                    new_hyps_sorted, end_hyps)
-                hyps = new_hyps[:]
-                if is_finish:
-                    break
+        Args:
+            eouts (FloatTensor): `[B, T, enc_n_units]`
+            elens (IntTensor): `[B]`
+            params (dict): hyperparameters for decoding
+            lm: firsh path LM
+            ctc_log_probs (FloatTensor): `[B, T, vocab]`
+            refs_id (list): reference list
+            speakers (list): speaker list
+            ensmbl_eouts (list): list of FloatTensor
+            ensmbl_elens (list) list of list
+            ensmbl_decs (list): list of torch.nn.Module
+            nbest (int): number of N-best list
+            cache_states (bool): cache TransformerLM/TransformerXL states for fast decoding
+        Returns:
+            end_hyps (list): length `B`, each of which contains a list of hypotheses
 
-            # Global pruning
-            if len(end_hyps) == 0:
-                end_hyps = hyps[:]
-            elif len(end_hyps) < nbest and nbest > 1:
-                end_hyps.extend(hyps[:nbest - len(end_hyps)])
+        """
+        bs = eouts.size(0)
+        n_models = len(ensmbl_decs) + 1
 
-            # forward second path LM rescoring
-            if lm_second is not None:
-                self.lm_rescoring(end_hyps, lm_second, lm_weight_second, tag='second')
+        beam_width = params['recog_beam_width']
+        ctc_weight = params['recog_ctc_weight']
+        max_len_ratio = params['recog_max_len_ratio']
+        min_len_ratio = params['recog_min_len_ratio']
+        lp_weight = params['recog_length_penalty']
+        cp_weight = params['recog_coverage_penalty']
+        cp_threshold = params['recog_coverage_threshold']
+        length_norm = params['recog_length_norm']
+        lm_weight = params['recog_lm_weight']
+        gnmt_decoding = params['recog_gnmt_decoding']
+        eos_threshold = params['recog_eos_threshold']
+        asr_state_CO = params['recog_asr_state_carry_over']
+        lm_state_CO = params['recog_lm_state_carry_over']
+        softmax_smoothing = params['recog_softmax_smoothing']
 
-            # backward secodn path LM rescoring
-            if lm_second_bwd is not None:
-                self.lm_rescoring(end_hyps, lm_second_bwd, lm_weight_second_bwd, tag='second_bwd')
+        trfm_lm = isinstance(lm, TransformerLM) or isinstance(lm, TransformerXL)
+        n_hyps = bs * beam_width
 
-            # Sort by score
-            end_hyps = sorted(end_hyps, key=lambda x: x['score'], reverse=True)
+        # NOTE: encoder outputs are not copied for each slot. The attention layer
+        # projects them once and broadcasts them to all slots of the same utterance.
+        eouts = eouts[:, :int(elens.max())]  # `[B, T, enc_n_units]`
+        src_mask = make_pad_mask(elens.to(self.device)).unsqueeze(1)  # `[B, 1, T]`
 
-            if idx2token is not None:
-                if utt_ids is not None:
-                    logger.info('Utt-id: %s' % utt_ids[b])
-                assert self.vocab == idx2token.vocab
-                logger.info('=' * 200)
-                for k in range(len(end_hyps)):
-                    if refs_id is not None:
-                        logger.info('Ref: %s' % idx2token(refs_id[b]))
-                    logger.info('Hyp: %s' % idx2token(
-                        end_hyps[k]['hyp'][1:][::-1] if self.bwd else end_hyps[k]['hyp'][1:]))
-                    logger.info('log prob (hyp): %.7f' % end_hyps[k]['score'])
-                    logger.info('log prob (hyp, att): %.7f' % (end_hyps[k]['score_att'] * (1 - ctc_weight)))
-                    logger.info('log prob (hyp, cp): %.7f' % (end_hyps[k]['score_cp'] * cp_weight))
-                    if ctc_prefix_scorer is not None:
-                        logger.info('log prob (hyp, ctc): %.7f' % (end_hyps[k]['score_ctc'] * ctc_weight))
-                    if lm is not None:
-                        logger.info('log prob (hyp, first-path lm): %.7f' % (end_hyps[k]['score_lm'] * lm_weight))
-                    if lm_second is not None:
-                        logger.info('log prob (hyp, second-path lm): %.7f' %
-                                    (end_hyps[k]['score_lm_second'] * lm_weight_second))
-                    if lm_second_bwd is not None:
-                        logger.info('log prob (hyp, second-path lm, reverse): %.7f' %
-                                    (end_hyps[k]['score_lm_second_rev'] * lm_weight_second_bwd))
-                    logger.info('-' * 50)
+        # Initialization
+        self.score.reset()
+        dstates = self.zero_state(n_hyps)
+        cv = eouts.new_zeros(n_hyps, 1, self.enc_n_units)
+        aw = None
+        lmstate = None
+        ys = eouts.new_zeros((n_hyps, 1), dtype=torch.int64).fill_(self.eos)  # for Transformer(XL) LM
+
+        # Ensemble initialization
+        ensmbl_dstates, ensmbl_cv, ensmbl_aw, ensmbl_mask = [], [], [], []
+        for i_e, dec in enumerate(ensmbl_decs):
+            dec.score.reset()
+            ensmbl_eouts[i_e] = ensmbl_eouts[i_e][:, :int(ensmbl_elens[i_e].max())]
+            ensmbl_mask += [make_pad_mask(ensmbl_elens[i_e].to(self.device)).unsqueeze(1)]
+            ensmbl_dstates += [dec.zero_state(n_hyps)]
+            ensmbl_cv += [eouts.new_zeros(n_hyps, 1, dec.enc_n_units)]
+            ensmbl_aw += [None]
+
+        if speakers is not None:
+            for b in range(bs):
+                if speakers[b] == self.prev_spk:
+                    # NOTE: bs == 1 here
+                    if asr_state_CO:
+                        hxs, cxs = self.dstates_final['dstate']
+                        dstates = {'dstate': (hxs.repeat([1, n_hyps, 1]),
+                                              cxs.repeat([1, n_hyps, 1]) if self.rnn_type == 'lstm' else None)}
+                    if lm_state_CO:
+                        # NOTE: Transformer LMs continue from keys/values of the previous utterance
+                        lmstate = reorder_lmstate(self.lmstate_final,
+                                                  eouts.new_zeros(n_hyps, dtype=torch.int64))
+                else:
+                    self.dstates_final = None  # reset
+                    self.lmstate_final = None  # reset
+                self.prev_spk = speakers[b]
 
-            # N-best list
-            if self.bwd:
-                # Reverse the order
-                nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:][::-1]) for n in range(nbest)]]
-                aws += [[tensor2np(torch.cat(end_hyps[n]['aws'][1:][::-1], dim=2).squeeze(0)) for n in range(nbest)]]
+        # For joint CTC-Attention decoding
+        ctc_prefix_scorer = None
+        if ctc_log_probs is not None:
+            ctc_prefix_scorer = BatchCTCPrefixScore(ctc_log_probs, elens, self.blank, self.eos,
+                                                    beam_width, backward=self.bwd)
+            ctc_state = ctc_prefix_scorer.initial_state()
+
+        # Only the first slot of each utterance is active at the beginning
+        alive = [k % beam_width == 0 for k in range(n_hyps)]
+        hyps = [[self.eos] for _ in range(n_hyps)]
+        aws_hist = [[None] for _ in range(n_hyps)]
+        score_att = eouts.new_zeros(n_hyps)
+        score_lm = eouts.new_zeros(n_hyps)
+        score_cp = eouts.new_zeros(n_hyps)
+
+        y = eouts.new_zeros((n_hyps, 1), dtype=torch.int64).fill_(
+            refs_id[0][0] if self.replace_sos else self.eos)
+        ymax = [math.ceil(int(elens[b]) * max_len_ratio) for b in range(bs)]
+        min_lens = (elens.float() * min_len_ratio).repeat_interleave(beam_width).to(self.device)
+        end_hyps = [[] for _ in range(bs)]
+        is_finish = [False] * bs
+        for i in range(max(ymax)):
+            # Update LM states for LM fusion
+            lmout, scores_lm = None, None
+            if lm is not None or self.lm is not None:
+                y_lm = ys if trfm_lm else y
+                if self.lm is not None:  # cold/deep fusion
+                    lmout, lmstate, scores_lm = self.lm.predict(y_lm, lmstate)
+                elif lm is not None:  # shallow fusion
+                    lmout, lmstate, scores_lm = lm.predict(y_lm, lmstate,
+                                                           cache=lmstate if cache_states or lm_state_CO else None)
+
+            # for the main model
+            dstates, cv, aw, attn_v, _, _ = self.decode_step(
+                eouts, dstates, cv, self.dropout_emb(self.embed(y)), src_mask, aw, lmout)
+            probs = torch.softmax(self.output(attn_v).squeeze(1) * softmax_smoothing, dim=1)
+
+            # for the ensemble
+            for i_e, dec in enumerate(ensmbl_decs):
+                ensmbl_dstates[i_e], ensmbl_cv[i_e], ensmbl_aw[i_e], attn_v_e, _, _ = dec.decode_step(
+                    ensmbl_eouts[i_e], ensmbl_dstates[i_e], ensmbl_cv[i_e],
+                    dec.dropout_emb(dec.embed(y)), ensmbl_mask[i_e], ensmbl_aw[i_e], lmout)
+                probs += torch.softmax(dec.output(attn_v_e).squeeze(1), dim=1)
+                # NOTE: sum in the probability scale (not log-scale)
+
+            # Ensemble
+            scores_att = torch.log(probs / n_models)  # `[B * beam, vocab]`
+
+            # Attention scores
+            total_scores_att = score_att.unsqueeze(1) + scores_att
+            total_scores = total_scores_att * (1 - ctc_weight)
+
+            # Add LM score <after> top-K selection
+            total_scores_topk, topk_ids = torch.topk(
+                total_scores, k=beam_width, dim=1, largest=True, sorted=True)  # `[B * beam, beam]`
+            if lm is not None:
+                total_scores_lm = score_lm.unsqueeze(1) + scores_lm[:, -1].gather(1, topk_ids)
+                total_scores_topk += total_scores_lm * lm_weight
             else:
-                nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:]) for n in range(nbest)]]
-                aws += [[tensor2np(torch.cat(end_hyps[n]['aws'][1:], dim=2).squeeze(0)) for n in range(nbest)]]
-            if length_norm:
-                scores += [[end_hyps[n]['score_att'] / len(end_hyps[n]['hyp'][1:]) for n in range(nbest)]]
+                total_scores_lm = eouts.new_zeros(n_hyps, beam_width)
+
+            # Add length penalty
+            # NOTE: all active hypotheses have the same length (i) here
+            if lp_weight > 0:
+                if gnmt_decoding:
+                    lp = math.pow(6 + i, lp_weight) / math.pow(6, lp_weight)
+                    total_scores_topk /= lp
+                else:
+                    total_scores_topk += (i + 1) * lp_weight
+
+            # Add coverage penalty
+            # NOTE: accumulated over steps instead of being recomputed from the whole history
+            if cp_weight > 0:
+                aw_h0 = aw[:, 0, 0]  # `[B * beam, T]`
+                if gnmt_decoding:
+                    cp_step = torch.log(aw_h0.sum(-1))
+                    cp_step = torch.where(cp_step < 0, cp_step, cp_step.new_zeros(cp_step.size()))
+                    # TODO(hirofumi): mask by elens[b]
+                    cp = score_cp + cp_step
+                else:
+                    if cp_threshold == 0:
+                        cp_step = aw_h0.sum(-1) / self.score.n_heads
+                    else:
+                        cp_step = torch.where(aw_h0 > cp_threshold, aw_h0,
+                                              aw_h0.new_zeros(aw_h0.size())).sum(-1) / self.score.n_heads
+                    cp = score_cp + cp_step
+                total_scores_topk += cp.unsqueeze(1) * cp_weight
             else:
-                scores += [[end_hyps[n]['score_att'] for n in range(nbest)]]
+                cp = eouts.new_zeros(n_hyps)
 
-            # Check <eos>
-            eos_flags.append([(end_hyps[n]['hyp'][-1] == self.eos) for n in range(nbest)])
-
-        # Exclude <eos> (<sos> in case of the backward decoder)
-        if exclude_eos:
-            if self.bwd:
-                nbest_hyps_idx = [[nbest_hyps_idx[b][n][1:] if eos_flags[b][n]
-                                   else nbest_hyps_idx[b][n] for n in range(nbest)] for b in range(bs)]
-                aws = [[aws[b][n][:, 1:] if eos_flags[b][n] else aws[b][n] for n in range(nbest)] for b in range(bs)]
+            # Add CTC score
+            if ctc_prefix_scorer is not None:
+                total_scores_ctc, new_ctc_states = ctc_prefix_scorer(i, y[:, 0], ctc_state, topk_ids)
+                total_scores_topk += total_scores_ctc * ctc_weight
             else:
-                nbest_hyps_idx = [[nbest_hyps_idx[b][n][:-1] if eos_flags[b][n]
-                                   else nbest_hyps_idx[b][n] for n in range(nbest)] for b in range(bs)]
-                aws = [[aws[b][n][:, :-1] if eos_flags[b][n] else aws[b][n] for n in range(nbest)] for b in range(bs)]
+                total_scores_ctc = eouts.new_zeros(n_hyps, beam_width)
 
-        # Store ASR/LM state
-        self.dstates_final = end_hyps[0]['dstates']
-        if isinstance(lm, RNNLM):
-            self.lmstate_final = end_hyps[0]['lmstate']
-        elif trfm_lm:
-            if isinstance(lm, TransformerXL):
-                self.lmmemory = lm.update_memory(self.lmmemory, end_hyps[0]['lmstate'])
-                logging.info('Memory: %d' % self.lmmemory[0].size(1))
-            else:
-                ys = end_hyps[0]['ys']
-                # Exclude the last state corresponding to <eos>
-                if ys[0, -1].item() == self.eos:
-                    ys = ys[:, :-1]
-                ys = ys[:, -lm.mem_len:]  # Truncate by BPTT length
-            self.lmstate_final = ys
+            if length_norm:
+                total_scores_topk /= (i + 1)
+
+            # Exclude inactive slots, short hypotheses and <eos> below the threshold
+            is_eos = topk_ids == self.eos
+            scores_att_no_eos = scores_att.clone()
+            scores_att_no_eos[:, self.eos] = float('-inf')
+            max_score_no_eos = scores_att_no_eos.max(1)[0]
+            eos_rejected = (i < min_lens) | (scores_att[:, self.eos] <= eos_threshold * max_score_no_eos)
+            valid = ~(is_eos & eos_rejected.unsqueeze(1))
+            valid &= torch.tensor(alive, device=self.device).unsqueeze(1)
+
+            # Local pruning per utterance
+            total_scores_topk = total_scores_topk.masked_fill(~valid, float('-inf'))
+            best_scores, best_ids = torch.topk(
+                total_scores_topk.view(bs, beam_width * beam_width), k=beam_width,
+                dim=1, largest=True, sorted=True)
+            best_scores = tensor2np(best_scores)
+            best_ids = tensor2np(best_ids)
+            topk_ids_np = tensor2np(topk_ids)
+
+            parent_ids = list(range(n_hyps))
+            cand_ids = [0] * n_hyps
+            new_alive = [False] * n_hyps
+            new_y = [self.eos] * n_hyps
+            new_hyps = hyps[:]
+            new_aws_hist = aws_hist[:]
+            for b in range(bs):
+                if is_finish[b]:
+                    continue
+                new_hyps_b = []
+                for r in range(beam_width):
+                    if np.isneginf(best_scores[b, r]):
+                        break
+                    j = b * beam_width + best_ids[b, r] // beam_width
+                    k = best_ids[b, r] % beam_width
+                    idx = topk_ids_np[j, k]
+                    if idx == self.eos:
+                        # Remove complete hypotheses
+                        end_hyps[b] += [self._make_hyp(
+                            j, k, idx, best_scores[b, r], hyps, aws_hist, ys, dstates, aw, lmstate,
+                            total_scores_att, total_scores_lm, total_scores_ctc, cp)]
+                    else:
+                        new_hyps_b += [(j, k, idx, best_scores[b, r])]
+
+                if len(end_hyps[b]) >= beam_width:
+                    end_hyps[b] = end_hyps[b][:beam_width]
+                    is_finish[b] = True
+                elif len(new_hyps_b) == 0 or i == ymax[b] - 1:
+                    # Global pruning
+                    if len(end_hyps[b]) == 0:
+                        n_rest = len(new_hyps_b)
+                    elif len(end_hyps[b]) < nbest and nbest > 1:
+                        n_rest = nbest - len(end_hyps[b])
+                    else:
+                        n_rest = 0
+                    end_hyps[b] += [self._make_hyp(
+                        j, k, idx, score, hyps, aws_hist, ys, dstates, aw, lmstate,
+                        total_scores_att, total_scores_lm, total_scores_ctc, cp)
+                        for (j, k, idx, score) in new_hyps_b[:n_rest]]
+                    is_finish[b] = True
+                if is_finish[b]:
+                    continue
+
+                for r, (j, k, idx, _) in enumerate(new_hyps_b):
+                    slot = b * beam_width + r
+                    parent_ids[slot] = j
+                    cand_ids[slot] = k
+                    new_alive[slot] = True
+                    new_y[slot] = int(idx)
+                    new_hyps[slot] = hyps[j] + [int(idx)]
+                    new_aws_hist[slot] = aws_hist[j] + [aw[j:j + 1]]
+
+            if all(is_finish):
+                break
 
-        return nbest_hyps_idx, aws, scores
+            # Reorder states by parent hypotheses
+            parent_ids = torch.tensor(parent_ids, dtype=torch.int64, device=self.device)
+            cand_ids = torch.tensor(cand_ids, dtype=torch.int64, device=self.device)
+            y = torch.tensor(new_y, dtype=torch.int64, device=self.device).unsqueeze(1)
+            alive = new_alive
+            hyps = new_hyps
+            aws_hist = new_aws_hist
+            ys = torch.cat([ys.index_select(0, parent_ids), y], dim=1)
+            score_att = total_scores_att[parent_ids, y[:, 0]]
+            score_lm = total_scores_lm[parent_ids, cand_ids]
+            score_cp = cp.index_select(0, parent_ids)
+            dstates = self._reorder_dstates(dstates, parent_ids)
+            cv = cv.index_select(0, parent_ids)
+            aw = aw.index_select(0, parent_ids)
+            lmstate = reorder_lmstate(lmstate, parent_ids)
+            if ctc_prefix_scorer is not None:
+                ctc_state = ctc_prefix_scorer.select_state(new_ctc_states, parent_ids, cand_ids)
+            if isinstance(self.score, GMMAttention):
+                self.score.myu = self.score.myu.index_select(0, parent_ids)
+            for i_e, dec in enumerate(ensmbl_decs):
+                ensmbl_dstates[i_e] = dec._reorder_dstates(ensmbl_dstates[i_e], parent_ids)
+                ensmbl_cv[i_e] = ensmbl_cv[i_e].index_select(0, parent_ids)
+                ensmbl_aw[i_e] = ensmbl_aw[i_e].index_select(0, parent_ids)
+
+        return end_hyps
+
+    def _make_hyp(self, j, k, idx, score, hyps, aws_hist, ys, dstates, aw, lmstate,
+                  total_scores_att, total_scores_lm, total_scores_ctc, cp):
+        """Make a hypothesis extended from the j-th slot with the k-th candidate token idx."""
+        hxs, cxs = dstates['dstate']
+        return {'hyp': hyps[j] + [int(idx)],
+                'score': float(score),
+                'score_att': total_scores_att[j, idx].item(),
+                'score_cp': cp[j].item(),
+                'score_ctc': total_scores_ctc[j, k].item(),
+                'score_lm': total_scores_lm[j, k].item(),
+                'dstates': {'dstate': (hxs[:, j:j + 1], cxs[:, j:j + 1] if self.rnn_type == 'lstm' else None)},
+                'aws': aws_hist[j] + [aw[j:j + 1]],
+                'lmstate': reorder_lmstate(lmstate, ys.new_zeros(1).fill_(j))}
+
+    def _reorder_dstates(self, dstates, ids):
+        """Reorder decoder states along the hypothesis dimension.
+
+        Args:
+            dstates (dict):
+                dstate (tuple): A tuple of (hxs, cxs)
+            ids (LongTensor): `[n_hyps_new]`, indices of parent hypotheses
+        Returns:
+            new_dstates (dict):
+                dstate (tuple): A tuple of (hxs, cxs)
+
+        """
+        hxs, cxs = dstates['dstate']
+        return {'dstate': (hxs.index_select(1, ids),
+                           cxs.index_select(1, ids) if self.rnn_type == 'lstm' else None)}
 
     def beam_search_chunk_sync(self, eouts_c, params, idx2token,
                                lm=None, ctc_log_probs=None,
                                hyps=False, state_carry_over=False, ignore_eos=False):
         assert eouts_c.size(0) == 1
+        end_hyps, hyps, caches = self.beam_search_chunk_sync_batch(
+            eouts_c, params, idx2token, lm, ctc_log_probs,
+            hyps=[hyps], caches=[self.get_cache()],
+            state_carry_over=state_carry_over, ignore_eos=ignore_eos)
+        self.set_cache(caches[0])
+        return end_hyps[0], hyps[0], None
+
+    def beam_search_chunk_sync_batch(self, eouts_c, params, idx2token,
+                                     lm=None, ctc_log_probs=None, hyps=None, caches=None,
+                                     state_carry_over=False, ignore_eos=False):
+        """Chunk-synchronous beam search over the current chunks of multiple streams.
+
+        Hypotheses of all streams are decoded in a single batch at every output step.
+        The hypotheses of each stream are padded to the same number so that
+        encoder outputs of each stream are shared by its hypotheses in MoChA.
+
+        Args:
+            eouts_c (FloatTensor): `[B, T, enc_units]`
+            params (dict): decoding hyperparameters
+            idx2token (): converter from index to token
+            lm (torch.nn.module): firsh-pass LM
+            ctc_log_probs (FloatTensor): `[B, T, vocab]`
+            hyps (list): A list of length `[B]`, which contains active hypotheses of
+                each stream carried over from the previous chunk (None for the first chunk)
+            caches (list): A list of length `[B]`, which contains decoder states of
+                each stream returned by get_cache()
+            state_carry_over (bool): carry over ASR/LM states from the previous utterance
+            ignore_eos (bool): do not emit <eos> (for unidirectional encoder)
+        Returns:
+            end_hyps (list): A list of length `[B]`, which contains ended hypotheses of each stream
+            hyps (list): A list of length `[B]`, which contains active hypotheses of each stream
+            caches (list): A list of length `[B]`, which contains updated decoder states of each stream
+
+        """
         assert self.attn_type == 'mocha'
+        bs, tmax = eouts_c.size()[:2]
 
         beam_width = params['recog_beam_width']
-        # beam_width_second = params['recog_beam_width']
         ctc_weight = params['recog_ctc_weight']
         max_len_ratio = params['recog_max_len_ratio']
         lp_weight = params['recog_length_penalty']
@@ -1406,198 +1490,228 @@ class RNNDecoder(DecoderBase):
             assert lm_weight > 0
             lm.eval()
 
-        # Initialization per utterance
-        # self.score.reset()
-        dstates = self.zero_state(1)
-        lmstate = None
-        ctc_state = None
+        helper = BeamSearch(beam_width, self.eos, ctc_weight, self.device)
 
-        # For joint CTC-Attention decoding
-        self.ctc_prefix_scorer = None
-        if ctc_log_probs is not None:
-            assert ctc_weight > 0
-            ctc_log_probs = tensor2np(ctc_log_probs)
-            if hyps is None:
-                # first chunk
-                self.ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[0], self.blank, self.eos)
+        hyps = list(hyps)
+        caches = [dict(cache) for cache in caches]
+        for b in range(bs):
+            # For joint CTC-Attention decoding
+            ctc_state = None
+            if ctc_log_probs is not None:
+                assert ctc_weight > 0
+                if hyps[b] is None:
+                    # first chunk
+                    caches[b]['ctc_prefix_scorer'] = CTCPrefixScore(
+                        tensor2np(ctc_log_probs[b]), self.blank, self.eos)
+                else:
+                    caches[b]['ctc_prefix_scorer'].register_new_chunk(tensor2np(ctc_log_probs[b]))
+                ctc_state = caches[b]['ctc_prefix_scorer'].initial_state()
             else:
-                self.ctc_prefix_scorer.register_new_chunk(ctc_log_probs[0])
-            ctc_state = self.ctc_prefix_scorer.initial_state()
-        # TODO: add truncated version
-
-        if state_carry_over:
-            dstates = self.dstates_final
-            if isinstance(lm, RNNLM):
-                lmstate = self.lmstate_final
-
-        helper = BeamSearch(beam_width, self.eos, ctc_weight, self.device)
+                caches[b]['ctc_prefix_scorer'] = None
+
+            if hyps[b] is None:
+                # Initialization per utterance
+                dstates = self.zero_state(1)
+                lmstate = None
+                if state_carry_over:
+                    dstates = caches[b]['dstates_final']
+                    if isinstance(lm, RNNLM):
+                        lmstate = caches[b]['lmstate_final']
+                caches[b]['n_frames'] = 0
+                caches[b]['chunk_size'] = tmax
+                hyps[b] = [{'hyp': [self.eos],
+                            'score': 0.,
+                            'score_att': 0.,
+                            'score_ctc': 0.,
+                            'score_lm': 0.,
+                            'dstates': dstates,
+                            'cv': eouts_c.new_zeros(1, 1, self.enc_n_units),
+                            'aws': [None],
+                            'lmstate': lmstate,
+                            'ctc_state': ctc_state,
+                            'no_boundary': False}]
+            else:
+                for h in hyps[b]:
+                    h['no_boundary'] = False
 
-        end_hyps = []
-        hyps_nobd = []
-        if hyps is None:
-            self.n_frames = 0
-            self.chunk_size = eouts_c.size(1)
-            hyps = [{'hyp': [self.eos],
-                     'score': 0.,
-                     'score_att': 0.,
-                     'score_ctc': 0.,
-                     'score_lm': 0.,
-                     'dstates': dstates,
-                     'cv': eouts_c.new_zeros(1, 1, self.enc_n_units),
-                     'aws': [None],
-                     'lmstate': lmstate,
-                     'ctc_state': ctc_state,
-                     'no_boundary': False}]
-        else:
-            for h in hyps:
-                h['no_boundary'] = False
+        # NOTE: tails of the previous chunks must have the same length among streams
+        key_prev_tails = [cache.get('key_prev_tail') for cache in caches]
 
-        ymax = math.ceil(eouts_c.size(1) * max_len_ratio)
+        end_hyps = [[] for _ in range(bs)]
+        hyps_nobd = [[] for _ in range(bs)]
+        is_active = [True] * bs
+        active_prev = None
+        ymax = math.ceil(tmax * max_len_ratio)
         for i in range(ymax):
-            # finish if no additional decision boundary is found in the current chunk for all candidates
-            if len(hyps) == 0:
-                break
-            if i > 0 and sum([cand['no_boundary'] for cand in hyps]) == len(hyps):
-                break
-
-            # ignore hypotheses with no boundary from batched hypotheses
-            new_hyps = []
-            hyps_filtered = []
-            for j, beam in enumerate(hyps):
-                # no decision boundary found in the current chunk
-                if beam['no_boundary']:
-                    new_hyps.append(beam.copy())
-                else:
-                    hyps_filtered.append(beam.copy())
-            if len(hyps_filtered) == 0:
+            new_hyps = [[] for _ in range(bs)]
+            for b in range(bs):
+                if not is_active[b]:
+                    continue
+                # finish if no additional decision boundary is found in the current chunk for all candidates
+                if len(hyps[b]) == 0 or (i > 0 and sum([cand['no_boundary'] for cand in hyps[b]]) == len(hyps[b])):
+                    is_active[b] = False
+                    continue
+
+                # ignore hypotheses with no boundary from batched hypotheses
+                hyps_filtered = []
+                for beam in hyps[b]:
+                    # no decision boundary found in the current chunk
+                    if beam['no_boundary']:
+                        new_hyps[b].append(beam.copy())
+                    else:
+                        hyps_filtered.append(beam.copy())
+                if len(hyps_filtered) == 0:
+                    is_active[b] = False
+                    continue
+                hyps[b] = hyps_filtered[:]
+
+            active = [b for b in range(bs) if is_active[b]]
+            if len(active) == 0:
                 break
-            hyps = hyps_filtered[:]
 
             # batchfy all hypotheses for batch decoding
-            y = eouts_c.new_zeros((len(hyps), 1), dtype=torch.int64)
-            for j, beam in enumerate(hyps):
+            # NOTE: hypotheses of each stream are padded with its last one
+            n_hyps = max(len(hyps[b]) for b in active)
+            batch_hyps = []
+            for b in active:
+                batch_hyps += hyps[b] + [hyps[b][-1]] * (n_hyps - len(hyps[b]))
+            y = eouts_c.new_zeros((len(batch_hyps), 1), dtype=torch.int64)
+            for j, beam in enumerate(batch_hyps):
                 y[j, 0] = beam['hyp'][-1]
-            cv = torch.cat([beam['cv'] for beam in hyps], dim=0)
-            aw = torch.cat([beam['aws'][-1] for beam in hyps], dim=0) if i > 0 else None
-            hxs = torch.cat([beam['dstates']['dstate'][0] for beam in hyps], dim=1)
+            cv = torch.cat([beam['cv'] for beam in batch_hyps], dim=0)
+            aw = torch.cat([beam['aws'][-1] for beam in batch_hyps], dim=0) if i > 0 else None
+            hxs = torch.cat([beam['dstates']['dstate'][0] for beam in batch_hyps], dim=1)
+            cxs = None
             if self.rnn_type == 'lstm':
-                cxs = torch.cat([beam['dstates']['dstate'][1] for beam in hyps], dim=1)
+                cxs = torch.cat([beam['dstates']['dstate'][1] for beam in batch_hyps], dim=1)
             dstates = {'dstate': (hxs, cxs)}
 
             # Update LM states for LM fusion
             lmout, lmstate, scores_lm = helper.update_rnnlm_state_batch(
-                self.lm if self.lm is not None else lm, hyps, y)
+                self.lm if self.lm is not None else lm, batch_hyps, y)
 
+            # NOTE: encoder-side features of the current chunk are computed at the first step
+            # and broadcast to all hypotheses of each stream
+            self.score.key_prev_tail = None
+            if key_prev_tails[active[0]] is not None:
+                self.score.key_prev_tail = torch.cat([key_prev_tails[b] for b in active], dim=0)
             dstates, cv, aw, attn_v, _, _ = self.decode_step(
-                eouts_c[0:1].repeat([cv.size(0), 1, 1]),
-                dstates, cv, self.dropout_emb(self.embed(y)), None, aw, lmout, cache=False)
+                eouts_c[active], dstates, cv, self.dropout_emb(self.embed(y)), None, aw, lmout,
+                cache=i > 0 and active == active_prev)
+            active_prev = active
             scores_att = torch.log_softmax(self.output(attn_v).squeeze(1), dim=1)
 
-            for j, beam in enumerate(hyps):
-                # no decision boundary found in the current chunk for j-th utterance
-                no_boundary = aw[j].sum().item() == 0
-                if no_boundary:
-                    beam['aws'][-1] = eouts_c.new_zeros(eouts_c.size(0), 1, 1, eouts_c.size(1))
-                    # NOTE: the case where the first token in the current chunk is <eos>
-                    beam['no_boundary'] = True
-                    new_hyps.append(beam.copy())  # this is important to remove repeated hyps
-
-                # Attention scores
-                total_scores_att = beam['score_att'] + scores_att[j:j + 1]
-                total_scores = total_scores_att * (1 - ctc_weight)
-
-                # Add LM score <after> top-K selection
-                total_scores_topk, topk_ids = torch.topk(
-                    total_scores, k=beam_width, dim=1, largest=True, sorted=True)
-                if lm is not None:
-                    total_scores_lm = beam['score_lm'] + scores_lm[j, -1, topk_ids[0]]
-                    total_scores_topk += total_scores_lm * lm_weight
-                else:
-                    total_scores_lm = eouts_c.new_zeros(beam_width)
+            for pos, b in enumerate(active):
+                ctc_prefix_scorer = caches[b]['ctc_prefix_scorer']
+                for j, beam in enumerate(hyps[b]):
+                    jj = pos * n_hyps + j  # index in the batch
 
-                # Add length penalty
-                total_scores_topk += (len(beam['hyp'][1:]) + 1) * lp_weight
+                    # no decision boundary found in the current chunk for j-th utterance
+                    no_boundary = aw[jj].sum().item() == 0
+                    if no_boundary:
+                        beam['aws'][-1] = eouts_c.new_zeros(1, 1, 1, tmax)
+                        # NOTE: the case where the first token in the current chunk is <eos>
+                        beam['no_boundary'] = True
+                        new_hyps[b].append(beam.copy())  # this is important to remove repeated hyps
 
-                # Add CTC score
-                new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
-                    beam['hyp'], topk_ids, beam['ctc_state'],
-                    total_scores_topk, self.ctc_prefix_scorer, new_chunk=(i == 0))
+                    # Attention scores
+                    total_scores_att = beam['score_att'] + scores_att[jj:jj + 1]
+                    total_scores = total_scores_att * (1 - ctc_weight)
 
-                for k in range(beam_width):
-                    idx = topk_ids[0, k].item()
-                    if no_boundary and idx != self.eos:
-                        continue
-                    length_norm_factor = len(beam['hyp'][1:]) + 1 if length_norm else 1
-                    total_score = total_scores_topk[0, k].item() / length_norm_factor
+                    # Add LM score <after> top-K selection
+                    total_scores_topk, topk_ids = torch.topk(
+                        total_scores, k=beam_width, dim=1, largest=True, sorted=True)
+                    if lm is not None:
+                        total_scores_lm = beam['score_lm'] + scores_lm[jj, -1, topk_ids[0]]
+                        total_scores_topk += total_scores_lm * lm_weight
+                    else:
+                        total_scores_lm = eouts_c.new_zeros(beam_width)
 
-                    if idx == self.eos:
-                        if ignore_eos:
-                            # NOTE: for unidirectional encoder
-                            beam['aws'][-1] = eouts_c.new_zeros(eouts_c.size(0), 1, 1, eouts_c.size(1))
-                            beam['no_boundary'] = True
-                            new_hyps.append(beam.copy())
-                            continue
+                    # Add length penalty
+                    total_scores_topk += (len(beam['hyp'][1:]) + 1) * lp_weight
 
-                        # EOS threshold
-                        max_score_no_eos = scores_att[j, :idx].max(0)[0].item()
-                        max_score_no_eos = max(max_score_no_eos, scores_att[j, idx + 1:].max(0)[0].item())
-                        if scores_att[j, idx].item() <= eos_threshold * max_score_no_eos:
+                    # Add CTC score
+                    new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
+                        beam['hyp'], topk_ids, beam['ctc_state'],
+                        total_scores_topk, ctc_prefix_scorer, new_chunk=(i == 0))
+
+                    for k in range(beam_width):
+                        idx = topk_ids[0, k].item()
+                        if no_boundary and idx != self.eos:
                             continue
+                        length_norm_factor = len(beam['hyp'][1:]) + 1 if length_norm else 1
+                        total_score = total_scores_topk[0, k].item() / length_norm_factor
 
-                    new_hyps.append(
-                        {'hyp': beam['hyp'] + [idx],
-                         'score': total_score,
-                         'score_att': total_scores_att[0, idx].item(),
-                         'score_ctc': total_scores_ctc[k].item(),
-                         'score_lm': total_scores_lm[k].item(),
-                         'dstates': {'dstate': (dstates['dstate'][0][:, j:j + 1], dstates['dstate'][1][:, j:j + 1])},
-                         'cv': cv[j:j + 1],
-                         'aws': beam['aws'] + [aw[j:j + 1]],
-                         'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
-                                     'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
-                         'ctc_state': new_ctc_states[k] if self.ctc_prefix_scorer is not None else None,
-                         'no_boundary': no_boundary})
-
-            # Local pruning
-            new_hyps_sorted = sorted(new_hyps, key=lambda x: x['score'], reverse=True)
-            hyps_nobd += [hyp for hyp in new_hyps_sorted[beam_width:] if hyp['no_boundary']]
-
-            # Remove complete hypotheses
-            new_hyps, end_hyps, is_finish = helper.remove_complete_hyp(new_hyps_sorted[:beam_width], end_hyps)
-            hyps = new_hyps[:]
-            if is_finish:
-                break
+                        if idx == self.eos:
+                            if ignore_eos:
+                                # NOTE: for unidirectional encoder
+                                beam['aws'][-1] = eouts_c.new_zeros(1, 1, 1, tmax)
+                                beam['no_boundary'] = True
+                                new_hyps[b].append(beam.copy())
+                                continue
 
-        # Global pruning
-        hyps_nobd_sorted = sorted(hyps_nobd, key=lambda x: x['score'], reverse=True)
-        hyps = (hyps[:] + hyps_nobd_sorted)[:beam_width]
+                            # EOS threshold
+                            max_score_no_eos = scores_att[jj, :idx].max(0)[0].item()
+                            max_score_no_eos = max(max_score_no_eos, scores_att[jj, idx + 1:].max(0)[0].item())
+                            if scores_att[jj, idx].item() <= eos_threshold * max_score_no_eos:
+                                continue
 
-        # Sort by score
-        if len(end_hyps) > 0:
-            end_hyps = sorted(end_hyps, key=lambda x: x['score'], reverse=True)
+                        new_hyps[b].append(
+                            {'hyp': beam['hyp'] + [idx],
+                             'score': total_score,
+                             'score_att': total_scores_att[0, idx].item(),
+                             'score_ctc': total_scores_ctc[k].item(),
+                             'score_lm': total_scores_lm[k].item(),
+                             'dstates': {'dstate': (dstates['dstate'][0][:, jj:jj + 1],
+                                                    dstates['dstate'][1][:, jj:jj + 1]
+                                                    if self.rnn_type == 'lstm' else None)},
+                             'cv': cv[jj:jj + 1],
+                             'aws': beam['aws'] + [aw[jj:jj + 1]],
+                             'lmstate': {'hxs': lmstate['hxs'][:, jj:jj + 1],
+                                         'cxs': lmstate['cxs'][:, jj:jj + 1]} if lmstate is not None else None,
+                             'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None,
+                             'no_boundary': no_boundary})
 
-        merged_hyps = sorted(end_hyps + hyps, key=lambda x: x['score'], reverse=True)[:beam_width]
-        if idx2token is not None:
-            logger.info('=' * 200)
-            for k in range(len(merged_hyps)):
-                logger.info('Hyp: %s' % idx2token(merged_hyps[k]['hyp'][1:]))
-                logger.info('no boundary: %s' % merged_hyps[k]['no_boundary'])
-                logger.info('log prob (hyp): %.7f' % merged_hyps[k]['score'])
-                logger.info('log prob (hyp, att): %.7f' % (merged_hyps[k]['score_att'] * (1 - ctc_weight)))
-                if self.ctc_prefix_scorer is not None:
-                    logger.info('log prob (hyp, ctc): %.7f' % (merged_hyps[k]['score_ctc'] * ctc_weight))
-                if lm is not None:
-                    logger.info('log prob (hyp, first-path lm): %.7f' % (merged_hyps[k]['score_lm'] * lm_weight))
-                logger.info('-' * 50)
-
-        aws = None
-
-        # Store ASR/LM state
-        if len(end_hyps) > 0:
-            self.dstates_final = end_hyps[0]['dstates']
-            self.lmstate_final = end_hyps[0]['lmstate']
+                # Local pruning
+                new_hyps_sorted = sorted(new_hyps[b], key=lambda x: x['score'], reverse=True)
+                hyps_nobd[b] += [hyp for hyp in new_hyps_sorted[beam_width:] if hyp['no_boundary']]
+
+                # Remove complete hypotheses
+                hyps[b], end_hyps[b], is_finish = helper.remove_complete_hyp(
+                    new_hyps_sorted[:beam_width], end_hyps[b])
+                if is_finish:
+                    is_active[b] = False
+
+        for b in range(bs):
+            # Global pruning
+            hyps_nobd_sorted = sorted(hyps_nobd[b], key=lambda x: x['score'], reverse=True)
+            hyps[b] = (hyps[b][:] + hyps_nobd_sorted)[:beam_width]
+
+            # Sort by score
+            if len(end_hyps[b]) > 0:
+                end_hyps[b] = sorted(end_hyps[b], key=lambda x: x['score'], reverse=True)
+
+            merged_hyps = sorted(end_hyps[b] + hyps[b], key=lambda x: x['score'], reverse=True)[:beam_width]
+            if idx2token is not None:
+                logger.info('=' * 200)
+                for k in range(len(merged_hyps)):
+                    logger.info('Hyp: %s' % idx2token(merged_hyps[k]['hyp'][1:]))
+                    logger.info('no boundary: %s' % merged_hyps[k]['no_boundary'])
+                    logger.info('log prob (hyp): %.7f' % merged_hyps[k]['score'])
+                    logger.info('log prob (hyp, att): %.7f' % (merged_hyps[k]['score_att'] * (1 - ctc_weight)))
+                    if caches[b]['ctc_prefix_scorer'] is not None:
+                        logger.info('log prob (hyp, ctc): %.7f' % (merged_hyps[k]['score_ctc'] * ctc_weight))
+                    if lm is not None:
+                        logger.info('log prob (hyp, first-path lm): %.7f' % (merged_hyps[k]['score_lm'] * lm_weight))
+                    logger.info('-' * 50)
+
+            # Store ASR/LM state
+            if len(end_hyps[b]) > 0:
+                caches[b]['dstates_final'] = end_hyps[b][0]['dstates']
+                caches[b]['lmstate_final'] = end_hyps[b][0]['lmstate']
 
-        self.n_frames += eouts_c.size(1)
-        self.score.register_key_prev_tail(eouts_c)
+            caches[b]['n_frames'] += tmax
+            self.score.register_key_prev_tail(eouts_c[b:b + 1])
+            caches[b]['key_prev_tail'] = self.score.key_prev_tail
 
-        return end_hyps, hyps, aws
+        return end_hyps, hyps, caches
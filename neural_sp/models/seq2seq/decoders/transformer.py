@@ -17,13 +17,15 @@ import torch.nn as nn
 
 from neural_sp.models.criterion import cross_entropy_lsm
 from neural_sp.models.lm.rnnlm import RNNLM
+from neural_sp.models.lm.transformerlm import TransformerLM
+from neural_sp.models.lm.transformer_xl import TransformerXL
 from neural_sp.models.modules.initialization import init_like_transformer_xl
 from neural_sp.models.modules.positional_embedding import PositionalEncoding
 from neural_sp.models.modules.positional_embedding import XLPositionalEmbedding
 from neural_sp.models.modules.transformer import TransformerDecoderBlock
-from neural_sp.models.seq2seq.decoders.beam_search import BeamSearch
+from neural_sp.models.seq2seq.decoders.beam_search import reorder_lmstate
 from neural_sp.models.seq2seq.decoders.ctc import CTC
-from neural_sp.models.seq2seq.decoders.ctc import CTCPrefixScore
+from neural_sp.models.seq2seq.decoders.ctc import BatchCTCPrefixScore
 from neural_sp.models.seq2seq.decoders.decoder_base import DecoderBase
 from neural_sp.models.torch_utils import append_sos_eos
 from neural_sp.models.torch_utils import compute_accuracy
@@ -86,6 +88,7 @@ class TransformerDecoder(DecoderBase):
         latency_loss_weight (float): latency loss weight for MMA
         mocha_first_layer (int): first layer to enable source-target attention (start from idx:1)
         share_chunkwise_attention (bool): share chunkwise attention in the same layer of MMA
+        mocha_query_block_size (int): number of query steps to compute chunkwise attention at once in MMA
         external_lm (RNNLM): external RNNLM for LM fusion
         lm_fusion (str): type of LM fusion
 
@@ -105,7 +108,7 @@ class TransformerDecoder(DecoderBase):
                  mocha_no_denominator, mocha_1dconv,
                  mocha_quantity_loss_weight, mocha_head_divergence_loss_weight,
                  latency_metric, latency_loss_weight,
-                 mocha_first_layer, share_chunkwise_attention,
+                 mocha_first_layer, share_chunkwise_attention, mocha_query_block_size,
                  external_lm, lm_fusion):
 
         super(TransformerDecoder, self).__init__()
@@ -195,7 +198,8 @@ class TransformerDecoder(DecoderBase):
                 dropout_head=dropout_head,
                 lm_fusion=lm_fusion,
                 ffn_bottleneck_dim=ffn_bottleneck_dim,
-                share_chunkwise_attention=share_chunkwise_attention)) for lth in range(n_layers)])
+                share_chunkwise_attention=share_chunkwise_attention,
+                mocha_query_block_size=mocha_query_block_size)) for lth in range(n_layers)])
             self.norm_out = nn.LayerNorm(d_model, eps=layer_norm_eps)
             self.output = nn.Linear(d_model, self.vocab)
             if tie_embedding:
@@ -270,6 +274,9 @@ class TransformerDecoder(DecoderBase):
                            help='head divergence loss weight for MMA')
         group.add_argument('--share_chunkwise_attention', type=strtobool, default=False,
                            help='share chunkwise attention heads among monotonic attention heads in the same layer')
+        group.add_argument('--mocha_query_block_size', type=int, default=0,
+                           help='number of query steps to compute chunkwise attention at once during MMA training '
+                                'to bound memory. 0 means all steps.')
 
         return parser
 
@@ -634,6 +641,119 @@ class TransformerDecoder(DecoderBase):
 
         return hyps, aws
 
+    def init_cache(self, bs, max_len):
+        """Initialize decoder states for incremental decoding.
+
+        Args:
+            bs (int): number of hypotheses
+            max_len (int): maximum number of decoding steps (including <sos>)
+        Returns:
+            cache (list): length `n_layers`, each of which contains
+                - Transformer: dict (see MultiheadAttentionMechanism.init_kv_cache)
+                - TransformerXL: None, filled with outputs `[B, L, d_model]` of each layer
+
+        """
+        if self.memory_transformer:
+            return [None] * self.n_layers
+        return [layer.self_attn.init_kv_cache(bs, max_len) for layer in self.layers]
+
+    def reorder_cache(self, cache, ids):
+        """Reorder decoder states along the hypothesis dimension.
+
+        Key/value buffers are overwritten in-place so that they are not reallocated.
+
+        Args:
+            cache (list): see init_cache
+            ids (LongTensor): `[n_hyps]`, indices of parent hypotheses
+        Returns:
+            cache (list): see init_cache
+
+        """
+        if cache is None:
+            return None
+        for lth in range(len(cache)):
+            if isinstance(cache[lth], dict):
+                klen = cache[lth]['length']
+                for k in ['key', 'value']:
+                    cache[lth][k][:, :klen] = cache[lth][k][:, :klen].index_select(0, ids)
+            elif cache[lth] is not None:
+                cache[lth] = cache[lth].index_select(0, ids)
+        return cache
+
+    def reset_src_cache(self):
+        """Discard encoder-side features cached in the source-target attention layers."""
+        for layer in self.layers:
+            if layer.src_tgt_attention:
+                layer.src_attn.reset()
+
+    def decode_step(self, ys, eouts, src_mask, cache=None, xy_aws_prev=None, eps_wait=-1,
+                    cache_src=False):
+        """Compute logits for the next token of all hypotheses.
+
+        Args:
+            ys (LongTensor): `[B, L]`, all previous tokens including <sos>
+            eouts (FloatTensor): `[B_k, T, d_model]`, where `B = B_k * n_hyps`
+            src_mask (ByteTensor): `[B_k, 1, T]`
+            cache (list): see init_cache. If None, all positions are recomputed.
+            xy_aws_prev (FloatTensor): `[B, n_layers_src, H, 1, T]`
+            eps_wait (int): wait time delay for head-synchronous decoding in MMA
+            cache_src (bool): reuse encoder-side features projected at the first step.
+                reset_src_cache must be called before decoding new utterances.
+        Returns:
+            logits (FloatTensor): `[B, vocab]`
+            xy_aws (FloatTensor): `[B, n_layers_src, H, 1, T]`
+            cache (list): see init_cache
+
+        """
+        bs, ylen = ys.size()
+        lth_s = self.mocha_first_layer - 1
+        incremental = cache is not None and not self.memory_transformer
+
+        if incremental:
+            # only the newest position is fed to each layer
+            causal_mask = None
+            if '1dconv' in self.pe_type:
+                out = self.pos_enc(self.embed(ys))[:, -1:]
+            else:
+                out = self.pos_enc(self.embed(ys[:, -1:]), offset=ylen - 1)  # scaled + dropout
+        else:
+            causal_mask = eouts.new_ones(ylen, ylen).byte()
+            causal_mask = torch.tril(causal_mask, out=causal_mask).unsqueeze(0).repeat([bs, 1, 1])
+            out = self.pos_enc(self.embed(ys))  # scaled + dropout
+        # NOTE: only the last position is used as a query when the outputs are cached
+        qlen = 1 if cache is not None and cache[0] is not None else ylen
+        xy_mask = src_mask.repeat([1, qlen, 1])
+
+        pos_embs = None
+        if self.memory_transformer:
+            mems = self.init_memory()
+            pos_embs = self.pos_emb(ys, zero_center_offset=True)
+
+        new_cache = [None] * self.n_layers
+        xy_aws = []
+        for lth, layer in enumerate(self.layers):
+            aws_prev_l = xy_aws_prev[:, lth - lth_s] if lth >= lth_s and xy_aws_prev is not None else None
+            if incremental:
+                out = layer(out, causal_mask, eouts, xy_mask,
+                            xy_aws_prev=aws_prev_l, eps_wait=eps_wait, kv_cache=cache[lth],
+                            cache_src=cache_src)
+                new_cache[lth] = cache[lth]
+            elif self.memory_transformer:
+                out = layer(out, causal_mask, eouts, xy_mask,
+                            cache=cache[lth] if cache is not None else None,
+                            pos_embs=pos_embs, memory=mems[lth], u_bias=self.u_bias, v_bias=self.v_bias,
+                            cache_src=cache_src)
+                new_cache[lth] = out
+            else:
+                out = layer(out, causal_mask, eouts, xy_mask,
+                            xy_aws_prev=aws_prev_l, eps_wait=eps_wait, cache_src=cache_src)
+            if layer.xy_aws is not None:
+                xy_aws.append(layer.xy_aws[:, :, -1:])
+        logits = self.output(self.norm_out(out[:, -1]))
+        xy_aws = torch.stack(xy_aws, dim=1)  # `[B, n_layers_src, H, 1, T]`
+
+        return logits, xy_aws, new_cache if cache is not None else None
+
     def beam_search(self, eouts, elens, params, idx2token=None,
                     lm=None, lm_second=None, lm_second_bwd=None, ctc_log_probs=None,
                     nbest=1, exclude_eos=False,
@@ -649,8 +769,8 @@ class TransformerDecoder(DecoderBase):
             lm: firsh path LM
             lm_second: second path LM
             lm_second_bwd: secoding path backward LM
-            ctc_log_probs (FloatTensor):
-            nbest (int):
+            ctc_log_probs (FloatTensor): `[B, T, vocab]`
+            nbest (int): number of N-best list
             exclude_eos (bool): exclude <eos> from hypothesis
             refs_id (list): reference list
             utt_ids (list): utterance id list
@@ -661,27 +781,19 @@ class TransformerDecoder(DecoderBase):
             cache_states (bool): cache decoder states for fast decoding
         Returns:
             nbest_hyps_idx (list): length `B`, each of which contains list of N hypotheses
-            aws (list): length `B`, each of which contains arrays of size `[H, L, T]`
+            aws (list): length `B`, each of which contains arrays of size `[H * n_layers, L, T]`
             scores (list):
 
         """
-        bs, xmax, _ = eouts.size()
-        n_models = len(ensmbl_decs) + 1
+        bs, xmax = eouts.size()[:2]
 
         beam_width = params['recog_beam_width']
         assert 1 <= nbest <= beam_width
         ctc_weight = params['recog_ctc_weight']
-        max_len_ratio = params['recog_max_len_ratio']
-        min_len_ratio = params['recog_min_len_ratio']
-        lp_weight = params['recog_length_penalty']
-        length_norm = params['recog_length_norm']
         lm_weight = params['recog_lm_weight']
         lm_weight_second = params['recog_lm_second_weight']
         lm_weight_second_bwd = params['recog_lm_bwd_weight']
-        eos_threshold = params['recog_eos_threshold']
         lm_state_carry_over = params['recog_lm_state_carry_over']
-        softmax_smoothing = params['recog_softmax_smoothing']
-        eps_wait = params['recog_mma_delay_threshold']
 
         if lm is not None:
             assert lm_weight > 0
@@ -695,293 +807,107 @@ class TransformerDecoder(DecoderBase):
 
         if ctc_log_probs is not None:
             assert ctc_weight > 0
-            ctc_log_probs = tensor2np(ctc_log_probs)
+
+        # NOTE: all utterances are decoded at once unless LM states are
+        # carried over from the previous utterance, which requires decoding them one by one
+        if speakers is not None and lm_state_carry_over:
+            batch_ids_list = [[b] for b in range(bs)]
+        else:
+            batch_ids_list = [list(range(bs))]
 
         nbest_hyps_idx, aws, scores = [], [], []
         eos_flags = []
-        for b in range(bs):
-            # Initialization per utterance
-            lmstate = None
-            ys = eouts.new_zeros((1, 1), dtype=torch.int64).fill_(self.eos)
-
-            # For joint CTC-Attention decoding
-            ctc_prefix_scorer = None
-            if ctc_log_probs is not None:
-                if self.bwd:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b][::-1], self.blank, self.eos)
-                else:
-                    ctc_prefix_scorer = CTCPrefixScore(ctc_log_probs[b], self.blank, self.eos)
-
-            if speakers is not None:
-                if speakers[b] == self.prev_spk:
-                    if lm_state_carry_over and isinstance(lm, RNNLM):
-                        lmstate = self.lmstate_final
-                self.prev_spk = speakers[b]
-
-            helper = BeamSearch(beam_width, self.eos, ctc_weight, self.device)
-
-            end_hyps = []
-            hyps = [{'hyp': [self.eos],
-                     'ys': ys,
-                     'cache': None,
-                     'score': 0.,
-                     'score_att': 0.,
-                     'score_ctc': 0.,
-                     'score_lm': 0.,
-                     'aws': [None],
-                     'lmstate': lmstate,
-                     'ensmbl_cache': [[None] * dec.n_layers for dec in ensmbl_decs] if n_models > 1 else None,
-                     'ctc_state': ctc_prefix_scorer.initial_state() if ctc_prefix_scorer is not None else None,
-                     'streamable': True,
-                     'streaming_failed_point': 1000}]
-            streamable_global = True
-            ymax = math.ceil(elens[b] * max_len_ratio)
-            for i in range(ymax):
-                # batchfy all hypotheses for batch decoding
-                cache = [None] * self.n_layers
-                if cache_states and i > 0:
-                    for lth in range(self.n_layers):
-                        cache[lth] = torch.cat([beam['cache'][lth] for beam in hyps], dim=0)
-                ys = eouts.new_zeros((len(hyps), i + 1), dtype=torch.int64)
-                for j, beam in enumerate(hyps):
-                    ys[j, :] = beam['ys']
-                if i > 0:
-                    xy_aws_prev = torch.cat([beam['aws'][-1] for beam in hyps], dim=0)  # `[B, n_layers, H_ma, 1, klen]`
-                else:
-                    xy_aws_prev = None
-
-                # Update LM states for shallow fusion
-                y_lm = ys[:, -1:].clone()  # NOTE: this is important
-                _, lmstate, scores_lm = helper.update_rnnlm_state_batch(lm, hyps, y_lm)
-
-                # for the main model
-                causal_mask = eouts.new_ones(i + 1, i + 1).byte()
-                causal_mask = torch.tril(causal_mask, out=causal_mask).unsqueeze(0).repeat([ys.size(0), 1, 1])
-
-                out = self.pos_enc(self.embed(ys))  # scaled + dropout
-
-                mlen = 0  # TODO: fix later
-                if self.memory_transformer:
-                    mems = self.init_memory()
-                    pos_embs = self.pos_emb(ys, mlen=mlen, zero_center_offset=True)
-                    hidden_states = [out]
-
-                n_heads_total = 0
-                eouts_b = eouts[b:b + 1, :elens[b]].repeat([ys.size(0), 1, 1])
-                new_cache = [None] * self.n_layers
-                xy_aws_layers = []
-                lth_s = self.mocha_first_layer - 1
-                for lth, layer in enumerate(self.layers):
-                    if self.memory_transformer:
-                        out = layer(
-                            out, causal_mask, eouts_b, None,
-                            cache=cache[lth],
-                            pos_embs=pos_embs, memory=mems[lth], u_bias=self.u_bias, v_bias=self.v_bias)
-                        hidden_states.append(out)
-                    else:
-                        out = layer(
-                            out, causal_mask, eouts_b, None,
-                            cache=cache[lth],
-                            xy_aws_prev=xy_aws_prev[:, lth - lth_s] if lth >= lth_s and i > 0 else None,
-                            eps_wait=eps_wait)
-
-                    new_cache[lth] = out
-                    if layer.xy_aws is not None:
-                        xy_aws_layers.append(layer.xy_aws)
-                logits = self.output(self.norm_out(out))
-                probs = torch.softmax(logits[:, -1] * softmax_smoothing, dim=1)
-                xy_aws_layers = torch.stack(xy_aws_layers, dim=1)  # `[B, H, n_layers, L, T]`
-
-                # Ensemble initialization
-                ensmbl_cache = [[None] * dec.n_layers for dec in ensmbl_decs]
-                if n_models > 1 and cache_states and i > 0:
-                    for i_e, dec in enumerate(ensmbl_decs):
-                        for lth in range(dec.n_layers):
-                            ensmbl_cache[i_e][lth] = torch.cat([beam['ensmbl_cache'][i_e][lth] for beam in hyps], dim=0)
-
-                # for the ensemble
-                ensmbl_new_cache = [[None] * dec.n_layers for dec in ensmbl_decs]
-                for i_e, dec in enumerate(ensmbl_decs):
-                    out_e = dec.pos_enc(dec.embed(ys))  # scaled + dropout
-                    eouts_e = ensmbl_eouts[i_e][b:b + 1, :elens[b]].repeat([ys.size(0), 1, 1])
-                    for lth in range(dec.n_layers):
-                        out_e = dec.layers[lth](out_e, causal_mask, eouts_e, None,
-                                                cache=ensmbl_cache[i_e][lth])
-                        ensmbl_new_cache[i_e][lth] = out_e
-                    logits_e = dec.output(dec.norm_out(out_e))
-                    probs += torch.softmax(logits_e[:, -1] * softmax_smoothing, dim=1)
-                    # NOTE: sum in the probability scale (not log-scale)
-
-                # Ensemble
-                scores_att = torch.log(probs / n_models)
-
-                new_hyps = []
-                for j, beam in enumerate(hyps):
-                    # Attention scores
-                    total_scores_att = beam['score_att'] + scores_att[j:j + 1]
-                    total_scores = total_scores_att * (1 - ctc_weight)
-
-                    # Add LM score <before> top-K selection
-                    if lm is not None:
-                        total_scores_lm = beam['score_lm'] + scores_lm[j:j + 1, -1]
-                        total_scores += total_scores_lm * lm_weight
-                    else:
-                        total_scores_lm = eouts.new_zeros(1, self.vocab)
-
-                    total_scores_topk, topk_ids = torch.topk(
-                        total_scores, k=beam_width, dim=1, largest=True, sorted=True)
-
-                    # Add length penalty
-                    if lp_weight > 0:
-                        total_scores_topk += (len(beam['hyp'][1:]) + 1) * lp_weight
-
-                    # Add CTC score
-                    new_ctc_states, total_scores_ctc, total_scores_topk = helper.add_ctc_score(
-                        beam['hyp'], topk_ids, beam['ctc_state'],
-                        total_scores_topk, ctc_prefix_scorer)
-
-                    new_aws = beam['aws'] + [xy_aws_layers[j:j + 1, :, :, -1:]]
-                    aws_j = torch.cat(new_aws[1:], dim=3)  # `[1, H, n_layers, L, T]`
-                    streaming_failed_point = beam['streaming_failed_point']
-
-                    # forward direction
-                    for k in range(beam_width):
-                        idx = topk_ids[0, k].item()
-                        length_norm_factor = len(beam['hyp'][1:]) + 1 if length_norm else 1
-                        total_score = total_scores_topk[0, k].item() / length_norm_factor
-
-                        if idx == self.eos:
-                            # Exclude short hypotheses
-                            if len(beam['hyp'][1:]) < elens[b] * min_len_ratio:
-                                continue
-                            # EOS threshold
-                            max_score_no_eos = scores_att[j, :idx].max(0)[0].item()
-                            max_score_no_eos = max(max_score_no_eos, scores_att[j, idx + 1:].max(0)[0].item())
-                            if scores_att[j, idx].item() <= eos_threshold * max_score_no_eos:
-                                continue
-
-                        quantity_rate = 1.
-                        if self.attn_type == 'mocha':
-                            n_tokens_hyp_k = i + 1
-                            n_quantity_k = aws_j[:, :, :, :n_tokens_hyp_k].int().sum().item()
-                            quantity_diff = n_tokens_hyp_k * n_heads_total - n_quantity_k
-
-                            if quantity_diff != 0:
-                                if idx == self.eos:
-                                    n_tokens_hyp_k -= 1  # NOTE: do not count <eos> for streamability
-                                    n_quantity_k = aws_j[:, :, :, :n_tokens_hyp_k].int().sum().item()
-                                else:
-                                    streamable_global = False
-                                if n_tokens_hyp_k * n_heads_total == 0:
-                                    quantity_rate = 0
-                                else:
-                                    quantity_rate = n_quantity_k / (n_tokens_hyp_k * n_heads_total)
-
-                            if beam['streamable'] and not streamable_global:
-                                streaming_failed_point = i
-
-                        new_hyps.append(
-                            {'hyp': beam['hyp'] + [idx],
-                             'ys': torch.cat([beam['ys'], eouts.new_zeros((1, 1), dtype=torch.int64).fill_(idx)], dim=-1),
-                             'cache': [new_cache_l[j:j + 1] for new_cache_l in new_cache] if cache_states else cache,
-                             'score': total_score,
-                             'score_att': total_scores_att[0, idx].item(),
-                             'score_ctc': total_scores_ctc[k].item(),
-                             'score_lm': total_scores_lm[0, idx].item(),
-                             'aws': new_aws,
-                             'lmstate': {'hxs': lmstate['hxs'][:, j:j + 1],
-                                         'cxs': lmstate['cxs'][:, j:j + 1]} if lmstate is not None else None,
-                             'ctc_state': new_ctc_states[k] if ctc_prefix_scorer is not None else None,
-                             'ensmbl_cache': [[new_cache_e_l[j:j + 1] for new_cache_e_l in new_cache_e] for new_cache_e in ensmbl_new_cache] if cache_states else None,
-                             'streamable': streamable_global,
-                             'streaming_failed_point': streaming_failed_point,
-                             'quantity_rate': quantity_rate})
-
-                # Local pruning
-                new_hyps_sorted = sorted(new_hyps, key=lambda x: x['score'], reverse=True)[:beam_width]
-
-                # Remove complete hypotheses
-                new_hyps, end_hyps, is_finish = helper.remove_complete_hyp(
-                    new_hyps_sorted, end_hyps, prune=True)
-                hyps = new_hyps[:]
-                if is_finish:
-                    break
-
-            # Global pruning
-            if len(end_hyps) == 0:
-                end_hyps = hyps[:]
-            elif len(end_hyps) < nbest and nbest > 1:
-                end_hyps.extend(hyps[:nbest - len(end_hyps)])
-
-            # forward second path LM rescoring
+        for batch_ids in batch_ids_list:
+            end_hyps_batch = self._beam_search_batch(
+                eouts[batch_ids], elens[batch_ids], params, lm,
+                ctc_log_probs[batch_ids] if ctc_log_probs is not None else None,
+                [speakers[b] for b in batch_ids] if speakers is not None else None,
+                [eouts_e[batch_ids] for eouts_e in ensmbl_eouts],
+                [elens_e[batch_ids] for elens_e in ensmbl_elens],
+                ensmbl_decs, nbest, cache_states)
+
+            # second path LM rescoring of all hypotheses in the mini-batch at once
+            end_hyps_all = [hyp for end_hyps in end_hyps_batch for hyp in end_hyps]
             if lm_second is not None:
-                self.lm_rescoring(end_hyps, lm_second, lm_weight_second, tag='second')
-
-            # backward secodn path LM rescoring
+                self.lm_rescoring(end_hyps_all, lm_second, lm_weight_second, tag='second')
             if lm_second_bwd is not None:
-                self.lm_rescoring(end_hyps, lm_second_bwd, lm_weight_second_bwd, tag='second_bwd')
-
-            # Sort by score
-            end_hyps = sorted(end_hyps, key=lambda x: x['score'], reverse=True)
+                self.lm_rescoring(end_hyps_all, lm_second_bwd, lm_weight_second_bwd, tag='second_bwd')
+
+            for b, end_hyps in zip(batch_ids, end_hyps_batch):
+                # Sort by score
+                end_hyps = sorted(end_hyps, key=lambda x: x['score'], reverse=True)
+
+                # `[1, n_layers_src, H, 1, T]` -> `[n_layers_src * H, L, T]` (truncate padded frames)
+                elen = int(elens[b])
+                for n in range(len(end_hyps)):
+                    aws_n = torch.cat(end_hyps[n]['aws'][1:], dim=3)
+                    end_hyps[n]['aws'] = aws_n.view(-1, aws_n.size(3), aws_n.size(4))[:, :, :elen]
+
+                # metrics for streaming infernece
+                self.streamable = end_hyps[0]['streamable']
+                self.quantity_rate = end_hyps[0]['quantity_rate']
+                self.last_success_frame_ratio = None
+
+                if idx2token is not None:
+                    if utt_ids is not None:
+                        logger.info('Utt-id: %s' % utt_ids[b])
+                    assert self.vocab == idx2token.vocab
+                    logger.info('=' * 200)
+                    for k in range(len(end_hyps)):
+                        if refs_id is not None:
+                            logger.info('Ref: %s' % idx2token(refs_id[b]))
+                        logger.info('Hyp: %s' % idx2token(
+                            end_hyps[k]['hyp'][1:][::-1] if self.bwd else end_hyps[k]['hyp'][1:]))
+                        logger.info('num tokens (hyp): %d' % len(end_hyps[k]['hyp'][1:]))
+                        logger.info('log prob (hyp): %.7f' % end_hyps[k]['score'])
+                        logger.info('log prob (hyp, att): %.7f' % (end_hyps[k]['score_att'] * (1 - ctc_weight)))
+                        if ctc_log_probs is not None:
+                            logger.info('log prob (hyp, ctc): %.7f' % (end_hyps[k]['score_ctc'] * ctc_weight))
+                        if lm is not None:
+                            logger.info('log prob (hyp, first-path lm): %.7f' % (end_hyps[k]['score_lm'] * lm_weight))
+                        if lm_second is not None:
+                            logger.info('log prob (hyp, second-path lm): %.7f' %
+                                        (end_hyps[k]['score_lm_second'] * lm_weight_second))
+                        if lm_second_bwd is not None:
+                            logger.info('log prob (hyp, second-path lm, reverse): %.7f' %
+                                        (end_hyps[k]['score_lm_second_bwd'] * lm_weight_second_bwd))
+                        if self.attn_type == 'mocha':
+                            logger.info('streamable: %s' % end_hyps[k]['streamable'])
+                            logger.info('streaming failed point: %d' % (end_hyps[k]['streaming_failed_point'] + 1))
+                            logger.info('quantity rate [%%]: %.2f' % (end_hyps[k]['quantity_rate'] * 100))
+                        logger.info('-' * 50)
+
+                    if self.attn_type == 'mocha' and end_hyps[0]['streaming_failed_point'] < 1000:
+                        assert not self.streamable
+                        rightmost_frame = 0
+                        if end_hyps[0]['streaming_failed_point'] > 0:
+                            aws_last_success = end_hyps[0]['aws'][:, end_hyps[0]['streaming_failed_point'] - 1]
+                            boundaries = aws_last_success.nonzero()
+                            if boundaries.size(0) > 0:
+                                rightmost_frame = boundaries[:, -1].max().item() + 1
+                        frame_ratio = rightmost_frame * 100 / xmax
+                        self.last_success_frame_ratio = frame_ratio
+                        logger.info('streaming last success frame ratio: %.2f' % frame_ratio)
+
+                # N-best list
+                if self.bwd:
+                    # Reverse the order
+                    nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:][::-1]) for n in range(nbest)]]
+                    aws += [[tensor2np(end_hyps[n]['aws'])[:, ::-1] for n in range(nbest)]]
+                else:
+                    nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:]) for n in range(nbest)]]
+                    aws += [[tensor2np(end_hyps[n]['aws']) for n in range(nbest)]]
+                scores += [[end_hyps[n]['score_att'] for n in range(nbest)]]
 
-            for j in range(len(end_hyps[0]['aws'][1:])):
-                tmp = end_hyps[0]['aws'][j + 1]
-                end_hyps[0]['aws'][j + 1] = tmp.view(1, -1, tmp.size(-2), tmp.size(-1))
+                # Check <eos>
+                eos_flags.append([(end_hyps[n]['hyp'][-1] == self.eos) for n in range(nbest)])
 
-            # metrics for streaming infernece
-            self.streamable = end_hyps[0]['streamable']
-            self.quantity_rate = end_hyps[0]['quantity_rate']
-            self.last_success_frame_ratio = None
-
-            if idx2token is not None:
-                if utt_ids is not None:
-                    logger.info('Utt-id: %s' % utt_ids[b])
-                assert self.vocab == idx2token.vocab
-                logger.info('=' * 200)
-                for k in range(len(end_hyps)):
-                    if refs_id is not None:
-                        logger.info('Ref: %s' % idx2token(refs_id[b]))
-                    logger.info('Hyp: %s' % idx2token(
-                        end_hyps[k]['hyp'][1:][::-1] if self.bwd else end_hyps[k]['hyp'][1:]))
-                    logger.info('num tokens (hyp): %d' % len(end_hyps[k]['hyp'][1:]))
-                    logger.info('log prob (hyp): %.7f' % end_hyps[k]['score'])
-                    logger.info('log prob (hyp, att): %.7f' % (end_hyps[k]['score_att'] * (1 - ctc_weight)))
-                    if ctc_prefix_scorer is not None:
-                        logger.info('log prob (hyp, ctc): %.7f' % (end_hyps[k]['score_ctc'] * ctc_weight))
-                    if lm is not None:
-                        logger.info('log prob (hyp, first-path lm): %.7f' % (end_hyps[k]['score_lm'] * lm_weight))
-                    if lm_second is not None:
-                        logger.info('log prob (hyp, second-path lm): %.7f' %
-                                    (end_hyps[k]['score_lm_second'] * lm_weight_second))
-                    if lm_second_bwd is not None:
-                        logger.info('log prob (hyp, second-path lm, reverse): %.7f' %
-                                    (end_hyps[k]['score_lm_second_rev'] * lm_weight_second_bwd))
-                    if self.attn_type == 'mocha':
-                        logger.info('streamable: %s' % end_hyps[k]['streamable'])
-                        logger.info('streaming failed point: %d' % (end_hyps[k]['streaming_failed_point'] + 1))
-                        logger.info('quantity rate [%%]: %.2f' % (end_hyps[k]['quantity_rate'] * 100))
-                    logger.info('-' * 50)
-
-                if self.attn_type == 'mocha' and end_hyps[0]['streaming_failed_point'] < 1000:
-                    assert not self.streamable
-                    aws_last_success = end_hyps[0]['aws'][1:][end_hyps[0]['streaming_failed_point'] - 1]
-                    rightmost_frame = max(0, aws_last_success[0, :, 0].nonzero()[:, -1].max().item()) + 1
-                    frame_ratio = rightmost_frame * 100 / xmax
-                    self.last_success_frame_ratio = frame_ratio
-                    logger.info('streaming last success frame ratio: %.2f' % frame_ratio)
-
-            # N-best list
-            if self.bwd:
-                # Reverse the order
-                nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:][::-1]) for n in range(nbest)]]
-                aws += [[tensor2np(torch.cat(end_hyps[n]['aws'][1:][::-1], dim=2).squeeze(0)) for n in range(nbest)]]
-            else:
-                nbest_hyps_idx += [[np.array(end_hyps[n]['hyp'][1:]) for n in range(nbest)]]
-                aws += [[tensor2np(torch.cat(end_hyps[n]['aws'][1:], dim=2).squeeze(0)) for n in range(nbest)]]
-            scores += [[end_hyps[n]['score_att'] for n in range(nbest)]]
-
-            # Check <eos>
-            eos_flags.append([(end_hyps[n]['hyp'][-1] == self.eos) for n in range(nbest)])
+            # Store LM state
+            if isinstance(lm, RNNLM):
+                self.lmstate_final = end_hyps[0]['lmstate']
+            elif isinstance(lm, TransformerLM) or isinstance(lm, TransformerXL):
+                # keep keys/values of the last `mem_len` tokens as memory
+                self.lmstate_final = lm.truncate_cache(end_hyps[0]['lmstate'], lm.mem_len)
 
         # Exclude <eos> (<sos> in case of the backward decoder)
         if exclude_eos:
@@ -994,8 +920,290 @@ class TransformerDecoder(DecoderBase):
                                    else nbest_hyps_idx[b][n] for n in range(nbest)] for b in range(bs)]
                 aws = [[aws[b][n][:, :-1] if eos_flags[b][n] else aws[b][n] for n in range(nbest)] for b in range(bs)]
 
-        # Store ASR/LM state
-        if isinstance(lm, RNNLM):
-            self.lmstate_final = end_hyps[0]['lmstate']
-
         return nbest_hyps_idx, aws, scores
+
+    def _beam_search_batch(self, eouts, elens, params, lm, ctc_log_probs, speakers,
+                           ensmbl_eouts, ensmbl_elens, ensmbl_decs, nbest, cache_states):
+        """Beam search over all utterances in a mini-batch at once.
+
+        Hypotheses are laid out in `[B * beam_width]` slots, where the k-th slot of
+        the b-th utterance is `b * beam_width + k`. Slots without any active
+        hypothesis are kept as dummy entries and never selected.
+
+        Args:
+            eouts (FloatTensor): `[B, T, d_model]`
+            elens (IntTensor): `[B]`
+            params (dict): hyperparameters for decoding
+            lm: firsh path LM
+            ctc_log_probs (FloatTensor): `[B, T, vocab]`
+            speakers (list): speaker list
+            ensmbl_eouts (list): list of FloatTensor
+            ensmbl_elens (list) list of list
+            ensmbl_decs (list): list of torch.nn.Module
+            nbest (int): number of N-best list
+            cache_states (bool): cache decoder states for fast decoding
+        Returns:
+            end_hyps (list): length `B`, each of which contains a list of hypotheses
+
+        """
+        bs = eouts.size(0)
+        n_models = len(ensmbl_decs) + 1
+
+        beam_width = params['recog_beam_width']
+        ctc_weight = params['recog_ctc_weight']
+        max_len_ratio = params['recog_max_len_ratio']
+        min_len_ratio = params['recog_min_len_ratio']
+        lp_weight = params['recog_length_penalty']
+        length_norm = params['recog_length_norm']
+        lm_weight = params['recog_lm_weight']
+        eos_threshold = params['recog_eos_threshold']
+        lm_state_carry_over = params['recog_lm_state_carry_over']
+        softmax_smoothing = params['recog_softmax_smoothing']
+        eps_wait = params['recog_mma_delay_threshold']
+
+        trfm_lm = isinstance(lm, TransformerLM) or isinstance(lm, TransformerXL)
+        n_hyps = bs * beam_width
+        ymax = [math.ceil(int(elens[b]) * max_len_ratio) for b in range(bs)]
+
+        # NOTE: encoder outputs are not copied for each slot. The source-target attention
+        # layers project them once and broadcast them to all slots of the same utterance.
+        eouts = eouts[:, :int(elens.max())]  # `[B, T, d_model]`
+        src_mask = make_pad_mask(elens.to(self.device)).unsqueeze(1)  # `[B, 1, T]`
+
+        # Initialization
+        self.reset_src_cache()
+        cache = self.init_cache(n_hyps, max(ymax) + 1) if cache_states else None
+        xy_aws_prev = None
+        lmstate = None
+        ys = eouts.new_zeros((n_hyps, 1), dtype=torch.int64).fill_(self.eos)
+
+        # Ensemble initialization
+        ensmbl_cache, ensmbl_mask = [], []
+        for i_e, dec in enumerate(ensmbl_decs):
+            dec.reset_src_cache()
+            ensmbl_eouts[i_e] = ensmbl_eouts[i_e][:, :int(ensmbl_elens[i_e].max())]
+            ensmbl_mask += [make_pad_mask(ensmbl_elens[i_e].to(self.device)).unsqueeze(1)]
+            ensmbl_cache += [dec.init_cache(n_hyps, max(ymax) + 1) if cache_states else None]
+
+        if speakers is not None:
+            for b in range(bs):
+                if speakers[b] == self.prev_spk:
+                    # NOTE: bs == 1 here
+                    if lm_state_carry_over and self.lmstate_final is not None:
+                        lmstate = reorder_lmstate(self.lmstate_final,
+                                                  eouts.new_zeros(n_hyps, dtype=torch.int64))
+                self.prev_spk = speakers[b]
+
+        # For joint CTC-Attention decoding
+        ctc_prefix_scorer = None
+        if ctc_log_probs is not None:
+            ctc_prefix_scorer = BatchCTCPrefixScore(ctc_log_probs, elens, self.blank, self.eos,
+                                                    beam_width, backward=self.bwd)
+            ctc_state = ctc_prefix_scorer.initial_state()
+
+        # Only the first slot of each utterance is active at the beginning
+        alive = [k % beam_width == 0 for k in range(n_hyps)]
+        hyps = [[self.eos] for _ in range(n_hyps)]
+        aws_hist = [[None] for _ in range(n_hyps)]
+        score_att = eouts.new_zeros(n_hyps)
+        score_lm = eouts.new_zeros(n_hyps)
+        # for MMA
+        streamable = [True] * n_hyps
+        streaming_failed_point = [1000] * n_hyps
+        n_quantity = [0] * n_hyps
+
+        min_lens = (elens.float() * min_len_ratio).repeat_interleave(beam_width).to(self.device)
+        end_hyps = [[] for _ in range(bs)]
+        is_finish = [False] * bs
+        for i in range(max(ymax)):
+            # Update LM states for shallow fusion
+            scores_lm = None
+            if lm is not None:
+                y_lm = ys if trfm_lm else ys[:, -1:]
+                use_cache = trfm_lm and (cache_states or lm_state_carry_over)
+                _, lmstate, scores_lm = lm.predict(y_lm, lmstate, cache=lmstate if use_cache else None)
+
+            # for the main model
+            logits, xy_aws, cache = self.decode_step(ys, eouts, src_mask, cache, xy_aws_prev, eps_wait,
+                                                     cache_src=True)
+            probs = torch.softmax(logits * softmax_smoothing, dim=1)
+
+            # for the ensemble
+            for i_e, dec in enumerate(ensmbl_decs):
+                logits_e, _, ensmbl_cache[i_e] = dec.decode_step(
+                    ys, ensmbl_eouts[i_e], ensmbl_mask[i_e], ensmbl_cache[i_e], cache_src=True)
+                probs += torch.softmax(logits_e * softmax_smoothing, dim=1)
+                # NOTE: sum in the probability scale (not log-scale)
+
+            # Ensemble
+            scores_att = torch.log(probs / n_models)  # `[B * beam, vocab]`
+
+            # Attention scores
+            total_scores_att = score_att.unsqueeze(1) + scores_att
+            total_scores = total_scores_att * (1 - ctc_weight)
+
+            # Add LM score <before> top-K selection
+            if lm is not None:
+                total_scores_lm = score_lm.unsqueeze(1) + scores_lm[:, -1]
+                total_scores += total_scores_lm * lm_weight
+            else:
+                total_scores_lm = eouts.new_zeros(n_hyps, self.vocab)
+
+            total_scores_topk, topk_ids = torch.topk(
+                total_scores, k=beam_width, dim=1, largest=True, sorted=True)  # `[B * beam, beam]`
+
+            # Add length penalty
+            # NOTE: all active hypotheses have the same length (i) here
+            if lp_weight > 0:
+                total_scores_topk += (i + 1) * lp_weight
+
+            # Add CTC score
+            if ctc_prefix_scorer is not None:
+                total_scores_ctc, new_ctc_states = ctc_prefix_scorer(i, ys[:, -1], ctc_state, topk_ids)
+                total_scores_topk += total_scores_ctc * ctc_weight
+            else:
+                total_scores_ctc = eouts.new_zeros(n_hyps, beam_width)
+
+            if length_norm:
+                total_scores_topk /= (i + 1)
+
+            # Exclude inactive slots, short hypotheses and <eos> below the threshold
+            is_eos = topk_ids == self.eos
+            scores_att_no_eos = scores_att.clone()
+            scores_att_no_eos[:, self.eos] = float('-inf')
+            max_score_no_eos = scores_att_no_eos.max(1)[0]
+            eos_rejected = (i < min_lens) | (scores_att[:, self.eos] <= eos_threshold * max_score_no_eos)
+            valid = ~(is_eos & eos_rejected.unsqueeze(1))
+            valid &= torch.tensor(alive, device=self.device).unsqueeze(1)
+
+            # Local pruning per utterance
+            total_scores_topk = total_scores_topk.masked_fill(~valid, float('-inf'))
+            best_scores, best_ids = torch.topk(
+                total_scores_topk.view(bs, beam_width * beam_width), k=beam_width,
+                dim=1, largest=True, sorted=True)
+            best_scores = tensor2np(best_scores)
+            best_ids = tensor2np(best_ids)
+            topk_ids_np = tensor2np(topk_ids)
+
+            # Streamability of MMA: all heads must detect a boundary for every token
+            if self.attn_type == 'mocha':
+                n_heads_total = xy_aws.size(1) * xy_aws.size(2)
+                n_quantity_step = tensor2np(xy_aws.int().view(n_hyps, -1).sum(1))
+
+            parent_ids = list(range(n_hyps))
+            cand_ids = [0] * n_hyps
+            new_alive = [False] * n_hyps
+            new_y = [self.eos] * n_hyps
+            new_hyps = hyps[:]
+            new_aws_hist = aws_hist[:]
+            new_streamable = streamable[:]
+            new_streaming_failed_point = streaming_failed_point[:]
+            new_n_quantity = n_quantity[:]
+            for b in range(bs):
+                if is_finish[b]:
+                    continue
+                new_hyps_b = []
+                for r in range(beam_width):
+                    if np.isneginf(best_scores[b, r]):
+                        break
+                    j = b * beam_width + best_ids[b, r] // beam_width
+                    k = best_ids[b, r] % beam_width
+                    idx = topk_ids_np[j, k]
+
+                    streamable_jk, failed_point_jk, quantity_rate = streamable[j], streaming_failed_point[j], 1.
+                    if self.attn_type == 'mocha':
+                        n_tokens_hyp_k = i + 1
+                        n_quantity_k = n_quantity[j] + n_quantity_step[j]
+                        if n_tokens_hyp_k * n_heads_total != n_quantity_k:
+                            if idx == self.eos:
+                                n_tokens_hyp_k -= 1  # NOTE: do not count <eos> for streamability
+                                n_quantity_k = n_quantity[j]
+                            else:
+                                streamable_jk = False
+                            if n_tokens_hyp_k * n_heads_total == 0:
+                                quantity_rate = 0
+                            else:
+                                quantity_rate = n_quantity_k / (n_tokens_hyp_k * n_heads_total)
+                        if streamable[j] and not streamable_jk:
+                            failed_point_jk = i
+                    mma_info = (streamable_jk, failed_point_jk, quantity_rate)
+
+                    if idx == self.eos:
+                        # Remove complete hypotheses
+                        end_hyps[b] += [self._make_hyp(
+                            j, k, idx, best_scores[b, r], hyps, aws_hist, xy_aws, lmstate,
+                            total_scores_att, total_scores_lm, total_scores_ctc, mma_info)]
+                    else:
+                        new_hyps_b += [(j, k, idx, best_scores[b, r], mma_info)]
+
+                if len(end_hyps[b]) >= beam_width:
+                    end_hyps[b] = end_hyps[b][:beam_width]
+                    is_finish[b] = True
+                elif len(new_hyps_b) == 0 or i == ymax[b] - 1:
+                    # Global pruning
+                    if len(end_hyps[b]) == 0:
+                        n_rest = len(new_hyps_b)
+                    elif len(end_hyps[b]) < nbest and nbest > 1:
+                        n_rest = nbest - len(end_hyps[b])
+                    else:
+                        n_rest = 0
+                    end_hyps[b] += [self._make_hyp(
+                        j, k, idx, score, hyps, aws_hist, xy_aws, lmstate,
+                        total_scores_att, total_scores_lm, total_scores_ctc, mma_info)
+                        for (j, k, idx, score, mma_info) in new_hyps_b[:n_rest]]
+                    is_finish[b] = True
+                if is_finish[b]:
+                    continue
+
+                for r, (j, k, idx, _, mma_info) in enumerate(new_hyps_b):
+                    slot = b * beam_width + r
+                    parent_ids[slot] = j
+                    cand_ids[slot] = k
+                    new_alive[slot] = True
+                    new_y[slot] = int(idx)
+                    new_hyps[slot] = hyps[j] + [int(idx)]
+                    new_aws_hist[slot] = aws_hist[j] + [xy_aws[j:j + 1]]
+                    new_streamable[slot], new_streaming_failed_point[slot] = mma_info[:2]
+                    if self.attn_type == 'mocha':
+                        new_n_quantity[slot] = n_quantity[j] + n_quantity_step[j]
+
+            if all(is_finish):
+                break
+
+            # Reorder states by parent hypotheses
+            parent_ids = torch.tensor(parent_ids, dtype=torch.int64, device=self.device)
+            cand_ids = torch.tensor(cand_ids, dtype=torch.int64, device=self.device)
+            y = torch.tensor(new_y, dtype=torch.int64, device=self.device).unsqueeze(1)
+            alive = new_alive
+            hyps = new_hyps
+            aws_hist = new_aws_hist
+            streamable = new_streamable
+            streaming_failed_point = new_streaming_failed_point
+            n_quantity = new_n_quantity
+            ys = torch.cat([ys.index_select(0, parent_ids), y], dim=1)
+            score_att = total_scores_att[parent_ids, y[:, 0]]
+            score_lm = total_scores_lm[parent_ids, y[:, 0]]
+            cache = self.reorder_cache(cache, parent_ids)
+            xy_aws_prev = xy_aws.index_select(0, parent_ids)
+            lmstate = reorder_lmstate(lmstate, parent_ids)
+            if ctc_prefix_scorer is not None:
+                ctc_state = ctc_prefix_scorer.select_state(new_ctc_states, parent_ids, cand_ids)
+            for i_e, dec in enumerate(ensmbl_decs):
+                ensmbl_cache[i_e] = dec.reorder_cache(ensmbl_cache[i_e], parent_ids)
+
+        return end_hyps
+
+    def _make_hyp(self, j, k, idx, score, hyps, aws_hist, xy_aws, lmstate,
+                  total_scores_att, total_scores_lm, total_scores_ctc, mma_info):
+        """Make a hypothesis extended from the j-th slot with the k-th candidate token idx."""
+        streamable, streaming_failed_point, quantity_rate = mma_info
+        return {'hyp': hyps[j] + [int(idx)],
+                'score': float(score),
+                'score_att': total_scores_att[j, idx].item(),
+                'score_ctc': total_scores_ctc[j, k].item(),
+                'score_lm': total_scores_lm[j, idx].item(),
+                'aws': aws_hist[j] + [xy_aws[j:j + 1]],
+                'lmstate': reorder_lmstate(lmstate, xy_aws.new_zeros(1, dtype=torch.int64).fill_(j)),
+                'streamable': streamable,
+                'streaming_failed_point': streaming_failed_point,
+                'quantity_rate': quantity_rate}
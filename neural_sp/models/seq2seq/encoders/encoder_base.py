@@ -41,6 +41,22 @@ class EncoderBase(ModelBase):
     def reset_cache(self):
         raise NotImplementedError
 
+    def get_cache(self):
+        """Return streaming states carried over to the next chunk."""
+        raise NotImplementedError
+
+    def set_cache(self, cache):
+        """Restore streaming states returned by get_cache()."""
+        raise NotImplementedError
+
+    def batch_cache(self, caches):
+        """Merge caches of multiple streams (None for a new stream) into one."""
+        raise NotImplementedError
+
+    def split_cache(self, cache, bs):
+        """Split a batched cache into `bs` caches of individual streams."""
+        raise NotImplementedError
+
     def turn_on_ceil_mode(self, encoder):
         if isinstance(encoder, torch.nn.Module):
             for name, module in encoder.named_children():
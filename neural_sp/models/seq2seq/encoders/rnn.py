@@ -261,6 +261,61 @@ class RNNEncoder(EncoderBase):
         self.hx_fwd = [None] * self.n_layers
         logger.debug('Reset cache.')
 
+    def get_cache(self):
+        return {'hx_fwd': self.hx_fwd[:]}
+
+    def set_cache(self, cache):
+        self.hx_fwd = cache['hx_fwd'][:]
+
+    def batch_cache(self, caches):
+        """Merge caches of multiple streams into a single cache.
+
+        Args:
+            caches (list): A list of length `[B]`, each of which is returned by
+                get_cache(). None stands for a stream starting from scratch.
+        Returns:
+            cache (dict): batched cache
+
+        """
+        hx_fwd = []
+        for lth in range(self.n_layers):
+            states = [c['hx_fwd'][lth] if c is not None else None for c in caches]
+            ref = next((state for state in states if state is not None), None)
+            if ref is None:
+                hx_fwd.append(None)
+                continue
+            # zero states are equivalent to no initial states
+            states = [state if state is not None else _zeros_like_state(ref) for state in states]
+            if isinstance(ref, tuple):
+                hx_fwd.append(tuple(torch.cat([state[i] for state in states], dim=1)
+                                    for i in range(len(ref))))
+            else:
+                hx_fwd.append(torch.cat(states, dim=1))
+        return {'hx_fwd': hx_fwd}
+
+    def split_cache(self, cache, bs):
+        """Split a batched cache into caches of individual streams.
+
+        Args:
+            cache (dict): batched cache returned by get_cache()
+            bs (int): batch size
+        Returns:
+            caches (list): A list of length `[B]`
+
+        """
+        caches = []
+        for b in range(bs):
+            hx_fwd = []
+            for state in cache['hx_fwd']:
+                if state is None:
+                    hx_fwd.append(None)
+                elif isinstance(state, tuple):
+                    hx_fwd.append(tuple(s[:, b:b + 1] for s in state))
+                else:
+                    hx_fwd.append(state[:, b:b + 1])
+            caches.append({'hx_fwd': hx_fwd})
+        return caches
+
     def forward(self, xs, xlens, task, streaming=False, lookback=False, lookahead=False):
         """Forward pass.
 
@@ -287,7 +342,12 @@ class RNNEncoder(EncoderBase):
 
         # Sort by lenghts in the descending order for pack_padded_sequence
         if not self.lc_bidir:
-            xlens, perm_ids = torch.IntTensor(xlens).sort(0, descending=True)
+            if streaming:
+                # keep the order so that states in the cache are aligned to streams
+                xlens = torch.IntTensor(xlens)
+                perm_ids = torch.arange(xlens.size(0))
+            else:
+                xlens, perm_ids = torch.IntTensor(xlens).sort(0, descending=True)
             xs = xs[perm_ids]
             _, perm_ids_unsort = perm_ids.sort()
 
@@ -533,3 +593,9 @@ class NiN(nn.Module):
         xs = torch.relu(self.batch_norm(self.conv(xs)))  # `[B, n_unis (*2), T, 1]`
         xs = xs.transpose(2, 1).squeeze(3)  # `[B, T, n_unis (*2)]`
         return xs
+
+
+def _zeros_like_state(state):
+    if isinstance(state, tuple):
+        return tuple(s.new_zeros(s.size()) for s in state)
+    return state.new_zeros(state.size())
@@ -240,6 +240,9 @@ class TransformerEncoder(EncoderBase):
 
         self.reset_parameters(param_init)
 
+        # for streaming inference
+        self.reset_cache()
+
     @staticmethod
     def add_args(parser, args):
         """Add arguments."""
@@ -329,6 +332,83 @@ class TransformerEncoder(EncoderBase):
                 nn.init.xavier_uniform_(self.u_bias)
                 nn.init.xavier_uniform_(self.v_bias)
 
+    @property
+    def streaming_with_cache(self):
+        """Whether chunks are encoded incrementally with the left context carried over in the cache.
+
+        Otherwise, each chunk is encoded independently by the latency-controlled
+        implementation, and the cache is left empty.
+
+        """
+        return self.latency_controlled and self.streaming_type == 'mask' and self.pe_type in ['add', 'none']
+
+    def reset_cache(self):
+        self.cache = [None] * self.n_layers  # inputs of each layer in the left context and their masks
+        self.offset = None  # position of the first frame in the next chunk
+        logger.debug('Reset cache.')
+
+    def get_cache(self):
+        return {'cache': self.cache[:], 'offset': self.offset}
+
+    def set_cache(self, cache):
+        self.cache = cache['cache'][:]
+        self.offset = cache['offset']
+
+    def batch_cache(self, caches):
+        """Merge caches of multiple streams into a single cache.
+
+        Left contexts shorter than the others are padded on the left side and masked out.
+
+        Args:
+            caches (list): A list of length `[B]`, each of which is returned by
+                get_cache(). None stands for a stream starting from scratch.
+        Returns:
+            cache (dict): batched cache
+
+        """
+        bs = len(caches)
+        caches = [c if c is not None else {'cache': [None] * self.n_layers, 'offset': None}
+                  for c in caches]
+        offset = None
+        if any(c['offset'] is not None for c in caches):
+            offset = torch.cat([c['offset'] if c['offset'] is not None else
+                                torch.zeros(1, dtype=torch.int64, device=self.device)
+                                for c in caches])
+
+        cache = []
+        for lth in range(self.n_layers):
+            entries = [c['cache'][lth] for c in caches]
+            if all(entry is None for entry in entries):
+                cache.append(None)
+                continue
+            ref_xs, ref_mask = next(entry for entry in entries if entry is not None)
+            tmax = max(entry[0].size(1) for entry in entries if entry is not None)
+            xs_pad = ref_xs.new_zeros(bs, tmax, ref_xs.size(2))
+            mask_pad = ref_mask.new_zeros(bs, tmax)
+            for b, entry in enumerate(entries):
+                if entry is not None and entry[0].size(1) > 0:
+                    xs_pad[b, tmax - entry[0].size(1):] = entry[0][0]
+                    mask_pad[b, tmax - entry[1].size(1):] = entry[1][0]
+            cache.append((xs_pad, mask_pad))
+        return {'cache': cache, 'offset': offset}
+
+    def split_cache(self, cache, bs):
+        """Split a batched cache into caches of individual streams.
+
+        Args:
+            cache (dict): batched cache returned by get_cache()
+            bs (int): batch size
+        Returns:
+            caches (list): A list of length `[B]`
+
+        """
+        caches = []
+        for b in range(bs):
+            caches.append({'cache': [(entry[0][b:b + 1], entry[1][b:b + 1]) if entry is not None else None
+                                     for entry in cache['cache']],
+                           'offset': cache['offset'][b:b + 1] if cache['offset'] is not None else None})
+        return caches
+
     def forward(self, xs, xlens, task, streaming=False, lookback=False, lookahead=False):
         """Forward pass.
 
@@ -349,6 +429,11 @@ class TransformerEncoder(EncoderBase):
                  'ys_sub1': {'xs': None, 'xlens': None},
                  'ys_sub2': {'xs': None, 'xlens': None}}
 
+        if streaming and self.streaming_with_cache:
+            eouts['ys']['xs'], eouts['ys']['xlens'] = self._forward_streaming(
+                xs, xlens, lookback, lookahead)
+            return eouts
+
         N_l = self.chunk_size_left
         N_c = self.chunk_size_current
         N_r = self.chunk_size_right
@@ -486,6 +571,75 @@ class TransformerEncoder(EncoderBase):
             eouts['ys_sub2']['xs'], eouts['ys_sub2']['xlens'] = xs_sub2, xlens
         return eouts
 
+    def _forward_streaming(self, xs, xlens, lookback=False, lookahead=False):
+        """Encode the next chunk incrementally.
+
+        Only the current and lookahead frames are fed, and inputs of each layer in
+        the left context are carried over from the previous chunks in the cache.
+        The outputs are identical to those of the 'mask' implementation.
+        This is used only when streaming_with_cache is True.
+
+        Args:
+            xs (FloatTensor): `[B, N_c + N_r, input_dim]` (+ CNN contexts)
+            xlens (IntTensor): `[B]` (on CPU)
+            lookback (bool): truncate leftmost frames for lookback in CNN context
+            lookahead (bool): truncate rightmost frames for lookahead in CNN context
+        Returns:
+            xs (FloatTensor): `[B, N_c // subsampling_factor, d_model]`
+            xlens (IntTensor): `[B]` (on CPU)
+
+        """
+        N_l = self.chunk_size_left
+        N_c = self.chunk_size_current
+        bs = xs.size(0)
+
+        if self.conv is None:
+            xs = self.embed(xs)
+        else:
+            # Path through CNN blocks
+            xs, xlens = self.conv(xs, xlens, lookback=lookback, lookahead=lookahead)
+            N_l = N_l // self.conv.subsampling_factor
+            N_c = N_c // self.conv.subsampling_factor
+
+        if self.offset is None:
+            self.offset = torch.zeros(bs, dtype=torch.int64, device=self.device)
+        xs = self.pos_enc(xs, scale=True, offset=self.offset)
+        self.offset = self.offset + min(N_c, xs.size(1))
+
+        for lth, layer in enumerate(self.layers):
+            xs_cur = xs[:, :N_c]
+            xlens = torch.IntTensor([xs_cur.size(1)] * bs)
+            if self.cache[lth] is None:
+                xs_cache = xs.new_zeros(bs, 0, xs.size(2))
+                mask_cache = make_pad_mask(torch.IntTensor([0] * bs).to(self.device))
+            else:
+                xs_cache, mask_cache = self.cache[lth]
+
+            # NOTE: the first layer refers to lookahead frames as well
+            mask = make_pad_mask(torch.IntTensor([xs.size(1)] * bs).to(self.device))
+            xx_mask = torch.cat([mask_cache, mask], dim=1).unsqueeze(1).repeat([1, xs.size(1), 1])
+            xs_out = layer(xs, xx_mask, cache=xs_cache)[:, :N_c]
+
+            # Update the left context
+            xs_cache = torch.cat([xs_cache, xs_cur], dim=1)
+            mask_cache = torch.cat([mask_cache, mask[:, :N_c]], dim=1)
+            start = max(0, xs_cache.size(1) - N_l)
+            self.cache[lth] = (xs_cache[:, start:], mask_cache[:, start:])
+
+            xs = xs_out
+            if self.subsample is not None:
+                xs, xlens = self.subsample[lth](xs, xlens)
+                N_l = N_l // self.subsample[lth].subsampling_factor
+                N_c = N_c // self.subsample[lth].subsampling_factor
+
+        xs = self.norm_out(xs)
+
+        # Bridge layer
+        if self.bridge is not None:
+            xs = self.bridge(xs)
+
+        return xs, xlens
+
     def sub_module(self, xs, xx_mask, lth, pos_embs=None, module='sub1'):
         if self.task_specific_layer:
             xs_sub = getattr(self, 'layer_' + module)(xs, xx_mask, pos_embs=pos_embs)
@@ -555,15 +709,17 @@ class TransformerEncoderBlock(nn.Module):
     def reset_visualization(self):
         self._xx_aws = None
 
-    def forward(self, xs, xx_mask=None, pos_embs=None, u_bias=None, v_bias=None):
+    def forward(self, xs, xx_mask=None, pos_embs=None, u_bias=None, v_bias=None, cache=None):
         """Transformer encoder layer definition.
 
         Args:
             xs (FloatTensor): `[B, T, d_model]`
-            xx_mask (ByteTensor): `[B, T (query), T (key)]`
+            xx_mask (ByteTensor): `[B, T (query), T_cache + T (key)]`
             pos_embs (LongTensor): `[L, 1, d_model]`
             u_bias (FloatTensor): global parameter for relative positional encoding
             v_bias (FloatTensor): global parameter for relative positional encoding
+            cache (FloatTensor): `[B, T_cache, d_model]`, inputs in the left context
+                referred to as keys and values in streaming encoding
         Returns:
             xs (FloatTensor): `[B, T, d_model]`
 
@@ -580,7 +736,8 @@ class TransformerEncoderBlock(nn.Module):
         if self.relative_attention:
             xs, self._xx_aws = self.self_attn(xs, xs, pos_embs, xx_mask, u_bias, v_bias)  # k/q/m
         else:
-            xs, self._xx_aws = self.self_attn(xs, xs, xs, mask=xx_mask)[:2]  # k/v/q
+            key = xs if cache is None else torch.cat([self.norm1(cache), xs], dim=1)
+            xs, self._xx_aws = self.self_attn(key, key, xs, mask=xx_mask)[:2]  # k/v/q
         xs = self.dropout(xs) + residual
 
         # position-wise feed-forward
@@ -7,6 +7,12 @@
 """Frame stacking."""
 
 import numpy as np
+import torch
+
+
+def stacked_length(T, n_stacks, n_skips):
+    """Number of frames after frame stacking."""
+    return T // n_skips if T % n_stacks == 0 else (T // n_skips) + 1
 
 
 def stack_frame(feat, n_stacks, n_skips, dtype=np.float32):
@@ -17,6 +23,9 @@ def stack_frame(feat, n_stacks, n_skips, dtype=np.float32):
            "Fast and accurate recurrent neural network acoustic models for speech recognition."
            arXiv preprint arXiv:1507.06947 (2015).
 
+    The t-th output frame is the concatenation of input frames
+    [t * n_skips, t * n_skips + n_stacks). Frames beyond the input are zero-padded.
+
     Args:
         feat (list): `[T, input_dim]`
         n_stacks (int): the number of frames to stack
@@ -26,46 +35,60 @@ def stack_frame(feat, n_stacks, n_skips, dtype=np.float32):
         stacked_feat (np.ndarray): `[floor(T / n_skips), input_dim * n_stacks]`
 
     """
-    if n_stacks == 1 and n_stacks == 1:
+    if n_stacks == 1 and n_skips == 1:
         return feat
 
     if n_stacks < n_skips:
         raise ValueError('n_skips must be less than n_stacks.')
 
     T, input_dim = feat.shape
-    T_new = T // n_skips if T % n_stacks == 0 else (T // n_skips) + 1
-
-    stacked_feat = np.zeros((T_new, input_dim * n_stacks), dtype=dtype)
-    stack_count = 0
-    stack = []
-    for t, frame_t in enumerate(feat):
-        if t == len(feat) - 1:  # final frame
-            # Stack the final frame
-            stack.append(frame_t)
-
-            while stack_count != int(T_new):
-                # Concatenate stacked frames
-                for i in range(len(stack)):
-                    stacked_feat[stack_count][input_dim * i:input_dim * (i + 1)] = stack[i]
-                stack_count += 1
-
-                # Delete some frames to skip
-                for _ in range(n_skips):
-                    if len(stack) != 0:
-                        stack.pop(0)
-
-        elif len(stack) < n_stacks:  # first & middle frames
-            # Stack some frames until stack is filled
-            stack.append(frame_t)
-
-        if len(stack) == n_stacks:
-            # Concatenate stacked frames
-            for i in range(n_stacks):
-                stacked_feat[stack_count][input_dim * i:input_dim * (i + 1)] = stack[i]
-            stack_count += 1
-
-            # Delete some frames to skip
-            for _ in range(n_skips):
-                stack.pop(0)
-
-    return stacked_feat
+    T_new = stacked_length(T, n_stacks, n_skips)
+
+    # pad (or truncate) so that the last window ends at the last frame
+    T_pad = (T_new - 1) * n_skips + n_stacks
+    feat_pad = np.zeros((T_pad, input_dim), dtype=dtype)
+    feat_pad[:min(T, T_pad)] = feat[:T_pad]
+
+    # `[T_new, n_stacks, input_dim]` view of overlapping windows
+    stride_t, stride_d = feat_pad.strides
+    stacked_feat = np.lib.stride_tricks.as_strided(
+        feat_pad, shape=(T_new, n_stacks, input_dim),
+        strides=(stride_t * n_skips, stride_t, stride_d))
+    return stacked_feat.reshape((T_new, n_stacks * input_dim))
+
+
+def stack_frame_pad(xs, xlens, n_stacks, n_skips):
+    """Batch version of stack_frame() for padded tensors.
+
+    Args:
+        xs (FloatTensor): `[B, T, input_dim]`
+        xlens (IntTensor): `[B]`
+        n_stacks (int): the number of frames to stack
+        n_skips (int): the number of frames to skip
+    Returns:
+        xs (FloatTensor): `[B, T_new, input_dim * n_stacks]`
+        xlens (IntTensor): `[B]`
+
+    """
+    if n_stacks == 1 and n_skips == 1:
+        return xs, xlens
+
+    if n_stacks < n_skips:
+        raise ValueError('n_skips must be less than n_stacks.')
+
+    bs, _, input_dim = xs.size()
+    xlens_new = torch.IntTensor([stacked_length(int(xlen), n_stacks, n_skips) for xlen in xlens])
+    T_new = int(xlens_new.max())
+
+    # pad (or truncate) so that the last window ends at the last frame
+    T_pad = (T_new - 1) * n_skips + n_stacks
+    xs = xs[:, :T_pad]
+    if xs.size(1) < T_pad:
+        xs = torch.cat([xs, xs.new_zeros(bs, T_pad - xs.size(1), input_dim)], dim=1)
+    # zero out padded frames since they are stacked into the last frames of each utterance
+    mask = torch.arange(T_pad, device=xs.device).unsqueeze(0) < xlens.to(xs.device).long().unsqueeze(1)
+    xs = xs.masked_fill(mask.unsqueeze(2) == 0, 0.)
+
+    # `[B, T_new, input_dim, n_stacks]` -> `[B, T_new, n_stacks * input_dim]`
+    xs = xs.unfold(1, n_stacks, n_skips).transpose(3, 2).contiguous()
+    return xs.view(bs, T_new, n_stacks * input_dim), xlens_new
@@ -7,7 +7,7 @@
 """SpecAugment data augmentation."""
 
 import logging
-import numpy as np
+import torch
 
 logger = logging.getLogger(__name__)
 
@@ -20,7 +20,7 @@ class SpecAugment(object):
         T (int): parameter for time masking
         n_freq_masks (int): number of frequency masks
         n_time_masks (int): number of time masks
-        W (int): parameter for time warping
+        W (int): parameter for time warping. 0 means no time warping.
         p (float): parameter for upperbound of the time mask
         adaptive_number_ratio (float): adaptive multiplicity ratio for time masking
         adaptive_size_ratio (float): adaptive size ratio for time masking
@@ -28,7 +28,7 @@ class SpecAugment(object):
 
     """
 
-    def __init__(self, F, T, n_freq_masks, n_time_masks, p=1.0, W=40,
+    def __init__(self, F, T, n_freq_masks, n_time_masks, p=1.0, W=0,
                  adaptive_number_ratio=0, adaptive_size_ratio=0,
                  max_n_time_masks=20):
 
@@ -90,54 +90,149 @@ class SpecAugment(object):
 
     @property
     def freq_mask(self):
+        """Frequency mask applied to the last mini-batch of size `[B, F]`."""
         return self._freq_mask
 
     @property
     def time_mask(self):
+        """Time mask applied to the last mini-batch of size `[B, T]`."""
         return self._time_mask
 
-    def __call__(self, xs):
+    def __call__(self, xs, xlens=None):
         """
         Args:
             xs (FloatTensor): `[B, T, F]`
+            xlens (IntTensor): `[B]`. All utterances are regarded as `T` frames if not given.
         Returns:
             xs (FloatTensor): `[B, T, F]`
 
         """
-        # xs = self.time_warp(xs)
+        if xlens is None:
+            xlens = torch.IntTensor([xs.size(1)] * xs.size(0))
+        xlens = xlens.to(xs.device).long()
+        if self.W > 0:
+            xs = self.time_warp(xs, xlens)
         xs = self.mask_freq(xs)
-        xs = self.mask_time(xs)
+        xs = self.mask_time(xs, xlens)
         return xs
 
-    def time_warp(xs, W=40):
-        raise NotImplementedError
+    def time_warp(self, xs, xlens):
+        """Warp each utterance in the time direction.
+
+        A point at c is moved to c + w, where c and w are sampled from
+        [W, xlen - W) and [-W, W] per utterance, and frames are linearly
+        interpolated. Utterances shorter than 2W + 1 frames are not warped.
+
+        Args:
+            xs (FloatTensor): `[B, T, F]`
+            xlens (LongTensor): `[B]`
+        Returns:
+            xs (FloatTensor): `[B, T, F]`
+
+        """
+        bs, n_frames, n_bins = xs.size()
+        W = self.W
+        device = xs.device
+        xlens_f = xlens.float()
+
+        center = W + (torch.rand(bs, device=device) * (xlens_f - 2 * W)).floor()
+        warped = center + (torch.rand(bs, device=device) * (2 * W + 1)).floor() - W
+        is_warped = (xlens > 2 * W).float()
+        center = center * is_warped + xlens_f * (1 - is_warped)
+        warped = warped * is_warped + xlens_f * (1 - is_warped)
+
+        # source position of each frame after warping
+        t = torch.arange(n_frames, device=device).float().unsqueeze(0)  # `[1, T]`
+        center, warped, xlens_f = center.unsqueeze(1), warped.unsqueeze(1), xlens_f.unsqueeze(1)
+        src_left = t * center / warped.clamp(min=1)
+        src_right = center + (t - warped) * (xlens_f - center) / (xlens_f - warped).clamp(min=1)
+        src = torch.where(t < warped, src_left, src_right)
+        last = (xlens_f - 1).clamp(min=0).expand_as(src)
+        is_inside = t.expand_as(src) < xlens_f
+        src = torch.where(is_inside, torch.min(src, last), t.expand_as(src))  # padded frames are kept
+
+        # linear interpolation
+        src_l = src.floor()
+        ratio = (src - src_l).unsqueeze(2)
+        src_r = torch.where(is_inside, torch.min(src_l + 1, last), src_l)
+        src_l, src_r = src_l.long(), src_r.long()
+        xs_l = xs.gather(1, src_l.unsqueeze(2).expand(bs, n_frames, n_bins))
+        xs_r = xs.gather(1, src_r.unsqueeze(2).expand(bs, n_frames, n_bins))
+        return xs_l * (1 - ratio) + xs_r * ratio
 
     def mask_freq(self, xs, replace_with_zero=False):
-        n_bins = xs.size(-1)
-        for i in range(0, self.n_freq_masks):
-            f = int(np.random.uniform(low=0, high=self.F))
-            f_0 = int(np.random.uniform(low=0, high=n_bins - f))
-            xs[:, :, f_0:f_0 + f] = 0
-            assert f_0 <= f_0 + f
-            self._freq_mask = (f_0, f_0 + f)
-        return xs
+        """Mask frequency bins of each utterance independently.
+
+        Args:
+            xs (FloatTensor): `[B, T, F]`
+        Returns:
+            xs (FloatTensor): `[B, T, F]`
+
+        """
+        bs, _, n_bins = xs.size()
+        device = xs.device
+        if self.n_freq_masks == 0:
+            self._freq_mask = torch.zeros(bs, n_bins, device=device) > 0
+            return xs
+
+        # `[B, n_freq_masks]`
+        f = (torch.rand(bs, self.n_freq_masks, device=device) * self.F).floor()
+        f_0 = (torch.rand(bs, self.n_freq_masks, device=device) * (n_bins - f)).floor()
+        self._freq_mask = self._make_mask(f_0, f, n_bins)
+        return xs.masked_fill(self._freq_mask.unsqueeze(1), 0)
+
+    def mask_time(self, xs, xlens=None, replace_with_zero=False):
+        """Mask frames of each utterance independently according to its length.
+
+        Args:
+            xs (FloatTensor): `[B, T, F]`
+            xlens (LongTensor): `[B]`
+        Returns:
+            xs (FloatTensor): `[B, T, F]`
+
+        """
+        bs, n_frames, _ = xs.size()
+        device = xs.device
+        if xlens is None:
+            xlens = torch.LongTensor([n_frames] * bs)
+        xlens = xlens.to(device).float().unsqueeze(1)  # `[B, 1]`
 
-    def mask_time(self, xs, replace_with_zero=False):
-        n_frames = xs.size(1)
         if self.adaptive_number_ratio > 0:
-            n_masks = int(n_frames * self.adaptive_number_ratio)
-            n_masks = min(n_masks, self.max_n_time_masks)
+            n_masks = (xlens * self.adaptive_number_ratio).floor().clamp(max=self.max_n_time_masks)
         else:
-            n_masks = self.n_time_masks
+            n_masks = xlens.new_zeros(bs, 1).fill_(self.n_time_masks)
+        max_n_masks = int(n_masks.max()) if bs > 0 else 0
+        if max_n_masks == 0:
+            self._time_mask = torch.zeros(bs, n_frames, device=device) > 0
+            return xs
+
         if self.adaptive_size_ratio > 0:
-            T = self.adaptive_size_ratio * n_frames
+            T = self.adaptive_size_ratio * xlens
         else:
-            T = self.T
-        for i in range(n_masks):
-            t = int(np.random.uniform(low=0, high=T))
-            t = min(t, int(n_frames * self.p))
-            t_0 = int(np.random.uniform(low=0, high=n_frames - t))
-            xs[:, t_0:t_0 + t] = 0
-            assert t_0 <= t_0 + t
-            self._time_mask = (t_0, t_0 + t)
-        return xs
+            T = xlens.new_zeros(bs, 1).fill_(self.T)
+
+        # `[B, max_n_masks]`
+        t = (torch.rand(bs, max_n_masks, device=device) * T).floor()
+        t = torch.min(t, (xlens * self.p).floor().expand_as(t))
+        t_0 = (torch.rand(bs, max_n_masks, device=device) * (xlens - t)).floor()
+        # disable masks over the number of masks of each utterance
+        is_valid = (torch.arange(max_n_masks, device=device).float().unsqueeze(0) < n_masks).float()
+        t = t * is_valid
+        self._time_mask = self._make_mask(t_0, t, n_frames)
+        return xs.masked_fill(self._time_mask.unsqueeze(2), 0)
+
+    @staticmethod
+    def _make_mask(start, width, size):
+        """Make a mask of the union of [start, start + width) per utterance.
+
+        Args:
+            start (FloatTensor): `[B, N]`
+            width (FloatTensor): `[B, N]`
+            size (int): size of masked dimension
+        Returns:
+            mask (BoolTensor): `[B, size]`
+
+        """
+        pos = torch.arange(size, device=start.device).float().view(1, 1, size)
+        mask = (pos >= start.unsqueeze(2)) & (pos < (start + width).unsqueeze(2))
+        return mask.sum(1) > 0
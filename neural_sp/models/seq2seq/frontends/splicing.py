@@ -34,31 +34,31 @@ def splice(feat, n_splices=1, n_stacks=1, dtype=np.float32):
 
     max_xlen, input_dim = feat.shape
     freq = (input_dim // 3) // n_stacks
-    feat_splice = np.zeros((max_xlen, freq * (n_splices * n_stacks) * 3), dtype=dtype)
-
-    for i_time in range(max_xlen):
-        spliced_frames = np.zeros((n_splices * n_stacks, freq, 3))
-        for i_splice in range(0, n_splices, 1):
-            if i_time <= n_splices - 1 and i_splice < n_splices - i_time:
-                # copy the first frame to left side (padding left frames)
-                copy_frame = feat[0]
-            elif max_xlen - n_splices <= i_time and i_time + (i_splice - n_splices) > max_xlen - 1:
-                # copy the last frame to right side (padding right frames)
-                copy_frame = feat[-1]
-            else:
-                copy_frame = feat[i_time + (i_splice - n_splices)]
-
-            # `[freq * 3 * n_stacks]` -> `[freq, 3, n_stacks]`
-            copy_frame = copy_frame.reshape((freq, 3, n_stacks))
-
-            # `[freq, 3, n_stacks]` -> `[n_stacks, freq, 3]`
-            copy_frame = np.transpose(copy_frame, (2, 0, 1))
-
-            spliced_frames[i_splice: i_splice + n_stacks] = copy_frame
-
-        # `[n_splices * n_stacks, freq, 3] -> `[freq, n_splices * n_stacks, 3]`
-        spliced_frames = np.transpose(spliced_frames, (1, 0, 2))
-
-        feat_splice[i_time] = spliced_frames.reshape((freq * (n_splices * n_stacks) * 3))
-
-    return feat_splice
+    n_slots = n_splices * n_stacks
+
+    # the i-th spliced frame at time t is feat[t + i - n_splices],
+    # where the first frame is copied to the left side (padding left frames)
+    feat_pad = np.concatenate([np.repeat(feat[:1], n_splices, axis=0), feat], axis=0)
+    stride_t, stride_d = feat_pad.strides
+    windows = np.lib.stride_tricks.as_strided(
+        feat_pad, shape=(max_xlen, n_splices, input_dim),
+        strides=(stride_t, stride_t, stride_d))
+
+    # `[T, n_splices, freq * 3 * n_stacks]` -> `[T, n_splices, n_stacks, freq, 3]`
+    windows = windows.reshape((max_xlen, n_splices, freq, 3, n_stacks)).transpose((0, 1, 4, 2, 3))
+
+    # NOTE: stacked frames of the i-th splice are placed from the i-th slot and
+    # overwritten by those of the next splice, so the j-th slot holds the
+    # (j - i)-th stacked frame of the i = min(j, n_splices - 1)-th splice.
+    # The remaining slots are filled with zeros.
+    slots = np.arange(n_slots)
+    splice_idx = np.minimum(slots, n_splices - 1)
+    stack_idx = slots - splice_idx
+    is_valid = stack_idx < n_stacks
+    spliced_frames = np.zeros((max_xlen, n_slots, freq, 3), dtype=dtype)
+    spliced_frames[:, is_valid] = windows[:, splice_idx[is_valid], stack_idx[is_valid]]
+
+    # `[T, n_splices * n_stacks, freq, 3] -> `[T, freq, n_splices * n_stacks, 3]`
+    feat_splice = spliced_frames.transpose((0, 2, 1, 3))
+
+    return feat_splice.reshape((max_xlen, freq * n_slots * 3))
@@ -6,7 +6,12 @@
 
 """Streaming encoding interface."""
 
+import collections
+import copy
+import numpy as np
+import threading
 import torch
+import weakref
 
 
 class Streaming(object):
@@ -15,12 +20,13 @@ class Streaming(object):
     def __init__(self, x_whole, params, encoder, idx2token):
         """
         Args:
-            x_whole (FloatTensor): `[T, input_dim]`
+            x_whole (np.ndarray): `[T, input_dim]`. Set None to append features incrementally.
 
         """
         super(Streaming, self).__init__()
 
         self.x_whole = x_whole
+        self.x_offset = 0  # global time index of the first frame in x_whole
         self.encoder = encoder
         if self.encoder.conv is not None:
             self.encoder.turn_off_ceil_mode(self.encoder)
@@ -29,8 +35,9 @@ class Streaming(object):
         # latency
         self.factor = encoder.subsampling_factor
         self.N_l = encoder.chunk_size_left
-        # self.N_c = getattr(encoder, 'chunk_size_current', -1)  # for Transformer
-        self.N_c = encoder.chunk_size_left  # for Transformer
+        if getattr(encoder, 'streaming_with_cache', False):
+            # for Transformer, the left context is carried over in the encoder cache
+            self.N_l = encoder.chunk_size_current
         self.N_r = encoder.chunk_size_right
         if self.N_l == 0 and self.N_r == 0:
             self.N_l = 40  # for unidirectional encoder
@@ -71,26 +78,78 @@ class Streaming(object):
     def next_chunk(self):
         self.offset += self.N_l
 
-    def extract_feature(self):
+    @property
+    def n_frames(self):
+        """Number of frames received so far."""
+        return self.x_offset + (len(self.x_whole) if self.x_whole is not None else 0)
+
+    def append_feature(self, x):
+        """Append input features arriving from a stream.
+
+        Args:
+            x (np.ndarray): `[T_chunk, input_dim]`
+
+        """
+        if self.x_whole is None:
+            self.x_whole = x
+        else:
+            self.x_whole = np.concatenate([self.x_whole, x], axis=0)
+
+    def is_ready(self, is_final=False):
+        """Check whether enough frames are buffered to encode the next chunk.
+
+        Args:
+            is_final (bool): no more features arrive in the session
+        Returns:
+            bool
+
+        """
+        if self.x_whole is None:
+            return False
+        if is_final:
+            return self.offset < self.n_frames
+        # NOTE: one more frame is required to judge lookahead as in offline decoding
+        return self.offset + self.N_l + self.N_r + self.conv_lookahead_n_frames < self.n_frames
+
+    def extract_feature(self, is_final=True):
+        """Extract the next chunk of input features.
+
+        Args:
+            is_final (bool): no more features arrive in the session
+        Returns:
+            x_chunk (np.ndarray): `[T_chunk, input_dim]`
+            is_last_chunk (bool):
+            lookback (bool): truncate leftmost frames for lookback in CNN context
+            lookahead (bool): truncate rightmost frames for lookahead in CNN context
+
+        """
         j = self.offset
         l = self.N_l
         r = self.N_r
 
+        # Discard frames that are never referred to again
+        # NOTE: the offset does not go back beyond the head of the current chunk
+        n_discard = max(0, j - self.conv_lookback_n_frames - self.x_offset)
+        if n_discard > 0:
+            self.x_whole = self.x_whole[n_discard:]
+            self.x_offset += n_discard
+        j_local = j - self.x_offset
+
         # Encode input features chunk by chunk
         if getattr(self.encoder, 'conv', None) is not None:
             context = self.encoder.conv.n_frames_context
-            x_chunk = self.x_whole[max(0, j - context):j + (l + r) + context]
+            x_chunk = self.x_whole[max(0, j_local - context):j_local + (l + r) + context]
         else:
-            x_chunk = self.x_whole[j:j + (l + r)]
+            x_chunk = self.x_whole[j_local:j_local + (l + r)]
 
-        is_last_chunk = (j + l - 1) >= len(self.x_whole) - 1
+        is_last_chunk = is_final and (j + l - 1) >= self.n_frames - 1
         self.bd_offset = -1  # reset
         self.n_accum_frames += min(self.N_l, x_chunk.shape[1])
 
         start = j - self.conv_lookback_n_frames
         end = j + (l + r) + self.conv_lookahead_n_frames
         lookback = start >= 0
-        lookahead = end <= self.x_whole.shape[0] - 1
+        lookahead = end <= self.n_frames - 1
 
         return x_chunk, is_last_chunk, lookback, lookahead
 
@@ -166,3 +225,348 @@ class Streaming(object):
                 print('Back %d frames (%d -> %d)' %
                       (x_chunk[(self.bd_offset + 1) * self.factor:self.N_l].shape[0],
                        offset_prev, self.offset))
+
+
+_MODEL_LOCKS = weakref.WeakKeyDictionary()
+_MODEL_LOCKS_GUARD = threading.Lock()
+
+
+def _model_lock(model):
+    """Return a lock shared by all sessions decoding with the same model."""
+    with _MODEL_LOCKS_GUARD:
+        if model not in _MODEL_LOCKS:
+            _MODEL_LOCKS[model] = threading.Lock()
+        return _MODEL_LOCKS[model]
+
+
+def _recog_params_key(params):
+    """Return a hashable snapshot of decoding hyper-parameters.
+
+    Sessions with equal parameters are batched even if their dicts are
+    constructed separately.
+
+    """
+    def _hashable(v):
+        if isinstance(v, (list, tuple)):
+            return tuple(_hashable(x) for x in v)
+        if isinstance(v, dict):
+            return tuple(sorted((k, _hashable(x)) for k, x in v.items()))
+        return v
+    return tuple(sorted((k, _hashable(v)) for k, v in params.items() if k.startswith('recog_')))
+
+
+class StreamingSession(object):
+    """Stateful streaming decoding session.
+
+    Input features are fed as they arrive, and every chunk that becomes
+    available is encoded and decoded immediately. Encoder caches, decoder
+    hypotheses, CTC-VAD counters and LM states are held by the session and
+    swapped into the model during each call, so that many sessions can share
+    one model in a process.
+
+    Args:
+        model (Speech2Text): ASR model
+        params (dict): hyper-parameters for decoding
+        idx2token (): converter from index to token
+        stdout (bool): print intermediate results
+
+    """
+
+    def __init__(self, model, params, idx2token, stdout=False):
+
+        # check configurations
+        assert model.input_type == 'speech'
+        assert model.ctc_weight > 0
+        assert model.fwd_weight > 0
+
+        self.model = model
+        self.params = params
+        self.global_params = copy.deepcopy(params)
+        self.global_params['recog_max_len_ratio'] = 1.0
+        self.idx2token = idx2token
+        self.stdout = stdout
+
+        self.streaming = Streaming(None, params, model.enc, idx2token)
+
+        self.hyps = None  # active hypotheses in chunk-synchronous decoding
+        self.best_hyp_id_prefix = []  # best partial hypothesis in the current segment
+        self.best_hyp_id_stream = []  # hypotheses of finalized segments
+        self.is_reset = True  # for the first chunk
+        self.is_finished = False
+
+        # states swapped into the model
+        # NOTE: decoder states start from scratch regardless of other sessions
+        self.enc_cache = None
+        self.dec_cache = {k: None for k in model.dec_fwd.get_cache().keys()}
+
+    def feed(self, x, is_final=False):
+        """Feed input features and decode all available chunks.
+
+        Args:
+            x (np.ndarray): `[T_chunk, input_dim]`
+            is_final (bool): x is the end of the session
+        Returns:
+            hyp_id (np.ndarray): `[L]`, finalized segments followed by
+                the best partial hypothesis in the current segment
+            segment_hyp_ids (list): hypotheses of segments finalized in this call,
+                each of which is an array of size `[L]`
+
+        """
+        return StreamingScheduler(self.model).feed([(self, x, is_final)])[0]
+
+    @property
+    def hyp_id(self):
+        """Hypothesis of the session so far. `[L]`"""
+        hyp_id = list(self.best_hyp_id_stream)
+        if not self.is_finished:
+            hyp_id += list(self.best_hyp_id_prefix)
+        return np.array(hyp_id, dtype=np.int64)
+
+    def _prepare_chunk(self, eout_chunk, ctc_probs_chunk, is_last_chunk):
+        """Run CTC-based VAD and truncate encoder outputs of the current chunk.
+
+        Args:
+            eout_chunk (FloatTensor): `[1, T_chunk, enc_n_units]`
+            ctc_probs_chunk (FloatTensor): `[1, T_chunk, vocab]`
+            is_last_chunk (bool):
+        Returns:
+            eout_chunk (FloatTensor): `[1, T_chunk', enc_n_units]`
+            ctc_log_probs_chunk (FloatTensor): `[1, T_chunk, vocab]`
+
+        """
+        params = self.params
+        streaming = self.streaming
+
+        self.is_reset = False  # detect the first boundary in the same chunk
+
+        # CTC-based VAD
+        ctc_log_probs_chunk = None
+        if streaming.is_ctc_vad:
+            if params['recog_ctc_weight'] > 0:
+                ctc_log_probs_chunk = torch.log(ctc_probs_chunk)
+            self.is_reset = streaming.ctc_vad(ctc_probs_chunk, stdout=self.stdout)
+
+        # Truncate the most right frames
+        if self.is_reset and not is_last_chunk and streaming.bd_offset >= 0:
+            eout_chunk = eout_chunk[:, :streaming.bd_offset]
+        streaming.eout_chunks.append(eout_chunk)
+        return eout_chunk, ctc_log_probs_chunk
+
+    def _finish_chunk(self, x_chunk, eout_chunk, end_hyps, is_last_chunk, segment_hyp_ids):
+        """Segment the session and move to the next chunk.
+
+        Args:
+            x_chunk (np.ndarray): `[T_chunk, input_dim]`
+            eout_chunk (FloatTensor): `[1, T_chunk, enc_n_units]`
+            end_hyps (list): ended hypotheses in chunk-synchronous decoding
+            is_last_chunk (bool):
+            segment_hyp_ids (list): hypotheses of finalized segments are appended
+
+        """
+        model = self.model
+        params = self.params
+        streaming = self.streaming
+        lm = getattr(model, 'lm_fwd', None)
+        lm_second = getattr(model, 'lm_second', None)
+
+        # Chunk-synchronous attention decoding
+        if params['recog_chunk_sync']:
+            merged_hyps = sorted(end_hyps + self.hyps, key=lambda x: x['score'], reverse=True)
+            self.best_hyp_id_prefix = np.array(merged_hyps[0]['hyp'][1:])
+            if len(self.best_hyp_id_prefix) > 0 and self.best_hyp_id_prefix[-1] == model.eos:
+                # reset beam if <eos> is generated from the best hypothesis
+                self.best_hyp_id_prefix = self.best_hyp_id_prefix[:-1]  # exclude <eos>
+                # Segmentation strategy 2:
+                # If <eos> is emitted from the decoder (not CTC),
+                # the current chunk is segmented.
+                if not self.is_reset:
+                    streaming.bd_offset = eout_chunk.size(1) - 1
+                    self.is_reset = True
+            if self.stdout and len(self.best_hyp_id_prefix) > 0:
+                print('\r%s' % (self.idx2token(self.best_hyp_id_prefix)))
+
+        if self.is_reset:
+            # Global decoding over the segmented region
+            if not params['recog_chunk_sync']:
+                eout = torch.cat(streaming.eout_chunks, dim=1)
+                elens = torch.IntTensor([eout.size(1)])
+                ctc_log_probs = None
+                if params['recog_ctc_weight'] > 0:
+                    ctc_log_probs = torch.log(model.dec_fwd.ctc_probs(eout))
+                nbest_hyps_id_offline = model.dec_fwd.beam_search(
+                    eout, elens, self.global_params, self.idx2token, lm, lm_second,
+                    ctc_log_probs=ctc_log_probs)[0]
+                best_hyp_id_segment = nbest_hyps_id_offline[0][0]
+            else:
+                best_hyp_id_segment = self.best_hyp_id_prefix
+
+            # pick up the best hyp from ended and active hypotheses
+            if len(best_hyp_id_segment) > 0:
+                self.best_hyp_id_stream.extend(best_hyp_id_segment)
+                segment_hyp_ids.append(np.array(best_hyp_id_segment))
+            self.best_hyp_id_prefix = []
+
+            # reset
+            streaming.reset(stdout=self.stdout)
+            self.hyps = None
+
+        streaming.next_chunk()
+        # next chunk will start from the frame next to the boundary
+        if not is_last_chunk:
+            streaming.backoff(x_chunk, model.dec_fwd, stdout=self.stdout)
+
+    def _finalize(self, segment_hyp_ids):
+        model = self.model
+        streaming = self.streaming
+
+        # Global decoding over the last chunk
+        if not self.params['recog_chunk_sync'] and len(streaming.eout_chunks) > 0:
+            eout = torch.cat(streaming.eout_chunks, dim=1)
+            elens = torch.IntTensor([eout.size(1)])
+            nbest_hyps_id_offline = model.dec_fwd.beam_search(
+                eout, elens, self.global_params, self.idx2token,
+                getattr(model, 'lm_fwd', None), getattr(model, 'lm_second', None))[0]
+            if len(nbest_hyps_id_offline[0][0]) > 0:
+                self.best_hyp_id_stream.extend(nbest_hyps_id_offline[0][0])
+                segment_hyp_ids.append(np.array(nbest_hyps_id_offline[0][0]))
+
+        # pick up the best hyp
+        if not self.is_reset and self.params['recog_chunk_sync'] and len(self.best_hyp_id_prefix) > 0:
+            self.best_hyp_id_stream.extend(self.best_hyp_id_prefix)
+            segment_hyp_ids.append(np.array(self.best_hyp_id_prefix))
+
+        self.is_finished = True
+
+
+class StreamingScheduler(object):
+    """Batched streaming decoding over multiple sessions sharing one model.
+
+    The next chunks of all sessions ready to be decoded are encoded in a
+    single batched call, and CTC posteriors for VAD are computed in the same
+    batch. Chunks are grouped by the number of frames and CNN context flags
+    because the streaming encoder does not pad chunks. Encoder caches of all
+    sessions in a group are merged before the call and split back after it,
+    and a session reset by CTC-VAD starts from an empty cache. In
+    chunk-synchronous decoding, hypotheses of all sessions are also expanded
+    in a single batched beam search step, where decoder states of each session
+    are swapped in and out through its cache. Segmentation and global
+    decoding are performed session by session.
+
+    Args:
+        model (Speech2Text): ASR model shared by all sessions
+
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def feed(self, inputs):
+        """Feed input features to sessions and decode all available chunks.
+
+        Args:
+            inputs (list): A list of `(session, x, is_final)`, where
+                x (np.ndarray) is `[T_chunk, input_dim]` or None
+        Returns:
+            outputs (list): A list of `(hyp_id, segment_hyp_ids)` for each input.
+                See StreamingSession.feed().
+
+        """
+        model = self.model
+        sessions = [session for session, _, _ in inputs]
+        assert len(set(map(id, sessions))) == len(sessions), 'Sessions must be unique.'
+        for session, x, is_final in inputs:
+            assert session.model is model
+            assert not session.is_finished
+            if x is not None and len(x) > 0:
+                session.streaming.append_feature(x)
+
+        segment_hyp_ids = [[] for _ in inputs]
+        with _model_lock(model):
+            model.eval()
+            with torch.no_grad():
+                active = list(range(len(inputs)))
+                while True:
+                    ready = [i for i in active if sessions[i].streaming.is_ready(inputs[i][2])]
+                    if len(ready) == 0:
+                        break
+
+                    # group chunks having the same shape
+                    groups = collections.OrderedDict()
+                    for i in ready:
+                        chunk = sessions[i].streaming.extract_feature(inputs[i][2])
+                        x_chunk, is_last_chunk, lookback, lookahead = chunk
+                        key = (x_chunk.shape[0], lookback, lookahead)
+                        groups.setdefault(key, []).append((i, chunk))
+                        if is_last_chunk:
+                            active.remove(i)
+
+                    for group in groups.values():
+                        self._step([sessions[i] for i, _ in group],
+                                   [chunk for _, chunk in group],
+                                   [segment_hyp_ids[i] for i, _ in group])
+
+                for i, (session, _, is_final) in enumerate(inputs):
+                    if is_final:
+                        model.dec_fwd.set_cache(session.dec_cache)
+                        session._finalize(segment_hyp_ids[i])
+                        session.dec_cache = model.dec_fwd.get_cache()
+
+        return [(session.hyp_id, segment_hyp_ids[i]) for i, session in enumerate(sessions)]
+
+    def _step(self, sessions, chunks, segment_hyp_ids):
+        model = self.model
+        enc = model.enc
+        _, _, lookback, lookahead = chunks[0]
+
+        # Encode chunks of all sessions at once
+        enc.set_cache(enc.batch_cache([None if s.is_reset else s.enc_cache for s in sessions]))
+        eout_chunks = model.encode([chunk[0] for chunk in chunks], 'ys',
+                                   streaming=True,
+                                   lookback=lookback,
+                                   lookahead=lookahead)['ys']['xs']
+        for session, cache in zip(sessions, enc.split_cache(enc.get_cache(), len(sessions))):
+            session.enc_cache = cache
+
+        ctc_probs_chunks = None
+        if any(s.streaming.is_ctc_vad for s in sessions):
+            ctc_probs_chunks = model.dec_fwd.ctc_probs(eout_chunks)
+
+        # Decode chunks of all sessions at once
+        # NOTE: chunks are grouped by the number of frames after truncation by CTC-VAD,
+        # the length of the MoChA tail of the previous chunk, and decoding parameters
+        groups = collections.OrderedDict()
+        for b, (session, chunk) in enumerate(zip(sessions, chunks)):
+            eout_chunk, ctc_log_probs_chunk = session._prepare_chunk(
+                eout_chunks[b:b + 1],
+                ctc_probs_chunks[b:b + 1] if ctc_probs_chunks is not None else None,
+                chunk[1])
+            key_prev_tail = session.dec_cache.get('key_prev_tail')
+            key = (eout_chunk.size(1), key_prev_tail.size(1) if key_prev_tail is not None else -1,
+                   _recog_params_key(session.params))
+            groups.setdefault(key, []).append((b, eout_chunk, ctc_log_probs_chunk))
+
+        for group in groups.values():
+            ids = [b for b, _, _ in group]
+            eout_chunks_g = torch.cat([eout_chunk for _, eout_chunk, _ in group], dim=0)
+            params = sessions[ids[0]].params
+            end_hyps = [None] * len(ids)
+            if params['recog_chunk_sync']:
+                ctc_log_probs_chunks_g = None
+                if group[0][2] is not None:
+                    ctc_log_probs_chunks_g = torch.cat([ctc_log_probs for _, _, ctc_log_probs in group], dim=0)
+                end_hyps, hyps, caches = model.dec_fwd.beam_search_chunk_sync_batch(
+                    eout_chunks_g, params, sessions[ids[0]].idx2token, getattr(model, 'lm_fwd', None),
+                    ctc_log_probs=ctc_log_probs_chunks_g,
+                    hyps=[sessions[b].hyps for b in ids],
+                    caches=[sessions[b].dec_cache for b in ids],
+                    state_carry_over=False,
+                    ignore_eos=enc.enc_type in ['lstm', 'conv_lstm'])
+                for b, hyps_b, cache in zip(ids, hyps, caches):
+                    sessions[b].hyps = hyps_b
+                    sessions[b].dec_cache = cache
+
+            for k, b in enumerate(ids):
+                model.dec_fwd.set_cache(sessions[b].dec_cache)
+                sessions[b]._finish_chunk(chunks[b][0], eout_chunks_g[k:k + 1], end_hyps[k],
+                                          chunks[b][1], segment_hyp_ids[b])
+                sessions[b].dec_cache = model.dec_fwd.get_cache()
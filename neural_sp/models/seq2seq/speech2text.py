@@ -6,7 +6,6 @@
 
 """Speech to text sequence-to-sequence model."""
 
-import copy
 import logging
 import numpy as np
 import random
@@ -21,6 +20,7 @@ from neural_sp.models.seq2seq.decoders.fwd_bwd_attention import fwd_bwd_attentio
 from neural_sp.models.seq2seq.decoders.rnn_transducer import RNNTransducer
 from neural_sp.models.seq2seq.encoders.build import build_encoder
 from neural_sp.models.seq2seq.frontends.frame_stacking import stack_frame
+from neural_sp.models.seq2seq.frontends.frame_stacking import stack_frame_pad
 from neural_sp.models.seq2seq.frontends.input_noise import add_input_noise
 from neural_sp.models.seq2seq.frontends.sequence_summary import SequenceSummaryNetwork
 from neural_sp.models.seq2seq.frontends.spec_augment import SpecAugment
@@ -98,7 +98,7 @@ class Speech2Text(ModelBase):
         self.n_splices = args.n_splices
         self.weight_noise_std = args.weight_noise_std
         self.specaug = None
-        if args.n_freq_masks > 0 or args.n_time_masks > 0:
+        if args.n_freq_masks > 0 or args.n_time_masks > 0 or args.time_warp_width > 0:
             assert args.n_stacks == 1 and args.n_skips == 1
             assert args.n_splices == 1
             self.specaug = SpecAugment(F=args.freq_width,
@@ -106,6 +106,7 @@ class Speech2Text(ModelBase):
                                        n_freq_masks=args.n_freq_masks,
                                        n_time_masks=args.n_time_masks,
                                        p=args.time_width_upper,
+                                       W=args.time_warp_width,
                                        adaptive_number_ratio=args.adaptive_number_ratio,
                                        adaptive_size_ratio=args.adaptive_size_ratio,
                                        max_n_time_masks=args.max_n_time_masks)
@@ -217,6 +218,17 @@ class Speech2Text(ModelBase):
             if hasattr(self, 'dec_fwd_' + sub):
                 getattr(self, 'dec_fwd_' + sub).reset_session()
 
+    def reset_state_carry_over(self):
+        # main task
+        for dir in ['fwd', 'bwd']:
+            if hasattr(self, 'dec_' + dir):
+                getattr(self, 'dec_' + dir).reset_state_carry_over()
+
+        # sub task
+        for sub in ['sub1', 'sub2']:
+            if hasattr(self, 'dec_fwd_' + sub):
+                getattr(self, 'dec_fwd_' + sub).reset_state_carry_over()
+
     def forward(self, batch, task, is_eval=False, teacher=None, teacher_lm=None):
         """Forward pass.
 
@@ -252,10 +264,12 @@ class Speech2Text(ModelBase):
     def _forward(self, batch, task, teacher=None, teacher_lm=None):
         # Encode input features
         if self.input_type == 'speech':
+            # NOTE: use inputs padded by the data loader if available
+            xs = batch['xs_pad'] if 'xs_pad' in batch else batch['xs']
             if self.mtl_per_batch:
-                eout_dict = self.encode(batch['xs'], task)
+                eout_dict = self.encode(xs, task)
             else:
-                eout_dict = self.encode(batch['xs'], 'all')
+                eout_dict = self.encode(xs, 'all')
         else:
             eout_dict = self.encode(batch['ys_sub1'])
 
@@ -347,11 +361,43 @@ class Speech2Text(ModelBase):
         logits = lm.output(lmout)
         return logits
 
+    def collate(self, xs, device=None, pin_memory=False):
+        """Stack, splice and pad input features.
+
+        Args:
+            xs (list): A list of length `[B]`, which contains arrays of size `[T, input_dim]`
+            device (torch.device): device to place the padded inputs
+            pin_memory (bool): place the padded inputs in page-locked memory
+        Returns:
+            xs (FloatTensor): `[B, T, input_dim * n_stacks * n_splices]`
+            xlens (IntTensor): `[B]`
+
+        """
+        if self.n_splices > 1:
+            # Frame stacking
+            if self.n_stacks > 1:
+                xs = [stack_frame(x, self.n_stacks, self.n_skips) for x in xs]
+
+            # Splicing
+            xs = [splice(x, self.n_splices, self.n_stacks) for x in xs]
+
+        xlens = torch.IntTensor([len(x) for x in xs])
+        xs = pad_list([np2tensor(x, device).float() for x in xs], 0.)
+
+        # Frame stacking over the padded batch
+        if self.n_splices == 1 and self.n_stacks > 1:
+            xs, xlens = stack_frame_pad(xs, xlens, self.n_stacks, self.n_skips)
+
+        if pin_memory:
+            xs = xs.pin_memory()
+        return xs, xlens
+
     def encode(self, xs, task='all', streaming=False, lookback=False, lookahead=False):
         """Encode acoustic or text features.
 
         Args:
-            xs (list): A list of length `[B]`, which contains Tensor of size `[T, input_dim]`
+            xs (list): A list of length `[B]`, which contains Tensor of size `[T, input_dim]`.
+                A tuple of padded inputs returned by collate() is also accepted.
             task (str): all/ys*/ys_sub1*/ys_sub2*
             streaming (bool): streaming encoding
             lookback (bool): truncate leftmost frames for lookback in CNN context
@@ -361,20 +407,15 @@ class Speech2Text(ModelBase):
 
         """
         if self.input_type == 'speech':
-            # Frame stacking
-            if self.n_stacks > 1:
-                xs = [stack_frame(x, self.n_stacks, self.n_skips) for x in xs]
-
-            # Splicing
-            if self.n_splices > 1:
-                xs = [splice(x, self.n_splices, self.n_stacks) for x in xs]
-
-            xlens = torch.IntTensor([len(x) for x in xs])
-            xs = pad_list([np2tensor(x, self.device).float() for x in xs], 0.)
+            if isinstance(xs, tuple):
+                xs, xlens = xs
+                xs = xs.to(self.device, non_blocking=True)
+            else:
+                xs, xlens = self.collate(xs, device=self.device)
 
             # SpecAugment
             if self.specaug is not None and self.training:
-                xs = self.specaug(xs)
+                xs = self.specaug(xs, xlens)
 
             # Weight noise injection
             if self.weight_noise_std > 0:
@@ -445,143 +486,44 @@ class Speech2Text(ModelBase):
             self.dec_fwd_sub2._plot_ctc(mkdir_join(self.save_path, 'ctc_sub2'))
 
     def decode_streaming(self, xs, params, idx2token, exclude_eos=False, task='ys'):
-        from neural_sp.models.seq2seq.frontends.streaming import Streaming
+        """Simulate streaming decoding by feeding a whole utterance to a session.
 
+        Args:
+            xs (list): A list of length `[1]`, which contains an array of size `[T, input_dim]`
+            params (dict): hyper-parameters for decoding
+            idx2token (): converter from index to token
+            exclude_eos (bool): not used (to make compatible)
+            task (str): ys only
+        Returns:
+            best_hyps_id (list): A list of length `[1]`, which contains an array of size `[L]`
+            aws (list): A list of length `[1]`, which contains None
+
+        """
         # check configurations
         assert task == 'ys'
-        assert self.input_type == 'speech'
-        assert self.ctc_weight > 0
-        assert self.fwd_weight > 0
         assert len(xs) == 1  # batch size
-        # assert params['recog_length_norm']
-        global_params = copy.deepcopy(params)
-        global_params['recog_max_len_ratio'] = 1.0
 
-        streaming = Streaming(xs[0], params, self.enc, idx2token)
+        session = self.streaming_session(params, idx2token)
+        best_hyp_id_stream, _ = session.feed(xs[0], is_final=True)
 
-        hyps = None
-        best_hyp_id_stream = []
-        is_reset = True  # for the first chunk
+        if len(best_hyp_id_stream) > 0:
+            return [best_hyp_id_stream], [None]
+        else:
+            return [[]], [None]
 
-        stdout = False
+    def streaming_session(self, params, idx2token, stdout=False):
+        """Open a stateful streaming decoding session.
 
-        self.eval()
-        with torch.no_grad():
-            lm = getattr(self, 'lm_fwd', None)
-            lm_second = getattr(self, 'lm_second', None)
-
-            while True:
-                # Encode input features chunk by chunk
-                x_chunk, is_last_chunk, lookback, lookahead = streaming.extract_feature()
-                if is_reset:
-                    self.enc.reset_cache()
-                eout_chunk = self.encode([x_chunk], task,
-                                         streaming=True,
-                                         lookback=lookback,
-                                         lookahead=lookahead)[task]['xs']
-                is_reset = False  # detect the first boundary in the same chunk
-
-                # CTC-based VAD
-                ctc_log_probs_chunk = None
-                if streaming.is_ctc_vad:
-                    ctc_probs_chunk = self.dec_fwd.ctc_probs(eout_chunk)
-                    if params['recog_ctc_weight'] > 0:
-                        ctc_log_probs_chunk = torch.log(ctc_probs_chunk)
-                    is_reset = streaming.ctc_vad(ctc_probs_chunk, stdout=stdout)
-
-                # Truncate the most right frames
-                if is_reset and not is_last_chunk and streaming.bd_offset >= 0:
-                    eout_chunk = eout_chunk[:, :streaming.bd_offset]
-                streaming.eout_chunks.append(eout_chunk)
-
-                # Chunk-synchronous attention decoding
-                if params['recog_chunk_sync']:
-                    end_hyps, hyps, aws_seg = self.dec_fwd.beam_search_chunk_sync(
-                        eout_chunk, params, idx2token, lm,
-                        ctc_log_probs=ctc_log_probs_chunk, hyps=hyps,
-                        state_carry_over=False,
-                        ignore_eos=self.enc.enc_type in ['lstm', 'conv_lstm'])
-                    merged_hyps = sorted(end_hyps + hyps, key=lambda x: x['score'], reverse=True)
-                    best_hyp_id_prefix = np.array(merged_hyps[0]['hyp'][1:])
-                    if len(best_hyp_id_prefix) > 0 and best_hyp_id_prefix[-1] == self.eos:
-                        # reset beam if <eos> is generated from the best hypothesis
-                        best_hyp_id_prefix = best_hyp_id_prefix[:-1]  # exclude <eos>
-                        # Segmentation strategy 2:
-                        # If <eos> is emitted from the decoder (not CTC),
-                        # the current chunk is segmented.
-                        if not is_reset:
-                            streaming.bd_offset = eout_chunk.size(1) - 1
-                            is_reset = True
-                    if len(best_hyp_id_prefix) > 0:
-                        # print('\rStreaming (T:%d [frame], offset:%d [frame], blank:%d [frame]): %s' %
-                        #       (streaming.offset + eout_chunk.size(1) * streaming.factor,
-                        #        self.dec_fwd.n_frames * streaming.factor,
-                        #        streaming.n_blanks * streaming.factor,
-                        #        idx2token(best_hyp_id_prefix)))
-                        print('\r%s' % (idx2token(best_hyp_id_prefix)))
-
-                if is_reset:
-                    # Global decoding over the segmented region
-                    if not params['recog_chunk_sync']:
-                        eout = torch.cat(streaming.eout_chunks, dim=1)
-                        elens = torch.IntTensor([eout.size(1)])
-                        ctc_log_probs = None
-                        if params['recog_ctc_weight'] > 0:
-                            ctc_log_probs = torch.log(self.dec_fwd.ctc_probs(eout))
-                        nbest_hyps_id_offline = self.dec_fwd.beam_search(
-                            eout, elens, global_params, idx2token, lm, lm_second,
-                            ctc_log_probs=ctc_log_probs)[0]
-                        # print('Offline (T:%d [frame]): %s' %
-                        #       (streaming.offset + eout_chunk.size(1) * streaming.factor,
-                        #        idx2token(nbest_hyps_id_offline[0][0])))
-
-                    # pick up the best hyp from ended and active hypotheses
-                    if not params['recog_chunk_sync']:
-                        if len(nbest_hyps_id_offline[0][0]) > 0:
-                            best_hyp_id_stream.extend(nbest_hyps_id_offline[0][0])
-                    else:
-                        if len(best_hyp_id_prefix) > 0:
-                            best_hyp_id_stream.extend(best_hyp_id_prefix)
-                        # print('Final (T:%d [frame], offset:%d [frame]): %s' %
-                        #       (streaming.offset + eout_chunk.size(1) * streaming.factor,
-                        #        self.dec_fwd.n_frames * streaming.factor,
-                        #        idx2token(best_hyp_id_prefix)))
-                        # print('-' * 50)
-                        # for test
-                        # eos_hyp = np.zeros(1, dtype=np.int32)
-                        # eos_hyp[0] = self.eos
-                        # best_hyp_id_stream.extend(eos_hyp)
-
-                    # reset
-                    streaming.reset(stdout=stdout)
-                    hyps = None
-
-                streaming.next_chunk()
-                # next chunk will start from the frame next to the boundary
-                if not is_last_chunk:
-                    streaming.backoff(x_chunk, self.dec_fwd, stdout=stdout)
-                if is_last_chunk:
-                    break
-
-            # Global decoding over the last chunk
-            if not params['recog_chunk_sync'] and len(streaming.eout_chunks) > 0:
-                eout = torch.cat(streaming.eout_chunks, dim=1)
-                elens = torch.IntTensor([eout.size(1)])
-                nbest_hyps_id_offline = self.dec_fwd.beam_search(
-                    eout, elens, global_params, idx2token, lm, lm_second)[0]
-                # print('MoChA: ' + idx2token(nbest_hyps_id_offline[0][0]))
-                # print('*' * 50)
-                if len(nbest_hyps_id_offline[0][0]) > 0:
-                    best_hyp_id_stream.extend(nbest_hyps_id_offline[0][0])
-
-            # pick up the best hyp
-            if not is_reset and params['recog_chunk_sync'] and len(best_hyp_id_prefix) > 0:
-                best_hyp_id_stream.extend(best_hyp_id_prefix)
-
-            if len(best_hyp_id_stream) > 0:
-                return [np.stack(best_hyp_id_stream, axis=0)], [None]
-            else:
-                return [[]], [None]
+        Args:
+            params (dict): hyper-parameters for decoding
+            idx2token (): converter from index to token
+            stdout (bool): print intermediate results
+        Returns:
+            session (StreamingSession): feed input features with session.feed()
+
+        """
+        from neural_sp.models.seq2seq.frontends.streaming import StreamingSession
+        return StreamingSession(self, params, idx2token, stdout=stdout)
 
     def streamable(self):
         return getattr(self.dec_fwd, 'streamable', False)
@@ -655,15 +597,22 @@ class Speech2Text(ModelBase):
                     lm, lm_second, lm_second_bwd, 1, refs_id, utt_ids, speakers)
                 return best_hyps_id, None
 
+            # Drop or merge blank-dominant frames before attention/RNN-T decoding
+            frame_ids = None
+            if params['recog_ctc_frame_reduction_threshold'] < 1 and self.ctc_weight > 0 and dir in ['fwd', 'bwd']:
+                frame_ids, eout_dict[task]['xlens'] = self.dec_fwd.blank_frame_ids(
+                    eout_dict[task]['xs'], eout_dict[task]['xlens'],
+                    params['recog_ctc_frame_reduction_threshold'], params['recog_ctc_frame_reduction_merge'])
+                eout_dict[task]['xs'] = self.dec_fwd.reduce_frames(
+                    eout_dict[task]['xs'], frame_ids, eout_dict[task]['xlens'])
+
             # Attention/RNN-T
-            elif params['recog_beam_width'] == 1 and not params['recog_fwd_bwd_attention']:
+            if params['recog_beam_width'] == 1 and not params['recog_fwd_bwd_attention']:
                 best_hyps_id, aws = getattr(self, 'dec_' + dir).greedy(
                     eout_dict[task]['xs'], eout_dict[task]['xlens'],
                     params['recog_max_len_ratio'], idx2token,
                     exclude_eos, refs_id, utt_ids, speakers)
             else:
-                assert params['recog_batch_size'] == 1
-
                 ctc_log_probs = None
                 if params['recog_ctc_weight'] > 0:
                     ctc_log_probs = self.dec_fwd.ctc_log_probs(eout_dict[task]['xs'])
@@ -701,6 +650,11 @@ class Speech2Text(ModelBase):
                                 enc_outs_e = model.encode(xs, task)
                             else:
                                 enc_outs_e = model.encode(xs, task)
+                            if frame_ids is not None:
+                                # reduce the same frames as the main model
+                                enc_outs_e[task]['xs'] = self.dec_fwd.reduce_frames(
+                                    enc_outs_e[task]['xs'], frame_ids, eout_dict[task]['xlens'])
+                                enc_outs_e[task]['xlens'] = eout_dict[task]['xlens'].clone()
                             ensmbl_eouts += [enc_outs_e[task]['xs']]
                             ensmbl_elens += [enc_outs_e[task]['xlens']]
                             ensmbl_decs += [getattr(model, 'dec_' + dir)]
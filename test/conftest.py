@@ -0,0 +1,57 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Shared fixtures for tests."""
+
+import kaldiio
+import numpy as np
+import os
+import pytest
+
+
+@pytest.fixture
+def make_asr_tsv(tmpdir):
+    """Return a function to write Kaldi features and tsv files of a toy ASR corpus.
+
+    Every utterance is transcribed into a random number of 'a' (token ID: 4).
+    Utterance IDs follow the CSJ format (<session>_<onset>) so that they can
+    also be used for discourse-aware bucketing.
+
+    """
+    def make(n_utts, input_dim=8, n_sessions=1, names=('train',)):
+        """
+        Args:
+            n_utts (int): number of utterances
+            input_dim (int): dimension of input features
+            n_sessions (int): number of sessions (speakers)
+            names (list): names of tsv files sharing the same utterances
+        Returns:
+            tsv_paths (list): paths to tsv files of each name
+            dict_path (str): path to the dictionary file
+            feat_paths (list): paths to features of each utterance
+
+        """
+        ark_path = os.path.join(str(tmpdir), 'feats.ark')
+        scp_path = os.path.join(str(tmpdir), 'feats.scp')
+        feats = {'S%02d_%05d' % (i * n_sessions // n_utts, i): np.random.randn(
+            np.random.randint(5, 30), input_dim).astype(np.float32) for i in range(n_utts)}
+        kaldiio.save_ark(ark_path, feats, scp=scp_path)
+        utt2featpath = dict(line.strip().split(' ') for line in open(scp_path))
+
+        tsv_paths = []
+        for name in names:
+            tsv_path = os.path.join(str(tmpdir), name + '.tsv')
+            with open(tsv_path, 'w') as f:
+                f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+                for utt_id, x in feats.items():
+                    ylen = np.random.randint(1, 5)
+                    f.write('%s\t%s\t%s\t%d\t%d\t%s\t%s\t%d\t5\n' % (
+                        utt_id, utt_id.split('_')[0], utt2featpath[utt_id], len(x), input_dim,
+                        'a' * ylen, ' '.join(['4'] * ylen), ylen))
+            tsv_paths.append(tsv_path)
+        dict_path = os.path.join(str(tmpdir), 'dict.txt')
+        with open(dict_path, 'w') as f:
+            f.write('<unk> 1\n<eos> 2\n<pad> 3\na 4\n')
+        return tsv_paths, dict_path, [utt2featpath[utt_id] for utt_id in feats.keys()]
+
+    return make
@@ -0,0 +1,134 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for ASR dataset."""
+
+import importlib
+import numpy as np
+import pytest
+import random
+import torch
+
+
+def load_all(make_dataset, seed):
+    random.seed(seed)
+    np.random.seed(seed)
+    dataset = make_dataset()
+    batches = []
+    while True:
+        try:
+            batch, is_new_epoch = dataset.next()
+        except StopIteration:
+            break
+        batches.append((batch, is_new_epoch, dataset.epoch_detail))
+    return batches
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        ({'n_prefetch_batches': 1, 'n_workers': 1}),
+        ({'n_prefetch_batches': 4, 'n_workers': 2}),
+        ({'n_prefetch_batches': 4, 'n_workers': 2, 'shuffle_bucket': True}),
+    ]
+)
+def test_prefetch(make_asr_tsv, kwargs):
+    module = importlib.import_module('neural_sp.datasets.asr')
+    (tsv_path,), dict_path, _ = make_asr_tsv(n_utts=23)
+    common = dict(tsv_path=tsv_path, dict_path=dict_path, unit='char', batch_size=4,
+                  n_epochs=3, min_n_frames=1, sort_by='input', sort_stop_epoch=2,
+                  shuffle_bucket=kwargs.pop('shuffle_bucket', False))
+
+    def make_dataset():
+        dataset = module.Dataset(**common, **kwargs)
+        dataset.collate_fn = lambda xs: (torch.zeros(len(xs), max(len(x) for x in xs), 8),
+                                         torch.IntTensor([len(x) for x in xs]))
+        return dataset
+
+    batches_ref = load_all(lambda: module.Dataset(**common), seed=1)
+    batches = load_all(make_dataset, seed=1)
+
+    # same batches, epoch boundaries and progress as synchronous loading
+    assert len(batches) == len(batches_ref)
+    for (batch, is_new_epoch, epoch_detail), (batch_ref, is_new_epoch_ref, epoch_detail_ref) in zip(
+            batches, batches_ref):
+        assert batch['utt_ids'] == batch_ref['utt_ids']
+        assert batch['ys'] == batch_ref['ys']
+        assert all(np.array_equal(x, x_ref) for x, x_ref in zip(batch['xs'], batch_ref['xs']))
+        assert is_new_epoch == is_new_epoch_ref
+        assert epoch_detail == epoch_detail_ref
+        assert batch['xs_pad'][0].size(0) == len(batch['xs'])
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        ({'max_n_frames_batch': 60}),
+        ({'max_n_frames_batch': 60, 'max_n_tokens_batch': 6}),
+        ({'max_n_tokens_batch': 6}),
+        ({'max_n_frames_batch': 60, 'sub1': True}),
+        ({'max_n_frames_batch': 60, 'discourse_aware': True}),
+    ]
+)
+def test_budget_batching(make_asr_tsv, kwargs):
+    module = importlib.import_module('neural_sp.datasets.asr')
+    (tsv_path, tsv_path_sub1), dict_path, _ = make_asr_tsv(n_utts=40, n_sessions=4,
+                                                           names=['train', 'train_sub1'])
+    if kwargs.pop('sub1', False):
+        kwargs.update({'tsv_path_sub1': tsv_path_sub1, 'dict_path_sub1': dict_path, 'unit_sub1': 'char'})
+    if kwargs.get('discourse_aware', False):
+        kwargs['corpus'] = 'csj'
+    batch_size = 8
+    n_epochs = 2
+    dataset = module.Dataset(tsv_path=tsv_path, dict_path=dict_path, unit='char', batch_size=batch_size,
+                             n_epochs=n_epochs, min_n_frames=1, sort_by='input', **kwargs)
+
+    utt_ids = []
+    while True:
+        try:
+            batch, is_new_epoch = dataset.next()
+        except StopIteration:
+            break
+        bs = len(batch['utt_ids'])
+        assert 1 <= bs <= batch_size
+        if bs > 1:
+            if dataset.max_n_frames_batch > 0:
+                assert bs * max(batch['xlens']) <= dataset.max_n_frames_batch
+            if dataset.max_n_tokens_batch > 0:
+                assert bs * max(len(y) for y in batch['ys']) <= dataset.max_n_tokens_batch
+                if batch['ys_sub1']:
+                    assert bs * max(len(y) for y in batch['ys_sub1']) <= dataset.max_n_tokens_batch
+        utt_ids += batch['utt_ids']
+
+    # every utterance is used once per epoch
+    assert sorted(utt_ids) == sorted(list(dataset.df['utt_id']) * n_epochs)
+
+
+@pytest.mark.parametrize(
+    "kwargs",
+    [
+        ({}),
+        ({'sort_stop_epoch': 2}),
+    ]
+)
+def test_sample_index(make_asr_tsv, kwargs):
+    module = importlib.import_module('neural_sp.datasets.asr')
+    (tsv_path,), dict_path, _ = make_asr_tsv(n_utts=40)
+    batch_size = 6
+    dataset = module.Dataset(tsv_path=tsv_path, dict_path=dict_path, unit='char', batch_size=batch_size,
+                             n_epochs=3, min_n_frames=1, sort_by='input', **kwargs)
+
+    utt_ids_epoch = []
+    while True:
+        try:
+            batch, is_new_epoch = dataset.next()
+        except StopIteration:
+            break
+        assert len(batch['utt_ids']) <= batch_size
+        utt_ids_epoch += batch['utt_ids']
+        if is_new_epoch:
+            # every utterance is used once per epoch
+            assert sorted(utt_ids_epoch) == sorted(dataset.df['utt_id'])
+            utt_ids_epoch = []
+    assert dataset.epoch == 3
+    assert len(utt_ids_epoch) == 0
@@ -0,0 +1,30 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for packed feature store."""
+
+import importlib
+import kaldiio
+import numpy as np
+import os
+import pytest
+
+
+@pytest.mark.parametrize("dtype", ['float32', 'float16'])
+def test_feature_store(tmpdir, make_asr_tsv, dtype):
+    module = importlib.import_module('neural_sp.datasets.feature_store')
+    (tsv_path,), _, feat_paths = make_asr_tsv(n_utts=10)
+    store_dir = os.path.join(str(tmpdir), 'store')
+
+    assert module.pack_features([tsv_path, tsv_path], store_dir, dtype=dtype) == 10
+    store = module.FeatureStore(store_dir)
+    assert len(store) == 10
+    assert store.input_dim == 8
+    for feat_path in feat_paths:
+        x_ref = kaldiio.load_mat(feat_path)
+        x = store[feat_path]
+        assert x.dtype == np.dtype(dtype)
+        assert x.shape == x_ref.shape
+        assert np.allclose(x, x_ref, atol=1e-2 if dtype == 'float16' else 0)
+        assert not x.flags.writeable
+    assert 'not_found' not in store
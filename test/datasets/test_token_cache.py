@@ -0,0 +1,51 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for binary cache of token IDs."""
+
+import importlib
+import numpy as np
+import os
+
+
+def make_tsv(tmpdir, token_ids):
+    tsv_path = os.path.join(str(tmpdir), 'train.tsv')
+    with open(tsv_path, 'w') as f:
+        f.write('utt_id\tspeaker\tfeat_path\txlen\txdim\ttext\ttoken_id\tylen\tydim\n')
+        for i, ys in enumerate(token_ids):
+            f.write('utt%d\tspk\tfeat%d\t100\t80\ta\t%s\t%d\t10\n' % (
+                i, i, ' '.join(map(str, ys)), len(ys)))
+    return tsv_path
+
+
+def test_token_cache(tmpdir):
+    module = importlib.import_module('neural_sp.datasets.token_cache')
+    token_ids = [np.random.randint(4, 1000, size=np.random.randint(0, 20)).tolist()
+                 for _ in range(50)]
+    tsv_path = make_tsv(tmpdir, token_ids)
+
+    cache = module.TokenCache(tsv_path)
+    assert os.path.isfile(tsv_path + module.CACHE_SUFFIX)
+    assert len(cache) == len(token_ids)
+    for i, ys in enumerate(token_ids):
+        assert cache[i] == ys
+
+    # concatenation with separators
+    indices = np.random.permutation(len(token_ids))[:30]
+    concat_ids = [2]
+    for i in indices:
+        concat_ids += token_ids[i] + [2]
+    assert np.array_equal(cache.concat(indices, sep=2), np.array(concat_ids))
+
+    # load from the saved cache
+    cache_mtime = os.path.getmtime(tsv_path + module.CACHE_SUFFIX)
+    cache = module.TokenCache(tsv_path)
+    assert os.path.getmtime(tsv_path + module.CACHE_SUFFIX) == cache_mtime
+    for i, ys in enumerate(token_ids):
+        assert cache[i] == ys
+
+    # rebuild after the tsv file is modified
+    token_ids[0] = [5, 6, 7]
+    make_tsv(tmpdir, token_ids)
+    cache = module.TokenCache(tsv_path)
+    assert cache[0] == [5, 6, 7]
@@ -0,0 +1,211 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for CTC decoder."""
+
+import argparse
+import importlib
+import math
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+
+
+ENC_N_UNITS = 32
+VOCAB = 10
+
+
+def make_args(**kwargs):
+    args = dict(
+        eos=2,
+        blank=0,
+        enc_n_units=ENC_N_UNITS,
+        vocab=VOCAB,
+        dropout=0.1,
+        lsm_prob=0.0,
+        fc_list='32_32',
+        param_init=0.1,
+        backward=False,
+    )
+    args.update(kwargs)
+    return args
+
+
+def make_decode_params(**kwargs):
+    args = dict(
+        recog_batch_size=1,
+        recog_beam_width=1,
+        recog_lm_weight=0.0,
+        recog_lm_second_weight=0.0,
+        recog_lm_bwd_weight=0.0,
+        recog_length_penalty=0.0,
+        recog_ctc_blank_skip_threshold=1.0,
+    )
+    args.update(kwargs)
+    return args
+
+
+def make_args_rnnlm(**kwargs):
+    args = dict(
+        lm_type='lstm',
+        n_units=32,
+        n_projs=0,
+        n_layers=2,
+        residual=False,
+        use_glu=False,
+        n_units_null_context=32,
+        bottleneck_dim=16,
+        emb_dim=16,
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        lsm_prob=0.0,
+        param_init=0.1,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        # greedy decoding
+        ({'recog_beam_width': 1}),
+        # beam search
+        ({'recog_beam_width': 4}),
+        ({'recog_beam_width': 4, 'recog_batch_size': 4}),
+        ({'recog_beam_width': 4, 'recog_batch_size': 4, 'recog_length_penalty': 0.1}),
+        ({'recog_beam_width': 4, 'recog_batch_size': 4, 'recog_ctc_blank_skip_threshold': 0.5}),
+        ({'recog_beam_width': 4, 'recog_batch_size': 4, 'recog_lm_weight': 0.1}),
+        ({'recog_beam_width': 4, 'recog_batch_size': 4, 'recog_lm_weight': 0.1,
+          'recog_lm_second_weight': 0.1}),
+        ({'recog_beam_width': 16, 'recog_batch_size': 4}),
+    ]
+)
+def test_decoding(params):
+    args = make_args()
+    params = make_decode_params(**params)
+
+    batch_size = params['recog_batch_size']
+    emax = 40
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([emax - 3 * b for b in range(batch_size)])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+
+    args_lm = make_args_rnnlm()
+    module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = None
+    lm_second = None
+    if params['recog_lm_weight'] > 0:
+        lm = module_rnnlm.RNNLM(args_lm).to(device)
+    if params['recog_lm_second_weight'] > 0:
+        lm_second = module_rnnlm.RNNLM(args_lm).to(device)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    ctc = module.CTC(**args)
+    ctc = ctc.to(device)
+
+    ctc.eval()
+    with torch.no_grad():
+        if params['recog_beam_width'] == 1:
+            hyps = ctc.greedy(eouts, elens)
+            assert len(hyps) == batch_size
+        else:
+            hyps = ctc.beam_search(eouts, elens, params, idx2token=None,
+                                   lm=lm, lm_second=lm_second)
+            assert isinstance(hyps, list)
+            assert len(hyps) == batch_size
+            for hyp in hyps:
+                assert args['blank'] not in hyp
+
+            # batch decoding is consistent with utterance-by-utterance decoding
+            for b in range(batch_size):
+                hyp_b = ctc.beam_search(eouts[b:b + 1, :elens[b]], elens[b:b + 1], params, idx2token=None,
+                                        lm=lm, lm_second=lm_second)
+                assert np.array_equal(hyps[b], hyp_b[0])
+
+
+def _logaddexp(x, y):
+    if x == -math.inf:
+        return y
+    if y == -math.inf:
+        return x
+    return max(x, y) + math.log1p(math.exp(-abs(x - y)))
+
+
+def prefix_beam_search_ref(log_probs, beam_width, lp_weight, blank=0):
+    """Prefix beam search merging prefixes by their label sequences in pure Python.
+
+    Args:
+        log_probs (np.ndarray): `[T, vocab]`
+        beam_width (int): size of beam
+        lp_weight (float): weight of length penalty
+        blank (int): index for <blank>
+    Returns:
+        nbest (list): A list of `(hyp, score)` sorted by score
+
+    """
+    vocab = log_probs.shape[1]
+
+    def score(item):
+        prefix, (p_b, p_nb) = item
+        return _logaddexp(p_b, p_nb) + len(prefix) * lp_weight
+
+    beam = {(): (0., -math.inf)}  # prefix: (p_b, p_nb)
+    for lp_t in log_probs.tolist():
+        cands = sorted(range(vocab), key=lambda c: lp_t[c], reverse=True)[:min(beam_width, vocab)]
+        new_beam = {}
+
+        def add(prefix, p_b, p_nb):
+            p_b_prev, p_nb_prev = new_beam.get(prefix, (-math.inf, -math.inf))
+            new_beam[prefix] = (_logaddexp(p_b_prev, p_b), _logaddexp(p_nb_prev, p_nb))
+
+        for prefix, (p_b, p_nb) in beam.items():
+            # not extended
+            add(prefix, _logaddexp(p_b, p_nb) + lp_t[blank],
+                p_nb + lp_t[prefix[-1]] if len(prefix) > 0 else -math.inf)
+            # extended
+            for c in cands:
+                if c == blank:
+                    continue
+                if len(prefix) > 0 and c == prefix[-1]:
+                    add(prefix + (c,), -math.inf, p_b + lp_t[c])
+                else:
+                    add(prefix + (c,), -math.inf, _logaddexp(p_b, p_nb) + lp_t[c])
+        beam = dict(sorted(new_beam.items(), key=score, reverse=True)[:beam_width])
+
+    return [(list(prefix), score((prefix, p))) for prefix, p in
+            sorted(beam.items(), key=score, reverse=True)]
+
+
+@pytest.mark.parametrize("beam_width", [2, 4, 10])
+@pytest.mark.parametrize("lp_weight", [0.0, 0.5, -0.5])
+def test_beam_search_reference(beam_width, lp_weight):
+    args = make_args()
+    params = make_decode_params(recog_beam_width=beam_width, recog_length_penalty=lp_weight)
+
+    torch.manual_seed(0)
+    batch_size = 4
+    emax = 20
+    eouts = torch.randn(batch_size, emax, ENC_N_UNITS)
+    elens = torch.IntTensor([emax - 3 * b for b in range(batch_size)])
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+    ctc = module.CTC(**args)
+    ctc.eval()
+    with torch.no_grad():
+        end_hyps_batch = ctc._prefix_beam_search(eouts, elens, params)
+        log_probs = torch.log_softmax(ctc.output(eouts), dim=-1).double().numpy()
+
+    for b in range(batch_size):
+        nbest_ref = prefix_beam_search_ref(log_probs[b, :elens[b]], beam_width, lp_weight, args['blank'])
+        nbest = sorted(end_hyps_batch[b], key=lambda x: x['score'], reverse=True)
+        assert [hyp['hyp'][1:] for hyp in nbest] == [hyp for hyp, _ in nbest_ref]
+        assert np.allclose([hyp['score'] for hyp in nbest], [score for _, score in nbest_ref], atol=1e-4)
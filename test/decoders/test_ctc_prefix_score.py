@@ -0,0 +1,76 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for batched CTC prefix scoring."""
+
+import importlib
+import numpy as np
+import pytest
+import torch
+
+
+VOCAB = 10
+BLANK = 0
+EOS = 2
+
+
+@pytest.mark.parametrize(
+    "backward, full_vocab",
+    [
+        (False, False),
+        (False, True),
+        (True, False),
+        (True, True),
+    ]
+)
+def test_batch_ctc_prefix_score(backward, full_vocab):
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.ctc')
+
+    bs, xmax, beam_width, n_cands = 2, 30, 3, 4
+    n_hyps = bs * beam_width
+    torch.manual_seed(1)
+    log_probs = torch.log_softmax(torch.randn(bs, xmax, VOCAB), dim=-1)
+    xlens = torch.IntTensor([xmax, xmax - 8])
+
+    scorer = module.BatchCTCPrefixScore(log_probs, xlens, BLANK, EOS, beam_width,
+                                        backward=backward)
+    ctc_state = scorer.initial_state()
+    assert ctc_state.size() == (n_hyps, xmax, 2)
+
+    # reference
+    scorers_ref = []
+    for b in range(bs):
+        log_probs_b = log_probs[b, :xlens[b]].numpy()
+        if backward:
+            log_probs_b = log_probs_b[::-1]
+        scorers_ref += [module.CTCPrefixScore(log_probs_b, BLANK, EOS)]
+    ctc_states_ref = [scorers_ref[j // beam_width].initial_state() for j in range(n_hyps)]
+
+    hyps = [[EOS] for _ in range(n_hyps)]
+    for i in range(5):
+        cand_ids = torch.stack([torch.randperm(VOCAB)[:n_cands] for _ in range(n_hyps)])
+        cand_ids[:, 0] = EOS
+        if i > 0:
+            cand_ids[:, 1] = torch.LongTensor([h[-1] for h in hyps])  # repeated labels
+        ys_last = torch.LongTensor([h[-1] for h in hyps])
+
+        scores, new_ctc_states = scorer(i, ys_last, ctc_state, None if full_vocab else cand_ids)
+        if full_vocab:
+            assert scores.size() == (n_hyps, VOCAB)
+            assert new_ctc_states.size() == (n_hyps, VOCAB, xmax, 2)
+            scores = scores.gather(1, cand_ids)
+            new_ctc_states = new_ctc_states[torch.arange(n_hyps).unsqueeze(1), cand_ids]
+        else:
+            assert scores.size() == (n_hyps, n_cands)
+            assert new_ctc_states.size() == (n_hyps, n_cands, xmax, 2)
+
+        k = n_cands - 1
+        for j in range(n_hyps):
+            scores_ref, states_ref = scorers_ref[j // beam_width](hyps[j], cand_ids[j].numpy(), ctc_states_ref[j])
+            assert np.allclose(scores[j].numpy(), scores_ref, atol=1e-3)
+            ctc_states_ref[j] = states_ref[k]
+            hyps[j] = hyps[j] + [int(cand_ids[j, k])]
+
+        parent_ids = torch.arange(n_hyps)
+        ctc_state = scorer.select_state(new_ctc_states, parent_ids, torch.full((n_hyps,), k, dtype=torch.int64))
+        assert ctc_state.size() == (n_hyps, xmax, 2)
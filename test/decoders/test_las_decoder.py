@@ -4,6 +4,7 @@
 """Test for attention-based RNN decoder."""
 
 import argparse
+import copy
 import importlib
 import numpy as np
 import pytest
@@ -122,6 +123,11 @@ def make_args(**kwargs):
         ({'lm_fusion': 'cold'}),
         ({'lm_fusion': 'cold_prob'}),
         ({'lm_fusion': 'deep'}),
+        # MoChA latency
+        ({'attn_type': 'mocha', 'mocha_chunk_size': 4,
+          'latency_metric': 'interval', 'latency_loss_weight': 1.0}),
+        ({'attn_type': 'mocha', 'mocha_chunk_size': 4, 'mocha_n_heads_mono': 4,
+          'latency_metric': 'interval', 'latency_loss_weight': 1.0}),
     ]
 )
 def test_forward(args):
@@ -164,6 +170,68 @@ def test_forward(args):
     #                 assert not p.requires_grad
 
 
+@pytest.mark.parametrize("word_level", [False, True])
+def test_forward_mbr(word_level):
+    args = make_args(mbr_training=True)
+    params = make_decode_params(recog_beam_width=3)
+
+    batch_size = 4
+    emax = 40
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([len(x) for x in eouts])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+    eouts.requires_grad_()
+    ylens = [4, 5, 3, 7]
+    ys = [np.random.randint(4, VOCAB, ylen).astype(np.int32) for ylen in ylens]
+    idx2token = (lambda y: ' '.join(map(str, y))) if word_level else None
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec = dec.to(device)
+
+    loss, observation = dec(eouts, elens, ys, task='all', recog_params=params, idx2token=idx2token)
+    assert loss.item() >= 0
+    assert observation['loss_mbr'] >= 0
+    loss.backward()
+    assert dec.output.weight.grad is not None
+    assert eouts.grad is not None
+
+
+def test_mbr_gradient():
+    module = importlib.import_module('neural_sp.models.criterion')
+    N_best, L = 3, 5
+    log_probs = torch.log_softmax(torch.randn(N_best, L, VOCAB), dim=-1).requires_grad_()
+    hyps = torch.LongTensor([[4, 5, 6, 2, -1], [4, 2, -1, -1, -1], [7, 8, 9, 5, 2]])
+    grad = torch.FloatTensor([0.1, -0.3, 0.2])
+    loss = module.MBR.apply(log_probs, hyps, torch.tensor(1.5), grad)
+    assert loss.item() == 1.5
+    loss.backward()
+
+    # equivalent to the gradient of sum_n grad[n] * log P(y_n)
+    log_probs_ref = log_probs.detach().clone().requires_grad_()
+    mask = (hyps >= 0).float()
+    seq_log_probs = (log_probs_ref.gather(2, hyps.clamp(min=0).unsqueeze(2)).squeeze(2) * mask).sum(1)
+    (seq_log_probs * grad).sum().backward()
+    assert torch.allclose(log_probs.grad, log_probs_ref.grad)
+
+
+def test_interval_latency():
+    module = importlib.import_module('neural_sp.models.criterion')
+    bs, n_heads, ymax, xmax = 2, 4, 6, 30
+    aws = torch.softmax(torch.randn(bs, n_heads, ymax, xmax), dim=-1)
+    loss = module.interval_latency(aws)
+
+    # dense computation with `[B, H, L, T, T]` tensors
+    aws_prev = torch.cat([aws.new_zeros(aws.size())[:, :, -1:], aws[:, :, :-1]], dim=2)
+    aws_mat = aws_prev.unsqueeze(3) * aws.unsqueeze(4)  # `[B, H, L, T, T]`
+    delay_mat = torch.tril(aws.new_ones(xmax, xmax), diagonal=-1)
+    delay_mat = torch.cumsum(delay_mat, dim=-2)
+    loss_ref = torch.pow((aws_mat * delay_mat).sum(-1), 2).sum(-1).mean()
+    assert torch.allclose(loss, loss_ref, rtol=1e-4)
+
+
 def make_decode_params(**kwargs):
     args = dict(
         recog_batch_size=1,
@@ -229,6 +297,8 @@ def make_args_rnnlm(**kwargs):
         (False, '', {'recog_beam_width': 4, 'nbest': 4}),
         (False, '', {'recog_beam_width': 4, 'nbest': 4, 'softmax_smoothing': 2.0}),
         (False, '', {'recog_beam_width': 4, 'recog_ctc_weight': 0.1}),
+        (False, '', {'recog_beam_width': 4, 'recog_batch_size': 4}),
+        (False, '', {'recog_beam_width': 4, 'recog_batch_size': 4, 'nbest': 2, 'recog_ctc_weight': 0.1}),
         # length penalty
         (False, '', {'recog_length_penalty': 0.1}),
         (False, '', {'recog_length_penalty': 0.1, 'recog_gnmt_decoding': True}),
@@ -238,6 +308,7 @@ def make_args_rnnlm(**kwargs):
         (False, '', {'recog_coverage_penalty': 0.1, 'recog_gnmt_decoding': True}),
         # shallow fusion
         (False, '', {'recog_beam_width': 4, 'recog_lm_weight': 0.1}),
+        (False, '', {'recog_beam_width': 4, 'recog_lm_weight': 0.1, 'recog_batch_size': 4}),
         # cold fusion
         (False, 'cold', {'recog_beam_width': 4}),
         (False, 'cold', {'recog_beam_width': 4, 'recog_lm_weight': 0.1}),
@@ -256,6 +327,7 @@ def make_args_rnnlm(**kwargs):
         (True, '', {'recog_beam_width': 4, 'nbest': 4}),
         (True, '', {'recog_beam_width': 4, 'nbest': 4, 'softmax_smoothing': 2.0}),
         (True, '', {'recog_beam_width': 4, 'recog_ctc_weight': 0.1}),
+        (True, '', {'recog_beam_width': 4, 'recog_batch_size': 4}),
         # length penalty
         (True, '', {'recog_length_penalty': 0.1}),
         (True, '', {'recog_length_penalty': 0.1, 'recog_gnmt_decoding': True}),
@@ -283,16 +355,18 @@ def test_decoding(backward, lm_fusion, params):
     emax = 40
     device = "cpu"
 
+    np.random.seed(0)
+    torch.manual_seed(0)
     eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
-    elens = torch.IntTensor([len(x) for x in eouts])
+    elens = torch.IntTensor([emax - 3 * b for b in range(batch_size)])
     eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
     ylens = [4, 5, 3, 7]
     ys = [np.random.randint(0, VOCAB, ylen).astype(np.int32) for ylen in ylens]
 
     ctc_log_probs = None
     if params['recog_ctc_weight'] > 0:
-        ctc_logits = torch.FloatTensor(batch_size, emax, VOCAB, device=device)
-        ctc_log_probs = torch.softmax(ctc_logits, dim=-1)
+        ctc_logits = torch.randn(batch_size, emax, VOCAB, device=device)
+        ctc_log_probs = torch.log_softmax(ctc_logits, dim=-1)
 
     args_lm = make_args_rnnlm()
     module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
@@ -347,6 +421,23 @@ def test_decoding(backward, lm_fusion, params):
             assert len(scores) == batch_size
             assert len(scores[0]) == params['nbest']
 
+            # batch decoding gives the same N-best lists as utterance-by-utterance decoding
+            n_check = min(params['nbest'] + 1, params['recog_beam_width'])
+            for b in range(batch_size if batch_size > 1 else 0):
+                nbest_hyps_b, _, scores_b = dec.beam_search(
+                    eouts[b:b + 1, :elens[b]], elens[b:b + 1], params, idx2token=None,
+                    lm=lm, lm_second=lm_second, lm_second_bwd=lm_second_bwd,
+                    ctc_log_probs=ctc_log_probs[b:b + 1, :elens[b]] if ctc_log_probs is not None else None,
+                    nbest=n_check, exclude_eos=params['exclude_eos'],
+                    refs_id=None, utt_ids=None, speakers=None,
+                    cache_states=True)
+                # skip utterances where scores of the toy model are (almost) tied
+                if np.any(np.abs(np.diff(scores_b[0])) < 1e-3):
+                    continue
+                for k in range(params['nbest']):
+                    assert np.array_equal(nbest_hyps[b][k], nbest_hyps_b[0][k])
+                    assert np.allclose(scores[b][k], scores_b[0][k], atol=1e-4)
+
             # ensemble
             ensmbl_eouts, ensmbl_elens, ensmbl_decs = [], [], []
             for _ in range(3):
@@ -372,3 +463,155 @@ def test_decoding(backward, lm_fusion, params):
             assert isinstance(scores, list)
             assert len(scores) == batch_size
             assert len(scores[0]) == params['nbest']
+
+
+@pytest.mark.parametrize(
+    "threshold, merge",
+    [
+        (0.5, False),
+        (0.5, True),
+        (0.0, False),
+        (0.0, True),
+        (1.0, False),
+    ]
+)
+def test_reduce_blank_frames(threshold, merge):
+    batch_size = 4
+    emax = 40
+    device = "cpu"
+
+    eouts = np.random.randn(batch_size, emax, ENC_N_UNITS).astype(np.float32)
+    elens = torch.IntTensor([emax - 3 * b for b in range(batch_size)])
+    eouts = pad_list([np2tensor(x, device).float() for x in eouts], 0.)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**make_args(ctc_weight=0.5))
+    dec = dec.to(device)
+
+    dec.eval()
+    with torch.no_grad():
+        eouts_new, elens_new = dec.reduce_blank_frames(eouts, elens, threshold, merge)
+        assert elens_new.dtype == elens.dtype
+        assert eouts_new.size() == (batch_size, elens_new.max(), ENC_N_UNITS)
+        assert (elens_new >= 1).all()
+        assert (elens_new <= elens).all()
+
+        blank_probs = dec.ctc_probs(eouts)[:, :, 0]
+        for b in range(batch_size):
+            is_blank = (blank_probs[b, :elens[b]] > threshold).tolist()
+            n_nonblank = is_blank.count(False)
+            if merge:
+                n_runs = sum(1 for t in range(len(is_blank)) if is_blank[t] and (t == 0 or not is_blank[t - 1]))
+                assert elens_new[b] == max(n_nonblank + n_runs, 1)
+            else:
+                assert elens_new[b] == max(n_nonblank, 1)
+                if n_nonblank > 0:
+                    kept = [t for t in range(elens[b]) if not is_blank[t]]
+                    assert torch.allclose(eouts_new[b, :elens_new[b]], eouts[b, kept])
+
+
+@pytest.mark.parametrize("merge", [False, True])
+def test_reduce_blank_frames_ensemble(monkeypatch, merge):
+    from neural_sp.bin.args_asr import parse_args_train
+    from neural_sp.models.seq2seq.speech2text import Speech2Text
+
+    argv = ['--train_set', '', '--dev_set', '', '--dict', '',
+            '--enc_type', 'blstm', '--enc_n_layers', '1', '--enc_n_units', '16',
+            '--subsample', '1', '--dec_n_units', '16', '--ctc_weight', '0.3']
+    monkeypatch.setattr('sys.argv', ['train.py'] + argv)
+    args = parse_args_train(argv)
+    args.input_dim = 8
+    args.vocab = VOCAB
+    args.vocab_sub1 = 0
+    args.vocab_sub2 = 0
+    params = vars(args).copy()
+    params.update(recog_beam_width=2,
+                  recog_ctc_frame_reduction_threshold=0.1,
+                  recog_ctc_frame_reduction_merge=merge)
+
+    torch.manual_seed(0)
+    model = Speech2Text(args)
+    model_ensmbl = copy.deepcopy(model)
+    xs = [np.random.randn(xlen, args.input_dim).astype(np.float32) for xlen in [30, 20, 25]]
+
+    # an ensemble of the same models reduces the same frames and gives the same hypotheses
+    hyps, _ = model.decode(xs, params, idx2token=None)
+    hyps_ensmbl, _ = model.decode(xs, params, idx2token=None, ensemble_models=[model_ensmbl])
+    for hyp, hyp_ensmbl in zip(hyps, hyps_ensmbl):
+        assert np.array_equal(hyp, hyp_ensmbl)
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {'recog_beam_width': 1},
+        {'recog_beam_width': 4},
+        {'recog_beam_width': 4, 'recog_length_norm': True},
+        {'recog_beam_width': 4, 'recog_lm_weight': 0.1},
+        {'recog_beam_width': 4, 'recog_ctc_weight': 0.1},
+    ]
+)
+def test_beam_search_chunk_sync_batch(params):
+    args = make_args(attn_type='mocha', mocha_init_r=4)
+    params = make_decode_params(**params)
+
+    n_streams = 3
+    n_chunks = 3
+    chunk_size = 8
+    restart = {(1, 1)}  # (stream, chunk) where a new segment starts
+    eouts = torch.randn(n_streams, n_chunks * chunk_size, ENC_N_UNITS)
+    ctc_log_probs = None
+    if params['recog_ctc_weight'] > 0:
+        ctc_log_probs = torch.log_softmax(torch.randn(n_streams, n_chunks * chunk_size, VOCAB), dim=-1)
+
+    lm = None
+    if params['recog_lm_weight'] > 0:
+        module_rnnlm = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module_rnnlm.RNNLM(make_args_rnnlm())
+
+    module = importlib.import_module('neural_sp.models.seq2seq.decoders.las')
+    dec = module.RNNDecoder(**args)
+    dec.eval()
+    cache_init = {k: None for k in dec.get_cache().keys()}
+
+    def get_chunk(xs, b, c):
+        if xs is None:
+            return None
+        return xs[b:b + 1, c * chunk_size:(c + 1) * chunk_size]
+
+    def summarize(end_hyps, hyps):
+        return [(beam['hyp'], beam['score']) for beam in end_hyps + hyps]
+
+    with torch.no_grad():
+        # decode streams one by one
+        results_ref = []
+        for b in range(n_streams):
+            dec.set_cache(cache_init)
+            hyps = None
+            for c in range(n_chunks):
+                if (b, c) in restart:
+                    hyps = None
+                end_hyps, hyps, _ = dec.beam_search_chunk_sync(
+                    get_chunk(eouts, b, c), params, None, lm,
+                    ctc_log_probs=get_chunk(ctc_log_probs, b, c), hyps=hyps)
+                results_ref.append(summarize(end_hyps, hyps))
+
+        # decode all streams at once
+        results = [[] for _ in range(n_streams)]
+        hyps = [None] * n_streams
+        caches = [dict(cache_init) for _ in range(n_streams)]
+        for c in range(n_chunks):
+            hyps = [None if (b, c) in restart else hyps[b] for b in range(n_streams)]
+            end_hyps, hyps, caches = dec.beam_search_chunk_sync_batch(
+                eouts[:, c * chunk_size:(c + 1) * chunk_size], params, None, lm,
+                ctc_log_probs=ctc_log_probs[:, c * chunk_size:(c + 1) * chunk_size]
+                if ctc_log_probs is not None else None,
+                hyps=hyps, caches=caches)
+            assert len(end_hyps) == len(hyps) == len(caches) == n_streams
+            for b in range(n_streams):
+                results[b].append(summarize(end_hyps[b], hyps[b]))
+        results = sum(results, [])
+
+    for result_ref, result in zip(results_ref, results):
+        assert [hyp for hyp, _ in result] == [hyp for hyp, _ in result_ref]
+        assert np.allclose([score for _, score in result], [score for _, score in result_ref], atol=1e-4)
@@ -61,6 +61,7 @@ def make_args(**kwargs):
         latency_loss_weight=0.0,
         mocha_first_layer=1,
         share_chunkwise_attention=False,
+        mocha_query_block_size=0,
         external_lm=None,
         lm_fusion='',
         # lm_init=False,
@@ -92,6 +93,8 @@ def make_args(**kwargs):
         ({'attn_type': 'mocha', 'mocha_chunk_size': 4, 'mocha_n_heads_mono': 4, 'mocha_n_heads_chunk': 4}),
         ({'attn_type': 'mocha', 'mocha_chunk_size': 4, 'mocha_n_heads_mono': 4, 'mocha_n_heads_chunk': 4,
           'share_chunkwise_attention': True}),
+        ({'attn_type': 'mocha', 'mocha_chunk_size': 4, 'mocha_n_heads_mono': 4, 'mocha_n_heads_chunk': 1,
+          'mocha_query_block_size': 2}),
         # MMA + HeadDrop
         ({'attn_type': 'mocha', 'dropout_head': 0.1, 'mocha_chunk_size': 1, 'mocha_n_heads_mono': 1}),
         ({'attn_type': 'mocha', 'dropout_head': 0.1, 'mocha_chunk_size': 1, 'mocha_n_heads_mono': 4}),
@@ -208,11 +211,15 @@ def make_args_rnnlm(**kwargs):
         (False, {'recog_beam_width': 4, 'nbest': 4}),
         (False, {'recog_beam_width': 4, 'nbest': 4, 'softmax_smoothing': 2.0}),
         (False, {'recog_beam_width': 4, 'recog_ctc_weight': 0.1}),
+        (False, {'recog_beam_width': 4, 'recog_batch_size': 4}),
+        (False, {'recog_beam_width': 4, 'recog_batch_size': 4, 'cache_states': False}),
+        (False, {'recog_beam_width': 4, 'recog_batch_size': 4, 'nbest': 2, 'recog_ctc_weight': 0.1}),
         # length penalty
         (False, {'recog_length_penalty': 0.1}),
         (False, {'recog_length_norm': True}),
         # shallow fusion
         (False, {'recog_beam_width': 4, 'recog_lm_weight': 0.1}),
+        (False, {'recog_beam_width': 4, 'recog_lm_weight': 0.1, 'recog_batch_size': 4}),
         # rescoring
         (False, {'recog_beam_width': 4, 'recog_lm_second_weight': 0.1}),
         (False, {'recog_beam_width': 4, 'recog_lm_bwd_weight': 0.1}),
@@ -230,6 +237,7 @@ def make_args_rnnlm(**kwargs):
         (True, {'recog_beam_width': 4, 'nbest': 4}),
         (True, {'recog_beam_width': 4, 'nbest': 4, 'softmax_smoothing': 2.0}),
         (True, {'recog_beam_width': 4, 'recog_ctc_weight': 0.1}),
+        (True, {'recog_beam_width': 4, 'recog_batch_size': 4}),
     ]
 )
 def test_decoding(backward, params):
@@ -185,3 +185,57 @@ def test_forward_streaming_chunkwise(args):
             assert torch.equal(enc_out_dict['ys']['xs'], eouts_stream)
             assert elens_stream.item() == eouts_stream.size(1)
             assert torch.equal(enc_out_dict['ys']['xlens'], elens_stream)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'enc_type': 'lstm', 'chunk_size_left': 4}),
+        ({'enc_type': 'gru', 'chunk_size_left': 4}),
+        ({'enc_type': 'blstm', 'chunk_size_left': 8, 'chunk_size_right': 4}),
+    ]
+)
+def test_batch_cache(args):
+    args = make_args(**args)
+    unidir = args['enc_type'] in ['conv_lstm', 'conv_gru', 'lstm', 'gru']
+    N_l, N_r = args['chunk_size_left'], args['chunk_size_right']
+    if unidir:
+        args['chunk_size_left'] = 0
+        args['chunk_size_right'] = 0
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.rnn')
+    enc = module.RNNEncoder(**args)
+
+    batch_size = 3
+    n_chunks = 4
+    device = "cpu"
+    xs = np.random.randn(batch_size, N_l * n_chunks + N_r, args['input_dim']).astype(np.float32)
+    xs = np2tensor(xs, device).float()
+
+    enc.eval()
+    with torch.no_grad():
+        # stream by stream, the second stream is reset after the second chunk
+        eouts_ref = [[] for _ in range(batch_size)]
+        caches_ref = [None] * batch_size
+        for chunk_idx in range(n_chunks):
+            for b in range(batch_size):
+                if caches_ref[b] is None or (b == 1 and chunk_idx == 2):
+                    enc.reset_cache()
+                else:
+                    enc.set_cache(caches_ref[b])
+                xs_chunk = xs[b:b + 1, chunk_idx * N_l:(chunk_idx + 1) * N_l + N_r]
+                eouts_ref[b].append(enc(xs_chunk, [xs_chunk.size(1)], task='all',
+                                        streaming=True)['ys']['xs'])
+                caches_ref[b] = enc.get_cache()
+
+        # all streams at once
+        caches = [None] * batch_size
+        for chunk_idx in range(n_chunks):
+            if chunk_idx == 2:
+                caches[1] = None
+            enc.set_cache(enc.batch_cache(caches))
+            xs_chunk = xs[:, chunk_idx * N_l:(chunk_idx + 1) * N_l + N_r]
+            eouts = enc(xs_chunk, [xs_chunk.size(1)] * batch_size, task='all',
+                        streaming=True)['ys']['xs']
+            caches = enc.split_cache(enc.get_cache(), batch_size)
+            for b in range(batch_size):
+                assert torch.allclose(eouts[b:b + 1], eouts_ref[b][chunk_idx], atol=1e-6)
@@ -0,0 +1,155 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for incremental encoding in streaming Transformer encoder."""
+
+import importlib
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+
+
+def make_args(**kwargs):
+    args = dict(
+        input_dim=80,
+        enc_type='transformer',
+        n_heads=4,
+        n_layers=3,
+        n_layers_sub1=0,
+        n_layers_sub2=0,
+        d_model=16,
+        d_ff=64,
+        ffn_bottleneck_dim=0,
+        last_proj_dim=0,
+        pe_type='add',
+        layer_norm_eps=1e-12,
+        ffn_activation='relu',
+        dropout_in=0.1,
+        dropout=0.1,
+        dropout_att=0.1,
+        dropout_layer=0.1,
+        subsample="1_1_1",
+        subsample_type='max_pool',
+        n_stacks=1,
+        n_splices=1,
+        conv_in_channel=1,
+        conv_channels="32_32",
+        conv_kernel_sizes="(3,3)_(3,3)",
+        conv_strides="(1,1)_(1,1)",
+        conv_poolings="(2,2)_(2,2)",
+        conv_batch_norm=False,
+        conv_layer_norm=False,
+        conv_bottleneck_dim=0,
+        conv_param_init=0.1,
+        task_specific_layer=False,
+        param_init='xavier_uniform',
+        clamp_len=-1,
+        chunk_size_left=16,
+        chunk_size_current=16,
+        chunk_size_right=8,
+        streaming_type='mask',
+    )
+    args.update(kwargs)
+    return args
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({}),
+        ({'pe_type': 'none'}),
+        ({'chunk_size_left': 32, 'chunk_size_current': 16, 'chunk_size_right': 0}),
+        ({'chunk_size_left': 0, 'chunk_size_current': 16, 'chunk_size_right': 16}),
+        ({'subsample': "1_2_1", 'subsample_type': 'drop'}),
+        ({'last_proj_dim': 10}),
+    ]
+)
+def test_forward_streaming_incremental(args):
+    args = make_args(**args)
+    N_c = args['chunk_size_current']
+    N_r = args['chunk_size_right']
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.transformer')
+    enc = module.TransformerEncoder(**args)
+    enc = enc.to(device)
+
+    enc.eval()
+    with torch.no_grad():
+        for xmax in [96, 100, 118]:
+            xs = np.random.randn(1, xmax, args['input_dim']).astype(np.float32)
+            xs = np2tensor(xs, device).float()
+
+            # all encoding
+            eouts = enc(xs, torch.IntTensor([xmax]), task='all')['ys']['xs']
+
+            # chunk by chunk encoding
+            enc.reset_cache()
+            eouts_stream = []
+            for j in range(0, xmax, N_c):
+                xs_chunk = xs[:, j:j + N_c + N_r]
+                eout_chunk = enc(xs_chunk, torch.IntTensor([xs_chunk.size(1)]), task='all',
+                                 streaming=True)['ys']['xs']
+                eouts_stream.append(eout_chunk)
+            eouts_stream = torch.cat(eouts_stream, dim=1)
+            assert eouts.size() == eouts_stream.size()
+            assert torch.allclose(eouts, eouts_stream, atol=1e-5)
+
+            # a batch of streams, the second of which is reset after the second chunk
+            eouts_reset = enc(xs[:, 2 * N_c:], torch.IntTensor([xmax - 2 * N_c]), task='all')['ys']['xs']
+            caches = [None, None]
+            eouts_stream = [[], []]
+            for chunk_idx, j in enumerate(range(0, xmax, N_c)):
+                if chunk_idx == 2:
+                    caches[1] = None
+                enc.set_cache(enc.batch_cache(caches))
+                xs_chunk = xs[:, j:j + N_c + N_r].repeat([2, 1, 1])
+                eout_chunk = enc(xs_chunk, torch.IntTensor([xs_chunk.size(1)] * 2), task='all',
+                                 streaming=True)['ys']['xs']
+                caches = enc.split_cache(enc.get_cache(), 2)
+                eouts_stream[0].append(eout_chunk[0:1])
+                if chunk_idx >= 2:
+                    eouts_stream[1].append(eout_chunk[1:2])
+            assert torch.allclose(eouts, torch.cat(eouts_stream[0], dim=1), atol=1e-5)
+            assert torch.allclose(eouts_reset, torch.cat(eouts_stream[1], dim=1), atol=1e-5)
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'pe_type': 'relative'}),
+        ({'pe_type': 'relative_xl'}),
+        ({'streaming_type': 'reshape'}),
+    ]
+)
+def test_forward_streaming_fallback(args):
+    args = make_args(**args)
+    N_l = args['chunk_size_left']
+    N_r = args['chunk_size_right']
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.transformer')
+    enc = module.TransformerEncoder(**args)
+    enc = enc.to(device)
+    assert not enc.streaming_with_cache
+
+    # the streaming frontend hops by the chunk size including the left context
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.streaming')
+    params = {'recog_ctc_vad': False, 'recog_ctc_vad_blank_threshold': 40,
+              'recog_ctc_vad_spike_threshold': 0.1, 'recog_ctc_vad_n_accum_frames': 4000}
+    assert module.Streaming(None, params, enc, idx2token=None).N_l == N_l
+
+    # each chunk is encoded independently by the latency-controlled implementation
+    enc.eval()
+    with torch.no_grad():
+        xs = np.random.randn(2, N_l + N_r, args['input_dim']).astype(np.float32)
+        xs = np2tensor(xs, device).float()
+        xlens = torch.IntTensor([N_l + N_r] * 2)
+        eouts = enc(xs, xlens, task='all')['ys']['xs']
+        for _ in range(2):
+            enc.set_cache(enc.batch_cache([None, enc.get_cache()]))
+            eouts_stream = enc(xs, xlens, task='all', streaming=True)['ys']['xs']
+            assert len(enc.split_cache(enc.get_cache(), 2)) == 2
+            assert torch.allclose(eouts, eouts_stream, atol=1e-5)
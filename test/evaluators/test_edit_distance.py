@@ -0,0 +1,108 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for edit distance."""
+
+import codecs
+import os
+import pytest
+import random
+
+from neural_sp.evaluators.edit_distance import compute_wer
+from neural_sp.evaluators.edit_distance import compute_wer_batch
+from neural_sp.evaluators.edit_distance import edit_distance_batch
+from neural_sp.evaluators.edit_distance import score_trn
+
+
+def compute_wer_ref(ref, hyp):
+    """Count errors with the full dynamic programming matrix and backtracking."""
+    d = [[0] * (len(hyp) + 1) for _ in range(len(ref) + 1)]
+    for i in range(len(ref) + 1):
+        d[i][0] = i
+    for j in range(len(hyp) + 1):
+        d[0][j] = j
+    for i in range(1, len(ref) + 1):
+        for j in range(1, len(hyp) + 1):
+            if ref[i - 1] == hyp[j - 1]:
+                d[i][j] = d[i - 1][j - 1]
+            else:
+                d[i][j] = min(d[i - 1][j - 1], d[i][j - 1], d[i - 1][j]) + 1
+    x, y = len(ref), len(hyp)
+    n_sub, n_ins, n_del = 0, 0, 0
+    while x > 0 or y > 0:
+        if x > 0 and y > 0 and d[x][y] == d[x - 1][y - 1] and ref[x - 1] == hyp[y - 1]:
+            x, y = x - 1, y - 1
+        elif y > 0 and d[x][y] == d[x][y - 1] + 1:
+            n_ins += 1
+            y -= 1
+        elif x > 0 and y > 0 and d[x][y] == d[x - 1][y - 1] + 1:
+            n_sub += 1
+            x, y = x - 1, y - 1
+        else:
+            n_del += 1
+            x -= 1
+    return d[-1][-1] * 100, n_sub * 100, n_ins * 100, n_del * 100
+
+
+def make_pairs(n_utts, vocab=5):
+    pairs = []
+    for _ in range(n_utts):
+        ref = [str(random.randrange(vocab)) for _ in range(random.randrange(0, 12))]
+        hyp = [str(random.randrange(vocab)) for _ in range(random.randrange(0, 12))]
+        pairs.append((ref, hyp))
+    return pairs
+
+
+def test_compute_wer():
+    assert compute_wer(['a', 'b', 'c'], ['a', 'b', 'c']) == (0, 0, 0, 0)
+    assert compute_wer(['a', 'b', 'c'], ['a', 'x', 'c', 'd']) == (200, 100, 100, 0)
+    assert compute_wer(['a', 'b', 'c'], []) == (300, 0, 0, 300)
+    assert compute_wer([], ['a']) == (100, 0, 100, 0)
+    assert compute_wer(['a', 'b'], ['b', 'a'], normalize=True)[0] == 100
+    for ref, hyp in make_pairs(500):
+        assert compute_wer(ref, hyp) == compute_wer_ref(ref, hyp)
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_compute_wer_batch(n_workers):
+    pairs = make_pairs(200)
+    refs = [ref for ref, _ in pairs]
+    hyps = [hyp for _, hyp in pairs]
+    results = compute_wer_batch(refs, hyps, n_workers=n_workers, chunk_size=16)
+    assert results == [compute_wer(ref, hyp) for ref, hyp in pairs]
+
+
+def test_edit_distance_batch():
+    pairs = make_pairs(200)
+    refs = [[int(w) for w in ref] for ref, _ in pairs]
+    hyps = [[int(w) for w in hyp] for _, hyp in pairs]
+    dists = edit_distance_batch(refs, hyps)
+    assert dists.shape == (len(pairs),)
+    assert dists.tolist() == [compute_wer(ref, hyp)[0] // 100 for ref, hyp in pairs]
+    assert edit_distance_batch([], []).shape == (0,)
+
+
+@pytest.mark.parametrize("n_workers", [1, 2])
+def test_score_trn(tmpdir, n_workers):
+    pairs = make_pairs(50)
+    ref_trn_path = os.path.join(str(tmpdir), 'ref.trn')
+    hyp_trn_path = os.path.join(str(tmpdir), 'hyp.trn')
+    with codecs.open(ref_trn_path, 'w', encoding='utf-8') as f_ref, \
+            codecs.open(hyp_trn_path, 'w', encoding='utf-8') as f_hyp:
+        for i, (ref, hyp) in enumerate(pairs):
+            f_ref.write(' '.join(ref) + ' (spk-utt%d)\n' % i)
+            f_hyp.write(' '.join(hyp) + ' (spk-utt%d)\n' % i)
+
+    wer, n_sub, n_ins, n_del = score_trn(ref_trn_path, hyp_trn_path, unit='word',
+                                         n_workers=n_workers, chunk_size=8)
+    results = [compute_wer(' '.join(ref).split(' '), ' '.join(hyp).split(' ')) for ref, hyp in pairs]
+    n_word = sum(len(' '.join(ref).split(' ')) for ref, _ in pairs)
+    assert wer == pytest.approx(sum(r[0] for r in results) / n_word)
+    assert n_sub == pytest.approx(sum(r[1] for r in results) / n_word)
+    assert n_ins == pytest.approx(sum(r[2] for r in results) / n_word)
+    assert n_del == pytest.approx(sum(r[3] for r in results) / n_word)
+
+    cer = score_trn(ref_trn_path, hyp_trn_path, unit='char', remove_space=True)[0]
+    n_char = sum(len(''.join(ref)) for ref, _ in pairs)
+    assert cer == pytest.approx(sum(compute_wer(list(''.join(ref)), list(''.join(hyp)))[0]
+                                    for ref, hyp in pairs) / n_char)
@@ -0,0 +1,174 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for sharded decoding of evaluation sets."""
+
+import importlib
+import logging
+import os
+import pytest
+
+
+def make_dataset(make_asr_tsv, n_utts, batch_size=1, n_speakers=1):
+    (tsv_path,), dict_path, _ = make_asr_tsv(n_utts, n_sessions=n_speakers, names=['eval'])
+    module = importlib.import_module('neural_sp.datasets.asr')
+    return module.Dataset(tsv_path=tsv_path, dict_path=dict_path, unit='char',
+                          batch_size=batch_size, min_n_frames=1, is_test=True)
+
+
+class StubModel(object):
+    """Decode each utterance into a length-dependent number of characters."""
+
+    def __init__(self, save_path):
+        self.save_path = save_path
+        self.xlen = 0
+
+    def decode(self, xs, params, **kwargs):
+        self.xlen = len(xs[-1])
+        return [[4] * (len(x) % 4) for x in xs], None
+
+    def streamable(self):
+        return self.xlen % 3 == 0
+
+    def quantity_rate(self):
+        return 1 / self.xlen
+
+    def last_success_frame_ratio(self):
+        return self.xlen / 7
+
+
+class CarryOverStubModel(StubModel):
+    """Decode each utterance depending on the previous utterances in the same session."""
+
+    def __init__(self, save_path):
+        super(CarryOverStubModel, self).__init__(save_path)
+        self.prev_spk = ''
+        self.n_prev_utts = 0
+
+    def reset_state_carry_over(self):
+        self.prev_spk = ''
+
+    def decode(self, xs, params, speakers, **kwargs):
+        best_hyps_id = []
+        for b in range(len(xs)):
+            if speakers[b] == self.prev_spk:
+                self.n_prev_utts += 1
+            else:
+                self.n_prev_utts = 0
+            self.prev_spk = speakers[b]
+            best_hyps_id.append([4] * (self.n_prev_utts + 1))
+        self.xlen = len(xs[-1])
+        return best_hyps_id, None
+
+
+EVAL_FNS = {'character': 'eval_char', 'phone': 'eval_phone', 'wordpiece_bleu': 'eval_wordpiece_bleu'}
+
+
+def run_eval(tmpdir, dataset, model, n_shards, carry_over=False, evaluator='character'):
+    module = importlib.import_module('neural_sp.evaluators.' + evaluator)
+    recog_dir = os.path.join(str(tmpdir), 'decode_%s_%d' % (evaluator, n_shards))
+    recog_params = {'recog_batch_size': 1, 'recog_chunk_sync': False,
+                    'recog_n_score_workers': 1, 'recog_n_shards': n_shards,
+                    'recog_asr_state_carry_over': carry_over,
+                    'recog_lm_state_carry_over': False}
+    score = getattr(module, EVAL_FNS[evaluator])([model], dataset, recog_params, epoch=1,
+                                                recog_dir=recog_dir)
+    trn = [open(os.path.join(recog_dir, name)).read() for name in ['ref.trn', 'hyp.trn']]
+    return score, trn
+
+
+@pytest.mark.parametrize("n_shards", [2, 3, 50])
+def test_decode_sharded(tmpdir, make_asr_tsv, caplog, n_shards):
+    dataset = make_dataset(make_asr_tsv, n_utts=23)
+    model = StubModel(str(tmpdir))
+
+    def streamability_logs():
+        logs = [r.getMessage() for r in caplog.records
+                if r.getMessage().split(' ')[0] in ['Streamablility', 'Quantity', 'Last']]
+        caplog.clear()
+        return logs
+
+    caplog.set_level(logging.INFO)
+    (wer_ref, cer_ref), trn_ref = run_eval(tmpdir, dataset, model, n_shards=1)
+    logs_ref = streamability_logs()
+    assert cer_ref > 0
+
+    # the same results and trn files as serial decoding
+    (wer, cer), trn = run_eval(tmpdir, dataset, model, n_shards=n_shards)
+    assert wer == wer_ref
+    assert cer == cer_ref
+    assert trn == trn_ref
+    assert streamability_logs() == logs_ref
+
+    # the dataset can be evaluated again
+    assert run_eval(tmpdir, dataset, model, n_shards=1)[0] == (wer_ref, cer_ref)
+
+
+def test_decode_sharded_cuda(tmpdir, make_asr_tsv, monkeypatch, caplog):
+    dataset = make_dataset(make_asr_tsv, n_utts=23)
+    model = StubModel(str(tmpdir))
+    (wer_ref, cer_ref), trn_ref = run_eval(tmpdir, dataset, model, n_shards=1)
+
+    # workers are not forked once CUDA is initialized
+    module = importlib.import_module('neural_sp.evaluators.sharding')
+    monkeypatch.setattr(module.torch.cuda, 'is_initialized', lambda: True)
+    monkeypatch.setattr(module.multiprocessing, 'get_context', None)
+    (wer, cer), trn = run_eval(tmpdir, dataset, model, n_shards=4)
+    assert (wer, cer) == (wer_ref, cer_ref)
+    assert trn == trn_ref
+    assert any('supported only on CPU' in r.getMessage() for r in caplog.records)
+
+
+@pytest.mark.parametrize("n_shards", [2, 3, 50])
+def test_decode_sharded_carry_over(tmpdir, make_asr_tsv, n_shards):
+    dataset = make_dataset(make_asr_tsv, n_utts=23, n_speakers=4)
+    model = CarryOverStubModel(str(tmpdir))
+
+    (wer_ref, cer_ref), trn_ref = run_eval(tmpdir, dataset, model, n_shards=1, carry_over=True)
+    assert cer_ref > 0
+
+    # sessions are not split into different shards
+    (wer, cer), trn = run_eval(tmpdir, dataset, model, n_shards=n_shards, carry_over=True)
+    assert wer == wer_ref
+    assert cer == cer_ref
+    assert trn == trn_ref
+
+
+
+@pytest.mark.parametrize("evaluator", ['phone', 'wordpiece_bleu'])
+def test_decode_sharded_evaluators(tmpdir, make_asr_tsv, evaluator):
+    dataset = make_dataset(make_asr_tsv, n_utts=23, n_speakers=4)
+    model = CarryOverStubModel(str(tmpdir))
+
+    score_ref, trn_ref = run_eval(tmpdir, dataset, model, n_shards=1,
+                                  carry_over=True, evaluator=evaluator)
+    score, trn = run_eval(tmpdir, dataset, model, n_shards=3,
+                          carry_over=True, evaluator=evaluator)
+    assert score == score_ref
+    assert trn == trn_ref
+
+
+def test_shard(tmpdir, make_asr_tsv):
+    dataset = make_dataset(make_asr_tsv, n_utts=10, batch_size=3)
+
+    utt_ids = []
+    for shard_id in range(3):
+        shard = dataset.shard(shard_id, 3)
+        assert len(shard) in [3, 4]
+        while True:
+            batch, is_new_epoch = shard.next()
+            utt_ids += sorted(batch['utt_ids'])
+            if is_new_epoch:
+                break
+    assert utt_ids == list(dataset.df['utt_id'])
+
+
+def test_shard_keep_sessions(tmpdir, make_asr_tsv):
+    dataset = make_dataset(make_asr_tsv, n_utts=10, n_speakers=3)
+
+    shards = [dataset.shard(shard_id, 4, keep_sessions=True) for shard_id in range(4)]
+    assert sum(len(shard) for shard in shards) == len(dataset)
+    sessions = [set(shard.df['session']) for shard in shards]
+    for i in range(4):
+        for j in range(i + 1, 4):
+            assert len(sessions[i] & sessions[j]) == 0
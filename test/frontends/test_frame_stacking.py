@@ -0,0 +1,79 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for frame stacking and splicing."""
+
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.seq2seq.frontends.frame_stacking import stack_frame
+from neural_sp.models.seq2seq.frontends.frame_stacking import stack_frame_pad
+from neural_sp.models.seq2seq.frontends.splicing import splice
+from neural_sp.models.torch_utils import np2tensor
+from neural_sp.models.torch_utils import pad_list
+
+
+def stack_frame_ref(feat, n_stacks, n_skips):
+    T, input_dim = feat.shape
+    T_new = T // n_skips if T % n_stacks == 0 else (T // n_skips) + 1
+    stacked_feat = np.zeros((T_new, input_dim * n_stacks), dtype=np.float32)
+    for t in range(T_new):
+        for i in range(n_stacks):
+            if t * n_skips + i < T:
+                stacked_feat[t, input_dim * i:input_dim * (i + 1)] = feat[t * n_skips + i]
+    return stacked_feat
+
+
+def splice_ref(feat, n_splices, n_stacks):
+    max_xlen, input_dim = feat.shape
+    freq = (input_dim // 3) // n_stacks
+    feat_splice = np.zeros((max_xlen, freq * (n_splices * n_stacks) * 3), dtype=np.float32)
+    for t in range(max_xlen):
+        spliced_frames = np.zeros((n_splices * n_stacks, freq, 3))
+        for i in range(n_splices):
+            copy_frame = feat[max(0, t + i - n_splices)].reshape((freq, 3, n_stacks))
+            spliced_frames[i:i + n_stacks] = np.transpose(copy_frame, (2, 0, 1))
+        feat_splice[t] = np.transpose(spliced_frames, (1, 0, 2)).reshape(-1)
+    return feat_splice
+
+
+@pytest.mark.parametrize(
+    "n_stacks, n_skips",
+    [(2, 1), (2, 2), (3, 3), (4, 3), (5, 2)]
+)
+def test_stack_frame(n_stacks, n_skips):
+    input_dim = 8
+    xlens = [1, 2, 7, 12, 25]
+    xs = [np.random.randn(xlen, input_dim).astype(np.float32) for xlen in xlens]
+
+    for x in xs:
+        assert np.array_equal(stack_frame(x, n_stacks, n_skips), stack_frame_ref(x, n_stacks, n_skips))
+
+    # batch version on padded tensors
+    xs_pad = pad_list([np2tensor(x).float() for x in xs], 1.)
+    out, out_lens = stack_frame_pad(xs_pad, torch.IntTensor(xlens), n_stacks, n_skips)
+    for b, x in enumerate(xs):
+        x_stack = stack_frame_ref(x, n_stacks, n_skips)
+        assert out_lens[b] == len(x_stack)
+        assert np.array_equal(out[b, :out_lens[b]].numpy(), x_stack)
+
+
+def test_stack_frame_invalid():
+    x = np.random.randn(10, 8).astype(np.float32)
+    assert stack_frame(x, 1, 1) is x
+    with pytest.raises(ValueError):
+        stack_frame(x, 1, 2)
+    with pytest.raises(ValueError):
+        stack_frame_pad(np2tensor(x).float().unsqueeze(0), torch.IntTensor([10]), 1, 2)
+
+
+@pytest.mark.parametrize(
+    "n_splices, n_stacks",
+    [(3, 1), (5, 1), (4, 2), (3, 3)]
+)
+def test_splice(n_splices, n_stacks):
+    freq = 4
+    for xlen in [1, 3, 20]:
+        x = np.random.randn(xlen, freq * 3 * n_stacks).astype(np.float32)
+        assert np.array_equal(splice(x, n_splices, n_stacks), splice_ref(x, n_splices, n_stacks))
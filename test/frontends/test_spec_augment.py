@@ -0,0 +1,106 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for SpecAugment."""
+
+import importlib
+import pytest
+import torch
+
+
+def make_args(**kwargs):
+    args = dict(
+        F=8,
+        T=10,
+        n_freq_masks=2,
+        n_time_masks=2,
+        p=1.0,
+        W=0,
+        adaptive_number_ratio=0,
+        adaptive_size_ratio=0,
+        max_n_time_masks=20,
+    )
+    args.update(kwargs)
+    return args
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({}),
+        ({'n_freq_masks': 0}),
+        ({'n_time_masks': 0}),
+        ({'p': 0.2}),
+        ({'adaptive_number_ratio': 0.04, 'adaptive_size_ratio': 0.05}),
+        ({'W': 5}),
+        ({'W': 5, 'n_freq_masks': 0, 'n_time_masks': 0}),
+    ]
+)
+def test_forward(args):
+    args = make_args(**args)
+    batch_size = 16
+    xmax = 100
+    n_bins = 40
+    device = "cpu"
+
+    xlens = torch.IntTensor([xmax - 5 * b for b in range(batch_size)])
+    xs = torch.rand(batch_size, xmax, n_bins, device=device) + 1  # non-zero
+    for b in range(batch_size):
+        xs[b, xlens[b]:] = 0
+
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.spec_augment')
+    specaug = module.SpecAugment(**args)
+    out = specaug(xs.clone(), xlens)
+    assert out.size() == xs.size()
+
+    freq_mask = specaug.freq_mask
+    time_mask = specaug.time_mask
+    assert freq_mask.size() == (batch_size, n_bins)
+    assert time_mask.size() == (batch_size, xmax)
+    for b in range(batch_size):
+        # padded frames are kept as they are
+        assert (out[b, xlens[b]:] == 0).all()
+        # time masks are inside each utterance
+        assert time_mask[b, xlens[b]:].sum() == 0
+        if args['adaptive_size_ratio'] == 0:
+            assert time_mask[b].sum() <= min(args['n_time_masks'] * args['T'], args['n_time_masks'] * int(xlens[b] * args['p']))
+        assert freq_mask[b].sum() <= args['n_freq_masks'] * args['F']
+
+        # masked regions are zero and others are not
+        mask_b = freq_mask[b].unsqueeze(0) | time_mask[b].unsqueeze(1)
+        assert (out[b, :xlens[b]][mask_b[:xlens[b]]] == 0).all()
+        assert (out[b, :xlens[b]][~mask_b[:xlens[b]]] != 0).all()
+        if args['W'] == 0:
+            assert torch.equal(out[b, :xlens[b]][~mask_b[:xlens[b]]], xs[b, :xlens[b]][~mask_b[:xlens[b]]])
+
+    # masks are sampled per utterance
+    if args['n_freq_masks'] > 0:
+        assert any(not torch.equal(freq_mask[0], freq_mask[b]) for b in range(1, batch_size))
+    if args['n_time_masks'] > 0:
+        assert any(not torch.equal(time_mask[0], time_mask[b]) for b in range(1, batch_size))
+
+
+def test_time_warp():
+    batch_size = 4
+    xmax = 50
+    n_bins = 8
+    W = 10
+    xlens = torch.IntTensor([50, 30, 21, 15])
+    # linear ramp in time so that warping keeps monotonicity
+    xs = torch.arange(xmax).float().view(1, xmax, 1).repeat(batch_size, 1, n_bins)
+    for b in range(batch_size):
+        xs[b, xlens[b]:] = 0
+
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.spec_augment')
+    specaug = module.SpecAugment(F=0, T=0, n_freq_masks=0, n_time_masks=0, W=W)
+    out = specaug.time_warp(xs.clone(), xlens.long())
+    for b in range(batch_size):
+        xlen = int(xlens[b])
+        if xlen <= 2 * W:
+            # too short to be warped
+            assert torch.equal(out[b], xs[b])
+        else:
+            assert out[b, 0, 0] == 0
+            assert (out[b, 1:xlen, 0] - out[b, :xlen - 1, 0] >= 0).all()
+            assert (out[b, :xlen] <= xlen - 1).all()
+            assert (out[b, xlen:] == 0).all()
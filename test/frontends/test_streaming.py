@@ -0,0 +1,159 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for streaming encoding interface."""
+
+import copy
+import importlib
+import numpy as np
+import pytest
+import torch
+
+
+def make_args(**kwargs):
+    args = dict(
+        input_dim=80,
+        enc_type='blstm',
+        n_units=16,
+        n_projs=0,
+        last_proj_dim=0,
+        n_layers=2,
+        n_layers_sub1=0,
+        n_layers_sub2=0,
+        dropout_in=0.1,
+        dropout=0.1,
+        subsample="1_1",
+        subsample_type='drop',
+        n_stacks=1,
+        n_splices=1,
+        conv_in_channel=1,
+        conv_channels="32_32",
+        conv_kernel_sizes="(3,3)_(3,3)",
+        conv_strides="(1,1)_(1,1)",
+        conv_poolings="(2,2)_(2,2)",
+        conv_batch_norm=False,
+        conv_layer_norm=False,
+        conv_bottleneck_dim=0,
+        bidir_sum_fwd_bwd=False,
+        task_specific_layer=False,
+        param_init=0.1,
+        chunk_size_left=0,
+        chunk_size_right=0,
+    )
+    args.update(kwargs)
+    return args
+
+
+def make_decode_params(**kwargs):
+    args = dict(
+        recog_ctc_vad=True,
+        recog_ctc_vad_blank_threshold=40,
+        recog_ctc_vad_spike_threshold=0.1,
+        recog_ctc_vad_n_accum_frames=4000,
+    )
+    args.update(kwargs)
+    return args
+
+
+@pytest.mark.parametrize(
+    "args, feed_size",
+    [
+        ({'enc_type': 'blstm', 'chunk_size_left': 20, 'chunk_size_right': 20}, 7),
+        ({'enc_type': 'blstm', 'chunk_size_left': 20, 'chunk_size_right': 20}, 100),
+        ({'enc_type': 'lstm', 'chunk_size_left': 0}, 13),
+        ({'enc_type': 'conv_blstm', 'conv_poolings': "(1,1)_(1,1)",
+          'chunk_size_left': 20, 'chunk_size_right': 20}, 7),
+    ]
+)
+def test_incremental_feature_extraction(args, feed_size):
+    args = make_args(**args)
+    params = make_decode_params()
+    xmax = 123
+
+    module = importlib.import_module('neural_sp.models.seq2seq.encoders.rnn')
+    enc = module.RNNEncoder(**args)
+    x_whole = np.random.randn(xmax, args['input_dim']).astype(np.float32)
+
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.streaming')
+
+    # reference: whole features are given in advance
+    streaming = module.Streaming(x_whole, params, enc, idx2token=None)
+    chunks_ref = []
+    while True:
+        x_chunk, is_last_chunk, lookback, lookahead = streaming.extract_feature()
+        chunks_ref.append((x_chunk, is_last_chunk, lookback, lookahead))
+        streaming.next_chunk()
+        if is_last_chunk:
+            break
+
+    # features arrive incrementally
+    streaming = module.Streaming(None, params, enc, idx2token=None)
+    chunks = []
+    for t in range(0, xmax, feed_size):
+        streaming.append_feature(x_whole[t:t + feed_size])
+        is_final = t + feed_size >= xmax
+        while streaming.is_ready(is_final):
+            x_chunk, is_last_chunk, lookback, lookahead = streaming.extract_feature(is_final)
+            chunks.append((x_chunk, is_last_chunk, lookback, lookahead))
+            streaming.next_chunk()
+            if is_last_chunk:
+                break
+        # consumed frames are discarded
+        assert streaming.x_offset <= streaming.offset
+    assert streaming.n_frames == xmax
+
+    assert len(chunks) == len(chunks_ref)
+    for (x_chunk, is_last_chunk, lookback, lookahead), ref in zip(chunks, chunks_ref):
+        assert np.array_equal(x_chunk, ref[0])
+        assert (is_last_chunk, lookback, lookahead) == ref[1:]
+
+
+def test_scheduler_batches_sessions_with_equal_params(monkeypatch):
+    from neural_sp.bin.args_asr import parse_args_train
+    from neural_sp.models.seq2seq.speech2text import Speech2Text
+
+    argv = ['--train_set', '', '--dev_set', '', '--dict', '',
+            '--enc_type', 'blstm', '--enc_n_layers', '2', '--enc_n_units', '16',
+            '--lc_chunk_size_left', '8', '--lc_chunk_size_right', '4', '--subsample', '1_1',
+            '--dec_n_units', '16', '--attn_type', 'mocha', '--mocha_chunk_size', '4',
+            '--mocha_init_r', '4', '--ctc_weight', '0.3']
+    monkeypatch.setattr('sys.argv', ['train.py'] + argv)
+    args = parse_args_train(argv)
+    args.input_dim = 8
+    args.vocab = 10
+    args.vocab_sub1 = 0
+    args.vocab_sub2 = 0
+    params = {k: v for k, v in vars(args).items() if k.startswith('recog_')}
+    params.update(make_decode_params(recog_ctc_vad_blank_threshold=4,
+                                     recog_ctc_vad_spike_threshold=0.5,
+                                     recog_ctc_vad_n_accum_frames=8))
+    params.update(recog_chunk_sync=True, recog_beam_width=3, recog_ctc_weight=0.3,
+                  recog_max_len_ratio=1.0)
+
+    np.random.seed(0)
+    torch.manual_seed(0)
+    model = Speech2Text(args)
+    module = importlib.import_module('neural_sp.models.seq2seq.frontends.streaming')
+    xs = [np.random.randn(xlen, args.input_dim).astype(np.float32) for xlen in [50, 60]]
+
+    # reference: each session is decoded alone
+    hyps_ref = []
+    for x in xs:
+        session = module.StreamingSession(model, copy.deepcopy(params), idx2token=None)
+        hyps_ref.append(session.feed(x, is_final=True)[0])
+
+    batch_sizes = []
+    beam_search_chunk_sync_batch = model.dec_fwd.beam_search_chunk_sync_batch
+
+    def spy(eouts_c, *args, **kwargs):
+        batch_sizes.append(eouts_c.size(0))
+        return beam_search_chunk_sync_batch(eouts_c, *args, **kwargs)
+    monkeypatch.setattr(model.dec_fwd, 'beam_search_chunk_sync_batch', spy)
+
+    # sessions with equal but separately constructed parameters are decoded in a batch
+    sessions = [module.StreamingSession(model, copy.deepcopy(params), idx2token=None) for _ in xs]
+    outputs = module.StreamingScheduler(model).feed(
+        [(session, x, True) for session, x in zip(sessions, xs)])
+    assert max(batch_sizes) == len(sessions)
+    for (hyp, _), hyp_ref in zip(outputs, hyps_ref):
+        assert np.array_equal(hyp, hyp_ref)
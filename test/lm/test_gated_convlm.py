@@ -0,0 +1,107 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for GatedConvLM."""
+
+import argparse
+import importlib
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.seq2seq.decoders.beam_search import reorder_lmstate
+from neural_sp.models.torch_utils import np2tensor
+
+
+VOCAB = 100  # large for adaptive softmax
+
+
+def make_args(**kwargs):
+    args = dict(
+        lm_type='gated_conv_custom',
+        n_units=32,
+        n_projs=0,
+        n_layers=3,
+        kernel_size=4,
+        emb_dim=32,
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        lsm_prob=0.0,
+        param_init=0.1,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'n_layers': 1}),
+        ({'n_layers': 3}),
+        # kernel size
+        ({'kernel_size': 1}),
+        ({'kernel_size': 2}),
+        # bottleneck
+        ({'n_projs': 16}),
+        ({'emb_dim': 16}),
+        # regularization
+        ({'lsm_prob': 0.1}),
+        # embedding
+        ({'adaptive_softmax': True}),
+        ({'tie_embedding': True}),
+    ]
+)
+def test_forward(args):
+    args = make_args(**args)
+
+    ylens = [4, 5, 3, 7] * 20
+    ys = [np.random.randint(0, VOCAB, ylen).astype(np.int64) for ylen in ylens]
+    device = "cpu"
+
+    module = importlib.import_module('neural_sp.models.lm.gated_convlm')
+    lm = module.GatedConvLM(args)
+    lm = lm.to(device)
+    loss, state, observation = lm(ys, state=None, n_caches=0)
+    assert loss.item() >= 0
+    assert isinstance(observation, dict)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'kernel_size': 4}),
+        ({'kernel_size': 1}),
+        ({'n_projs': 16, 'emb_dim': 16}),
+    ]
+)
+def test_predict_incremental(args):
+    args = make_args(**args)
+    bs, ymax = 4, 9
+    module = importlib.import_module('neural_sp.models.lm.gated_convlm')
+    lm = module.GatedConvLM(args).eval()
+
+    ys = np2tensor(np.random.randint(0, VOCAB, (bs, ymax)).astype(np.int64))
+    with torch.no_grad():
+        _, _, log_probs_full = lm.predict(ys, None)
+
+        # one token at a time
+        state = None
+        for t in range(ymax):
+            lmout, state, log_probs = lm.predict(ys[:, t:t + 1], state, cache=state)
+            assert lmout.size() == (bs, 1, args.n_units)
+            assert len(state) == args.n_layers
+            assert all(s.size(0) == bs and s.size(2) == args.kernel_size - 1 for s in state)
+            assert torch.allclose(log_probs[:, 0], log_probs_full[:, t], atol=1e-5)
+
+        # prefix first, then the rest
+        _, state, _ = lm.predict(ys[:, :5], None)
+        _, _, log_probs = lm.predict(ys[:, 5:], state)
+        assert torch.allclose(log_probs, log_probs_full[:, 5:], atol=1e-5)
+
+        # reorder states along hypotheses
+        ids = torch.LongTensor([2, 2, 0, 3])
+        _, state, _ = lm.predict(ys[:, :5], None)
+        state = reorder_lmstate(state, ids)
+        _, _, log_probs = lm.predict(ys[ids, 5:6], state)
+        assert torch.allclose(log_probs[:, 0], log_probs_full[ids, 5], atol=1e-5)
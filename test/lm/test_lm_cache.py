@@ -0,0 +1,89 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for the continuous cache of LMs."""
+
+import argparse
+import importlib
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+
+
+VOCAB = 100
+
+
+def make_args(**kwargs):
+    args = dict(
+        lm_type='lstm',
+        n_units=32,
+        n_projs=0,
+        n_layers=2,
+        residual=False,
+        use_glu=False,
+        n_units_null_context=0,
+        bottleneck_dim=16,
+        emb_dim=16,
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        lsm_prob=0.0,
+        param_init=0.1,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def cache_loss_loop(lm, ys, n_caches):
+    """Compute losses with the continuous cache token by token."""
+    bs = ys.shape[0]
+    ys = np2tensor(ys)
+    with torch.no_grad():
+        logits, out, _ = lm.decode(ys[:, :-1], None)
+    probs = torch.softmax(logits, dim=-1)
+    losses = []
+    for b in range(bs):
+        cache_ids, cache_keys = [], []
+        for t in range(ys.size(1) - 1):
+            p = probs[b, t]
+            if len(cache_ids) > 0:
+                cache_ids = cache_ids[-n_caches:]
+                cache_keys = cache_keys[-n_caches:]
+                attn = torch.softmax(lm.cache_theta * torch.stack(cache_keys).matmul(out[b, t]), dim=0)
+                cache_probs = p.new_zeros(p.size())
+                for offset, idx in enumerate(cache_ids):
+                    cache_probs[idx] += attn[offset]
+                p = (1 - lm.cache_lambda) * p + lm.cache_lambda * cache_probs
+            losses.append(-torch.log(p[ys[b, t + 1]]).item())
+            cache_ids.append(ys[b, t + 1].item())
+            cache_keys.append(out[b, t])
+    return np.mean(losses)
+
+
+@pytest.mark.parametrize("n_caches", [1, 4, 100])
+@pytest.mark.parametrize("bs", [1, 3])
+def test_cache_loss(n_caches, bs):
+    args = make_args()
+    module = importlib.import_module('neural_sp.models.lm.rnnlm')
+    lm = module.RNNLM(args).eval()
+
+    ys = np.random.randint(4, VOCAB, (bs, 16)).astype(np.int64)
+    loss_ref = cache_loss_loop(lm, ys, n_caches)
+
+    # whole sequence at once
+    lm.reset_cache()
+    loss, _, observation = lm(ys, None, is_eval=True, n_caches=n_caches)
+    assert np.allclose(loss.item(), loss_ref, atol=1e-5)
+    assert lm.cache_len == min(ys.shape[1] - 1, n_caches)
+
+    # two segments with the ring buffer
+    lm.reset_cache()
+    loss1, state, _ = lm(ys[:, :7], None, is_eval=True, n_caches=n_caches)
+    loss2, state, _ = lm(ys[:, 6:], state, is_eval=True, n_caches=n_caches)
+    loss = (loss1.item() * 6 + loss2.item() * 9) / 15
+    assert np.allclose(loss, loss_ref, atol=1e-5)
+    assert lm.cache_attn.size() == (bs, 9, min(6, n_caches) + 9)
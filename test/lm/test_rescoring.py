@@ -0,0 +1,168 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Test for batched N-best rescoring with LMs."""
+
+import argparse
+import importlib
+import numpy as np
+import pytest
+import torch
+
+from neural_sp.models.torch_utils import np2tensor
+
+
+VOCAB = 100  # large for adaptive softmax
+
+
+def make_args(**kwargs):
+    args = dict(
+        lm_type='lstm',
+        n_units=32,
+        n_projs=0,
+        n_layers=2,
+        residual=False,
+        use_glu=False,
+        n_units_null_context=0,
+        bottleneck_dim=16,
+        emb_dim=16,
+        kernel_size=3,
+        transformer_attn_type='scaled_dot',
+        transformer_n_heads=4,
+        transformer_d_model=16,
+        transformer_d_ff=64,
+        transformer_layer_norm_eps=1e-12,
+        transformer_ffn_activation='relu',
+        transformer_pe_type='add',
+        transformer_param_init='xavier_uniform',
+        vocab=VOCAB,
+        dropout_in=0.1,
+        dropout_hidden=0.1,
+        dropout_att=0.1,
+        dropout_layer=0.0,
+        lsm_prob=0.0,
+        param_init=0.1,
+        bptt=200,
+        mem_len=0,
+        recog_mem_len=0,
+        zero_center_offset=False,
+        adaptive_softmax=False,
+        tie_embedding=False,
+    )
+    args.update(kwargs)
+    return argparse.Namespace(**args)
+
+
+def build_lm(args):
+    if args.lm_type == 'transformer':
+        module = importlib.import_module('neural_sp.models.lm.transformerlm')
+        lm = module.TransformerLM(args)
+    elif args.lm_type == 'transformer_xl':
+        module = importlib.import_module('neural_sp.models.lm.transformer_xl')
+        lm = module.TransformerXL(args)
+    elif 'gated_conv' in args.lm_type:
+        module = importlib.import_module('neural_sp.models.lm.gated_convlm')
+        lm = module.GatedConvLM(args)
+    else:
+        module = importlib.import_module('neural_sp.models.lm.rnnlm')
+        lm = module.RNNLM(args)
+    return lm.eval()
+
+
+def make_nbest(n_utts, nbest, eos=2):
+    """N-best lists sharing prefixes (including duplicates and empty hypotheses)."""
+    hyps = []
+    for _ in range(n_utts):
+        base = np.random.randint(4, VOCAB, np.random.randint(3, 12)).tolist()
+        for _ in range(nbest):
+            cut = np.random.randint(0, len(base) + 1)
+            suffix = np.random.randint(4, VOCAB, np.random.randint(0, 4)).tolist()
+            hyps.append({'hyp': [eos] + base[:cut] + suffix + [eos], 'score': 0.})
+    hyps.append({'hyp': [eos], 'score': 0.})
+    return hyps
+
+
+def score_loop(lm, hyps, reverse=False):
+    """Score hypotheses one by one."""
+    scores = []
+    for h in hyps:
+        ys = h['hyp'][::-1] if reverse else h['hyp']
+        if len(ys) == 1:
+            scores.append(0.)
+            continue
+        ys = np2tensor(np.array(ys, dtype=np.int64)).unsqueeze(0)
+        with torch.no_grad():
+            log_probs = torch.log_softmax(lm.decode(ys[:, :-1], None)[0], dim=-1)
+        scores.append(log_probs[0].gather(1, ys[0, 1:].unsqueeze(1)).sum().item())
+    return np.array(scores)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'lm_type': 'lstm'}),
+        ({'lm_type': 'gru', 'n_layers': 1}),
+        ({'lm_type': 'lstm', 'n_projs': 8, 'residual': True}),
+        ({'lm_type': 'transformer'}),
+        ({'lm_type': 'transformer', 'transformer_pe_type': 'none'}),
+        ({'lm_type': 'transformer_xl'}),
+        ({'lm_type': 'gated_conv_custom', 'n_units': 16}),
+        ({'lm_type': 'gated_conv_custom', 'n_units': 16, 'n_projs': 8}),
+    ]
+)
+@pytest.mark.parametrize("reverse", [False, True])
+def test_score(args, reverse):
+    args = make_args(**args)
+    lm = build_lm(args)
+    hyps = make_nbest(n_utts=3, nbest=8)
+    scores_ref = score_loop(lm, hyps, reverse=reverse)
+
+    module = importlib.import_module('neural_sp.models.lm.rescoring')
+    for use_trie in [True, False]:
+        rescorer = module.LMRescorer(lm, use_trie=use_trie)
+        scores, ylens = rescorer.score([h['hyp'] for h in hyps], reverse=reverse)
+        assert scores.shape == (len(hyps),)
+        assert ylens.tolist() == [len(h['hyp']) - 1 for h in hyps]
+        np.testing.assert_allclose(scores, scores_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("use_trie", [True, False])
+def test_score_adaptive_softmax(use_trie):
+    args = make_args(lm_type='transformer', adaptive_softmax=True)
+    lm = build_lm(args)
+    hyps = make_nbest(n_utts=2, nbest=4)
+
+    module = importlib.import_module('neural_sp.models.lm.rescoring')
+    rescorer = module.LMRescorer(lm, use_trie=use_trie)
+    scores, _ = rescorer.score([h['hyp'] for h in hyps])
+
+    scores_ref = []
+    for h in hyps:
+        ys = np2tensor(np.array(h['hyp'], dtype=np.int64)).unsqueeze(0)
+        with torch.no_grad():
+            out = lm.decode(ys[:, :-1], None)[0]
+            log_probs = lm.adaptive_softmax.log_prob(out[0]) if ys.size(1) > 1 else None
+        scores_ref.append(log_probs.gather(1, ys[0, 1:].unsqueeze(1)).sum().item()
+                          if log_probs is not None else 0.)
+    np.testing.assert_allclose(scores, scores_ref, rtol=1e-4, atol=1e-4)
+
+
+def test_rescore():
+    args = make_args()
+    lm = build_lm(args)
+    hyps = make_nbest(n_utts=2, nbest=4)
+    for h in hyps:
+        h['score'] = np.random.randn()
+    scores_prev = np.array([h['score'] for h in hyps])
+    scores_lm = score_loop(lm, hyps)
+    ylens = np.array([max(len(h['hyp']) - 1, 1) for h in hyps])
+
+    module = importlib.import_module('neural_sp.models.lm.rescoring')
+    rescorer = module.LMRescorer(lm)
+    rescorer.rescore(hyps, lm_weight=0.3, tag='second')
+    np.testing.assert_allclose([h['score_lm_second'] for h in hyps], scores_lm / ylens, rtol=1e-4, atol=1e-4)
+    np.testing.assert_allclose([h['score'] for h in hyps], scores_prev + 0.3 * scores_lm / ylens,
+                               rtol=1e-4, atol=1e-4)
+
+    # without length normalization
+    rescorer.rescore(hyps, lm_weight=0.5, tag='second', length_norm=False)
+    np.testing.assert_allclose([h['score_lm_second'] for h in hyps], scores_lm, rtol=1e-4, atol=1e-4)
@@ -7,6 +7,10 @@ import argparse
 import importlib
 import numpy as np
 import pytest
+import torch
+
+from neural_sp.models.seq2seq.decoders.beam_search import reorder_lmstate
+from neural_sp.models.torch_utils import np2tensor
 
 
 VOCAB = 100  # large for adaptive softmax
@@ -82,3 +86,64 @@ def test_forward(args):
     # assert loss.size(0) == 1
     assert loss.item() >= 0
     assert isinstance(observation, dict)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'transformer_n_heads': 4}),
+        ({'zero_center_offset': True}),
+    ]
+)
+def test_predict_incremental(args):
+    args = make_args(**args)
+    bs, ymax = 4, 9
+    module = importlib.import_module('neural_sp.models.lm.transformer_xl')
+    lm = module.TransformerXL(args).eval()
+
+    ys = np2tensor(np.random.randint(0, VOCAB, (bs, ymax)).astype(np.int64))
+    with torch.no_grad():
+        logits_full = lm.decode(ys, None)[0]
+
+        # one token at a time with key/value buffers
+        cache = lm.init_cache(bs, 4)  # buffers are extended when full
+        for t in range(ymax):
+            logits, _, cache = lm.decode(ys[:, :t + 1], None, cache=cache, incremental=True)
+            assert logits.size() == (bs, 1, VOCAB)
+            assert all(cache_l['length'] == t + 1 for cache_l in cache)
+            assert torch.allclose(logits[:, 0], logits_full[:, t], atol=1e-4)
+
+        # prefix first, then the rest
+        _, _, cache = lm.decode(ys[:, :5], None, incremental=True)
+        logits, _, cache = lm.decode(ys, None, cache=cache, incremental=True)
+        assert torch.allclose(logits, logits_full[:, 5:], atol=1e-4)
+
+        # reorder buffers along hypotheses
+        ids = torch.LongTensor([2, 2, 0, 3])
+        _, _, cache = lm.decode(ys[:, :5], None, incremental=True)
+        cache = reorder_lmstate(cache, ids)
+        logits, _, _ = lm.decode(ys[ids, :6], None, cache=cache, incremental=True)
+        assert torch.allclose(logits[:, 0], logits_full[ids, 5], atol=1e-4)
+
+
+def test_truncate_cache():
+    args = make_args()
+    bs = 2
+    module = importlib.import_module('neural_sp.models.lm.transformer_xl')
+    lm = module.TransformerXL(args).eval()
+
+    ys = np2tensor(np.random.randint(0, VOCAB, (bs, 9)).astype(np.int64))
+    with torch.no_grad():
+        # segment-level recurrence with hidden states
+        _, _, mems = lm.decode(ys[:, :5], None)
+        logits_ref = lm.decode(ys[:, 5:], None, mems=mems)[0]
+
+        # the same recurrence with key/value buffers
+        _, _, cache = lm.decode(ys[:, :5], None, incremental=True)
+        cache = lm.truncate_cache(cache, mem_len=args.mem_len)
+        assert all(cache_l['length'] == cache_l['mlen'] == 5 for cache_l in cache)
+        logits, _, _ = lm.decode(ys[:, 5:], None, cache=cache, incremental=True)
+        assert torch.allclose(logits, logits_ref, atol=1e-4)
+
+        # memory given as hidden states
+        logits, _, _ = lm.decode(ys[:, 5:], None, mems=mems, incremental=True)
+        assert torch.allclose(logits, logits_ref, atol=1e-4)
@@ -7,6 +7,10 @@ import argparse
 import importlib
 import numpy as np
 import pytest
+import torch
+
+from neural_sp.models.seq2seq.decoders.beam_search import reorder_lmstate
+from neural_sp.models.torch_utils import np2tensor
 
 
 VOCAB = 100  # large for adaptive softmax
@@ -79,3 +83,87 @@ def test_forward(args):
     # assert loss.size(0) == 1
     assert loss.item() >= 0
     assert isinstance(observation, dict)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'transformer_n_heads': 4}),
+        ({'transformer_pe_type': 'none'}),
+        ({'transformer_pe_type': '1dconv3L'}),
+    ]
+)
+def test_predict_incremental(args):
+    args = make_args(**args)
+    bs, ymax = 4, 9
+    module = importlib.import_module('neural_sp.models.lm.transformerlm')
+    lm = module.TransformerLM(args).eval()
+
+    ys = np2tensor(np.random.randint(0, VOCAB, (bs, ymax)).astype(np.int64))
+    with torch.no_grad():
+        logits_full = lm.decode(ys, None)[0]
+
+        # one token at a time with key/value buffers
+        cache = lm.init_cache(bs, 4)  # buffers are extended when full
+        for t in range(ymax):
+            logits, _, cache = lm.decode(ys[:, :t + 1], None, cache=cache, incremental=True)
+            assert logits.size() == (bs, 1, VOCAB)
+            assert all(cache_l['length'] == t + 1 for cache_l in cache)
+            assert torch.allclose(logits[:, 0], logits_full[:, t], atol=1e-5)
+
+        # prefix first, then the rest
+        _, _, cache = lm.decode(ys[:, :5], None, incremental=True)
+        logits, _, cache = lm.decode(ys, None, cache=cache, incremental=True)
+        assert torch.allclose(logits, logits_full[:, 5:], atol=1e-5)
+
+        # reorder buffers along hypotheses
+        ids = torch.LongTensor([2, 2, 0, 3])
+        _, _, cache = lm.decode(ys[:, :5], None, incremental=True)
+        cache = reorder_lmstate(cache, ids)
+        logits, _, _ = lm.decode(ys[ids, :6], None, cache=cache, incremental=True)
+        assert torch.allclose(logits[:, 0], logits_full[ids, 5], atol=1e-5)
+
+
+def decode_windowed(lm, ys, start, window):
+    """Decode ys while positions from `start` attend only to the last `window` positions before `start`."""
+    bs, ylen = ys.size()
+    causal_mask = torch.tril(ys.new_ones(ylen, ylen).byte())
+    causal_mask[start:, :start - window] = 0
+    causal_mask = causal_mask.unsqueeze(0).repeat([bs, 1, 1])
+    out = lm.pos_enc(lm.embed(ys))
+    for layer in lm.layers:
+        out = layer(out, causal_mask)
+    return lm.output(lm.norm_out(out))
+
+
+@pytest.mark.parametrize("pe_type", ['add', 'none'])
+def test_truncate_cache(pe_type):
+    args = make_args(transformer_pe_type=pe_type)
+    bs = 2
+    module = importlib.import_module('neural_sp.models.lm.transformerlm')
+    lm = module.TransformerLM(args).eval()
+
+    ys = np2tensor(np.random.randint(0, VOCAB, (bs, 12)).astype(np.int64))
+    with torch.no_grad():
+        logits_full = lm.decode(ys, None)[0]
+
+        # carry over all positions of the previous segment
+        _, _, cache = lm.decode(ys[:, :5], None, incremental=True)
+        cache = lm.truncate_cache(cache, mem_len=0)
+        assert all(cache_l['length'] == cache_l['mlen'] == 5 for cache_l in cache)
+        logits, _, _ = lm.decode(ys[:, 5:], None, cache=cache, incremental=True)
+        assert torch.allclose(logits, logits_full[:, 5:], atol=1e-5)
+
+        # memory is bounded
+        _, _, cache = lm.decode(ys[:, :9], None, incremental=True)
+        cache = lm.truncate_cache(cache, mem_len=3)
+        assert all(cache_l['length'] == cache_l['mlen'] == 3 for cache_l in cache)
+        assert all(cache_l['key'].size(1) == 3 for cache_l in cache)
+        assert all(cache_l['pos'] == 9 for cache_l in cache)
+
+        # new tokens keep their absolute positions after the truncated memory
+        logits_ref = decode_windowed(lm, ys, start=9, window=3)[:, 9:]
+        logits, _, cache = lm.decode(ys[:, 9:11], None, cache=cache, incremental=True)
+        assert torch.allclose(logits, logits_ref[:, :2], atol=1e-5)
+        logits, _, cache = lm.decode(ys[:, 9:], None, cache=cache, incremental=True)
+        assert torch.allclose(logits, logits_ref[:, 2:], atol=1e-5)
+        assert all(cache_l['pos'] == 12 for cache_l in cache)
@@ -83,3 +83,97 @@ def test_forward_incremental(args):
         assert cv.size() == (batch_size, 1, args['enc_dim'])
         assert alpha.size() == (batch_size, xmax)
         assert aws.size() == (batch_size, 1, xmax)
+
+
+def integrate_and_fire_loop(alpha, eouts, beta, ymax):
+    """Frame-by-frame reference for a single utterance."""
+    cv = eouts.new_zeros(ymax + 1, eouts.size(1))
+    aws = eouts.new_zeros(ymax + 1, eouts.size(0))
+    n_tokens = 0
+    alpha_accum = 0.
+    for j in range(eouts.size(0)):
+        a = alpha[j].item()
+        while n_tokens < ymax and alpha_accum + a >= beta:
+            # A boundary is located
+            ak1 = beta - alpha_accum
+            cv[n_tokens] += ak1 * eouts[j]
+            aws[n_tokens, j] += ak1
+            n_tokens += 1
+            a -= ak1
+            alpha_accum = 0.
+        # Carry over to the next frame
+        alpha_accum += a
+        cv[n_tokens] += a * eouts[j]
+        aws[n_tokens, j] += a
+    return cv[:ymax], aws[:ymax]
+
+
+@pytest.mark.parametrize("threshold", [1.0, 0.9])
+def test_forward_parallel_batch(threshold):
+    args = make_args(threshold=threshold)
+
+    xmax = 40
+    device = "cpu"
+
+    eouts = torch.randn(3, xmax, args['enc_dim'], device=device)
+    elens = torch.IntTensor([xmax, 31, 17])
+    for b in range(3):
+        eouts[b, elens[b]:] = 0
+    ylens = torch.IntTensor([9, 5, 12])
+
+    module = importlib.import_module('neural_sp.models.modules.cif')
+    cif = module.CIF(**args)
+    cif = cif.to(device)
+    cif.eval()
+
+    cv, alpha, aws = cif(eouts, elens, ylens, mode='parallel')
+    assert cv.size() == (3, 12, args['enc_dim'])
+    assert aws.size() == (3, 12, xmax)
+    for b in range(3):
+        alpha_norm = alpha[b] / alpha[b].sum() * ylens[b].float()
+        cv_b, aws_b = integrate_and_fire_loop(alpha_norm, eouts[b], threshold, ylens[b].item())
+        assert torch.allclose(aws[b, :ylens[b]], aws_b, atol=1e-4)
+        assert torch.allclose(cv[b, :ylens[b]], cv_b, atol=1e-4)
+        assert aws[b, ylens[b]:].sum() == 0
+        assert aws[b, :, elens[b]:].sum() == 0
+
+
+@pytest.mark.parametrize("threshold", [1.0, 0.9])
+def test_forward_incremental_batch(threshold):
+    args = make_args(threshold=threshold)
+
+    xmax = 40
+    ymax = 30
+    device = "cpu"
+
+    eouts = torch.randn(3, xmax, args['enc_dim'], device=device)
+    elens = torch.IntTensor([xmax, 31, 17])
+    for b in range(3):
+        eouts[b, elens[b]:] = 0
+
+    module = importlib.import_module('neural_sp.models.modules.cif')
+    cif = module.CIF(**args)
+    cif = cif.to(device)
+    cif.eval()
+
+    cv, aws = [], []
+    for i in range(ymax):
+        cv_i, alpha, aws_i = cif(eouts, elens, mode='incremental')
+        cv.append(cv_i)
+        aws.append(aws_i)
+    cv = torch.cat(cv, dim=1)
+    aws = torch.cat(aws, dim=1)
+
+    for b in range(3):
+        # the same tokens as decoding each utterance separately
+        cif.reset()
+        for i in range(ymax):
+            cv_b, _, aws_b = cif(eouts[b:b + 1, :elens[b]], elens[b:b + 1], mode='incremental')
+            assert torch.allclose(cv[b:b + 1, i:i + 1], cv_b, atol=1e-5)
+            assert torch.allclose(aws[b:b + 1, i:i + 1, :elens[b]], aws_b, atol=1e-5)
+
+        # fired tokens match the frame-by-frame integration
+        n_fired = int(alpha[b, :elens[b]].sum().item() // threshold)
+        _, aws_ref = integrate_and_fire_loop(alpha[b, :elens[b]], eouts[b, :elens[b]],
+                                             threshold, n_fired)
+        assert torch.allclose(aws[b, :n_fired, :elens[b]], aws_ref, atol=1e-4)
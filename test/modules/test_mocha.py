@@ -170,3 +170,144 @@ def test_forward_hard(args):
         if args['chunk_size'] > 1:
             assert beta is not None
             assert beta.size() == (batch_size, args['n_heads_mono'] * args['n_heads_chunk'], 1, klen)
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'n_heads_mono': 1, 'chunk_size': 1}),
+        ({'n_heads_mono': 1, 'chunk_size': 4}),
+        ({'n_heads_mono': 1, 'chunk_size': -1}),
+        ({'n_heads_mono': 4, 'n_heads_chunk': 1, 'chunk_size': 4, 'atype': 'scaled_dot'}),
+        ({'n_heads_mono': 4, 'n_heads_chunk': 4, 'chunk_size': 4, 'atype': 'scaled_dot',
+          'share_chunkwise_attention': False}),
+    ]
+)
+def test_forward_hard_shared_key(args):
+    """Keys/values of `[B, klen]` are shared by `[B * n_hyps]` queries."""
+    args = make_args(**args)
+
+    batch_size = 2
+    n_hyps = 3
+    klen = 40
+    qlen = 5
+    device = "cpu"
+
+    key = torch.randn(batch_size, klen, args['kdim'], device=device)
+    query = torch.randn(batch_size * n_hyps, qlen, args['qdim'], device=device)
+
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+    mocha = module.MoChA(**args)
+    mocha = mocha.to(device)
+
+    mocha.eval()
+    mocha_rep = module.MoChA(**args)
+    mocha_rep.load_state_dict(mocha.state_dict())
+    mocha_rep.eval()
+    key_rep = key.repeat_interleave(n_hyps, dim=0)
+    alpha, alpha_rep = None, None
+    with torch.no_grad():
+        for i in range(qlen):
+            cv, alpha, beta, _ = mocha(key, key, query[:, i:i + 1], aw_prev=alpha,
+                                       mode='hard', cache=i > 0)
+            cv_rep, alpha_rep, beta_rep, _ = mocha_rep(key_rep, key_rep, query[:, i:i + 1],
+                                                       aw_prev=alpha_rep, mode='hard')
+            assert torch.allclose(cv, cv_rep, atol=1e-5)
+            assert torch.equal(alpha, alpha_rep)
+            if args['chunk_size'] > 1:
+                assert torch.allclose(beta, beta_rep, atol=1e-5)
+
+
+@pytest.mark.parametrize("no_denominator", [False, True])
+def test_monotonic_attention_recurrence(no_denominator):
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+
+    batch_size, n_heads, qlen, klen = 2, 3, 4, 7
+    numer = torch.rand(batch_size, n_heads, qlen, klen, dtype=torch.float64, requires_grad=True)
+    if no_denominator:
+        denom = torch.ones(1, 1, 1, 1, dtype=torch.float64)
+    else:
+        # NOTE: keep away from zero for numerical gradients
+        denom = torch.rand(batch_size, n_heads, qlen, klen, dtype=torch.float64) * 0.5 + 0.5
+        denom.requires_grad_()
+    aw_prev = torch.softmax(torch.randn(batch_size, n_heads, 1, klen, dtype=torch.float64), dim=-1)
+    aw_prev.requires_grad_()
+    assert torch.autograd.gradcheck(module.MonotonicAttentionRecurrence.apply,
+                                    (numer, denom, aw_prev))
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        ({'chunk_size': 4, 'n_heads_mono': 1, 'n_heads_chunk': 1, 'share': True}),
+        ({'chunk_size': -1, 'n_heads_mono': 1, 'n_heads_chunk': 1, 'share': True}),
+        ({'chunk_size': 4, 'n_heads_mono': 2, 'n_heads_chunk': 3, 'share': True}),
+        ({'chunk_size': 4, 'n_heads_mono': 2, 'n_heads_chunk': 3, 'share': False}),
+        ({'chunk_size': -1, 'n_heads_mono': 2, 'n_heads_chunk': 3, 'share': False}),
+    ]
+)
+def test_efficient_chunkwise_attention(args):
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+
+    batch_size, qlen, klen = 2, 5, 9
+    n_heads_mono, n_heads_chunk = args['n_heads_mono'], args['n_heads_chunk']
+    alpha = torch.rand(batch_size, n_heads_mono, qlen, klen, dtype=torch.float64,
+                       requires_grad=True)
+    u = torch.randn(batch_size, n_heads_chunk if args['share'] else n_heads_mono * n_heads_chunk,
+                    qlen, klen, dtype=torch.float64, requires_grad=True)
+
+    def chunkwise_attention(alpha, u, block_size=0):
+        return module.efficient_chunkwise_attention(
+            alpha, u, None, args['chunk_size'], n_heads_chunk, 2.0, args['share'], block_size)
+
+    assert torch.autograd.gradcheck(chunkwise_attention, (alpha, u))
+
+    # computing in blocks of query steps does not change results
+    beta = chunkwise_attention(alpha, u)
+    assert beta.size() == (batch_size, n_heads_mono * n_heads_chunk, qlen, klen)
+    grads = torch.autograd.grad(beta.pow(2).sum(), (alpha, u))
+    beta_blk = chunkwise_attention(alpha, u, block_size=2)
+    grads_blk = torch.autograd.grad(beta_blk.pow(2).sum(), (alpha, u))
+    assert torch.allclose(beta, beta_blk)
+    assert all(torch.allclose(g, g_blk) for g, g_blk in zip(grads, grads_blk))
+
+
+@pytest.mark.parametrize(
+    "args", [
+        ({'n_heads_mono': 1, 'chunk_size': 1}),
+        ({'n_heads_mono': 1, 'chunk_size': 4}),
+        ({'n_heads_mono': 4, 'n_heads_chunk': 1, 'chunk_size': 1, 'atype': 'scaled_dot'}),
+        ({'n_heads_mono': 4, 'n_heads_chunk': 2, 'chunk_size': 4, 'atype': 'scaled_dot',
+          'share_chunkwise_attention': False}),
+        ({'n_heads_mono': 4, 'n_heads_chunk': 1, 'chunk_size': -1, 'atype': 'scaled_dot'}),
+    ]
+)
+def test_forward_hard_batch(args):
+    """Batched hard decoding gives the same results as decoding each utterance."""
+    args = make_args(**args)
+
+    batch_size = 3
+    klen = 40
+    qlen = 5
+    eps_wait = 2 if args['n_heads_mono'] > 1 else -1
+    device = "cpu"
+
+    key = torch.randn(batch_size, klen, args['kdim'], device=device)
+    query = torch.randn(batch_size, qlen, args['qdim'], device=device)
+
+    module = importlib.import_module('neural_sp.models.modules.mocha')
+    mocha = module.MoChA(**args)
+    mocha = mocha.to(device)
+
+    mocha.eval()
+    alphas = [None] * (batch_size + 1)
+    with torch.no_grad():
+        for i in range(qlen):
+            cv, alphas[-1], beta, _ = mocha(key, key, query[:, i:i + 1], aw_prev=alphas[-1],
+                                            mode='hard', eps_wait=eps_wait)
+            for b in range(batch_size):
+                cv_b, alphas[b], beta_b, _ = mocha(key[b:b + 1], key[b:b + 1], query[b:b + 1, i:i + 1],
+                                                   aw_prev=alphas[b], mode='hard', eps_wait=eps_wait)
+                assert torch.allclose(cv[b:b + 1], cv_b, atol=1e-6)
+                assert torch.equal(alphas[-1][b:b + 1], alphas[b])
+                if args['chunk_size'] > 1:
+                    assert torch.allclose(beta[b:b + 1], beta_b, atol=1e-6)
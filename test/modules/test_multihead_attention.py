@@ -63,3 +63,34 @@ def test_forward(args):
         cv, aws, _, _ = out
         assert cv.size() == (batch_size, 1, value.size(2))
         assert aws.size() == (batch_size, args['n_heads'], 1, klen)
+
+
+@pytest.mark.parametrize("atype", ['scaled_dot', 'add'])
+def test_forward_shared_key(atype):
+    """Keys/values of `[B, klen]` are shared by `[B * n_hyps]` queries."""
+    args = make_args(atype=atype)
+
+    batch_size = 2
+    n_hyps = 3
+    klen = 40
+    qlen = 2
+    device = "cpu"
+
+    key = torch.randn(batch_size, klen, args['kdim'], device=device)
+    query = torch.randn(batch_size * n_hyps, qlen, args['qdim'], device=device)
+    src_mask = torch.ones(batch_size, qlen, klen, device=device).byte()
+    src_mask[0, :, klen // 2:] = 0
+
+    module = importlib.import_module('neural_sp.models.modules.multihead_attention')
+    attention = module.MultiheadAttentionMechanism(**args)
+    attention = attention.to(device)
+
+    attention.eval()
+    with torch.no_grad():
+        cv, aw, _, _ = attention(key, key, query, mask=src_mask)
+        attention.reset()
+        key_rep = key.repeat_interleave(n_hyps, dim=0)
+        cv_rep, aw_rep, _, _ = attention(key_rep, key_rep, query,
+                                         mask=src_mask.repeat_interleave(n_hyps, dim=0))
+    assert torch.allclose(cv, cv_rep, atol=1e-5)
+    assert torch.allclose(aw, aw_rep, atol=1e-5)
@@ -0,0 +1,29 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Pack input features of dataset tsv files into a memory-mapped feature store."""
+
+import argparse
+
+from neural_sp.datasets.feature_store import pack_features
+
+parser = argparse.ArgumentParser()
+parser.add_argument('tsv', type=str, nargs='+',
+                    help='dataset tsv files')
+parser.add_argument('--out', type=str,
+                    help='directory to save the feature store')
+parser.add_argument('--dtype', type=str, default='float32',
+                    choices=['float32', 'float16'],
+                    help='data type of the stored features')
+args = parser.parse_args()
+
+
+def main():
+    pack_features(args.tsv, args.out, dtype=args.dtype)
+
+
+if __name__ == '__main__':
+    main()
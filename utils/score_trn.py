@@ -0,0 +1,36 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# Copyright 2020 Kyoto University (Hirofumi Inaguma)
+#  Apache 2.0  (http://www.apache.org/licenses/LICENSE-2.0)
+
+"""Compute WER/CER between reference and hypothesis trn files."""
+
+import argparse
+
+from neural_sp.evaluators.edit_distance import score_trn
+
+parser = argparse.ArgumentParser()
+parser.add_argument('ref', type=str,
+                    help='reference trn file')
+parser.add_argument('hyp', type=str,
+                    help='hypothesis trn file')
+parser.add_argument('--unit', type=str, default='word', choices=['word', 'char'],
+                    help='unit to compute error rate')
+parser.add_argument('--remove_space', action='store_true',
+                    help='remove spaces before computing CER')
+parser.add_argument('--n_workers', type=int, default=1,
+                    help='number of worker processes')
+args = parser.parse_args()
+
+
+def main():
+    err, n_sub, n_ins, n_del = score_trn(args.ref, args.hyp, unit=args.unit,
+                                         remove_space=args.remove_space,
+                                         n_workers=args.n_workers)
+    print('%s: %.2f %%' % ('WER' if args.unit == 'word' else 'CER', err))
+    print('SUB: %.2f / INS: %.2f / DEL: %.2f' % (n_sub, n_ins, n_del))
+
+
+if __name__ == '__main__':
+    main()